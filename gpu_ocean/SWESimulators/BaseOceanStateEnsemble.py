@@ -22,16 +22,16 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import matplotlib
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import abc
 import warnings
 
 
-import pycuda.driver as cuda
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 from SWESimulators import CDKLM16
 from SWESimulators import GPUDrifterCollection
@@ -28,46 +28,113 @@ import numpy as np
 
 """
 This file contains functions for creating initial conditions
-and bathymetry
+and bathymetry.
+
+All functions evaluate their expressions on whole arrays of cell indices,
+and give bit-identical results to evaluating the same expressions cell by 
+cell. To achieve this, the index arrays are given the type that the 
+corresponding python/numpy scalars would get (see _cellIndices), and 
+squares are computed with pow() (see _square) rather than as x*x.
+The halo argument is given as [north, east, south, west].
 """
 
 
+def _cellIndices(start, stop, scale, offset=0):
+    """
+    Returns the indices range(start, stop) plus offset, as an array with the 
+    same type as the scalar expression scale*(index + offset)
+    """
+    return (np.arange(start, stop) + offset).astype(np.result_type(scale, offset))
+
+def _square(x):
+    """
+    Computes x**2 elementwise in the same way as for python/numpy scalars, which
+    use pow() and may differ in the last bit from x*x (used by x**2 for arrays).
+    """
+    x = np.asarray(x)
+    if x.dtype == np.float64:
+        return np.float_power(x, 2)
+    return np.array([value**2 for value in x.ravel()], dtype=x.dtype).reshape(x.shape)
+
+def _cellOffsets(nx, ny, dx, dy, halo, x_center, y_center, offset=0):
+    """
+    Returns x = dx*(i + offset) - x_center as a row vector and y = dy*(j + offset) - y_center 
+    as a column vector, for i in [-halo[3], nx+halo[1]) and j in [-halo[2], ny+halo[0]).
+    """
+    x = dx*_cellIndices(-halo[3], nx + halo[1], dx, offset) - x_center
+    y = dy*_cellIndices(-halo[2], ny + halo[0], dy, offset) - y_center
+    return x[np.newaxis, :], y[:, np.newaxis]
+
+def _haloDomain(eta, nx, ny, halo, reduce_by=0):
+    """
+    Returns the view of eta holding the cells [-halo[3], nx+halo[1]-reduce_by) x [-halo[2], ny+halo[0]-reduce_by)
+    """
+    return eta[:ny + halo[0] + halo[2] - reduce_by, :nx + halo[1] + halo[3] - reduce_by]
+
+def _innerDomain(B, nx, ny, halo):
+    """
+    Returns the view of B holding the cells [0, nx] x [0, ny]
+    """
+    return B[halo[2]:halo[2]+ny+1, halo[3]:halo[3]+nx+1]
+
+def _gaussianBump(x, y, size):
+    """
+    Returns the mask sqrt(x**2 + y**2) < size and the bump exp(-(x**2/size+y**2/size))
+    """
+    x2, y2 = _square(x), _square(y)
+    mask = np.sqrt(x2 + y2) < size
+    return mask, np.exp(-(x2/size+y2/size))
+
+def _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add):
+    """
+    Sets (or adds, if add is True) a gaussian bump centered at (x_center, y_center) in eta
+    """
+    x, y = _cellOffsets(nx, ny, dx, dy, halo, x_center, y_center)
+    mask, bump = _gaussianBump(x, y, size)
+    domain = _haloDomain(eta, nx, ny, halo)
+    if add:
+        domain[mask] += bump[mask]
+    else:
+        domain[mask] = bump[mask]
+
+
 
 def initializeBalancedVelocityFieldStaggered(eta, H, hu, hv, f, beta, g, nx, ny, dx, dy, ghosts):
     """
     Initializing hu and hv according to geostrophic balance, given eta and H.
     This implementation assumes a staggered C-grid
     """
+    # Vectorized along rows, since the coriolis parameter is a scalar for each row
+    ie = nx+ghosts[1]+ghosts[3]-1
     for j in range(1, ny+ghosts[0]+ghosts[2]-1):
         coriolis = f + beta*j*dy
-        for i in range(1, nx+ghosts[1]+ghosts[3]-1):
-            eta_pluss = (eta[j+1, i] + eta[j+1, i-1])/2.0
-            eta_minus = (eta[j-1, i] + eta[j-1, i-1])/2.0
-            h_mid = (eta[j,i] + H[j,i] + eta[j, i-1] + H[j,i-1])/2.0
-            hu[j,i] = -(g/coriolis)*h_mid*(eta_pluss - eta_minus)/(2.0*dy)
+        eta_pluss = (eta[j+1, 1:ie] + eta[j+1, 0:ie-1])/2.0
+        eta_minus = (eta[j-1, 1:ie] + eta[j-1, 0:ie-1])/2.0
+        h_mid = (eta[j, 1:ie] + H[j, 1:ie] + eta[j, 0:ie-1] + H[j, 0:ie-1])/2.0
+        hu[j, 1:ie] = -(g/coriolis)*h_mid*(eta_pluss - eta_minus)/(2.0*dy)
     for j in range(1, ny+ghosts[0]+ghosts[2]-1):
         coriolis = f + beta*j*dy
-        for i in range(1, nx+ghosts[1]+ghosts[3]-1):
-            eta_pluss = (eta[j, i+1] + eta[j-1, i+1])/2.0
-            eta_minus = (eta[j, i-1] + eta[j-1, i-1])/2.0
-            h_mid = (eta[j,i] + H[j,i] + eta[j-1,i] + H[j-1,i])/2.0
-            hv[j,i] =  (g/coriolis)*h_mid*(eta_pluss - eta_minus)/(2.0*dx)
+        eta_pluss = (eta[j, 2:ie+1] + eta[j-1, 2:ie+1])/2.0
+        eta_minus = (eta[j, 0:ie-1] + eta[j-1, 0:ie-1])/2.0
+        h_mid = (eta[j, 1:ie] + H[j, 1:ie] + eta[j-1, 1:ie] + H[j-1, 1:ie])/2.0
+        hv[j, 1:ie] =  (g/coriolis)*h_mid*(eta_pluss - eta_minus)/(2.0*dx)
             
 def initializeBalancedVelocityField(eta, H, hu, hv, f, beta, g, nx, ny, dx, dy, ghosts):
     """
     Initializing hu and hv according to geostrophic balance, given eta and H.
     This implementation assumes a non-staggered A-grid
     """
+    # Vectorized along rows, since the coriolis parameter is a scalar for each row
+    ie = nx+ghosts[1]+ghosts[3]-1
     for j in range(1, ny+ghosts[0]+ghosts[2]-1):
         coriolis = f + beta*j*dy
-        for i in range(1, nx+ghosts[1]+ghosts[3]-1):
-            h_mid = eta[j,i] + H[j,i]
-            
-            eta_diff_y = (eta[j+1, i] - eta[j-1, i])/(2.0*dy)
-            hu[j,i] = -(g/coriolis)*h_mid*eta_diff_y
-            
-            eta_diff_x = (eta[j, i+1] - eta[j, i-1])/(2.0*dx)
-            hv[j,i] = (g/coriolis)*h_mid*eta_diff_x            
+        h_mid = eta[j, 1:ie] + H[j, 1:ie]
+        
+        eta_diff_y = (eta[j+1, 1:ie] - eta[j-1, 1:ie])/(2.0*dy)
+        hu[j, 1:ie] = -(g/coriolis)*h_mid*eta_diff_y
+        
+        eta_diff_x = (eta[j, 2:ie+1] - eta[j, 0:ie-1])/(2.0*dx)
+        hv[j, 1:ie] = (g/coriolis)*h_mid*eta_diff_x            
             
 
 """
@@ -77,47 +144,29 @@ and leave the rest of the water surface unchanged"
 def makeCornerBump(eta, nx, ny, dx, dy, halo):
     x_center = 4*dx
     y_center = 4*dy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] = np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=False)
                 
 def makeUpperCornerBump(eta, nx, ny, dx, dy, halo):
     x_center = (nx-4)*dx
     y_center = (ny-4)*dy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] = np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=False)
 
                 
 def makeCentralBump(eta, H0, nx, ny, dx, dy, halo):
     x_center = dx*nx/2.0
     y_center = dy*ny/2.0
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = (0.015* min(nx, ny)*min(dx, dy))**2
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] = H0 + np.exp(-(x**2/size+y**2/size))
+    size = (0.015* min(nx, ny)*min(dx, dy))**2
+    x, y = _cellOffsets(nx, ny, dx, dy, halo, x_center, y_center)
+    mask, bump = _gaussianBump(x, y, size)
+    _haloDomain(eta, nx, ny, halo)[mask] = H0 + bump[mask]
                 
 def makeLowerLeftBump(eta, nx, ny, dx, dy, halo):
     x_center = dx*nx*0.3
     y_center = dy*ny*0.2
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] = np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=False)
                 
                 
 ## Adding initial conditions on top of an existing initialCondition:
@@ -128,38 +177,23 @@ the already existing input array
 def addCornerBump(eta, nx, ny, dx, dy, halo):
     x_center = 4*dx
     y_center = 4*dy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
                 
                 
 def addUpperCornerBump(eta, nx, ny, dx, dy, halo):
     x_center = (nx-4)*dx
     y_center = (ny-4)*dy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
 
                 
 def addCentralBump(eta, nx, ny, dx, dy, halo):
     x_center = dx*nx/2.0
     y_center = dy*ny/2.0
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            #size = (0.015* min(nx, ny)*min(dx, dy))**2
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    #size = (0.015* min(nx, ny)*min(dx, dy))**2
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
 
 def addLowerLeftBump(eta, nx, ny, dx, dy, halo):
     print("addLowerLeftBump")
@@ -168,53 +202,33 @@ def addLowerLeftBump(eta, nx, ny, dx, dy, halo):
     print("ny", ny)
     x_center = dx*nx*0.3
     y_center = dy*ny*0.2
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
 
 def addBump(eta, nx, ny, dx, dy, relposx, relposy,widthfactor, halo):
     x_center = dx*nx*relposx
     y_center = dy*ny*relposy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = widthfactor*500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = widthfactor*500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
                 
 # This bump is for debug purposes and will be modified without mercy :)
 def addDebugBump(eta, nx, ny, dx, dy, posx, posy, halo):
     x_center = dx*nx*posx
     y_center = dy*ny*posy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
 
 # This bump is for debug purposes and will be modified without mercy :)
 def addWideDebugBump(eta, nx, ny, dx, dy, posx, posy, width_factor, halo):
     x_center = dx*nx*posx
     y_center = dy*ny*posy
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)*width_factor
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += np.exp(-(x**2/size+y**2/size))
+    size = 500.0*min(dx, dy)*width_factor
+    _setBump(eta, nx, ny, dx, dy, halo, x_center, y_center, size, add=True)
 
 
 
 def eta_gauss_func(rel_x, rel_y, bump_height, bump_width):
-    return bump_height*np.exp(- ((rel_x)**2 + (rel_y)**2)/ bump_width)
+    return bump_height*np.exp(- (_square(rel_x) + _square(rel_y))/ bump_width)
 
 """
 Defines a gaussian bump in the surface, which is balanced according to the 
@@ -237,24 +251,26 @@ def initializeBalancedBumpOverPoint(eta, hu, hv, # allocated buffers to be fille
     y0 = ny*dy*rel_y0
     bump_width = rel_bump_width*500*min(dx, dy)
     
-    for j in range(-ghosts[2], ny+ghosts[0]):
-        #y = (j+0.5)*dy
-        y = (j)*dy
-        rel_y = y - y0
-        y_hv = y - staggered_y
-        rel_y_hv = y_hv - y0
-        for i in range(-ghosts[3], nx+ghosts[1]):
-            #x = (i+0.5)*dx
-            x = (i)*dx
-            rel_x = x - x0
-            x_hu = x - staggered_x
-            rel_x_hu = x_hu - x0
-            
-            eta[j+ghosts[2], i+ghosts[1]] = eta_gauss_func(rel_x, rel_y, bump_height, bump_width)
-            
-            hu[j+ghosts[2], i+ghosts[1]] =  (g*H0/f)*2*(rel_y/bump_width)*eta_gauss_func(rel_x_hu, rel_y, bump_height, bump_width)
-            
-            hv[j+ghosts[2], i+ghosts[1]] = -(g*H0/f)*2*(rel_x/bump_width)*eta_gauss_func(rel_x, rel_y_hv, bump_height, bump_width)
+    #y = (j+0.5)*dy
+    y = dy*_cellIndices(-ghosts[2], ny+ghosts[0], dy)[:, np.newaxis]
+    rel_y = y - y0
+    y_hv = y - staggered_y
+    rel_y_hv = y_hv - y0
+    #x = (i+0.5)*dx
+    x = dx*_cellIndices(-ghosts[3], nx+ghosts[1], dx)[np.newaxis, :]
+    rel_x = x - x0
+    x_hu = x - staggered_x
+    rel_x_hu = x_hu - x0
+    
+    # Note that the x-index is offset by ghosts[1] 
+    rows = np.arange(-ghosts[2], ny+ghosts[0])[:, np.newaxis] + ghosts[2]
+    cols = np.arange(-ghosts[3], nx+ghosts[1])[np.newaxis, :] + ghosts[1]
+    
+    eta[rows, cols] = eta_gauss_func(rel_x, rel_y, bump_height, bump_width)
+    
+    hu[rows, cols] =  (g*H0/f)*2*(rel_y/bump_width)*eta_gauss_func(rel_x_hu, rel_y, bump_height, bump_width)
+    
+    hv[rows, cols] = -(g*H0/f)*2*(rel_x/bump_width)*eta_gauss_func(rel_x, rel_y_hv, bump_height, bump_width)
                 
 
 """
@@ -263,14 +279,11 @@ Generate a radial dam break initial condition with a step function
 def addCentralDamBreakStep(eta, nx, ny, dx, dy, step_size, halo):
     x_center = dx*nx/2.0
     y_center = dy*ny/2.0
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            size = 10.0*min(dx, dy)
-            #size = (0.015* min(nx, ny)*min(dx, dy))**2
-            if (np.sqrt(x**2 + y**2) < size):
-                eta[j+halo[2], i+halo[3]] += step_size
+    size = 10.0*min(dx, dy)
+    #size = (0.015* min(nx, ny)*min(dx, dy))**2
+    x, y = _cellOffsets(nx, ny, dx, dy, halo, x_center, y_center)
+    mask = np.sqrt(_square(x) + _square(y)) < size
+    _haloDomain(eta, nx, ny, halo)[mask] += step_size
 
 """
 Generate a radial dam break initial condition with a step function
@@ -289,10 +302,9 @@ def addTopographyBump(h, nx, ny, dx, dy, halo, bumpsize):
     print(yPos)
     print((-halo[2], ny))
     print((-halo[3], nx + halo[1]))
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            r = 0.01*(yPos - j)**2
-            h[j+halo[2], i+halo[3]] -= bumpsize*np.exp(-r) 
+    j = np.arange(-halo[2], ny + halo[0])
+    r = 0.01*_square(yPos - j)
+    _haloDomain(h, nx, ny, halo)[:, :] -= (bumpsize*np.exp(-r))[:, np.newaxis]
 
 """
 Generates a crater in the bathymetry B centered in the middle of the domain.
@@ -304,15 +316,12 @@ def makeBathymetryCrater(B, nx, ny, dx, dy, halo):
     minReach = min(nx*dx, ny*dy)
     innerEdge = minReach*0.3/2.0
     outerEdge = minReach*0.7/2.0
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i - x_center
-            y = dy*j - y_center
-            radius = np.sqrt(x**2 + y**2)
-            if (radius > innerEdge) and (radius < outerEdge):
-                B[j+halo[2], i+halo[3]] = 30.0*np.sin((radius - innerEdge)/(outerEdge - innerEdge)*np.pi )**2
-            else:
-                B[j+halo[2], i+halo[3]] = 0.0
+    x, y = _cellOffsets(nx, ny, dx, dy, halo, x_center, y_center)
+    radius = np.sqrt(_square(x) + _square(y))
+    mask = (radius > innerEdge) & (radius < outerEdge)
+    domain = _haloDomain(B, nx, ny, halo)
+    domain[:, :] = 0.0
+    domain[mask] = 30.0*_square(np.sin((radius[mask] - innerEdge)/(outerEdge - innerEdge)*np.pi ))
 
 """
 Adds a semi-crazy bottom consisting of a few periods of sines both in x and y direction. 
@@ -320,11 +329,11 @@ Adds a semi-crazy bottom consisting of a few periods of sines both in x and y di
 def makeBathymetryCrazyness(B, nx, ny, dx, dy, halo):
     length = dx*nx*1.0
     height = dy*ny*1.0
-    for j in range(-halo[2], ny + halo[0]):
-        for i in range(-halo[3], nx + halo[1]):
-            x = dx*i*1.0
-            y = dy*j*1.0
-            B[j+halo[2], i+halo[3]] = 25.0*(np.sin(np.pi*(x/length)*4)**2 + np.sin(np.pi*(y/height)*4)**2)
+    x = dx*_cellIndices(-halo[3], nx + halo[1], dx)*1.0
+    y = dy*_cellIndices(-halo[2], ny + halo[0], dy)*1.0
+    sin_x = _square(np.sin(np.pi*(x/length)*4))
+    sin_y = _square(np.sin(np.pi*(y/height)*4))
+    _haloDomain(B, nx, ny, halo)[:, :] = 25.0*(sin_x[np.newaxis, :] + sin_y[:, np.newaxis])
 
 """
 Generates a bathymetry with a constant slope along the x-axis.
@@ -333,9 +342,8 @@ B(x,y) = low + x*(high-low)/(nx*dx)
 def linearBathymetryX(B, nx, ny, dx, dy, halo, low, high):
     length=dx*nx*1.0
     gradient = (high-low)/length
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            B[j+halo[2], i+halo[3]] = low + i*dx*gradient
+    i = _cellIndices(0, nx+1, dx)
+    _innerDomain(B, nx, ny, halo)[:, :] = (low + i*dx*gradient)[np.newaxis, :]
 """
 Generates a bathymetry with a constant slope along the y-axis.
 B(x,y) = low + y*(high-low)/(ny*dy)
@@ -343,20 +351,18 @@ B(x,y) = low + y*(high-low)/(ny*dy)
 def linearBathymetryY(B, nx, ny, dx, dy, halo, low, high):
     length=dy*ny*1.0
     gradient = (high-low)/length
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            B[j+halo[2], i+halo[3]] = low + j*dy*gradient
+    j = _cellIndices(0, ny+1, dy)
+    _innerDomain(B, nx, ny, halo)[:, :] = (low + j*dy*gradient)[:, np.newaxis]
             
 """
 Generates a smooth jeté diagonally across the domain
 """            
 def diagonalWallBathymetry(B, nx, ny, dx, dy, halo, height):
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            factor = 1.0
-            if ( i-j > -30 and i-j < 10):
-                factor = 1 - np.exp(-0.01*(abs(10 - j + i)**2))
-            B[j+halo[2], i+halo[3]] = factor*height*np.exp(-0.006*(abs(100-j - i)**2))
+    j = np.arange(0, ny+1)[:, np.newaxis]
+    i = np.arange(0, nx+1)[np.newaxis, :]
+    factor = np.where((i-j > -30) & (i-j < 10), 
+                      1 - np.exp(-0.01*(abs(10 - j + i)**2)), 1.0)
+    _innerDomain(B, nx, ny, halo)[:, :] = factor*height*np.exp(-0.006*(abs(100-j - i)**2))
 
         
 """
@@ -366,9 +372,8 @@ B(x,y) = low + y*(high-low)/(ny*dy)
 def exponentialBathymetryY(B, nx, ny, dx, dy, halo, low, high):
     length=dy*ny*1.0
     gradient = (high-low)/length
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            B[j+halo[2], i+halo[3]] = low + j*dy*gradient
+    j = _cellIndices(0, ny+1, dy)
+    _innerDomain(B, nx, ny, halo)[:, :] = (low + j*dy*gradient)[:, np.newaxis]
             
 
 """
@@ -376,31 +381,26 @@ Generates initial conditions for a dam break, where the dam is diagonal in a
 corner of the domain
 """                
 def addDiagonalDam(h, nx, ny, dx, dy, halo, height):
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            if ( i+j < 50):
-                h[j+halo[2], i+halo[3]] += height
+    j = np.arange(0, ny+1)[:, np.newaxis]
+    i = np.arange(0, nx+1)[np.newaxis, :]
+    _innerDomain(h, nx, ny, halo)[i+j < 50] += height
             
 """
 Generates a smooth jeté along the x-axis across the domain
 """                 
 def straightWallBathymetry(B, nx, ny, dx, dy, halo, height):
-    for j in range(0, ny+1):
-        for i in range(0, nx+1):
-            factor = 1.0
-            if ( i > 40 and i < 60):
-                factor = 1 - np.exp(-0.05*(abs(50 - i)**2))
-            B[j+halo[2], i+halo[3]] = factor*height*np.exp(-0.01*(abs(80-j)**2))
+    j = np.arange(0, ny+1)[:, np.newaxis]
+    i = np.arange(0, nx+1)[np.newaxis, :]
+    factor = np.where((i > 40) & (i < 60), 1 - np.exp(-0.05*(abs(50 - i)**2)), 1.0)
+    _innerDomain(B, nx, ny, halo)[:, :] = factor*height*np.exp(-0.01*(abs(80-j)**2))
 
 """
 Generates initial conditions for a dam break, where the dam is across the
 entire domain along the x-axis, located at y = dam_start_y
 """       
 def addStraightDam(h, nx, ny, dx, dy, halo, height, dam_start_y=30):
-    for j in range(0, ny+1):
-        if ( j < dam_start_y):
-            for i in range(0, nx+1):
-                h[j+halo[2], i+halo[3]] += height
+    j = np.arange(0, ny+1)
+    _innerDomain(h, nx, ny, halo)[j < dam_start_y, :] += height
 
 """
 Adds a continental shelf in the south of the domain.
@@ -408,13 +408,10 @@ The shelf is sharp and discontinuous
 """                
 def addContinentalShelfBathymetry(B, nx, ny, halo, shallow, deep, where_in_y):
     where_in_ny = ny*where_in_y
-    for j in range(0, ny+1):
-        if ( j < where_in_ny):
-            for i in range(0, nx+1):
-                B[j+halo[2], i+halo[3]] = shallow;
-        else:
-            for i in range(0, nx+1):
-                B[j+halo[2], i+halo[3]] = deep;
+    j = np.arange(0, ny+1)
+    domain = _innerDomain(B, nx, ny, halo)
+    domain[j < where_in_ny, :] = shallow
+    domain[j >= where_in_ny, :] = deep
 
 """
 Adds a smooth continental shelf in the south of the domain.
@@ -430,108 +427,92 @@ Dual vortex initial conditions.
 Qualitatively inspired by the figures in this paper:
 http://journals.ametsoc.org/doi/pdf/10.1175/1520-0469(1992)049%3C2015:LMOASW%3E2.0.CO%3B2
 """
+def _vortexContributions(x, y_pos, y_neg, size):
+    """
+    Returns the velocity contributions from the positive and negative vortex, 
+    which are zero outside the vortices
+    """
+    x2 = _square(x)
+    y_pos2, y_neg2 = _square(y_pos), _square(y_neg)
+    contribution = np.where(np.sqrt(x2 + y_pos2) < size, 
+                            -np.exp(-0.5*(x2/size+y_pos2/size)) + np.exp(-0.2*(x2/size+y_pos2/size)), 0.0)
+    neg_cont = np.where(np.sqrt(x2 + y_neg2) < size,
+                        -np.exp(-0.5*(x2/size+y_neg2/size)) + np.exp(-0.2*(x2/size+y_neg2/size)), 0.0)
+    return contribution, neg_cont
+
+def _addVortexSurface(eta, x, y_pos, y_neg, size):
+    """
+    Adds the surface elevation of the positive and subtracts that of the negative vortex
+    """
+    x2 = _square(x)
+    y_pos2, y_neg2 = _square(y_pos), _square(y_neg)
+    mask_pos = np.sqrt(x2 + y_pos2) < size
+    mask_neg = np.sqrt(x2 + y_neg2) < size
+    eta[mask_pos] += (0.035*np.exp(-0.2*(x2/size+y_pos2/size)))[mask_pos]
+    eta[mask_neg] -= (0.035*np.exp(-0.2*(x2/size+y_neg2/size)))[mask_neg]
+
 def addDualVortex(eta, u, v, nx, ny, dx, dy, halo):
     x_center = dx*nx*0.5
     y_center_pos = dy*ny*0.52
     y_center_neg = dy*ny*0.48
     y_center = dy*ny*0.5
-    for j in range(-halo[2], ny + halo[0]-1):
-        for i in range(-halo[3], nx + halo[1]-1):
-            # The -1 in the for loop is to avoid out-of-range on staggered grids...
-            x = dx*i - x_center
-            y_pos = dy*j - y_center_pos
-            y_neg = dy*j - y_center_neg
-            y = dy*j - y_center
-            size = 500.0*min(dx, dy)
-            contribution = 0.0
-            neg_cont = 0.0
-            #size = (0.015* min(nx, ny)*min(dx, dy))**2
-            if (np.sqrt(x**2 + y_pos**2) < size):
-                contribution -= np.exp(-0.5*(x**2/size+y_pos**2/size))
-                contribution += np.exp(-0.2*(x**2/size+y_pos**2/size))
-                eta[j+halo[2], i+halo[3]] += 0.035*np.exp(-0.2*(x**2/size+y_pos**2/size))
-            
-            if (np.sqrt(x**2 + y_neg**2) < size):
-                neg_cont -= np.exp(-0.5*(x**2/size+y_neg**2/size))
-                neg_cont += np.exp(-0.2*(x**2/size+y_neg**2/size))
-                eta[j+halo[2], i+halo[3]] -= 0.035*np.exp(-0.2*(x**2/size+y_neg**2/size))
-            
-            global_cont = 0.0
-            global_cont -= np.exp(-0.02*(x**2/size + y**2/size))
-            global_cont += np.exp(-0.005*(x**2/size + y**2/size))
-            
-            phi_pos = np.arctan2(x, y_pos)
-            phi_neg = np.arctan2(x, y_neg)
-            phi = np.arctan2(x, y)
-            velocity_scale = 10.0
-            u[j+halo[2], i+halo[3]] += velocity_scale*contribution*np.cos(phi_pos)
-            v[j+halo[2], i+halo[3]] -= velocity_scale*contribution*np.sin(phi_pos)
-            
-            u[j+halo[2], i+halo[3]] -= velocity_scale*neg_cont*np.cos(phi_neg)
-            v[j+halo[2], i+halo[3]] += velocity_scale*neg_cont*np.sin(phi_neg)
-
-            ## Add these two lines in order to initate a rotation of water under the dual vortices
-            #u[j+halo[2], i+halo[3]] += 0.2*velocity_scale*global_cont*np.cos(phi)
-            #v[j+halo[2], i+halo[3]] -= 0.2*velocity_scale*global_cont*np.sin(phi)
+    # The -1 in the domain is to avoid out-of-range on staggered grids...
+    halo_reduced = [halo[0]-1, halo[1]-1, halo[2], halo[3]]
+    x, y_pos = _cellOffsets(nx, ny, dx, dy, halo_reduced, x_center, y_center_pos)
+    x, y_neg = _cellOffsets(nx, ny, dx, dy, halo_reduced, x_center, y_center_neg)
+    size = 500.0*min(dx, dy)
+    #size = (0.015* min(nx, ny)*min(dx, dy))**2
+    
+    _addVortexSurface(_haloDomain(eta, nx, ny, halo, 1), x, y_pos, y_neg, size)
+    contribution, neg_cont = _vortexContributions(x, y_pos, y_neg, size)
+    
+    phi_pos = np.arctan2(x, y_pos)
+    phi_neg = np.arctan2(x, y_neg)
+    velocity_scale = 10.0
+    u_domain = _haloDomain(u, nx, ny, halo, 1)
+    v_domain = _haloDomain(v, nx, ny, halo, 1)
+    u_domain += velocity_scale*contribution*np.cos(phi_pos)
+    v_domain -= velocity_scale*contribution*np.sin(phi_pos)
+    
+    u_domain -= velocity_scale*neg_cont*np.cos(phi_neg)
+    v_domain += velocity_scale*neg_cont*np.sin(phi_neg)
+
+    ## Add these lines in order to initate a rotation of water under the dual vortices
+    #global_cont = -np.exp(-0.02*(x**2/size + y**2/size)) + np.exp(-0.005*(x**2/size + y**2/size))
+    #phi = np.arctan2(x, y)
+    #u_domain += 0.2*velocity_scale*global_cont*np.cos(phi)
+    #v_domain -= 0.2*velocity_scale*global_cont*np.sin(phi)
             
 def addDualVortexStaggered(eta, u, v, nx, ny, dx, dy, halo):
     x_center = dx*nx*0.5
     y_center_pos = dy*ny*0.52
     y_center_neg = dy*ny*0.48
     y_center = dy*ny*0.5
-    for j in range(-halo[2], ny + halo[0]-1):
-        for i in range(-halo[3], nx + halo[1]-1):
-            # The -1 in the for loop is to avoid out-of-range on staggered grids...
-            x = dx*(i+0.5) - x_center
-            y_pos = dy*(j+0.5) - y_center_pos
-            y_neg = dy*(j+0.5) - y_center_neg
-            y = dy*(j+0.5) - y_center
-            size = 500.0*min(dx, dy)
-            #size = (0.015* min(nx, ny)*min(dx, dy))**2
-            if (np.sqrt(x**2 + y_pos**2) < size):
-                eta[j+halo[2], i+halo[3]] += 0.035*np.exp(-0.2*(x**2/size+y_pos**2/size))
-            if (np.sqrt(x**2 + y_neg**2) < size):
-                eta[j+halo[2], i+halo[3]] -= 0.035*np.exp(-0.2*(x**2/size+y_neg**2/size))
-
-            x = x - 0.5*dx
-            contribution = 0.0
-            neg_cont = 0.0
-            if (np.sqrt(x**2 + y_pos**2) < size):
-                contribution -= np.exp(-0.5*(x**2/size+y_pos**2/size))
-                contribution += np.exp(-0.2*(x**2/size+y_pos**2/size))
-            if (np.sqrt(x**2 + y_neg**2) < size):
-                neg_cont -= np.exp(-0.5*(x**2/size+y_neg**2/size))
-                neg_cont += np.exp(-0.2*(x**2/size+y_neg**2/size))
-            phi_pos = np.arctan2(x, y_pos)
-            phi_neg = np.arctan2(x, y_neg)
-            phi = np.arctan2(x, y)
-            velocity_scale = 10.0
-            u[j+halo[2], i+halo[3]] += velocity_scale*contribution*np.cos(phi_pos)                
-            u[j+halo[2], i+halo[3]] -= velocity_scale*neg_cont*np.cos(phi_neg)
-
-            x = x + 0.5*dx
-            y = y - 0.5*dy
-            y_pos = y_pos - 0.5*dy
-            y_neg = y_neg - 0.5*dy
-            contribution = 0.0
-            neg_cont = 0.0
-            if (np.sqrt(x**2 + y_pos**2) < size):
-                contribution -= np.exp(-0.5*(x**2/size+y_pos**2/size))
-                contribution += np.exp(-0.2*(x**2/size+y_pos**2/size))
-            if (np.sqrt(x**2 + y_neg**2) < size):
-                neg_cont -= np.exp(-0.5*(x**2/size+y_neg**2/size))
-                neg_cont += np.exp(-0.2*(x**2/size+y_neg**2/size))
-            phi_pos = np.arctan2(x, y_pos)
-            phi_neg = np.arctan2(x, y_neg)
-            phi = np.arctan2(x, y)
-            v[j+halo[2], i+halo[3]] -= velocity_scale*contribution*np.sin(phi_pos)
-            v[j+halo[2], i+halo[3]] += velocity_scale*neg_cont*np.sin(phi_neg)
-            
-            ## Add these two lines in order to initate a rotation of water under the dual vortices
-            #u[j+halo[2], i+halo[3]] += 0.2*velocity_scale*global_cont*np.cos(phi)
-            #v[j+halo[2], i+halo[3]] -= 0.2*velocity_scale*global_cont*np.sin(phi)
-            
-            ## Debug lines without the cos/sin terms
-            #u[j+halo[2], i+halo[3]] += velocity_scale*contribution
-            #u[j+halo[2], i+halo[3]] -= velocity_scale*neg_cont
-            #u[j+halo[2], i+halo[3]] += 0.2*velocity_scale*global_cont
+    # The -1 in the domain is to avoid out-of-range on staggered grids...
+    halo_reduced = [halo[0]-1, halo[1]-1, halo[2], halo[3]]
+    x, y_pos = _cellOffsets(nx, ny, dx, dy, halo_reduced, x_center, y_center_pos, offset=0.5)
+    x, y_neg = _cellOffsets(nx, ny, dx, dy, halo_reduced, x_center, y_center_neg, offset=0.5)
+    size = 500.0*min(dx, dy)
+    #size = (0.015* min(nx, ny)*min(dx, dy))**2
+    _addVortexSurface(_haloDomain(eta, nx, ny, halo, 1), x, y_pos, y_neg, size)
+
+    # u in the cell faces in x
+    x = x - 0.5*dx
+    contribution, neg_cont = _vortexContributions(x, y_pos, y_neg, size)
+    phi_pos = np.arctan2(x, y_pos)
+    phi_neg = np.arctan2(x, y_neg)
+    velocity_scale = 10.0
+    u_domain = _haloDomain(u, nx, ny, halo, 1)
+    u_domain += velocity_scale*contribution*np.cos(phi_pos)                
+    u_domain -= velocity_scale*neg_cont*np.cos(phi_neg)
+
+    # v in the cell faces in y
+    x = x + 0.5*dx
+    y_pos = y_pos - 0.5*dy
+    y_neg = y_neg - 0.5*dy
+    contribution, neg_cont = _vortexContributions(x, y_pos, y_neg, size)
+    phi_pos = np.arctan2(x, y_pos)
+    phi_neg = np.arctan2(x, y_neg)
+    v_domain = _haloDomain(v, nx, ny, halo, 1)
+    v_domain -= velocity_scale*contribution*np.sin(phi_pos)
+    v_domain += velocity_scale*neg_cont*np.sin(phi_neg)
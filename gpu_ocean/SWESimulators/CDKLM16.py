@@ -28,17 +28,19 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #Import packages we need
 import numpy as np
 import gc
+import copy
 import logging
-from scipy.interpolate import interp2d
 
 from SWESimulators import Common, SimWriter, SimReader
 from SWESimulators import Simulator
 from SWESimulators import WindStress
 from SWESimulators import OceanStateNoise
 from SWESimulators import OceanographicUtilities
+from SWESimulators import Instrumentation
+from SWESimulators import TimestepPolicy
 
-# Needed for the random perturbation of the wind forcing:
-import pycuda.driver as cuda
+from SWESimulators import LazyImport
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 
 class CDKLM16(Simulator.Simulator):
@@ -76,12 +78,14 @@ class CDKLM16(Simulator.Simulator):
                  netcdf_filename=None, \
                  ignore_ghostcells=False, \
                  courant_number=0.8, \
+                 dt_policy=TimestepPolicy.EveryStepTimestep(), \
                  offset_x=0, offset_y=0, \
                  flux_slope_eps = 1.0e-1, \
                  desingularization_eps = 1.0e-1, \
                  depth_cutoff = 1.0e-5, \
                  block_width=12, block_height=32, num_threads_dt=256,
-                 block_width_model_error=16, block_height_model_error=16):
+                 block_width_model_error=16, block_height_model_error=16,
+                 skip_dry_tiles=False):
         """
         Initialization routine
         eta0: Initial deviation from mean sea level incl ghost cells, (nx+2)*(ny+2) cells
@@ -104,8 +108,8 @@ class CDKLM16(Simulator.Simulator):
         theta: MINMOD theta used the reconstructions of the derivatives in the numerical scheme
         rk_order: Order of Runge Kutta method {1,2*,3}
         coriolis_beta: Coriolis linear factor -> f = f + beta*(y-y_0)
-        max_wind_direction_perturbation: Large-scale model error emulation by per-time-step perturbation of wind direction by +/- max_wind_direction_perturbation (degrees)
-        wind_stress: Wind stress parameters
+        max_wind_direction_perturbation: Large-scale model error emulation by perturbation of the wind direction of each wind stress table time by +/- max_wind_direction_perturbation (degrees)
+        wind_stress: Wind stress table (WindStress), or parametric wind stress which is evaluated at time t
         boundary_conditions: Boundary condition object
         small_scale_perturbation: Boolean value for applying a stochastic model error
         small_scale_perturbation_amplitude: Amplitude (q0 coefficient) for model error
@@ -121,6 +125,9 @@ class CDKLM16(Simulator.Simulator):
         depth_cutoff: Used for defining dry cells
         super_dir_name: Directory to write netcdf files to
         netcdf_filename: Use this filename. (If not defined, a filename will be generated by SimWriter.)
+        courant_number: Courant number used when updating dt
+        dt_policy: TimestepPolicy deciding when dt is recomputed in step(update_dt=True). The simulator keeps its own copy.
+        skip_dry_tiles: Only launch the step and model error kernels on blocks with at least one wet cell. Land cells in fully dry blocks then keep their values.
         """
                
         self.logger = logging.getLogger(__name__)
@@ -150,7 +157,6 @@ class CDKLM16(Simulator.Simulator):
         y_zero_reference_cell = 0
         
         A = None
-        self.max_wind_direction_perturbation = max_wind_direction_perturbation
         super(CDKLM16, self).__init__(gpu_ctx, \
                                       nx, ny, \
                                       ghost_cells_x, \
@@ -169,6 +175,11 @@ class CDKLM16(Simulator.Simulator):
                                       block_width, block_height,
                                       local_particle_id=local_particle_id)
         
+        # Simulator.__init__ has converted parametric wind stress to a table
+        self.max_wind_direction_perturbation = max_wind_direction_perturbation
+        if self.max_wind_direction_perturbation > 0.0:
+            self.wind_stress = WindStress.perturbWindDirection(self.wind_stress, self.max_wind_direction_perturbation)[0]
+        
         # Index range for interior domain (north, east, south, west)
         # so that interior domain of eta is
         # eta[self.interior_domain_indices[2]:self.interior_domain_indices[0], \
@@ -211,7 +222,7 @@ class CDKLM16(Simulator.Simulator):
         
         # Get CUDA functions and define data types for prepared_{async_}call()
         self.cdklm_swe_2D = self.kernel.get_function("cdklm_swe_2D")
-        self.cdklm_swe_2D.prepare("fiPiPiPiPiPiPiPiPiffi")
+        self.cdklm_swe_2D.prepare("fiPiPiPiPiPiPiPiPiffiP")
         self.update_wind_stress(self.kernel, self.cdklm_swe_2D)
         
         # CUDA functions for finding max time step size:
@@ -232,6 +243,17 @@ class CDKLM16(Simulator.Simulator):
                                             ghost_cells_x, ghost_cells_y, H, 
                                             boundary_conditions)
                 
+        # Blocks (tiles) of the domain holding at least one wet cell
+        self.skip_dry_tiles = skip_dry_tiles
+        self.tile_activity_map = None
+        self.active_tiles = None
+        if self.skip_dry_tiles:
+            # Downloads the bathymetry, so it is only done when the dry blocks are skipped
+            self.tile_activity_map = self.bathymetry.tileActivityMap(block_width, block_height)
+            self.active_tiles = Common.ActiveTiles(self.gpu_stream, self.tile_activity_map)
+            self.logger.debug("Skipping {:d} of {:d} blocks which are fully dry".format( \
+                self.active_tiles.num_tiles - self.active_tiles.num_active_tiles, self.active_tiles.num_tiles))
+        
         # Adjust eta for possible dry states
         Hm = self.downloadBathymetry()[1]
         eta0 = np.maximum(eta0, -Hm)
@@ -247,6 +269,13 @@ class CDKLM16(Simulator.Simulator):
         self.max_dt_buffer = Common.CUDAArray2D(self.gpu_stream, 1, 1, 0, 0, host_max_dt_buffer)
         self.courant_number = courant_number
         
+        # Page-locked host memory and event for reading the max time step asynchronously
+        self.max_dt_host = cuda.pagelocked_empty((1,1), dtype=np.float32)
+        self.max_dt_event = cuda.Event()
+        
+        # The policy holds state for this simulator, so it cannot be shared with other simulators
+        self.dt_policy = copy.deepcopy(dt_policy)
+        
         ## Allocating memory for geostrophical equilibrium variables
         self.reportGeostrophicEquilibrium = np.int32(reportGeostrophicEquilibrium)
         self.geoEq_uxpvy = None
@@ -268,22 +297,9 @@ class CDKLM16(Simulator.Simulator):
                                                            self.boundary_conditions, \
                                                            boundary_conditions_data, \
         )
+        Instrumentation.attach(self.bc_kernel, self)
 
 
-        def subsample_texture(data, factor):
-            ny, nx = data.shape 
-            dx, dy = 1/nx, 1/ny
-            I = interp2d(np.linspace(0.5*dx, 1-0.5*dx, nx), 
-                         np.linspace(0.5*dy, 1-0.5*dy, ny), 
-                         data, kind='linear')
-            
-            new_nx, new_ny = max(2, nx//factor), max(2, ny//factor)
-            new_dx, new_dy = 1/new_nx, 1/new_ny
-            x_new = np.linspace(0.5*new_dx, 1-0.5*new_dx, new_nx)
-            y_new = np.linspace(0.5*new_dy, 1-0.5*new_dy, new_ny)
-            return I(x_new, y_new)
-                                            
-                                    
         # Texture for angle
         self.angle_texref = self.kernel.get_texref("angle_tex")
         if isinstance(angle, cuda.Array):
@@ -294,7 +310,7 @@ class CDKLM16(Simulator.Simulator):
             if (subsample_angle and angle.size >= eta0.size):
                 self.logger.info("Subsampling angle texture by factor " + str(subsample_angle))
                 self.logger.warning("This will give inaccurate angle along the border!")
-                angle = subsample_texture(angle, subsample_angle)
+                angle = OceanographicUtilities.subsampleTexture(angle, subsample_angle)
                 
             self.angle_texref.set_array(cuda.np_to_array(np.ascontiguousarray(angle, dtype=np.float32), order="C"))
                     
@@ -338,7 +354,7 @@ class CDKLM16(Simulator.Simulator):
         if (subsample_f and coriolis_f.size >= eta0.size):
             self.logger.info("Subsampling coriolis texture by factor " + str(subsample_f))
             self.logger.warning("This will give inaccurate coriolis along the border!")
-            coriolis_f = subsample_texture(coriolis_f, subsample_f)
+            coriolis_f = OceanographicUtilities.subsampleTexture(coriolis_f, subsample_f)
         
         #Upload data to GPU and bind to texture reference
         self.coriolis_texref.set_array(cuda.np_to_array(np.ascontiguousarray(coriolis_f, dtype=np.float32), order="C"))
@@ -362,6 +378,8 @@ class CDKLM16(Simulator.Simulator):
                                                                                    use_lcg=use_lcg,
                                                                                    block_width=block_width_model_error, 
                                                                                    block_height=block_height_model_error)
+            if self.skip_dry_tiles:
+                self.small_scale_model_error.setActiveTiles(self.bathymetry)
     
         
         # Data assimilation model step size
@@ -391,6 +409,9 @@ class CDKLM16(Simulator.Simulator):
         if self.small_scale_model_error is not None:
             self.small_scale_model_error.cleanUp()
         
+        if self.active_tiles is not None:
+            self.active_tiles.release()
+        
         
         if self.geoEq_uxpvy is not None:
             self.geoEq_uxpvy.release()
@@ -414,6 +435,17 @@ class CDKLM16(Simulator.Simulator):
         filename: Continue simulation based on parameters and last timestep in this file
         new_netcdf_filename: If we want to continue to write netcdf, we should use this filename. Automatically generated if None.
         """
+        initial_state = cls.readInitialState(filename)
+        return cls.fromInitialState(gpu_ctx, initial_state, cont_write_netcdf=cont_write_netcdf, 
+                                    use_lcg=use_lcg, new_netcdf_filename=new_netcdf_filename)
+    
+    @classmethod
+    def readInitialState(cls, filename):
+        """
+        Reads the simulation parameters and the last timestep from nc-file, 
+        for hotstarting one or more simulations with fromInitialState.
+        filename: Continue simulation based on parameters and last timestep in this file
+        """
         # open nc-file
         sim_reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
         sim_name = str(sim_reader.get('simulator_short'))
@@ -436,7 +468,6 @@ class CDKLM16(Simulator.Simulator):
        
         # Set simulation parameters
         sim_params = {
-            'gpu_ctx': gpu_ctx,
             'eta0': eta0,
             'hu0': hu0,
             'hv0': hv0,
@@ -454,9 +485,6 @@ class CDKLM16(Simulator.Simulator):
             'rk_order': sim_reader.get("time_integrator"),
             'coriolis_beta': sim_reader.get("coriolis_beta"),
             # 'y_zero_reference_cell': sim_reader.get("y_zero_reference_cell"), # TODO - UPDATE WITH NEW API
-            'write_netcdf': cont_write_netcdf,
-            'use_lcg': use_lcg,
-            'netcdf_filename': new_netcdf_filename
         }    
         
         # Wind stress
@@ -481,7 +509,29 @@ class CDKLM16(Simulator.Simulator):
         # Data assimilation parameters:
         if sim_reader.has('model_time_step'):
             sim_params['model_time_step'] = sim_reader.get('model_time_step')
+        
+        sim_reader.ncfile.close()
+        return sim_params
     
+    @classmethod
+    def fromInitialState(cls, gpu_ctx, initial_state, cont_write_netcdf=True, use_lcg=False, new_netcdf_filename=None):
+        """
+        Initialize and hotstart simulation from an initial state read by readInitialState.
+        The same initial state can be used for several simulators, as the arrays are only uploaded.
+        cont_write_netcdf: Continue to write the results after each superstep to a new netCDF file
+        new_netcdf_filename: If we want to continue to write netcdf, we should use this filename. Automatically generated if None.
+        """
+        sim_params = dict(initial_state)
+        
+        # The (small) parameter objects are not shared between simulators
+        sim_params['wind_stress'] = copy.deepcopy(initial_state['wind_stress'])
+        sim_params['boundary_conditions'] = copy.deepcopy(initial_state['boundary_conditions'])
+        
+        sim_params['gpu_ctx'] = gpu_ctx
+        sim_params['write_netcdf'] = cont_write_netcdf
+        sim_params['use_lcg'] = use_lcg
+        sim_params['netcdf_filename'] = new_netcdf_filename
+        
         return cls(**sim_params)
     
     
@@ -503,20 +553,9 @@ class CDKLM16(Simulator.Simulator):
         t_now = 0.0
         while (t_now < t_end):
         #for i in range(0, n):
-            # Get new random wind direction (emulationg large-scale model error)
-            if(self.max_wind_direction_perturbation > 0.0 and self.wind_stress.type() == 1):
-                # max perturbation +/- max_wind_direction_perturbation deg within original wind direction (at t=0)
-                perturbation = 2.0*(np.random.rand()-0.5) * self.max_wind_direction_perturbation;
-                new_wind_stress = WindStress.GenericUniformWindStress( \
-                    rho_air=self.wind_stress.rho_air, \
-                    wind_speed=self.wind_stress.wind_speed, \
-                    wind_direction=self.wind_stress.wind_direction + perturbation)
-                # Upload new wind stress params to device
-                cuda.memcpy_htod_async(int(self.wind_stress_dev), new_wind_stress.tostruct(), stream=self.gpu_stream)
-                
             # Calculate dt if using automatic dt
             if (update_dt):
-                self.updateDt()
+                self.dt_policy.update(self)
             local_dt = np.float32(min(self.dt, np.float32(t_end - t_now)))
             
             wind_stress_t = np.float32(self.update_wind_stress(self.kernel, self.cdklm_swe_2D))
@@ -593,6 +632,7 @@ class CDKLM16(Simulator.Simulator):
             
         return self.t
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def drifterStep(self, dt):
         # Evolve drifters
         if self.hasDrifters:
@@ -606,6 +646,7 @@ class CDKLM16(Simulator.Simulator):
             return self.drifter_t
         
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def callKernel(self, \
                    h_in, hu_in, hv_in, \
                    h_out, hu_out, hv_out, \
@@ -619,7 +660,13 @@ class CDKLM16(Simulator.Simulator):
         boundary_conditions = boundary_conditions | np.int8(self.boundary_conditions.east) << 8
         boundary_conditions = boundary_conditions | np.int8(self.boundary_conditions.west) << 0
 
-        self.cdklm_swe_2D.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
+        global_size = self.global_size
+        active_tiles = np.intp(0)
+        if self.active_tiles is not None:
+            global_size = self.active_tiles.global_size
+            active_tiles = self.active_tiles.pointer()
+
+        self.cdklm_swe_2D.prepared_async_call(global_size, self.local_size, self.gpu_stream, \
                            local_dt, \
                            np.int32(rk_step), \
                            h_in.data.gpudata, h_in.pitch, \
@@ -632,7 +679,8 @@ class CDKLM16(Simulator.Simulator):
                            self.bathymetry.Bm.data.gpudata, self.bathymetry.Bm.pitch, \
                            self.bathymetry.mask_value,
                            wind_stress_t, \
-                           boundary_conditions)
+                           boundary_conditions, \
+                           active_tiles)
             
     
     def perturbState(self, q0_scale=1):
@@ -713,6 +761,16 @@ class CDKLM16(Simulator.Simulator):
         if courant_number is None:
             courant_number = self.courant_number
         
+        self.requestMaxDt()
+        self.dt = courant_number*self.readMaxDt()
+    
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def requestMaxDt(self):
+        """
+        Starts computing the maximum time step of the current state according to the
+        CFL conditions (without courant number). The result is copied to page-locked
+        host memory asynchronously, and is available through readMaxDt().
+        """
         self.per_block_max_dt_kernel.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
                    self.nx, self.ny, \
                    self.dx, self.dy, \
@@ -730,9 +788,23 @@ class CDKLM16(Simulator.Simulator):
                                                          self.num_blocks_dt,
                                                          self.device_dt.data.gpudata,
                                                          self.max_dt_buffer.data.gpudata)
-
-        dt_host = self.max_dt_buffer.download(self.gpu_stream)
-        self.dt = courant_number*dt_host[0,0]
+        
+        cuda.memcpy_dtoh_async(self.max_dt_host, self.max_dt_buffer.data.gpudata, stream=self.gpu_stream)
+        self.max_dt_event.record(self.gpu_stream)
+    
+    def maxDtReady(self):
+        """
+        Checks, without waiting, whether the latest requestMaxDt() has completed
+        """
+        return self.max_dt_event.query()
+    
+    @Instrumentation.instrument(Instrumentation.TRANSFER)
+    def readMaxDt(self):
+        """
+        Waits for the latest requestMaxDt() and returns the maximum time step
+        """
+        self.max_dt_event.synchronize()
+        return self.max_dt_host[0,0]
     
     def _getMaxTimestepHost(self, courant_number=0.8):
         """
@@ -742,17 +814,8 @@ class CDKLM16(Simulator.Simulator):
         """
         eta, hu, hv = self.download(interior_domain_only=True)
         Hm = self.downloadBathymetry()[1][2:-2, 2:-2]
-        #print(eta.shape, Hm.shape)
-        
-        h = eta + Hm
-        gravityWaves = np.sqrt(self.g*h)
-        u = hu/h
-        v = hv/h
-        
-        max_dt = 0.25*min(self.dx/np.max(np.abs(u)+gravityWaves), 
-                          self.dy/np.max(np.abs(v)+gravityWaves) )
         
-        return courant_number*max_dt    
+        return TimestepPolicy.maxTimestepHost(eta, hu, hv, Hm, self.dx, self.dy, self.g, courant_number)
     
     def downloadBathymetry(self, interior_domain_only=False):
         Bi, Bm = self.bathymetry.download(self.gpu_stream)
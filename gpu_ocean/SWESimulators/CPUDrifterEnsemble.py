@@ -24,8 +24,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import abc
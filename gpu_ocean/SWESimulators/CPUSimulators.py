@@ -0,0 +1,1686 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements NumPy reference versions of the FBL, CTCS,
+KP07 and CDKLM16 simulators. They take the same constructor arguments as their
+GPU counterparts (the gpu_ctx argument is ignored and may be None), and
+support the same boundary conditions (except sponge boundaries), wind
+stress and download interface. They are intended for regression runs
+and debugging on small domains on machines without a CUDA device.
+
+The kernels are evaluated in single precision on whole arrays, in the same
+order of operations as the CUDA kernels. Due to the fast-math compilation
+of the CUDA kernels the results are not bitwise identical to the GPU
+results. For the reference runs in tests/timestep50 the largest
+differences are below 5e-6 (absolute) for FBL and CTCS, and below 5e-5
+(relative to the largest value) for KP07. CPUCDKLM16 only supports wall and
+periodic boundaries, and is mainly used to verify the skipping of fully
+dry tiles in the CDKLM16 step.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+
+import logging
+import numpy as np
+
+from SWESimulators import Common
+from SWESimulators import WindStress
+from SWESimulators import OceanographicUtilities
+
+
+def _textureLookup(texture, s, t):
+    """
+    Evaluates texture at the normalized coordinates (s, t) in the same way
+    as the CUDA texture units used by the kernels, i.e., bilinear
+    interpolation between texel centers with clamped addressing.
+    """
+    height, width = texture.shape
+    x = np.float32(width)*s - np.float32(0.5)
+    y = np.float32(height)*t - np.float32(0.5)
+    i0 = np.floor(x)
+    j0 = np.floor(y)
+    a = (x - i0).astype(np.float32)
+    b = (y - j0).astype(np.float32)
+    i0 = i0.astype(np.int64)
+    j0 = j0.astype(np.int64)
+    i1 = np.clip(i0+1, 0, width-1)
+    j1 = np.clip(j0+1, 0, height-1)
+    i0 = np.clip(i0, 0, width-1)
+    j0 = np.clip(j0, 0, height-1)
+    return (1-a)*(1-b)*texture[j0, i0] + a*(1-b)*texture[j0, i1] \
+           + (1-a)*b*texture[j1, i0] + a*b*texture[j1, i1]
+
+
+def _minmodSlope(left, center, right, theta):
+    """
+    Vectorized version of minmodSlope in common.cu
+    """
+    backward = (center - left) * theta
+    central = (right - left) * np.float32(0.5)
+    forward = (right - center) * theta
+    return _minmodRaw(backward, central, forward)
+
+
+def _minmodRaw(backward, central, forward):
+    """
+    Vectorized version of minmodRaw in common.cu
+    """
+    sign_b = np.copysign(np.float32(1.0), backward)
+    sign_c = np.copysign(np.float32(1.0), central)
+    sign_f = np.copysign(np.float32(1.0), forward)
+    return np.float32(0.25) * sign_b * (sign_b + sign_c) * (sign_c + sign_f) \
+           * np.minimum(np.minimum(np.abs(backward), np.abs(central)), np.abs(forward))
+
+
+def _periodicGhostCells(Q, nx, ny, boundary_conditions):
+    """
+    Copies the two layers of periodic ghost cells of the stacked (eta, hu, hv) 
+    arrays Q, as Common.BoundaryConditionsArakawaA.boundaryCondition.
+    """
+    if boundary_conditions.isPeriodicNorthSouth():
+        Q[:, :2, :] = Q[:, ny:ny+2, :]
+        Q[:, ny+2:, :] = Q[:, 2:4, :]
+    if boundary_conditions.isPeriodicEastWest():
+        Q[:, :, :2] = Q[:, :, nx:nx+2]
+        Q[:, :, nx+2:] = Q[:, :, 2:4]
+
+
+class CPUSimulator(object):
+    """
+    Baseclass for the NumPy reference simulators.
+    Mirrors the host side interface of Simulator.Simulator.
+    """
+
+    def __init__(self, \
+                 nx, ny, \
+                 ghost_cells_x, \
+                 ghost_cells_y, \
+                 dx, dy, dt, \
+                 g, f, r, A, \
+                 t, \
+                 theta, rk_order, \
+                 coriolis_beta, \
+                 y_zero_reference_cell, \
+                 wind_stress, \
+                 boundary_conditions, \
+                 write_netcdf, \
+                 ignore_ghostcells, \
+                 offset_x, offset_y, \
+                 comm):
+        self.logger = logging.getLogger(__name__)
+
+        assert(not boundary_conditions.isSponge()), \
+            "Sponge boundary conditions are not supported by the CPU simulators"
+
+        # There is no GPU context or stream, but SimWriter expects the attributes
+        self.gpu_ctx = None
+        self.gpu_stream = None
+
+        #Save input parameters
+        #Notice that we need to specify them in the correct dataformat for the
+        #GPU kernel
+        self.nx = np.int32(nx)
+        self.ny = np.int32(ny)
+        self.ghost_cells_x = np.int32(ghost_cells_x)
+        self.ghost_cells_y = np.int32(ghost_cells_y)
+        self.dx = np.float32(dx)
+        self.dy = np.float32(dy)
+        self.dt = np.float32(dt)
+        self.g = np.float32(g)
+        self.f = np.float32(f)
+        self.r = np.float32(r)
+        self.coriolis_beta = np.float32(coriolis_beta)
+        self.y_zero_reference_cell = np.float32(y_zero_reference_cell)
+        self.wind_stress = wind_stress
+        self.boundary_conditions = boundary_conditions
+        self.write_netcdf = write_netcdf
+        self.ignore_ghostcells = ignore_ghostcells
+        self.offset_x = offset_x
+        self.offset_y = offset_y
+        self.comm = comm
+
+        #Initialize time
+        self.t = np.float64(t)
+        self.num_iterations = 0
+
+        if A is None:
+            self.A = 'NA'  # Eddy viscocity coefficient
+        else:
+            self.A = np.float32(A)
+
+        if theta is None:
+            self.theta = 'NA'
+        else:
+            self.theta = np.float32(theta)
+        if rk_order is None:
+            self.rk_order = 'NA'
+        else:
+            self.rk_order = np.int32(rk_order)
+
+        self.hasDrifters = False
+        self.drifters = None
+
+        # Used in the SimWriter and in the ensembles
+        self.local_particle_id = 0
+        self.sim_writer = None
+
+        # Wind stress sampled on the grid of the scheme, one entry per time index
+        self._wind_stress_positions = None
+        self._wind_stress_cache = {}
+
+    def _setWindStressPositions(self, x_positions, y_positions):
+        """
+        Sets the (global) cell coordinates where the scheme evaluates the
+        x- and y-components of the wind stress. Each argument is a tuple
+        (ti, tj) of arrays that broadcast against each other, with the
+        same meaning as the arguments to windStressX/windStressY in the kernels.
+        """
+        self._wind_stress_positions = (x_positions, y_positions)
+        self._wind_stress_cache = {}
+
+    def _sampleWindStress(self, t_index):
+        if t_index not in self._wind_stress_cache:
+            (xi, xj), (yi, yj) = self._wind_stress_positions
+            X = np.asarray(self.wind_stress.X[t_index], dtype=np.float32)
+            Y = np.asarray(self.wind_stress.Y[t_index], dtype=np.float32)
+            self._wind_stress_cache[t_index] = ( \
+                _textureLookup(X, xi/self.nx, xj/self.ny).astype(np.float32), \
+                _textureLookup(Y, yi/self.nx, yj/self.ny).astype(np.float32))
+        return self._wind_stress_cache[t_index]
+
+    def windStress(self):
+        """
+        Host version of update_wind_stress and the wind stress lookup in the kernels.
+        Returns the x- and y-components of the wind stress at the current
+        simulator time, evaluated where the scheme uses them.
+        """
+        t_max_index = len(self.wind_stress.t)-1
+        t0_index = max(0, np.searchsorted(self.wind_stress.t, self.t)-1)
+        t1_index = min(t_max_index, np.searchsorted(self.wind_stress.t, self.t))
+        t0 = self.wind_stress.t[t0_index]
+        t1 = self.wind_stress.t[t1_index]
+
+        # Only keep the sampled wind stress that is in use
+        for key in list(self._wind_stress_cache.keys()):
+            if key != t0_index and key != t1_index:
+                del self._wind_stress_cache[key]
+
+        X0, Y0 = self._sampleWindStress(t0_index)
+        X1, Y1 = self._sampleWindStress(t1_index)
+
+        # Compute the weight for the linear interpolation in time
+        wind_stress_t = np.float32(max(0.0, min(1.0, (self.t-t0)/max(1e-10, t1-t0))))
+        X = wind_stress_t*X1 + (1-wind_stress_t)*X0
+        Y = wind_stress_t*Y1 + (1-wind_stress_t)*Y0
+        return X, Y
+
+    def _state(self):
+        """
+        Returns the arrays (eta, hu, hv) of the current time step
+        """
+        raise NotImplementedError("Needs to be implemented in subclass")
+
+    def _prevState(self):
+        """
+        Returns the arrays (eta, hu, hv) of the additional buffer
+        """
+        raise NotImplementedError("Needs to be implemented in subclass")
+
+    def step(self, t_end=0.0):
+        raise NotImplementedError("Needs to be implemented in subclass")
+
+    def download(self, interior_domain_only=False):
+        """
+        Download the latest time step
+        """
+        eta, hu, hv = [array.copy() for array in self._state()]
+        if interior_domain_only:
+            idx = self.interior_domain_indices
+            return eta[idx[2]:idx[0], idx[3]:idx[1]], \
+                   hu[idx[2]:idx[0], idx[3]:idx[1]], \
+                   hv[idx[2]:idx[0], idx[3]:idx[1]]
+        return eta, hu, hv
+
+    def downloadPrevTimestep(self):
+        """
+        Download the second-latest time step
+        """
+        return tuple(array.copy() for array in self._prevState())
+
+    def upload(self, eta0, hu0, hv0):
+        """
+        Replaces the current time step with the given arrays (incl. ghost cells)
+        """
+        for array, data in zip(self._state(), [eta0, hu0, hv0]):
+            assert(array.shape == data.shape), str(array.shape) + " vs " + str(data.shape)
+            array[:] = data
+
+    def copyState(self, otherSim):
+        """
+        Copies the state eta, hu, hv from another CPU simulator of the same type.
+        """
+        self.upload(*otherSim.download())
+
+    def attachDrifters(self, drifters):
+        raise NotImplementedError("Drifters are not supported by the CPU simulators")
+
+    def writeState(self):
+        self.sim_writer.writeTimestep(self)
+
+    def closeNetCDF(self):
+        if self.write_netcdf:
+            self.sim_writer.__exit__(0,0,0)
+            self.write_netcdf = False
+            self.sim_writer = None
+
+    def cleanUp(self):
+        self.closeNetCDF()
+
+    def _openNetCDF(self, staggered_grid=False):
+        if self.write_netcdf:
+            # Imported here as SimWriter is only needed for writing to file
+            from SWESimulators import SimWriter
+            self.sim_writer = SimWriter.SimNetCDFWriter(self, ignore_ghostcells=self.ignore_ghostcells, \
+                                    staggered_grid=staggered_grid, \
+                                    offset_x=self.offset_x, offset_y=self.offset_y)
+
+
+class CPUFBL(CPUSimulator):
+    """
+    NumPy version of the FBL (forward backward linear) scheme, see FBL.FBL
+    """
+
+    def __init__(self, \
+                 gpu_ctx, \
+                 H, eta0, hu0, hv0, \
+                 nx, ny, \
+                 dx, dy, dt, \
+                 g, f, r, \
+                 t=0.0, \
+                 coriolis_beta=0.0, \
+                 y_zero_reference_cell = 1, \
+                 wind_stress=WindStress.WindStress(), \
+                 boundary_conditions=Common.BoundaryConditions(), \
+                 write_netcdf=False, \
+                 comm=None, \
+                 ignore_ghostcells=False, \
+                 offset_x=0, offset_y=0, \
+                 block_width=16, block_height=16):
+        """
+        Same arguments as FBL.FBL. gpu_ctx, block_width and block_height are ignored.
+        """
+        ghost_cells_x = 1
+        ghost_cells_y = 1
+
+        # Allow the old input shapes, as in FBL.FBL
+        if (eta0.shape == (ny, nx)):
+            new_eta = np.zeros((ny+2, nx+2),  dtype=np.float32)
+            new_eta[:ny, :nx] = eta0.copy()
+            eta0 = new_eta
+        if (H.shape == (ny, nx)):
+            new_H = np.ones((ny+2, nx+2),  dtype=np.float32)*np.max(H)
+            new_H[:ny,:nx] = H.copy()
+            H = new_H
+        if (hu0.shape == (ny, nx+1)):
+            new_hu = np.zeros((ny+2, nx+1),  dtype=np.float32)
+            new_hu[:ny, :nx+1] = hu0.copy()
+            hu0 = new_hu
+        if (hv0.shape == (ny+1, nx)):
+            new_hv = np.zeros((ny+3, nx+2),  dtype=np.float32)
+            new_hv[:ny+1,:nx] = hv0.copy()
+            hv0 = new_hv
+
+        super(CPUFBL, self).__init__(nx, ny, \
+                                     ghost_cells_x, \
+                                     ghost_cells_y, \
+                                     dx, dy, dt, \
+                                     g, f, r, None, \
+                                     t, \
+                                     None, None, \
+                                     coriolis_beta, \
+                                     y_zero_reference_cell, \
+                                     wind_stress, \
+                                     boundary_conditions, \
+                                     write_netcdf, \
+                                     ignore_ghostcells, \
+                                     offset_x, offset_y, \
+                                     comm)
+
+        assert(H.shape == (ny+2, nx+2)), str(H.shape)
+        assert(eta0.shape == (ny+2, nx+2)), str(eta0.shape)
+        assert(hu0.shape == (ny+2, nx+1)), str(hu0.shape)
+        assert(hv0.shape == (ny+3, nx+2)), str(hv0.shape)
+
+        self.H = Common.HostArray2D(None, H.shape[1], H.shape[0], 0, 0, np.array(H, dtype=np.float32))
+        self.eta = np.array(eta0, dtype=np.float32)
+        self.hu = np.array(hu0, dtype=np.float32)
+        self.hv = np.array(hv0, dtype=np.float32)
+
+        # Bit-wise wall boundary conditions, as in FBL.FBL
+        self.wall_bc = 0
+        if (self.boundary_conditions.north == 1):
+            self.wall_bc = self.wall_bc | 0x01
+        if (self.boundary_conditions.east == 1):
+            self.wall_bc = self.wall_bc | 0x02
+        if (self.boundary_conditions.south == 1):
+            self.wall_bc = self.wall_bc | 0x04
+        if (self.boundary_conditions.west == 1):
+            self.wall_bc = self.wall_bc | 0x08
+
+        # U is computed on all rows and faces, V on the rows 1..ny+1 of interior columns
+        self._setWindStressPositions( \
+            (np.arange(nx+1, dtype=np.float32)[np.newaxis, :], \
+             np.arange(ny+2, dtype=np.float32)[:, np.newaxis] + np.float32(0.5)), \
+            (np.arange(1, nx+1, dtype=np.float32)[np.newaxis, :] + np.float32(0.5), \
+             np.arange(1, ny+2, dtype=np.float32)[:, np.newaxis]))
+
+        # Coriolis parameter on the V positions (southern faces of the rows) and U positions (row centers)
+        rows = np.arange(ny+3, dtype=np.float32)[:, np.newaxis]
+        self._f_v = self.f + self.coriolis_beta * (rows - self.y_zero_reference_cell) * self.dy
+        self._f_u = self.f + self.coriolis_beta * ((rows[:ny+2] + np.float32(0.5)) - self.y_zero_reference_cell) * self.dy
+
+        self.interior_domain_indices = np.array([-1,-1,1,1])
+        self._openNetCDF(staggered_grid=True)
+
+    def _state(self):
+        return self.eta, self.hu, self.hv
+
+    def _prevState(self):
+        return self._state()
+
+    def download(self, interior_domain_only=False):
+        """
+        Same as FBL.FBL.download, where hu includes the eastern face
+        """
+        if interior_domain_only:
+            return self.eta[1:-1, 1:-1].copy(), \
+                   self.hu[1:-1, :].copy(), \
+                   self.hv[1:-1, 1:-1].copy()
+        return self.eta.copy(), self.hu.copy(), self.hv.copy()
+
+    def downloadPrevTimestep(self):
+        return self.download()
+
+    def step(self, t_end=0.0):
+        """
+        Function which steps n timesteps
+        """
+        n = int(t_end / self.dt + 1)
+
+        if self.t == 0:
+            self._boundaryConditionU()
+            self._boundaryConditionV()
+            self._boundaryConditionEta()
+
+        for i in range(0, n):
+            local_dt = np.float32(min(self.dt, t_end-i*self.dt))
+
+            if (local_dt <= 0.0):
+                break
+
+            self._step(local_dt)
+
+            self._boundaryConditionU()
+            self._boundaryConditionV()
+            self._boundaryConditionEta()
+
+            self.t += np.float64(local_dt)
+            self.num_iterations += 1
+
+        if self.write_netcdf:
+            self.sim_writer.writeTimestep(self)
+
+        return self.t
+
+    def _step(self, dt):
+        """
+        Same as the fblStepKernel
+        """
+        nx, ny = self.nx, self.ny
+        g, r, dx, dy = self.g, self.r, self.dx, self.dy
+        H, eta, U, V = self.H.data, self.eta, self.hu, self.hv
+        X, Y = self.windStress()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # U on rows 0..ny+1, faces 0..nx
+            H_m = np.float32(0.5)*(H[:, :-1] + H[:, 1:])
+            fV_m = np.float32(0.25)*( self._f_v[:ny+2]*(V[:-1, :-1] + V[:-1, 1:]) \
+                                    + self._f_v[1:ny+3]*(V[1:, :-1] + V[1:, 1:]) )
+            B = H_m/(H_m + r*dt)
+            P = g*H_m*(eta[:, :-1] - eta[:, 1:])/dx
+            U_next = B*(U + dt*(fV_m + P + X))
+            if (self.wall_bc & 0x08):
+                U_next[:, 0] = 0.0
+            if (self.wall_bc & 0x02):
+                U_next[:, nx] = 0.0
+
+            # V on rows 1..ny+1, columns 1..nx
+            H_m = np.float32(0.5)*(H[:-1, 1:-1] + H[1:, 1:-1])
+            fU_m = np.float32(0.25)*( self._f_u[:ny+1]*(U_next[:-1, :-1] + U_next[:-1, 1:]) \
+                                    + self._f_u[1:ny+2]*(U_next[1:, :-1] + U_next[1:, 1:]) )
+            B = H_m/(H_m + r*dt)
+            P = g*H_m*(eta[:-1, 1:-1] - eta[1:, 1:-1])/dy
+            V_next = B*(V[1:-1, 1:-1] + dt*(-fU_m + P + Y))
+            if (self.wall_bc & 0x04):
+                V_next[0, :] = 0.0
+            if (self.wall_bc & 0x01):
+                V_next[ny, :] = 0.0
+
+        # eta in the interior
+        eta[1:-1, 1:-1] = eta[1:-1, 1:-1] - dt/dx*(U_next[1:-1, 1:] - U_next[1:-1, :-1]) \
+                                          - dt/dy*(V_next[1:, :] - V_next[:-1, :])
+
+        # The kernel writes U on interior rows except the eastern face, and V on interior cells
+        U[1:-1, :-1] = U_next[1:-1, :-1]
+        V[1:ny+1, 1:-1] = V_next[:-1, :]
+
+    def _boundaryConditionU(self):
+        """
+        Same as FBL.FBL.bc_kernel.boundaryConditionU
+        """
+        nx, ny = self.nx, self.ny
+        bc = self.boundary_conditions
+        U = self.hu
+        if (bc.north == 1) or (bc.east == 1) or (bc.south == 1) or (bc.west == 1):
+            if bc.west == 1:
+                U[:, 0] = 0.0
+            if bc.east == 1:
+                U[:, nx] = 0.0
+            if bc.south == 1:
+                U[0, :] = U[1, :]
+            if bc.north == 1:
+                U[ny+1, :] = U[ny, :]
+        if bc.north == 2:
+            U[0, 1:nx] = U[ny, 1:nx]
+            U[ny+1, 1:nx] = U[1, 1:nx]
+        if bc.east == 2:
+            U[:, nx] = U[:, 0]
+
+    def _boundaryConditionV(self):
+        """
+        Same as FBL.FBL.bc_kernel.boundaryConditionV
+        """
+        nx, ny = self.nx, self.ny
+        bc = self.boundary_conditions
+        V = self.hv
+        if (bc.north == 1) or (bc.east == 1) or (bc.south == 1) or (bc.west == 1):
+            # The kernel does not modify the southern face (row 1) of a southern wall
+            if bc.north == 1:
+                V[ny+1, :] = 0.0
+            if bc.south == 1:
+                V[0, :] = -V[2, :]
+            if bc.north == 1:
+                V[ny+2, :] = -V[ny, :]
+            if bc.west == 1:
+                V[:, 0] = V[:, 1]
+            if bc.east == 1:
+                V[:, nx+1] = V[:, nx]
+        if bc.north == 2:
+            V[0, 1:nx+1] = V[ny, 1:nx+1]
+            V[ny+1, 1:nx+1] = V[1, 1:nx+1]
+            V[ny+2, 1:nx+1] = V[2, 1:nx+1]
+        if bc.east == 2:
+            V[:, 0] = V[:, nx]
+            V[:, nx+1] = V[:, 1]
+
+    def _boundaryConditionEta(self):
+        """
+        Same as FBL.FBL.bc_kernel.boundaryConditionEta
+        """
+        nx, ny = self.nx, self.ny
+        bc = self.boundary_conditions
+        eta = self.eta
+        if (bc.north == 1) or (bc.east == 1) or (bc.south == 1) or (bc.west == 1):
+            if bc.south == 1:
+                eta[0, :] = eta[1, :]
+            if bc.north == 1:
+                eta[ny+1, :] = eta[ny, :]
+            if bc.west == 1:
+                eta[:, 0] = eta[:, 1]
+            if bc.east == 1:
+                eta[:, nx+1] = eta[:, nx]
+        if bc.north == 2:
+            eta[0, 1:nx+1] = eta[ny, 1:nx+1]
+            eta[ny+1, 1:nx+1] = eta[1, 1:nx+1]
+        if bc.east == 2:
+            eta[:, 0] = eta[:, nx]
+            eta[:, nx+1] = eta[:, 1]
+
+
+class CPUCTCS(CPUSimulator):
+    """
+    NumPy version of the CTCS (centered in time, centered in space) scheme, see CTCS.CTCS
+    """
+
+    def __init__(self, \
+                 gpu_ctx, \
+                 H, eta0, hu0, hv0, \
+                 nx, ny, \
+                 dx, dy, dt, \
+                 g, f, r, A=0.0, \
+                 t=0.0, \
+                 coriolis_beta=0.0, \
+                 y_zero_reference_cell = 0, \
+                 wind_stress=WindStress.WindStress(), \
+                 boundary_conditions=Common.BoundaryConditions(), \
+                 write_netcdf=False, \
+                 comm=None, \
+                 ignore_ghostcells=False, \
+                 offset_x=0, offset_y=0, \
+                 block_width=16, block_height=16):
+        """
+        Same arguments as CTCS.CTCS. gpu_ctx, block_width and block_height are ignored.
+        """
+        ghost_cells_x = 1
+        ghost_cells_y = 1
+        y_zero_reference_cell = y_zero_reference_cell + 1
+
+        super(CPUCTCS, self).__init__(nx, ny, \
+                                      ghost_cells_x, \
+                                      ghost_cells_y, \
+                                      dx, dy, dt, \
+                                      g, f, r, A, \
+                                      t, \
+                                      None, None, \
+                                      coriolis_beta, \
+                                      y_zero_reference_cell, \
+                                      wind_stress, \
+                                      boundary_conditions, \
+                                      write_netcdf, \
+                                      ignore_ghostcells, \
+                                      offset_x, offset_y, \
+                                      comm)
+
+        assert(H.shape == (ny+2, nx+2)), str(H.shape)
+        assert(eta0.shape == (ny+2, nx+2)), str(eta0.shape)
+        assert(hu0.shape == (ny+2, nx+3)), str(hu0.shape)
+        assert(hv0.shape == (ny+3, nx+2)), str(hv0.shape)
+
+        self.H = Common.HostArray2D(None, H.shape[1], H.shape[0], 0, 0, np.array(H, dtype=np.float32))
+
+        # Buffer 0 holds time step n-1 (and receives n+1), buffer 1 holds time step n
+        self.eta0 = np.array(eta0, dtype=np.float32)
+        self.hu0 = np.array(hu0, dtype=np.float32)
+        self.hv0 = np.array(hv0, dtype=np.float32)
+        self.eta1 = self.eta0.copy()
+        self.hu1 = self.hu0.copy()
+        self.hv1 = self.hv0.copy()
+
+        # U is computed on rows 1..ny, faces 1..nx+1, and V on rows 1..ny+1, columns 1..nx
+        self._setWindStressPositions( \
+            (np.arange(1, nx+2, dtype=np.float32)[np.newaxis, :], \
+             np.arange(1, ny+1, dtype=np.float32)[:, np.newaxis] + np.float32(0.5)), \
+            (np.arange(1, nx+1, dtype=np.float32)[np.newaxis, :] + np.float32(0.5), \
+             np.arange(1, ny+2, dtype=np.float32)[:, np.newaxis]))
+
+        # Coriolis parameter at the V positions surrounding U, and the U positions surrounding V
+        tj = np.arange(1, ny+2, dtype=np.float32)[:, np.newaxis]
+        y0 = self.y_zero_reference_cell
+        self._f_v_0 = self.f + self.coriolis_beta * ((tj[:ny]-1) + np.float32(0.5) - y0 + np.float32(0.5)) * self.dy
+        self._f_v_m = self.f + self.coriolis_beta * ((tj[:ny]-1) - np.float32(0.5) - y0 + np.float32(0.5)) * self.dy
+        self._f_u_0 = self.f + self.coriolis_beta * (tj - np.float32(0.5) - y0) * self.dy
+        self._f_u_p = self.f + self.coriolis_beta * (tj + np.float32(0.5) - y0) * self.dy
+
+        self.interior_domain_indices = np.array([-1,-1,1,1])
+        self._openNetCDF(staggered_grid=True)
+
+    def _state(self):
+        return self.eta0, self.hu0, self.hv0
+
+    def _prevState(self):
+        return self.eta1, self.hu1, self.hv1
+
+    def _swap(self):
+        self.eta0, self.eta1 = self.eta1, self.eta0
+        self.hu0, self.hu1 = self.hu1, self.hu0
+        self.hv0, self.hv1 = self.hv1, self.hv0
+
+    def step(self, t_end=0.0):
+        """
+        Function which steps n timesteps
+        """
+        n = int(t_end / self.dt + 1)
+
+        # Ensure that we take an odd number of steps, as in CTCS.CTCS
+        if (n % 2 == 0):
+            n += 1
+
+        if self.t == 0:
+            self._boundaryConditions(self.eta0, self.hu0, self.hv0)
+            self._boundaryConditions(self.eta1, self.hu1, self.hv1)
+
+        for i in range(0, n):
+            # Notation:
+            # cl_data.u0 => U^{n-1} before U kernel, U^{n+1} after U kernel
+            # cl_data.u1 => U^{n}
+            local_dt = t_end / n
+            local_dt = local_dt + (local_dt / (100*n))
+            local_dt = np.float32(min(local_dt, t_end-i*local_dt))
+
+            if (local_dt <= 0.0):
+                break
+
+            self._step(local_dt)
+            self._boundaryConditions(self.eta0, self.hu0, self.hv0)
+
+            self._swap()
+
+            self.t += np.float64(local_dt)
+            self.num_iterations += 1
+
+        if self.write_netcdf:
+            self.sim_writer.writeTimestep(self)
+
+        return self.t
+
+    def _step(self, dt):
+        """
+        Same as the ctcsStepKernel (eta, U and V)
+        """
+        nx, ny = self.nx, self.ny
+        g, r, A, dx, dy = self.g, self.r, self.A, self.dx, self.dy
+        H = self.H.data
+        eta0, U0, V0 = self.eta0, self.hu0, self.hv0
+        eta1, U1, V1 = self.eta1, self.hu1, self.hv1
+        X, Y = self.windStress()
+        quarter = np.float32(0.25)
+        half = np.float32(0.5)
+        eddy = np.float32(2.0)*A*dt*(dx*dx + dy*dy)/(dx*dx*dy*dy)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            # U on rows 1..ny and faces 1..nx+1
+            U_00 = U1[1:ny+1, 1:nx+2]
+            U_0p = U1[2:ny+2, 1:nx+2]
+            U_0m = U1[0:ny,   1:nx+2]
+            U_p0 = U1[1:ny+1, 2:nx+3]
+            U_m0 = U1[1:ny+1, 0:nx+1]
+            V_00 = V1[2:ny+2, 0:nx+1]
+            V_p0 = V1[2:ny+2, 1:nx+2]
+            V_0m = V1[1:ny+1, 0:nx+1]
+            V_pm = V1[1:ny+1, 1:nx+2]
+            H_0m = H[0:ny,   0:nx+1]
+            H_00 = H[1:ny+1, 0:nx+1]
+            H_0p = H[2:ny+2, 0:nx+1]
+            H_pm = H[0:ny,   1:nx+2]
+            H_p0 = H[1:ny+1, 1:nx+2]
+            H_pp = H[2:ny+2, 1:nx+2]
+            eta_0m = eta1[0:ny,   0:nx+1]
+            eta_00 = eta1[1:ny+1, 0:nx+1]
+            eta_0p = eta1[2:ny+2, 0:nx+1]
+            eta_pm = eta1[0:ny,   1:nx+2]
+            eta_p0 = eta1[1:ny+1, 1:nx+2]
+            eta_pp = eta1[2:ny+2, 1:nx+2]
+            U_0 = U0[1:ny+1, 1:nx+2]
+
+            H_bar_0m = quarter*(H_0m + H_pm + H_00 + H_p0)
+            H_bar_00 = quarter*(H_00 + H_p0 + H_0p + H_pp)
+            H_x = half*(H_00 + H_p0)
+            eta_bar_0m = quarter*(eta_0m + eta_pm + eta_00 + eta_p0)
+            eta_bar_00 = quarter*(eta_00 + eta_p0 + eta_0p + eta_pp)
+
+            fV_bar = quarter*(self._f_v_m*(V_0m + V_pm) + self._f_v_0*(V_00 + V_p0))
+            C = np.float32(1.0) + np.float32(2.0)*r*dt/H_x + eddy
+            P_x_hat = -half*g*(eta_p0*eta_p0 - eta_00*eta_00)
+            P_x = -g*H_x*(eta_p0 - eta_00) + P_x_hat
+            N_a = (U_p0 + U_00)*(U_p0 + U_00) / (H_p0 + eta_p0)
+            N_b = (U_00 + U_m0)*(U_00 + U_m0) / (H_00 + eta_00)
+            N_c = (U_0p + U_00)*(V_p0 + V_00) / (H_bar_00 + eta_bar_00)
+            N_d = (U_00 + U_0m)*(V_pm + V_0m) / (H_bar_0m + eta_bar_0m)
+            N = quarter*(N_a - N_b + (dx/dy)*(N_c - N_d))
+            E = (U_p0 - U_0 + U_m0)/(dx*dx) + (U_0p - U_0 + U_0m)/(dy*dy)
+
+            U2 = (U_0 + np.float32(2.0)*dt*(fV_bar + (N + P_x)/dx + X + A*E) ) / C
+            if self.boundary_conditions.west == 1:
+                U2[:, 0] = 0.0
+            if self.boundary_conditions.east == 1:
+                U2[:, nx] = 0.0
+
+            # V on rows 1..ny+1 and columns 1..nx
+            V_00 = V1[1:ny+2, 1:nx+1]
+            V_0p = V1[2:ny+3, 1:nx+1]
+            V_0m = V1[0:ny+1, 1:nx+1]
+            V_p0 = V1[1:ny+2, 2:nx+2]
+            V_m0 = V1[1:ny+2, 0:nx]
+            U_00 = U1[0:ny+1, 2:nx+2]
+            U_0p = U1[1:ny+2, 2:nx+2]
+            U_m0 = U1[0:ny+1, 1:nx+1]
+            U_mp = U1[1:ny+2, 1:nx+1]
+            H_m0 = H[0:ny+1, 0:nx]
+            H_00 = H[0:ny+1, 1:nx+1]
+            H_p0 = H[0:ny+1, 2:nx+2]
+            H_mp = H[1:ny+2, 0:nx]
+            H_0p = H[1:ny+2, 1:nx+1]
+            H_pp = H[1:ny+2, 2:nx+2]
+            eta_m0 = eta1[0:ny+1, 0:nx]
+            eta_00 = eta1[0:ny+1, 1:nx+1]
+            eta_p0 = eta1[0:ny+1, 2:nx+2]
+            eta_mp = eta1[1:ny+2, 0:nx]
+            eta_0p = eta1[1:ny+2, 1:nx+1]
+            eta_pp = eta1[1:ny+2, 2:nx+2]
+            V_0 = V0[1:ny+2, 1:nx+1]
+
+            fU_bar = quarter*(self._f_u_0*(U_m0 + U_00) + self._f_u_p*(U_mp + U_0p))
+            H_bar_m0 = quarter*(H_m0 + H_mp + H_00 + H_0p)
+            H_bar_00 = quarter*(H_00 + H_0p + H_p0 + H_pp)
+            H_y = half*(H_00 + H_0p)
+            eta_bar_m0 = quarter*(eta_m0 + eta_mp + eta_00 + eta_0p)
+            eta_bar_00 = quarter*(eta_00 + eta_0p + eta_p0 + eta_pp)
+
+            C = np.float32(1.0) + np.float32(2.0)*r*dt/H_y + eddy
+            P_y_hat = -half*g*(eta_0p*eta_0p - eta_00*eta_00)
+            P_y = -g*H_y*(eta_0p - eta_00) + P_y_hat
+            N_a = (V_0p + V_00)*(V_0p + V_00) / (H_0p + eta_0p)
+            N_b = (V_00 + V_0m)*(V_00 + V_0m) / (H_00 + eta_00)
+            N_c = (U_0p + U_00)*(V_p0 + V_00) / (H_bar_00 + eta_bar_00)
+            N_d = (U_mp + U_m0)*(V_00 + V_m0) / (H_bar_m0 + eta_bar_m0)
+            N = quarter*(N_a - N_b + (dy/dx)*(N_c - N_d))
+            E = (V_p0 - V_0 + V_m0)/(dx*dx) + (V_0p - V_0 + V_0m)/(dy*dy)
+
+            V2 = (V_0 + np.float32(2.0)*dt*(-fU_bar + (N + P_y)/dy + Y + A*E) ) / C
+            if self.boundary_conditions.south == 1:
+                V2[0, :] = 0.0
+            if self.boundary_conditions.north == 1:
+                V2[ny, :] = 0.0
+
+        # eta in the interior, using U and V at time n
+        eta0[1:-1, 1:-1] = eta0[1:-1, 1:-1] \
+                           - np.float32(2.0)*dt/dx*(U1[1:ny+1, 2:nx+2] - U1[1:ny+1, 1:nx+1]) \
+                           - np.float32(2.0)*dt/dy*(V1[2:ny+2, 1:nx+1] - V1[1:ny+1, 1:nx+1])
+        U0[1:ny+1, 1:nx+2] = U2
+        V0[1:ny+2, 1:nx+1] = V2
+
+    def _boundaryConditions(self, eta, U, V):
+        """
+        Same as CTCS.CTCS.bc_kernel.boundaryCondition{Eta,U,V}
+        """
+        nx, ny = self.nx, self.ny
+        bc = self.boundary_conditions
+
+        # eta and U have the same north-south boundary
+        for data in [eta, U]:
+            if bc.south < 3:
+                data[0, :] = data[1, :] if bc.south == 1 else data[ny, :]
+            if bc.north < 3:
+                data[ny+1, :] = data[1, :] if bc.north == 2 else data[ny, :]
+
+        if bc.west < 3:
+            eta[:, 0] = eta[:, 1] if bc.west == 1 else eta[:, nx]
+        if bc.east < 3:
+            eta[:, nx+1] = eta[:, 1] if bc.east == 2 else eta[:, nx]
+
+        if (bc.west == 1) or (bc.east == 1):
+            if bc.west == 1:
+                U[:, 0] = -U[:, 2]
+                U[:, 1] = 0.0
+            if bc.east == 1:
+                U[:, nx+1] = 0.0
+                U[:, nx+2] = -U[:, nx]
+        elif bc.west == 2:
+            U[:, 0] = U[:, nx]
+            U[:, nx+1] = U[:, 1]
+            U[:, nx+2] = U[:, 2]
+
+        if (bc.south == 1) or (bc.north == 1):
+            if bc.south == 1:
+                V[0, :] = -V[2, :]
+                V[1, :] = 0.0
+            if bc.north == 1:
+                V[ny+1, :] = 0.0
+                V[ny+2, :] = -V[ny, :]
+        elif bc.north == 2:
+            V[0, :] = V[ny, :]
+            V[ny+1, :] = V[1, :]
+            V[ny+2, :] = V[2, :]
+
+        if bc.west < 3:
+            V[:, 0] = V[:, 1] if bc.west == 1 else V[:, nx]
+        if bc.east < 3:
+            V[:, nx+1] = V[:, 1] if bc.east == 2 else V[:, nx]
+
+
+class CPUKP07(CPUSimulator):
+    """
+    NumPy version of the Kurganov-Petrova 2007 scheme, see KP07.KP07
+    """
+
+    def __init__(self, \
+                 gpu_ctx, \
+                 eta0, H, hu0, hv0, \
+                 nx, ny, \
+                 dx, dy, dt, \
+                 g, f=0.0, r=0.0, \
+                 t=0.0, \
+                 theta=1.3, use_rk2=True,
+                 coriolis_beta=0.0, \
+                 y_zero_reference_cell = 0, \
+                 wind_stress=WindStress.WindStress(), \
+                 boundary_conditions=Common.BoundaryConditions(), \
+                 write_netcdf=False, \
+                 comm=None, \
+                 ignore_ghostcells=False, \
+                 offset_x=0, offset_y=0, \
+                 flux_slope_eps = 1.0e-1, \
+                 depth_cutoff = 1.0e-5, \
+                 block_width=32, block_height=16):
+        """
+        Same arguments as KP07.KP07. gpu_ctx, block_width and block_height are ignored.
+        """
+        ghost_cells_x = 2
+        ghost_cells_y = 2
+        y_zero_reference_cell = 2.0 + y_zero_reference_cell
+
+        rk_order = np.int32(use_rk2 + 1)
+        A = None
+        super(CPUKP07, self).__init__(nx, ny, \
+                                      ghost_cells_x, \
+                                      ghost_cells_y, \
+                                      dx, dy, dt, \
+                                      g, f, r, A, \
+                                      t, \
+                                      theta, rk_order, \
+                                      coriolis_beta, \
+                                      y_zero_reference_cell, \
+                                      wind_stress, \
+                                      boundary_conditions, \
+                                      write_netcdf, \
+                                      ignore_ghostcells, \
+                                      offset_x, offset_y, \
+                                      comm)
+
+        self.use_rk2 = use_rk2
+        self.flux_slope_eps = np.float32(flux_slope_eps)
+        self.depth_cutoff = np.float32(depth_cutoff)
+        self._eps4 = np.float32(flux_slope_eps**4)
+
+        self.bathymetry = Common.Bathymetry(None, None, nx, ny, ghost_cells_x, ghost_cells_y, H, \
+                                            self.boundary_conditions, backend='host')
+        Hm = self.downloadBathymetry()[1]
+        eta0 = np.maximum(eta0, -Hm)
+
+        assert(eta0.shape == (ny+4, nx+4)), str(eta0.shape)
+        assert(hu0.shape == (ny+4, nx+4)), str(hu0.shape)
+        assert(hv0.shape == (ny+4, nx+4)), str(hv0.shape)
+
+        # Buffer 0 holds the current time step
+        self.Q0 = np.stack([np.asarray(eta0, dtype=np.float32), \
+                            np.asarray(hu0, dtype=np.float32), \
+                            np.asarray(hv0, dtype=np.float32)])
+        self.Q1 = self.Q0.copy()
+
+        # Bathymetry reconstructed at the cell faces
+        Hi = self.bathymetry.Bi.data
+        self._RHx = np.float32(0.5)*(Hi[:-1, :] + Hi[1:, :])
+        self._RHy = np.float32(0.5)*(Hi[:, :-1] + Hi[:, 1:])
+        self._Hm = self.bathymetry.Bm.data[2:-2, 2:-2]
+
+        # Wind stress and Coriolis parameter at the interior cell centers
+        self._setWindStressPositions( \
+            (np.arange(2, nx+2, dtype=np.float32)[np.newaxis, :] + np.float32(0.5), \
+             np.arange(2, ny+2, dtype=np.float32)[:, np.newaxis] + np.float32(0.5)), \
+            (np.arange(2, nx+2, dtype=np.float32)[np.newaxis, :] + np.float32(0.5), \
+             np.arange(2, ny+2, dtype=np.float32)[:, np.newaxis] + np.float32(0.5)))
+        tj = np.arange(2, ny+2, dtype=np.float32)[:, np.newaxis]
+        self._coriolis_f = self.f + self.coriolis_beta * \
+            ((tj - np.float32(2)) - self.y_zero_reference_cell + np.float32(0.5)) * self.dy
+
+        self.interior_domain_indices = np.array([-2,-2,2,2])
+        self._openNetCDF()
+
+    def _state(self):
+        return self.Q0[0], self.Q0[1], self.Q0[2]
+
+    def _prevState(self):
+        return self.Q1[0], self.Q1[1], self.Q1[2]
+
+    def downloadBathymetry(self):
+        return self.bathymetry.download(None)
+
+    def step(self, t_end=0.0):
+        """
+        Function which steps n timesteps
+        """
+        n = int(t_end / self.dt + 1)
+
+        if self.t == 0:
+            self._boundaryConditions(self.Q0)
+
+        for i in range(0, n):
+            local_dt = np.float32(min(self.dt, t_end-i*self.dt))
+
+            if (local_dt <= 0.0):
+                break
+
+            if (self.use_rk2):
+                self._step(self.Q0, self.Q1, local_dt, 0)
+                self._boundaryConditions(self.Q1)
+                self._step(self.Q1, self.Q0, local_dt, 1)
+                self._boundaryConditions(self.Q0)
+            else:
+                self._step(self.Q0, self.Q1, local_dt, 0)
+                self.Q0, self.Q1 = self.Q1, self.Q0
+                self._boundaryConditions(self.Q0)
+
+            self.t += np.float64(local_dt)
+            self.num_iterations += 1
+
+        if self.write_netcdf:
+            self.sim_writer.writeTimestep(self)
+
+        return self.t
+
+    def _boundaryConditions(self, Q):
+        """
+        Same as Common.BoundaryConditionsArakawaA.boundaryCondition.
+        Walls are handled in the step.
+        """
+        _periodicGhostCells(Q, self.nx, self.ny, self.boundary_conditions)
+
+    def _flux(self, Qm, Qp, RH):
+        """
+        Vectorized version of CentralUpwindFluxBottom in common.cu.
+        Qm and Qp are the reconstructed (eta, hu, hv) on each side of the faces.
+        """
+        g = self.g
+        eps = self.flux_slope_eps
+        sqrt2 = np.float32(np.sqrt(2.0))
+        half = np.float32(0.5)
+
+        F = []
+        speeds = []
+        Q = []
+        for Qs in [Qm, Qp]:
+            h = Qs[0] + RH
+            wet = h > self.depth_cutoff
+            hu = Qs[1]
+            hv = Qs[2]
+            u = hu / h
+
+            # Desingularize almost dry cells
+            almost_dry = wet & (h <= eps)
+            if np.any(almost_dry):
+                h4 = (h*h)*(h*h)
+                denom = np.sqrt(h4 + np.maximum(h4, self._eps4))
+                u = np.where(almost_dry, sqrt2*h*hu/denom, u)
+                v = np.where(almost_dry, sqrt2*h*hv/denom, hv/h)
+                hu = np.where(almost_dry, h*u, hu)
+                hv = np.where(almost_dry, h*v, hv)
+
+            F.append(np.where(wet, np.stack([hu, hu*u + half*g*(h*h), hv*u]), np.float32(0.0)))
+            c = np.where(wet, np.sqrt(np.where(wet, g*h, np.float32(0.0))), np.float32(0.0))
+            u = np.where(wet, u, np.float32(0.0))
+            speeds.append((u, c))
+            Q.append(np.stack([Qs[0], hu, hv]))
+
+        (um, cm), (up, cp) = speeds
+        am = np.minimum(np.minimum(um-cm, up-cp), np.float32(0.0))
+        ap = np.maximum(np.maximum(um+cm, up+cp), np.float32(0.0))
+
+        flux = ((ap*F[0] - am*F[1]) + ap*am*(Q[1]-Q[0]))/(ap-am)
+        return np.where(np.abs(ap-am) < eps, np.float32(0.0), flux)
+
+    def _bottomSourceTerm(self, Q, Qx, RH_m, RH_p, desingularize_h4):
+        """
+        Vectorized version of bottomSourceTerm2_kp and bottomSourceTerm3_kp in KP07_kernel.cu
+        """
+        eps = self.flux_slope_eps
+        eta_p = Q + Qx
+        eta_m = Q - Qx
+        H_x = RH_p - RH_m
+        h = Q + (RH_p + RH_m)/np.float32(2.0)
+        h4 = (h*h)*(h*h)
+
+        almost_dry = (h4 if desingularize_h4 else h) <= eps
+        if np.any(almost_dry):
+            H_x = np.where(almost_dry, \
+                           np.float32(np.sqrt(2.0))*h*h*H_x/np.sqrt(h4 + np.maximum(h4, self._eps4)), \
+                           H_x)
+        ST = np.float32(-0.5)*self.g*H_x*(eta_p + RH_p + eta_m + RH_m)
+        return np.where(h > self.depth_cutoff, ST, np.float32(0.0))
+
+    def _step(self, Q_in, Q_out, dt, step):
+        """
+        Same as the swe_2D kernel in KP07_kernel.cu
+        """
+        nx, ny = self.nx, self.ny
+        dx, dy = self.dx, self.dy
+        bc = self.boundary_conditions
+        Hm = self._Hm
+        RHx, RHy = self._RHx, self._RHy
+
+        # Read the state with eta limited by the bathymetry
+        Q = Q_in.copy()
+        Q[0] = np.maximum(Q[0], -self.bathymetry.Bm.data)
+
+        # Mirror the non-corner ghost cells at walls
+        rows = slice(2, ny+2)
+        cols = slice(2, nx+2)
+        flip_x = np.array([1, -1, 1], dtype=np.float32)[:, np.newaxis]
+        flip_y = np.array([1, 1, -1], dtype=np.float32)[:, np.newaxis]
+        if bc.west == 1:
+            Q[:, rows, 1] = Q[:, rows, 2]*flip_x
+            Q[:, rows, 0] = Q[:, rows, 3]*flip_x
+        if bc.east == 1:
+            Q[:, rows, nx+2] = Q[:, rows, nx+1]*flip_x
+            Q[:, rows, nx+3] = Q[:, rows, nx]*flip_x
+        if bc.south == 1:
+            Q[:, 1, cols] = Q[:, 2, cols]*flip_y
+            Q[:, 0, cols] = Q[:, 3, cols]*flip_y
+        if bc.north == 1:
+            Q[:, ny+2, cols] = Q[:, ny+1, cols]*flip_y
+            Q[:, ny+3, cols] = Q[:, ny, cols]*flip_y
+
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            # x-direction: slopes in the columns 1..nx+2 of the interior rows
+            Qr = Q[:, rows, :]
+            Qx = np.float32(0.5)*_minmodSlope(Qr[:, :, 0:nx+2], Qr[:, :, 1:nx+3], Qr[:, :, 2:nx+4], self.theta)
+            Qc = Qr[:, :, 1:nx+3]
+            RH_m = RHx[rows, 1:nx+3]
+            RH_p = RHx[rows, 2:nx+4]
+            Qx[0] = np.where(Qc[0] - Qx[0] < -RH_m, Qc[0] + RH_m, Qx[0])
+            Qx[0] = np.where(Qc[0] + Qx[0] < -RH_p, -RH_p - Qc[0], Qx[0])
+
+            # Fluxes through the faces 1|2 .. nx+1|nx+2
+            F = self._flux(Qc[:, :, :-1] + Qx[:, :, :-1], Qc[:, :, 1:] - Qx[:, :, 1:], RHx[rows, 2:nx+3])
+            ST2 = self._bottomSourceTerm(Qc[0, :, 1:-1], Qx[0, :, 1:-1], \
+                                         RH_m[:, 1:-1], RH_p[:, 1:-1], True)
+
+            R1 = -(F[0, :, 1:] - F[0, :, :-1])/dx
+            R2 = -(F[1, :, 1:] - F[1, :, :-1])/dx + (-ST2/dx)
+            R3 = -(F[2, :, 1:] - F[2, :, :-1])/dx
+
+            # y-direction: slopes in the rows 1..ny+2 of the interior columns
+            Qcol = Q[:, :, cols]
+            Qy = np.float32(0.5)*_minmodSlope(Qcol[:, 0:ny+2, :], Qcol[:, 1:ny+3, :], Qcol[:, 2:ny+4, :], self.theta)
+            Qc = Qcol[:, 1:ny+3, :]
+            RH_m = RHy[1:ny+3, cols]
+            RH_p = RHy[2:ny+4, cols]
+            Qy[0] = np.where(Qc[0] - Qy[0] < -RH_m, Qc[0] + RH_m, Qy[0])
+            Qy[0] = np.where(Qc[0] + Qy[0] < -RH_p, -RH_p - Qc[0], Qy[0])
+
+            # Fluxes through the faces 1|2 .. ny+1|ny+2, with hu and hv swapped
+            swap = [0, 2, 1]
+            G = self._flux((Qc[:, :-1] + Qy[:, :-1])[swap], (Qc[:, 1:] - Qy[:, 1:])[swap], RHy[2:ny+3, cols])[swap]
+            ST3 = self._bottomSourceTerm(Qc[0, 1:-1], Qy[0, 1:-1], \
+                                         RH_m[1:-1], RH_p[1:-1], False)
+
+            X, Y = self.windStress()
+            hu = Q[1, rows, cols]
+            hv = Q[2, rows, cols]
+            R1 = R1 + -(G[0, 1:] - G[0, :-1])/dy
+            R2 = R2 + (-(G[1, 1:] - G[1, :-1])/dy + (X + self._coriolis_f*hv))
+            R3 = R3 + (-(G[2, 1:] - G[2, :-1])/dy + (Y - self._coriolis_f*hu - ST3/dy))
+
+        Q_new = np.stack([Q[0, rows, cols] + dt*R1, hu + dt*R2, hv + dt*R3])
+        if step == 1:
+            Q_n = Q_out[:, rows, cols].copy()
+            Q_n[0] = np.maximum(Q_n[0], -Hm)
+            Q_new = np.float32(0.5)*(Q_n + Q_new)
+
+        dry = Q_new[0] + Hm <= self.depth_cutoff
+        Q_new[0] = np.where(dry, -Hm, Q_new[0])
+        Q_new[1:] = np.where(dry, np.float32(0.0), Q_new[1:])
+
+        Q_out[:, rows, cols] = Q_new
+
+
+class CPUCDKLM16(CPUSimulator):
+    """
+    NumPy version of the CDKLM16 scheme, see CDKLM16.CDKLM16
+
+    The interior domain is split into tiles of block_width x block_height cells,
+    in the same way as the thread blocks of the kernel. With skip_dry_tiles=True,
+    only the tiles holding at least one wet cell are computed, and each tile is
+    evaluated from the same halo of two cells as the kernel reads into shared
+    memory. The results in the wet cells are therefore bitwise identical to
+    computing the whole domain at once, whereas land cells in skipped tiles
+    keep their values.
+    """
+
+    # Must match CDKLM16_kernel.cu
+    DRY_FLAG = np.float32(1.0e-30)
+    DRY_EPS = np.float32(1.0e-3)
+
+    def __init__(self, \
+                 gpu_ctx, \
+                 eta0, hu0, hv0, H, \
+                 nx, ny, \
+                 dx, dy, dt, \
+                 g, f, r, \
+                 subsample_f=10, \
+                 angle=np.array([[0]], dtype=np.float32), \
+                 subsample_angle=10, \
+                 latitude=None, \
+                 t=0.0, \
+                 theta=1.3, rk_order=2, \
+                 coriolis_beta=0.0, \
+                 wind_stress=WindStress.WindStress(), \
+                 boundary_conditions=Common.BoundaryConditions(), \
+                 write_netcdf=False, \
+                 comm=None, \
+                 ignore_ghostcells=False, \
+                 offset_x=0, offset_y=0, \
+                 flux_slope_eps = 1.0e-1, \
+                 desingularization_eps = 1.0e-1, \
+                 depth_cutoff = 1.0e-5, \
+                 small_scale_perturbation=False, \
+                 small_scale_perturbation_amplitude=None, \
+                 use_lcg=False, \
+                 block_width=12, block_height=32, \
+                 skip_dry_tiles=False):
+        """
+        Same arguments as CDKLM16.CDKLM16, without the arguments for drifters and 
+        time step control. gpu_ctx is ignored. The small scale perturbation is 
+        computed by OceanStateNoise with the host backend, and is only supported 
+        without interpolation.
+        """
+        assert(rk_order in [1, 2, 3]), "Only 1st, 2nd and 3rd order Runge Kutta supported"
+        if (rk_order == 3):
+            assert(r == 0.0), "3rd order Runge Kutta supported only without friction"
+        for bc in [boundary_conditions.north, boundary_conditions.south, \
+                   boundary_conditions.east, boundary_conditions.west]:
+            assert(bc in [1, 2]), "Only wall and periodic boundary conditions are supported by CPUCDKLM16"
+
+        ghost_cells_x = 2
+        ghost_cells_y = 2
+
+        # Compensate f for reference cell (first cell in internal of domain), as in CDKLM16
+        north = np.array([np.sin(angle[0,0]), np.cos(angle[0,0])])
+        f = f - coriolis_beta * (ghost_cells_x*dx*north[0] + ghost_cells_y*dy*north[1])
+
+        A = None
+        super(CPUCDKLM16, self).__init__(nx, ny, \
+                                         ghost_cells_x, \
+                                         ghost_cells_y, \
+                                         dx, dy, dt, \
+                                         g, f, r, A, \
+                                         t, \
+                                         theta, rk_order, \
+                                         coriolis_beta, \
+                                         0, \
+                                         wind_stress, \
+                                         boundary_conditions, \
+                                         write_netcdf, \
+                                         ignore_ghostcells, \
+                                         offset_x, offset_y, \
+                                         comm)
+
+        self.flux_slope_eps = np.float32(flux_slope_eps)
+        self.desingularization_eps = np.float32(desingularization_eps)
+        self.depth_cutoff = np.float32(depth_cutoff)
+
+        self.bathymetry = Common.Bathymetry(None, None, nx, ny, ghost_cells_x, ghost_cells_y, H, \
+                                            self.boundary_conditions, backend='host')
+        Hm = self.downloadBathymetry()[1]
+        eta0 = np.maximum(eta0, -Hm)
+
+        assert(eta0.shape == (ny+4, nx+4)), str(eta0.shape)
+        assert(hu0.shape == (ny+4, nx+4)), str(hu0.shape)
+        assert(hv0.shape == (ny+4, nx+4)), str(hv0.shape)
+
+        # Buffer 0 holds the current time step
+        self.Q0 = np.stack([np.ma.getdata(eta0).astype(np.float32), \
+                            np.asarray(hu0, dtype=np.float32), \
+                            np.asarray(hv0, dtype=np.float32)])
+        self.Q1 = self.Q0.copy()
+
+        # Bathymetry as read by the kernel, with land intersections replaced by the dry flag,
+        # and reconstructed on the x-faces, y-faces and cell centers
+        Hi = self.bathymetry.Bi.data
+        Hi = np.where(np.abs(Hi - self.bathymetry.mask_value) < self.DRY_EPS, self.DRY_FLAG, Hi)
+        half = np.float32(0.5)
+        self._Hx = half*(Hi[:-1, :] + Hi[1:, :])
+        self._Hy = half*(Hi[:, :-1] + Hi[:, 1:])
+        self._Hm = np.float32(0.25)*(Hi[:-1, :-1] + Hi[1:, :-1] + Hi[:-1, 1:] + Hi[1:, 1:])
+        self._Bm = self.bathymetry.Bm.data
+
+        # Coriolis parameter and north vector at all cell centers, as looked up in the textures
+        coriolis_f, angle = self._textures(eta0.shape, f, angle, latitude, subsample_f, subsample_angle)
+        s = (np.arange(nx+4, dtype=np.float32) + half) / np.float32(nx+4)
+        t = (np.arange(ny+4, dtype=np.float32) + half) / np.float32(ny+4)
+        s, t = s[np.newaxis, :], t[:, np.newaxis]
+        self._coriolis_f = _textureLookup(coriolis_f, s, t).astype(np.float32)
+        angle = _textureLookup(angle, s, t).astype(np.float32)
+        self._north = (np.sin(angle), np.cos(angle))
+
+        # Wind stress at the interior cell centers
+        positions = (np.arange(2, nx+2, dtype=np.float32)[np.newaxis, :] + half, \
+                     np.arange(2, ny+2, dtype=np.float32)[:, np.newaxis] + half)
+        self._setWindStressPositions(positions, positions)
+
+        # Tiles (thread blocks of the kernel) to compute, given by the global rows and columns
+        self.skip_dry_tiles = skip_dry_tiles
+        self.tile_activity_map = None
+        self._tiles = [(slice(2, ny+2), slice(2, nx+2))]
+        if self.skip_dry_tiles:
+            self.tile_activity_map = self.bathymetry.tileActivityMap(block_width, block_height)
+            tiles_x = self.tile_activity_map.shape[1]
+            self._tiles = []
+            for tile in Common.activeTileIndices(self.tile_activity_map):
+                tile_y, tile_x = divmod(int(tile), tiles_x)
+                self._tiles.append((slice(2 + tile_y*block_height, 2 + min((tile_y+1)*block_height, ny)), \
+                                    slice(2 + tile_x*block_width, 2 + min((tile_x+1)*block_width, nx))))
+
+        # Small scale perturbation, as in CDKLM16 (imported here, as it is only needed for stochastic runs)
+        self.small_scale_perturbation = small_scale_perturbation
+        self.small_scale_model_error = None
+        if small_scale_perturbation:
+            from SWESimulators import OceanStateNoise
+            self.small_scale_model_error = OceanStateNoise.OceanStateNoise.fromsim(self, 
+                                                                                   soar_q0=small_scale_perturbation_amplitude,
+                                                                                   use_lcg=use_lcg)
+
+        self.interior_domain_indices = np.array([-2,-2,2,2])
+        self._openNetCDF()
+
+    def _textures(self, shape, f, angle, latitude, subsample_f, subsample_angle):
+        """
+        Returns the (possibly subsampled) coriolis and angle textures, as created in CDKLM16
+        """
+        angle = np.asarray(angle, dtype=np.float32)
+        if (subsample_angle and angle.size >= np.prod(shape)):
+            angle = OceanographicUtilities.subsampleTexture(angle, subsample_angle)
+
+        if (latitude is not None):
+            if (self.f != 0.0):
+                raise RuntimeError("Cannot specify both latitude and f. Make your mind up.")
+            coriolis_f, _ = OceanographicUtilities.calcCoriolisParams(latitude)
+        elif (self.coriolis_beta != 0.0):
+            if (angle.size != 1):
+                raise RuntimeError("non-constant angle cannot be combined with beta plane model (makes no sense)")
+            x = np.linspace(-1.5*self.dx, (self.nx+1.5)*self.dx, self.nx+4)
+            y = np.linspace(-1.5*self.dy, (self.ny+1.5)*self.dy, self.ny+4)
+            x, y = np.meshgrid(x, y)
+            coriolis_f = self.f + self.coriolis_beta*(x*np.sin(angle[0, 0]) + y*np.cos(angle[0, 0]))
+        elif (np.size(self.f) == 1):
+            coriolis_f = np.array([[self.f]])
+        elif (np.shape(self.f) == shape):
+            coriolis_f = np.array(self.f)
+        else:
+            raise RuntimeError("The shape of f should match up with eta or be scalar.")
+
+        if (subsample_f and coriolis_f.size >= np.prod(shape)):
+            coriolis_f = OceanographicUtilities.subsampleTexture(coriolis_f, subsample_f)
+        return np.asarray(coriolis_f, dtype=np.float32), np.asarray(angle, dtype=np.float32)
+
+    def _state(self):
+        return self.Q0[0], self.Q0[1], self.Q0[2]
+
+    def _prevState(self):
+        return self.Q1[0], self.Q1[1], self.Q1[2]
+
+    def downloadBathymetry(self):
+        return self.bathymetry.download(None)
+
+    def step(self, t_end=0.0, apply_stochastic_term=True):
+        """
+        Function which steps n timesteps.
+        apply_stochastic_term: Boolean value for whether the stochastic
+            perturbation (if any) should be applied.
+        """
+        if self.t == 0:
+            self._boundaryConditions(self.Q0)
+
+        t_now = 0.0
+        while (t_now < t_end):
+            local_dt = np.float32(min(self.dt, np.float32(t_end - t_now)))
+
+            if (self.rk_order == 2):
+                self._step(self.Q0, self.Q1, local_dt, 0)
+                self._boundaryConditions(self.Q1)
+                self._step(self.Q1, self.Q0, local_dt, 1)
+            elif (self.rk_order == 1):
+                self._step(self.Q0, self.Q1, local_dt, 0)
+                self.Q0, self.Q1 = self.Q1, self.Q0
+            elif (self.rk_order == 3):
+                self._step(self.Q0, self.Q1, local_dt, 0)
+                self._boundaryConditions(self.Q1)
+                self._step(self.Q1, self.Q0, local_dt, 1)
+                self._boundaryConditions(self.Q1)
+                self._step(self.Q1, self.Q0, local_dt, 2)
+
+            # Perturb ocean state with model error
+            if self.small_scale_perturbation and apply_stochastic_term:
+                self.small_scale_model_error.perturbSim(self)
+
+            self._boundaryConditions(self.Q0)
+
+            self.t += np.float64(local_dt)
+            t_now += np.float64(local_dt)
+            self.num_iterations += 1
+
+        if self.write_netcdf:
+            self.sim_writer.writeTimestep(self)
+
+        return self.t
+
+    def _boundaryConditions(self, Q):
+        """
+        Same as Common.BoundaryConditionsArakawaA.boundaryCondition.
+        Walls are handled in the step.
+        """
+        _periodicGhostCells(Q, self.nx, self.ny, self.boundary_conditions)
+
+    def _step(self, Q_in, Q_out, dt, step):
+        """
+        Same as the cdklm_swe_2D kernel in CDKLM16_kernel.cu, applied to each tile.
+        All tiles read the input before any results are written.
+        """
+        X, Y = self.windStress()
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            results = [self._stepTile(Q_in, Q_out, dt, step, X, Y, rows, cols) for rows, cols in self._tiles]
+
+        # The second step of RK3 writes to the input buffer
+        if (self.rk_order == 3 and step == 1):
+            Q_out = Q_in
+        for (rows, cols), Q_new in zip(self._tiles, results):
+            Q_out[:, rows, cols] = Q_new
+
+    def _desingularize(self, h, hu):
+        """
+        Vectorized version of desingularize in common.cu
+        """
+        eps = self.desingularization_eps
+        # 0.5*eps is evaluated in double precision in the kernel
+        denominator = (h*h/(np.float32(2.0)*eps)).astype(np.float64) + 0.5*np.float64(eps)
+        return hu / np.fmax(np.fmin(denominator.astype(np.float32), eps), np.abs(h))
+
+    def _flux(self, hm, um, vm, hp, up, vp):
+        """
+        Vectorized version of CDKLM16_flux in CDKLM16_kernel.cu, given (h, u, v) on each side of the faces
+        """
+        g = self.g
+        zero = np.float32(0.0)
+
+        F = []
+        speeds = []
+        for h, u, v in [(hm, um, vm), (hp, up, vp)]:
+            wet = h > self.depth_cutoff
+            F.append([np.where(wet, h*u, zero), \
+                      np.where(wet, h*u*u + np.float32(0.5)*g*h*h, zero), \
+                      np.where(wet, h*u*v, zero)])
+            speeds.append((np.where(wet, u, zero), np.sqrt(np.where(wet, g*h, zero))))
+        (Fm, Fp), ((um_, cm), (up_, cp)) = F, speeds
+
+        am = np.fmin(np.fmin(um_-cm, up_-cp), zero)
+        ap = np.fmax(np.fmax(um_+cm, up_+cp), zero)
+
+        F1 = ((ap*Fm[0] - am*Fp[0]) + ap*am*(hp-hm))/(ap-am)
+        F2 = ((ap*Fm[1] - am*Fp[1]) + ap*am*(Fp[0]-Fm[0]))/(ap-am)
+        F3 = np.where(um + up > 0, Fm[2], Fp[2])
+
+        # Symmetric Riemann fan
+        symmetric = np.abs(ap - am) < self.flux_slope_eps
+        return [np.where(symmetric, zero, F) for F in [F1, F2, F3]]
+
+    def _stepTile(self, Q_in, Q_out, dt, step, X, Y, rows, cols):
+        """
+        Computes the updated (eta, hu, hv) in the interior cells [rows, cols], 
+        reading two halo cells in each direction from Q_in.
+        The variables are named as in the kernel.
+        """
+        nx, ny = self.nx, self.ny
+        g, dx, dy = self.g, self.dx, self.dy
+        theta = self.theta
+        bc = self.boundary_conditions
+        half = np.float32(0.5)
+        two_g = np.float32(2.0)*g
+        zero = np.float32(0.0)
+        j0, j1, i0, i1 = rows.start, rows.stop, cols.start, cols.stop
+        h, w = j1-j0, i1-i0
+
+        # The tile with two halo cells (local index l corresponds to global row j0-2+l)
+        R = Q_in[:, j0-2:j1+2, i0-2:i1+2].copy()
+
+        # Mirror the non-corner halo cells at walls, as handleWallBC
+        flip_x = np.array([1, -1, 1], dtype=np.float32)[:, np.newaxis]
+        flip_y = np.array([1, 1, -1], dtype=np.float32)[:, np.newaxis]
+        if bc.north == 1 and j1 == ny+2:
+            R[:, h+2, 2:w+2] = R[:, h+1, 2:w+2]*flip_y
+            R[:, h+3, 2:w+2] = R[:, h, 2:w+2]*flip_y
+        if bc.south == 1 and j0 == 2:
+            R[:, 1, 2:w+2] = R[:, 2, 2:w+2]*flip_y
+            R[:, 0, 2:w+2] = R[:, 3, 2:w+2]*flip_y
+        if bc.east == 1 and i1 == nx+2:
+            R[:, 2:h+2, w+2] = R[:, 2:h+2, w+1]*flip_x
+            R[:, 2:h+2, w+3] = R[:, 2:h+2, w]*flip_x
+        if bc.west == 1 and i0 == 2:
+            R[:, 2:h+2, 1] = R[:, 2:h+2, 2]*flip_x
+            R[:, 2:h+2, 0] = R[:, 2:h+2, 3]*flip_x
+
+        # Create the reconstruction variables (eta, u, v) with dry and land cells
+        local_Hm = self._Bm[j0-2:j1+2, i0-2:i1+2]
+        depth = R[0] + local_Hm
+        land = np.abs(local_Hm - self.bathymetry.mask_value) <= self.DRY_EPS
+        almost_dry = depth < self.desingularization_eps
+        dry = almost_dry & (depth <= self.depth_cutoff)
+        for p in [1, 2]:
+            R[p] = np.where(almost_dry, self._desingularize(depth, R[p]), R[p]/depth)
+            R[p] = np.where(land | dry, zero, R[p])
+        R[0] = np.where(dry, -local_Hm + self.depth_cutoff, R[0])
+        R[0] = np.where(land, self.DRY_FLAG, R[0])
+
+        # The cells of the tile
+        Hm = self._Hm[j0:j1, i0:i1]
+        eta, u, v = R[:, 2:h+2, 2:w+2]
+        north_x = self._north[0][j0:j1, i0:i1]
+        north_y = self._north[1][j0:j1, i0:i1]
+        east_x, east_y = north_y, -north_x
+        coriolis_f_central = self._coriolis_f[j0:j1, i0:i1]
+
+        # Desingularized hu and hv
+        h_c = eta + Hm
+        hu = np.where(h_c > self.depth_cutoff, u*h_c, zero)
+        hv = np.where(h_c > self.depth_cutoff, v*h_c, zero)
+
+        # Slopes along x in the columns i0-1..i1 (global index c)
+        c = np.arange(i0-1, i1+1)[np.newaxis, :]
+        Rx = R[:, 2:h+2, :]
+        left, center, right = Rx[:, :, 0:w+2], Rx[:, :, 1:w+3], Rx[:, :, 2:w+4]
+        Qx = [_minmodSlope(left[1], center[1], right[1], theta), \
+              _minmodSlope(left[2], center[2], right[2], theta)]
+        left_v, center_v, right_v = left[2], center[2], right[2]
+        if bc.west == 1:
+            left_v = np.where(c < 3, -left_v, left_v)
+            center_v = np.where(c < 2, -center_v, center_v)
+        if bc.east == 1:
+            right_v = np.where(c > nx, -right_v, right_v)
+            center_v = np.where(c > nx+1, -center_v, center_v)
+        local_north_x = self._north[0][j0:j1, i0-1:i1+1]
+        local_north_y = self._north[1][j0:j1, i0-1:i1+1]
+        f_c = self._coriolis_f[j0:j1, i0-1:i1+1]
+        left_fv = (local_north_x*left[1] + local_north_y*left_v)*self._coriolis_f[j0:j1, i0-2:i1]
+        center_fv = (local_north_x*center[1] + local_north_y*center_v)*f_c
+        right_fv = (local_north_x*right[1] + local_north_y*right_v)*self._coriolis_f[j0:j1, i0:i1+2]
+        V_constant = dx/two_g
+        backward = theta*g*(center[0] - left[0] - V_constant*(center_fv + left_fv))
+        central = half*g*(right[0] - left[0] - V_constant*(right_fv + np.float32(2.0)*center_fv + left_fv))
+        forward = theta*g*(right[0] - center[0] - V_constant*(center_fv + right_fv))
+        Kx = _minmodRaw(backward, central, forward)
+
+        # Adjust the Kx slopes to avoid negative h, as adjustSlopes_x
+        v_adj = center[2]
+        if bc.west == 1:
+            v_adj = np.where(c < 2, -v_adj, v_adj)
+        if bc.east == 1:
+            v_adj = np.where(c > nx+2, -v_adj, v_adj)
+        dxfv = dx*f_c*v_adj
+        H_west = self._Hx[j0:j1, i0-1:i1+1]
+        H_east = self._Hx[j0:j1, i0:i1+2]
+        h_west = center[0] + H_west - (Kx + dxfv)/two_g
+        h_east = center[0] + H_east + (Kx + dxfv)/two_g
+        Kx = np.where(h_west > 0, Kx, -dxfv + two_g*(center[0] + H_west))
+        Kx = np.where(h_east > 0, Kx, -dxfv - two_g*(center[0] + H_east))
+
+        # Fluxes through the west (m = 0) and east (m = 1) faces of the cells, using
+        # the north vector of the cell itself. The kernel passes the north and south
+        # boundary conditions as the east and west boundary conditions here.
+        F = []
+        for m in [0, 1]:
+            p = m+1
+            eta_m, um, vm = center[:, :, m:m+w]
+            eta_p, up, vp = center[:, :, p:p+w]
+            Rp = (up - half*Qx[0][:, p:p+w], vp - half*Qx[1][:, p:p+w])
+            Rm = (um + half*Qx[0][:, m:m+w], vm + half*Qx[1][:, m:m+w])
+            H_face = self._Hx[j0:j1, i0+m:i1+m]
+            c_p = c[:, p:p+w]
+            if bc.south == 1:
+                vm = np.where(c_p == 2, -vm, vm)
+            if bc.north == 1:
+                vp = np.where(c_p == nx+2, -vp, vp)
+            vp_north = up*north_x + vp*north_y
+            vm_north = um*north_x + vm*north_y
+            coriolis_fm = self._coriolis_f[j0:j1, i0-1+m:i1-1+m]
+            coriolis_fp = self._coriolis_f[j0:j1, i0+m:i1+m]
+            hp = np.fmax(zero, eta_p + H_face - (Kx[:, p:p+w] + dx*coriolis_fp*vp_north)/two_g)
+            hm = np.fmax(zero, eta_m + H_face + (Kx[:, m:m+w] + dx*coriolis_fm*vm_north)/two_g)
+            flux = self._flux(hm, Rm[0], Rm[1], hp, Rp[0], Rp[1])
+            dry_face = (eta_p == self.DRY_FLAG) | (eta_m == self.DRY_FLAG)
+            F.append([np.where(dry_face, zero, flux_p) for flux_p in flux])
+        flux_diff = [(F[1][p] - F[0][p])/dx for p in range(3)]
+
+        # Reconstruct eta_west, eta_east for use in bathymetry source term
+        eta_west = eta - (Kx[:, 1:w+1] + dx*coriolis_f_central*v)/two_g
+        eta_east = eta + (Kx[:, 1:w+1] + dx*coriolis_f_central*v)/two_g
+
+        # Slopes along y in the rows j0-1..j1 (global index r)
+        r = np.arange(j0-1, j1+1)[:, np.newaxis]
+        Ry = R[:, :, 2:w+2]
+        lower, center, upper = Ry[:, 0:h+2, :], Ry[:, 1:h+3, :], Ry[:, 2:h+4, :]
+        Qy = [_minmodSlope(lower[1], center[1], upper[1], theta), \
+              _minmodSlope(lower[2], center[2], upper[2], theta)]
+        lower_u, center_u, upper_u = lower[1], center[1], upper[1]
+        if bc.south == 1:
+            lower_u = np.where(r < 3, -lower_u, lower_u)
+            center_u = np.where(r < 2, -center_u, center_u)
+        if bc.north == 1:
+            upper_u = np.where(r > ny, -upper_u, upper_u)
+            center_u = np.where(r > ny+1, -center_u, center_u)
+        local_east_x = self._north[1][j0-1:j1+1, i0:i1]
+        local_east_y = -self._north[0][j0-1:j1+1, i0:i1]
+        f_c = self._coriolis_f[j0-1:j1+1, i0:i1]
+        lower_fu = (local_east_x*lower_u + local_east_y*lower[2])*self._coriolis_f[j0-2:j1, i0:i1]
+        center_fu = (local_east_x*center_u + local_east_y*center[2])*f_c
+        upper_fu = (local_east_x*upper_u + local_east_y*upper[2])*self._coriolis_f[j0:j1+2, i0:i1]
+        U_constant = dy/two_g
+        backward = theta*g*(center[0] - lower[0] + U_constant*(center_fu + lower_fu))
+        central = half*g*(upper[0] - lower[0] + U_constant*(upper_fu + np.float32(2.0)*center_fu + lower_fu))
+        forward = theta*g*(upper[0] - center[0] + U_constant*(center_fu + upper_fu))
+        Ly = _minmodRaw(backward, central, forward)
+
+        # Adjust the Ly slopes to avoid negative h, as adjustSlopes_y
+        u_adj = center[1]
+        if bc.south == 1:
+            u_adj = np.where(r < 2, -u_adj, u_adj)
+        if bc.north == 1:
+            u_adj = np.where(r > ny+2, -u_adj, u_adj)
+        dyfu = dy*f_c*u_adj
+        H_south = self._Hy[j0-1:j1+1, i0:i1]
+        H_north = self._Hy[j0:j1+2, i0:i1]
+        h_south = center[0] + H_south - (Ly - dyfu)/two_g
+        h_north = center[0] + H_north + (Ly - dyfu)/two_g
+        Ly = np.where(h_south > 0, Ly, dyfu + two_g*(center[0] + H_south))
+        Ly = np.where(h_north > 0, Ly, dyfu - two_g*(center[0] + H_north))
+
+        # Fluxes through the south (m = 0) and north (m = 1) faces of the cells, with u and v
+        # swapped. The kernel passes the east and west boundary conditions as the north and
+        # south boundary conditions here.
+        G = []
+        for m in [0, 1]:
+            p = m+1
+            eta_m, um, vm = center[:, m:m+h, :]
+            eta_p, up, vp = center[:, p:p+h, :]
+            Rp = (up - half*Qy[0][p:p+h, :], vp - half*Qy[1][p:p+h, :])
+            Rm = (um + half*Qy[0][m:m+h, :], vm + half*Qy[1][m:m+h, :])
+            H_face = self._Hy[j0+m:j1+m, i0:i1]
+            r_p = r[p:p+h, :]
+            if bc.west == 1:
+                um = np.where(r_p == 2, -um, um)
+            if bc.east == 1:
+                up = np.where(r_p == ny+2, -up, up)
+            up_east = up*east_x + vp*east_y
+            um_east = um*east_x + vm*east_y
+            coriolis_fm = self._coriolis_f[j0-1+m:j1-1+m, i0:i1]
+            coriolis_fp = self._coriolis_f[j0+m:j1+m, i0:i1]
+            hp = np.fmax(zero, eta_p + H_face - (Ly[p:p+h, :] - dy*coriolis_fp*up_east)/two_g)
+            hm = np.fmax(zero, eta_m + H_face + (Ly[m:m+h, :] - dy*coriolis_fm*um_east)/two_g)
+            flux = self._flux(hm, Rm[1], Rm[0], hp, Rp[1], Rp[0])
+            dry_face = (eta_p == self.DRY_FLAG) | (eta_m == self.DRY_FLAG)
+            G.append([np.where(dry_face, zero, flux[k]) for k in [0, 2, 1]])
+        flux_diff = [flux_diff[p] + (G[1][p] - G[0][p])/dy for p in range(3)]
+
+        # Reconstruct eta_north, eta_south for use in bathymetry source term
+        eta_south = eta - (Ly[1:h+1, :] - dy*coriolis_f_central*u)/two_g
+        eta_north = eta + (Ly[1:h+1, :] - dy*coriolis_f_central*u)/two_g
+
+        # Source terms (wind, coriolis, bathymetry) in wet cells that are not land
+        H_x = self._Hx[j0:j1, i0+1:i1+1] - self._Hx[j0:j1, i0:i1]
+        H_y = self._Hy[j0+1:j1+1, i0:i1] - self._Hy[j0:j1, i0:i1]
+        eta_sn = half*(eta_north + eta_south)
+        eta_we = half*(eta_west + eta_east)
+        bathymetry1 = g*(eta_we + Hm)*H_x
+        bathymetry2 = g*(eta_sn + Hm)*H_y
+
+        # Project momenta onto north/east axes, convert due to Coriolis, and project back
+        hu_east = hu*east_x + hv*east_y
+        hv_north = hu*north_x + hv*north_y
+        hu_east_cor = coriolis_f_central*hv_north
+        hv_north_cor = -coriolis_f_central*hu_east
+        hu_cor = north_y*hu_east_cor + north_x*hv_north_cor
+        hv_cor = -north_x*hu_east_cor + north_y*hv_north_cor
+
+        wet = (h_c >= self.depth_cutoff) & (eta != self.DRY_FLAG)
+        st1 = np.where(wet, X[j0-2:j1-2, i0-2:i1-2] + hu_cor + bathymetry1/dx, zero)
+        st2 = np.where(wet, Y[j0-2:j1-2, i0-2:i1-2] + hv_cor + bathymetry2/dy, zero)
+
+        L1 = -flux_diff[0]
+        L2 = -flux_diff[1] + st1
+        L3 = -flux_diff[2] + st2
+
+        Q_a = Q_out[:, j0:j1, i0:i1]
+        if (self.rk_order < 3):
+            C = zero
+            if (self.r > 0.0):
+                almost_dry = h_c < self.desingularization_eps
+                u_C = np.where(almost_dry, self._desingularize(h_c, hu), hu/h_c)
+                v_C = np.where(almost_dry, self._desingularize(h_c, hv), hv/h_c)
+                speed = np.sqrt(u_C*u_C + v_C*v_C)
+                C = np.where(almost_dry, dt*self.r*self._desingularize(h_c, speed), dt*self.r*speed/h_c)
+
+            if (step == 0):
+                updated_eta = eta + dt*L1
+                updated_hu = (hu + dt*L2) / (np.float32(1.0) + C)
+                updated_hv = (hv + dt*L3) / (np.float32(1.0) + C)
+            else:
+                updated_eta = half*(Q_a[0] + (eta + dt*L1))
+                updated_hu = half*(Q_a[1] + (hu + dt*L2)) / (np.float32(1.0) + half*C)
+                updated_hv = half*(Q_a[2] + (hv + dt*L3)) / (np.float32(1.0) + half*C)
+        else:
+            updated = [eta + dt*L1, hu + dt*L2, hv + dt*L3]
+            if (step == 1):
+                updated = [np.float32(0.75)*Q_a[p] + np.float32(0.25)*updated[p] for p in range(3)]
+            elif (step == 2):
+                updated = [(Q_a[p] + np.float32(2.0)*updated[p]) / np.float32(3.0) for p in range(3)]
+            updated_eta, updated_hu, updated_hv = updated
+
+        dry = updated_eta + Hm <= self.depth_cutoff
+        updated_eta = np.where(dry, -Hm + self.depth_cutoff, updated_eta)
+        updated_hu = np.where(dry, zero, updated_hu)
+        updated_hv = np.where(dry, zero, updated_hv)
+
+        return np.stack([np.fmax(-Hm + self.depth_cutoff, updated_eta), updated_hu, updated_hv])
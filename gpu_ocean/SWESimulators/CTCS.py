@@ -31,11 +31,13 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 #Import packages we need
 import numpy as np
 import gc
-import pycuda.driver as cuda
+from SWESimulators import LazyImport
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 from SWESimulators import Common, SimWriter, SimReader
 from SWESimulators import Simulator
 from SWESimulators import WindStress
+from SWESimulators import Instrumentation
 
 import time
 
@@ -169,6 +171,7 @@ class CTCS(Simulator.Simulator):
                                                  self.boundary_conditions, \
                                                  halo_x, halo_y \
         )
+        Instrumentation.attach(self.bc_kernel, self)
         
         #"Beautify" code a bit by packing four bools into a single int
         #Note: Must match code in kernel!
@@ -298,23 +301,7 @@ class CTCS(Simulator.Simulator):
             
             wind_stress_t = np.float32(self.update_wind_stress(self.step_kernel, self.ctcsStepKernel))
 
-            self.ctcsStepKernel.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
-                    self.nx, self.ny, \
-                    self.wall_bc, \
-                    self.dx, self.dy, local_dt, \
-                    self.g, self.f, self.coriolis_beta, self.y_zero_reference_cell, \
-                    self.r, self.A,\
-                    
-                    self.gpu_data.h0.data.gpudata, self.gpu_data.h0.pitch,     # eta^{n-1} => eta^{n+1} \
-                    self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch,   # U^{n-1} => U^{n+1} \
-                    self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch,   # V^{n-1} => V^{n+1} \
-                    
-                    self.H.data.gpudata, self.H.pitch,                         # H (bathymetry) \        
-                    self.gpu_data.h1.data.gpudata, self.gpu_data.h1.pitch,     # eta^{n} \
-                    self.gpu_data.hu1.data.gpudata, self.gpu_data.hu1.pitch,   # U^{n} \
-                    self.gpu_data.hv1.data.gpudata, self.gpu_data.hv1.pitch,   # V^{n} \
-
-                    wind_stress_t)
+            self.callKernel(local_dt, wind_stress_t)
                    
             self.bc_kernel.boundaryConditionEta(self.gpu_stream, self.gpu_data.h0)
             self.bc_kernel.boundaryConditionU(self.gpu_stream, self.gpu_data.hu0)
@@ -331,6 +318,26 @@ class CTCS(Simulator.Simulator):
             
         return self.t
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def callKernel(self, local_dt, wind_stress_t):
+        self.ctcsStepKernel.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
+                self.nx, self.ny, \
+                self.wall_bc, \
+                self.dx, self.dy, local_dt, \
+                self.g, self.f, self.coriolis_beta, self.y_zero_reference_cell, \
+                self.r, self.A,\
+                
+                self.gpu_data.h0.data.gpudata, self.gpu_data.h0.pitch,     # eta^{n-1} => eta^{n+1} \
+                self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch,   # U^{n-1} => U^{n+1} \
+                self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch,   # V^{n-1} => V^{n+1} \
+                
+                self.H.data.gpudata, self.H.pitch,                         # H (bathymetry) \        
+                self.gpu_data.h1.data.gpudata, self.gpu_data.h1.pitch,     # eta^{n} \
+                self.gpu_data.hu1.data.gpudata, self.gpu_data.hu1.pitch,   # U^{n} \
+                self.gpu_data.hv1.data.gpudata, self.gpu_data.hv1.pitch,   # V^{n} \
+
+                wind_stress_t)
+
         
     def _call_all_boundary_conditions(self):
         self.bc_kernel.boundaryConditionEta(self.gpu_stream, self.gpu_data.h0)
@@ -407,6 +414,7 @@ class CTCS_boundary_condition:
 
         
        
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionU(self, gpu_stream, hu0):
         """
         Updates hu according periodic boundary conditions
@@ -434,6 +442,7 @@ class CTCS_boundary_condition:
         
         
         
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionV(self, gpu_stream, hv0):
         """
         Updates hv according to periodic boundary conditions
@@ -459,6 +468,7 @@ class CTCS_boundary_condition:
         self.callSpongeEW(gpu_stream, hv0, 0, 1)
         #self.callSpongeEW(gpu_stream, hv0, 0, 0)
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionEta(self, gpu_stream, eta0):
         """
         Updates eta boundary conditions (ghost cells)
@@ -30,6 +30,8 @@ import time
 import numpy as np
 import pyopencl as cl #OpenCL in Python
 
+from SWESimulators import OpenCLContext, WindStress
+
 
 
 
@@ -241,6 +243,9 @@ class CTCS2Layer:
     wind_y0: Initial y position of moving cyclone (dy*(ny/2) - v0*3600.0*48.0)
     wind_u0: Translation speed along x for moving cyclone (30.0/sqrt(5.0))
     wind_v0: Translation speed along y for moving cyclone (-0.5*u0)
+    block_width, block_height: Work-group size (default chosen for the device, see OpenCLContext)
+    cl_ctx may be a pyopencl.Context or an OpenCLContext.OpenCLContext, e.g.,
+    OpenCLContext.OpenCLContext(device_type='cpu') to run on a CPU OpenCL device.
     """
     def __init__(self, \
                  cl_ctx,\
@@ -253,17 +258,28 @@ class CTCS2Layer:
                  wind_type=99, # "no wind" \
                  wind_tau0=0, wind_alpha=0, wind_xm=0, wind_Rc=0, \
                  wind_x0=0, wind_y0=0, \
-                 wind_u0=0, wind_v0=0):
-        self.cl_ctx = cl_ctx
-        print("Using " + str(self.cl_ctx.devices[0].name))
+                 wind_u0=0, wind_v0=0, \
+                 block_width=None, block_height=None):
+        self.opencl_ctx = OpenCLContext.OpenCLContext.fromContext(cl_ctx)
+        self.cl_ctx = self.opencl_ctx.cl_ctx
+        print("Using " + str(self.opencl_ctx.device.name))
 
         #Create an OpenCL command queue
         self.cl_queue = cl.CommandQueue(self.cl_ctx)
 
+        #Work-group size, which is also compiled into the kernels
+        self.local_size = self.opencl_ctx.workGroupSize(block_width, block_height)
+        defines = {'block_width': self.local_size[0], 'block_height': self.local_size[1]}
+
         #Get kernels
-        self.u_kernel = self.get_kernel("CTCS2Layer_U_kernel.opencl")
-        self.v_kernel = self.get_kernel("CTCS2Layer_V_kernel.opencl")
-        self.eta_kernel = self.get_kernel("CTCS2Layer_eta_kernel.opencl")
+        self.u_kernel = self.opencl_ctx.get_kernel("CTCS2Layer_U_kernel.opencl", defines)
+        self.v_kernel = self.opencl_ctx.get_kernel("CTCS2Layer_V_kernel.opencl", defines)
+        self.eta_kernel = self.opencl_ctx.get_kernel("CTCS2Layer_eta_kernel.opencl", defines)
+        
+        #Retrieve each kernel function once, as retrieving it creates a new kernel object
+        self.computeEtaKernel = cl.Kernel(self.eta_kernel, "computeEtaKernel")
+        self.computeUKernel = cl.Kernel(self.u_kernel, "computeUKernel")
+        self.computeVKernel = cl.Kernel(self.v_kernel, "computeVKernel")
         
         #Create data by uploading to device
         self.cl_data = CTCS2LayerDataCL(self.cl_ctx, h1_0, eta1_0, u1_0, v1_0, h2_0, eta2_0, u2_0, v2_0)
@@ -284,21 +300,21 @@ class CTCS2Layer:
         assert(rho1 <= rho2)
         self.rho1 = np.float32(rho1)
         self.rho2 = np.float32(rho2)
-        self.wind_type = np.int32(wind_type)
-        self.wind_tau0 = np.float32(wind_tau0)
-        self.wind_alpha = np.float32(wind_alpha)
-        self.wind_xm = np.float32(wind_xm)
-        self.wind_Rc = np.float32(wind_Rc)
-        self.wind_x0 = np.float32(wind_x0)
-        self.wind_y0 = np.float32(wind_y0)
-        self.wind_u0 = np.float32(wind_u0)
-        self.wind_v0 = np.float32(wind_v0)
+        
+        #Upload the wind stress parameters as the wind_stress_params struct in common.opencl.
+        #The wind stress acts on the upper layer, with density rho1
+        wind_stress = WindStress.WIND_STRESS_PARAMS(wind_stress_type=wind_type, \
+                                                    tau0=wind_tau0, rho=rho1, alpha=wind_alpha, \
+                                                    xm=wind_xm, Rc=wind_Rc, \
+                                                    x0=wind_x0, y0=wind_y0, \
+                                                    u0=wind_u0, v0=wind_v0)
+        self.wind_stress = cl.Buffer(self.cl_ctx, cl.mem_flags.READ_ONLY | cl.mem_flags.COPY_HOST_PTR, \
+                                     hostbuf=np.frombuffer(bytes(wind_stress), dtype=np.uint8))
         
         #Initialize time
         self.t = np.float32(0.0)
         
         #Compute kernel launch parameters
-        self.local_size = (8, 8) # WARNING::: MUST MATCH defines of block_width/height in kernels!
         self.global_size = ( \
                        int(np.ceil(self.nx / float(self.local_size[0])) * self.local_size[0]), \
                        int(np.ceil(self.ny / float(self.local_size[1])) * self.local_size[1]) \
@@ -327,7 +343,7 @@ class CTCS2Layer:
             if (local_dt <= 0.0):
                 break
             
-            self.eta_kernel.computeEtaKernel(self.cl_queue, self.global_size, self.local_size, \
+            self.computeEtaKernel(self.cl_queue, self.global_size, self.local_size, \
                     self.nx, self.ny, \
                     self.dx, self.dy, local_dt, \
                     \
@@ -339,7 +355,7 @@ class CTCS2Layer:
                     self.cl_data.u2_1, self.cl_data.u2_1_pitch, \
                     self.cl_data.v2_1, self.cl_data.v2_1_pitch)
             
-            self.u_kernel.computeUKernel(self.cl_queue, self.global_size, self.local_size, \
+            self.computeUKernel(self.cl_queue, self.global_size, self.local_size, \
                     self.nx, self.ny, \
                     self.dx, self.dy, local_dt, \
                     self.g, self.f, \
@@ -359,13 +375,10 @@ class CTCS2Layer:
                     self.cl_data.u2_1, self.cl_data.u2_1_pitch, \
                     self.cl_data.v2_1, self.cl_data.v2_1_pitch, \
                     \
-                    self.wind_type, \
-                    self.wind_tau0, self.wind_alpha, self.wind_xm, self.wind_Rc, \
-                    self.wind_x0, self.wind_y0, \
-                    self.wind_u0, self.wind_v0, \
+                    self.wind_stress, \
                     self.t)
 
-            self.v_kernel.computeVKernel(self.cl_queue, self.global_size, self.local_size, \
+            self.computeVKernel(self.cl_queue, self.global_size, self.local_size, \
                     self.nx, self.ny, \
                     self.dx, self.dy, local_dt, \
                     self.g, self.f, \
@@ -385,10 +398,7 @@ class CTCS2Layer:
                     self.cl_data.v2_0, self.cl_data.v2_0_pitch, \
                     self.cl_data.v2_1, self.cl_data.v2_1_pitch, \
                     \
-                    self.wind_type, \
-                    self.wind_tau0, self.wind_alpha, self.wind_xm, self.wind_Rc, \
-                    self.wind_x0, self.wind_y0, \
-                    self.wind_u0, self.wind_v0, \
+                    self.wind_stress, \
                     self.t)
                     
                     
@@ -399,21 +409,6 @@ class CTCS2Layer:
         
         return self.t
     
-    """
-    Static function which reads a text file and creates an OpenCL kernel from that
-    """
-    def get_kernel(self, kernel_filename):
-        #Read the proper program
-        module_path = os.path.dirname(os.path.realpath(__file__))
-        fullpath = os.path.join(module_path, kernel_filename)
-        with open(fullpath, "r") as kernel_file:
-            kernel_string = kernel_file.read()
-            kernel = cl.Program(self.cl_ctx, kernel_string).build()
-            
-        return kernel
-    
-    
-    
     def download(self):
         return self.cl_data.download(self.cl_queue)
 
@@ -37,14 +37,18 @@ import hashlib
 import logging
 import gc
 
-import pycuda
-import pycuda.compiler as cuda_compiler
-import pycuda.gpuarray
-import pycuda.driver as cuda
+# pycuda is only imported when the GPU functionality is used
+from SWESimulators import LazyImport
+pycuda = LazyImport.lazyImport('pycuda')
+cuda = LazyImport.lazyImport('pycuda.driver')
+cuda_compiler = LazyImport.lazyImport('pycuda.compiler')
+gpuarray = LazyImport.lazyImport('pycuda.gpuarray')
 
 import warnings
 import functools
 from SWESimulators import WindStress
+from SWESimulators import Instrumentation
+from SWESimulators import StagingPool
 
 
 
@@ -504,6 +508,8 @@ class CUDAArray2D:
     """
     Class that holds data 
     """
+    
+    backend = 'cuda'
 
     def __init__(self, gpu_stream, nx, ny, halo_x, halo_y, data, \
                  asymHalo=None, double_precision=False, integers=False):
@@ -533,7 +539,7 @@ class CUDAArray2D:
         assert(data.shape == (self.ny_halo, self.nx_halo))
 
         #Upload data to the device
-        self.data = pycuda.gpuarray.to_gpu_async(host_data, stream=gpu_stream)
+        self.data = self._allocate(gpu_stream, host_data)
         self.holds_data = True
 
         self.mask = None
@@ -569,7 +575,7 @@ class CUDAArray2D:
         assert(host_data.itemsize == self.bytes_per_float), "Host data itemsize is " + str(host_data.itemsize) + ", but should have been " + str(self.bytes_per_float)
         
         # Okay, everything is fine, now upload:
-        self.data.set_async(host_data, stream=gpu_stream)
+        self._set(gpu_stream, host_data)
         
     
     def copyBuffer(self, gpu_stream, buffer):
@@ -588,9 +594,10 @@ class CUDAArray2D:
         
         assert(buffer.bytes_per_float == self.bytes_per_float), "Provided buffer itemsize is " + str(buffer.bytes_per_float) + ", but should have been " + str(self.bytes_per_float)
         
+        assert(buffer.backend == self.backend), "Cannot copy a " + buffer.backend + " buffer into a " + self.backend + " buffer"
+        
         # Okay, everything is fine - issue device-to-device-copy:
-        total_num_bytes = self.bytes_per_float*self.nx_halo*self.ny_halo
-        cuda.memcpy_dtod_async(self.data.ptr, buffer.data.ptr, total_num_bytes, stream=gpu_stream)
+        self._copy(gpu_stream, buffer)
         
         
         
@@ -602,7 +609,7 @@ class CUDAArray2D:
             raise RuntimeError('CUDA buffer has been freed')
         
         #Copy data from device to host
-        host_data = self.data.get(stream=gpu_stream)
+        host_data = self._get(gpu_stream)
 
         if (self.mask is not None):
             host_data = np.ma.array(host_data, mask=self.mask)
@@ -616,9 +623,39 @@ class CUDAArray2D:
         Frees the allocated memory buffers on the GPU 
         """
         if self.holds_data:
-            self.data.gpudata.free()
+            self._free()
             self.holds_data = False
 
+    def _allocate(self, gpu_stream, host_data):
+        return gpuarray.to_gpu_async(host_data, stream=gpu_stream)
+    
+    def _set(self, gpu_stream, host_data):
+        if StagingPool.pool is None:
+            if gpu_stream is None:
+                self.data.set(host_data)
+            else:
+                self.data.set_async(host_data, stream=gpu_stream)
+            return
+
+        # Upload through a staging buffer, which is reused once the upload has completed
+        staging = StagingPool.acquire(host_data.shape, host_data.dtype)
+        np.copyto(staging, np.asarray(host_data))
+        if gpu_stream is None:
+            self.data.set(staging)
+        else:
+            self.data.set_async(staging, stream=gpu_stream)
+        StagingPool.release(staging, gpu_stream)
+    
+    def _copy(self, gpu_stream, buffer):
+        total_num_bytes = self.bytes_per_float*self.nx_halo*self.ny_halo
+        cuda.memcpy_dtod_async(self.data.ptr, buffer.data.ptr, total_num_bytes, stream=gpu_stream)
+    
+    def _get(self, gpu_stream):
+        # Downloaded directly into a new array, as a staging buffer would only add a copy
+        return self.data.get(stream=gpu_stream)
+    
+    def _free(self):
+        self.data.gpudata.free()
     
     @staticmethod
     def convert_to_float32(data):
@@ -630,23 +667,79 @@ class CUDAArray2D:
         else:
             return data
 
+
+
+class HostArray2D(CUDAArray2D):
+    """
+    Host memory version of CUDAArray2D, with the same upload, download, copyBuffer and 
+    halo semantics. The data is a numpy array, and the gpu_stream arguments are ignored.
+    """
+    
+    backend = 'host'
+    
+    def _allocate(self, gpu_stream, host_data):
+        return np.array(host_data, copy=True, order='C')
+    
+    def _set(self, gpu_stream, host_data):
+        np.copyto(self.data, host_data)
+    
+    def _copy(self, gpu_stream, buffer):
+        np.copyto(self.data, buffer.data)
+    
+    def _get(self, gpu_stream):
+        return self.data.copy()
+    
+    def _free(self):
+        self.data = None
+
+
+# Array classes for SWEDataArakawaA, SWEDataArakawaC and Bathymetry.
+# With the 'host' backend, code built on these containers runs without a GPU.
+ARRAY_BACKENDS = {'cuda': CUDAArray2D, 'host': HostArray2D}
+default_array_backend = 'cuda'
+
+def setArrayBackend(backend):
+    """
+    Sets the array backend used by the containers created without an explicit backend
+    """
+    global default_array_backend
+    assert(backend in ARRAY_BACKENDS), "Unknown array backend " + str(backend)
+    default_array_backend = backend
+
+def getArrayBackend(backend=None):
+    """
+    Returns the name of the given backend, or the default backend if None
+    """
+    if backend is None:
+        backend = default_array_backend
+    assert(backend in ARRAY_BACKENDS), "Unknown array backend " + str(backend)
+    return backend
+
+def Array2D(backend, gpu_stream, nx, ny, halo_x, halo_y, data, **kwargs):
+    """
+    Creates a CUDAArray2D or HostArray2D according to the backend (None for the default)
+    """
+    return ARRAY_BACKENDS[getArrayBackend(backend)](gpu_stream, nx, ny, halo_x, halo_y, data, **kwargs)
+
     
 class SWEDataArakawaA:
     """
     A class representing an Arakawa A type (unstaggered, logically Cartesian) grid
     """
 
-    def __init__(self, gpu_stream, nx, ny, halo_x, halo_y, h0, hu0, hv0):
+    def __init__(self, gpu_stream, nx, ny, halo_x, halo_y, h0, hu0, hv0, backend=None):
         """
-        Uploads initial data to the CUDA device
+        Uploads initial data to the CUDA device (or host memory, with backend='host')
         """
-        self.h0  = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, h0)
-        self.hu0 = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, hu0)
-        self.hv0 = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, hv0)
+        self.backend = getArrayBackend(backend)
         
-        self.h1  = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, h0)
-        self.hu1 = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, hu0)
-        self.hv1 = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, hv0)
+        self.h0  = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, h0)
+        self.hu0 = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, hu0)
+        self.hv0 = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, hv0)
+        
+        self.h1  = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, h0)
+        self.hu1 = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, hu0)
+        self.hv1 = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, hv0)
 
     def swap(self):
         """
@@ -697,24 +790,25 @@ class SWEDataArakawaC:
     We use h as cell centers
     """
     def __init__(self, gpu_stream, nx, ny, halo_x, halo_y, h0, hu0, hv0, \
-                 fbl=False):
+                 fbl=False, backend=None):
         """
-        Uploads initial data to the CUDA device
+        Uploads initial data to the CUDA device (or host memory, with backend='host')
         asymHalo needs to be on the form [north, east, south, west]
         """
         #FIXME: This at least works for 0 and 1 ghost cells, but not convinced it generalizes
         assert(halo_x <= 1 and halo_y <= 1)
         
         self.fbl = fbl
+        self.backend = getArrayBackend(backend)
         
         if (fbl):
-            self.h0   = CUDAArray2D(gpu_stream, nx  , ny  , halo_x, halo_y, h0)
-            self.hu0  = CUDAArray2D(gpu_stream, nx-1, ny  , halo_x, halo_y, hu0)
-            self.hv0  = CUDAArray2D(gpu_stream, nx  , ny+1, halo_x, halo_y, hv0)
+            self.h0   = Array2D(self.backend, gpu_stream, nx  , ny  , halo_x, halo_y, h0)
+            self.hu0  = Array2D(self.backend, gpu_stream, nx-1, ny  , halo_x, halo_y, hu0)
+            self.hv0  = Array2D(self.backend, gpu_stream, nx  , ny+1, halo_x, halo_y, hv0)
                                                           
-            self.h1   = CUDAArray2D(gpu_stream, nx  , ny  , halo_x, halo_y, h0)
-            self.hu1  = CUDAArray2D(gpu_stream, nx-1, ny  , halo_x, halo_y, hu0)
-            self.hv1  = CUDAArray2D(gpu_stream, nx  , ny+1, halo_x, halo_y, hv0)
+            self.h1   = Array2D(self.backend, gpu_stream, nx  , ny  , halo_x, halo_y, h0)
+            self.hu1  = Array2D(self.backend, gpu_stream, nx-1, ny  , halo_x, halo_y, hu0)
+            self.hv1  = Array2D(self.backend, gpu_stream, nx  , ny+1, halo_x, halo_y, hv0)
             
             return
 
@@ -723,13 +817,13 @@ class SWEDataArakawaC:
         #print "(hu0.shape, (nx, ny), asymHalo, (halo_x, halo_y)): ", (hu0.shape, (nx+1, ny), asymHaloU,  (halo_x, halo_y))
         #print "(hv0.shape, (nx, ny), asymHalo,  (halo_x, halo_y)): ", (hv0.shape, (nx, ny+1), asymHaloV, (halo_x, halo_y))
 
-        self.h0   = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, h0)
-        self.hu0  = CUDAArray2D(gpu_stream, nx+1, ny, halo_x, halo_y, hu0)
-        self.hv0  = CUDAArray2D(gpu_stream, nx, ny+1, halo_x, halo_y, hv0)
+        self.h0   = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, h0)
+        self.hu0  = Array2D(self.backend, gpu_stream, nx+1, ny, halo_x, halo_y, hu0)
+        self.hv0  = Array2D(self.backend, gpu_stream, nx, ny+1, halo_x, halo_y, hv0)
         
-        self.h1   = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, h0)
-        self.hu1  = CUDAArray2D(gpu_stream, nx+1, ny, halo_x, halo_y, hu0)
-        self.hv1  = CUDAArray2D(gpu_stream, nx, ny+1, halo_x, halo_y, hv0)
+        self.h1   = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, h0)
+        self.hu1  = Array2D(self.backend, gpu_stream, nx+1, ny, halo_x, halo_y, hu0)
+        self.hv1  = Array2D(self.backend, gpu_stream, nx, ny+1, halo_x, halo_y, hv0)
                    
         
     def swap(self):
@@ -1108,10 +1202,12 @@ class BoundaryConditionsArakawaA:
         
         #Helper function to upload data to the GPU as a texture
         def setTexture(texref, numpy_array):       
+            if Instrumentation.enabled:
+                tic = time.perf_counter()
+            
             #Upload data to GPU and bind to texture reference
             #shape is interpreted as height, width, num_channels for order == “C”,
-            data = np.ascontiguousarray(numpy_array)
-            texref.set_array(cuda.make_multichannel_2d_array(data, order="C"))
+            texref.set_array(cuda.make_multichannel_2d_array(numpy_array, order="C"))
             #cuda.bind_array_to_texref(cuda.make_multichannel_2d_array(numpy_array, order="C"), texref)
                         
             # Set texture parameters
@@ -1120,90 +1216,60 @@ class BoundaryConditionsArakawaA:
             texref.set_address_mode(1, cuda.address_mode.CLAMP)
             texref.set_flags(cuda.TRSF_NORMALIZED_COORDINATES) #Use [0, 1] indexing
             
-        def packDataNS(data, t_index):
-            h = data.h[t_index]
-            hu = data.hu[t_index]
-            hv = data.hv[t_index]
+            if Instrumentation.enabled:
+                Instrumentation.record(Instrumentation.TRANSFER, "bc_texture", Instrumentation.label(self), 
+                                       time.perf_counter() - tic, numpy_array.nbytes)
             
-            h = np.squeeze(h)
-            hu = np.squeeze(hu)
-            hv = np.squeeze(hv)
-            zeros = np.zeros_like(h)
-            assert(len(h.shape) == 1), "NS-data must be one row"
-            nx = h.shape[0]
+        def packData(data, t_index, out):
+            """
+            Packs h, hu, hv (and zeros) of one boundary as the four texture channels in out (n*4)
+            """
+            h = np.squeeze(data.h[t_index])
+            hu = np.squeeze(data.hu[t_index])
+            hv = np.squeeze(data.hv[t_index])
+            assert(len(h.shape) == 1), "Boundary data must be one row or column"
             
-            components = 4
-            NS_data = np.vstack((h, hu, hv, zeros))
-            NS_data = np.transpose(NS_data);
-            NS_data = np.reshape(NS_data, (1, nx, components))
-            NS_data = np.ascontiguousarray(NS_data)
-            #print(NS_data)
+            out[:, 0] = h
+            out[:, 1] = hu
+            out[:, 2] = hv
+            out[:, 3] = 0
             
-            return NS_data
+        def setTextures(NS_texref, EW_texref, t_index):
+            # South and north are the two rows, and west and east the two columns, 
+            # of host arrays with four channels
+            north, south, east, west = self.bc_data.north, self.bc_data.south, self.bc_data.east, self.bc_data.west
             
-        def packDataEW(data, t_index):
-            h = data.h[t_index]
-            hu = data.hu[t_index]
-            hv = data.hv[t_index]
+            nx = np.squeeze(north.h[t_index]).shape[0]
+            dtype = np.result_type(north.h[t_index], north.hu[t_index], north.hv[t_index])
+            NS_data = np.empty((2, nx, 4), dtype=dtype)
+            packData(south, t_index, NS_data[0])
+            packData(north, t_index, NS_data[1])
+            setTexture(NS_texref, NS_data)
+            self.flowRelaxationScheme_NS.param_set_texref(NS_texref)
             
-            h = np.squeeze(h)
-            hu = np.squeeze(hu)
-            hv = np.squeeze(hv)
-            zeros = np.zeros_like(h)
-            assert(len(h.shape) == 1), "EW-data must be one column"
-            ny = h.shape[0]
+            ny = np.squeeze(east.h[t_index]).shape[0]
+            dtype = np.result_type(east.h[t_index], east.hu[t_index], east.hv[t_index])
+            EW_data = np.empty((ny, 2, 4), dtype=dtype)
+            packData(west, t_index, EW_data[:, 0])
+            packData(east, t_index, EW_data[:, 1])
+            setTexture(EW_texref, EW_data)
+            self.flowRelaxationScheme_EW.param_set_texref(EW_texref)
             
-            components = 4
-            EW_data = np.vstack((h, hu, hv, zeros))
-            EW_data = np.transpose(EW_data);
-            EW_data = np.reshape(EW_data, (ny, 1, components))
-            EW_data = np.ascontiguousarray(EW_data)
-            
-            return EW_data
+            self.logger.debug("NS-Data is set to " + str(NS_data) + ", " + str(NS_data.shape))
+            self.logger.debug("EW-Data is set to " + str(EW_data) + ", " + str(EW_data.shape))
 
             
         #If time interval has changed, upload new data
         if (new_t0 != old_t0):
             gpu_stream.synchronize()
             self.logger.debug("Updating T0")
-            
-            N_data = packDataNS(self.bc_data.north, t0_index)
-            S_data = packDataNS(self.bc_data.south, t0_index)
-            NS_data = np.vstack((S_data, N_data))
-            setTexture(NS0_texref, NS_data)
-            self.flowRelaxationScheme_NS.param_set_texref(NS0_texref)
-            
-            
-            E_data = packDataEW(self.bc_data.east, t0_index)
-            W_data = packDataEW(self.bc_data.west, t0_index)
-            EW_data = np.hstack((W_data, E_data)) 
-            setTexture(EW0_texref, EW_data)
-            self.flowRelaxationScheme_EW.param_set_texref(EW0_texref)
-            
-            self.logger.debug("NS-Data is set to " + str(NS_data) + ", " + str(NS_data.shape))
-            self.logger.debug("EW-Data is set to " + str(EW_data) + ", " + str(EW_data.shape))
-            
+            setTextures(NS0_texref, EW0_texref, t0_index)
             gpu_stream.synchronize()
 
         if (new_t1 != old_t1):
             gpu_stream.synchronize()
             self.logger.debug("Updating T1")
-            
-            N_data = packDataNS(self.bc_data.north, t1_index)
-            S_data = packDataNS(self.bc_data.south, t1_index)
-            NS_data = np.vstack((S_data, N_data))
-            setTexture(NS1_texref, NS_data)
-            self.flowRelaxationScheme_NS.param_set_texref(NS1_texref)
-            
-            E_data = packDataEW(self.bc_data.east, t1_index)
-            W_data = packDataEW(self.bc_data.west, t1_index)
-            EW_data = np.hstack((W_data, E_data)) 
-            setTexture(EW1_texref, EW_data)
-            self.flowRelaxationScheme_EW.param_set_texref(EW1_texref)
-            
-            self.logger.debug("NS-Data is set to " + str(NS_data) + ", " + str(NS_data.shape))
-            self.logger.debug("EW-Data is set to " + str(EW_data) + ", " + str(EW_data.shape))
-            
+            setTextures(NS1_texref, EW1_texref, t1_index)
             gpu_stream.synchronize()
                 
         # Store texture references (they are deleted if collected by python garbage collector)
@@ -1216,6 +1282,7 @@ class BoundaryConditionsArakawaA:
         self.bc_t = np.float32(max(0.0, min(1.0, elapsed_since_t0 / time_interval)))
         self.logger.debug("Interpolation t is %f", self.bc_t)
         
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryCondition(self, gpu_stream, h, u, v):
         if self.boundary_conditions.north == 2:
             self.periodic_boundary_NS(gpu_stream, h, u, v)
@@ -1318,9 +1385,14 @@ class Bathymetry:
     
     def __init__(self, gpu_ctx, gpu_stream, nx, ny, halo_x, halo_y, Bi_host, \
                  boundary_conditions=BoundaryConditions(), \
-                 block_width=16, block_height=16):
+                 block_width=16, block_height=16, backend=None):
+        """
+        With backend='host', the bathymetry is kept in host memory and the kernels
+        are replaced by numpy implementations, so that gpu_ctx and gpu_stream can be None.
+        """
         # Convert scalar data to int32
         self.gpu_stream = gpu_stream
+        self.backend = getArrayBackend(backend)
         self.nx = np.int32(nx)
         self.ny = np.int32(ny)
         self.halo_x = np.int32(halo_x)
@@ -1343,7 +1415,12 @@ class Bathymetry:
                 str((BiShapeX, BiShapeY)) + " vs " + str((nx+1+2*halo_x, ny+1+2*halo_y))
         
         # Upload Bi to device
-        self.Bi = CUDAArray2D(gpu_stream, nx+1, ny+1, halo_x, halo_y, Bi_host)
+        self.Bi = Array2D(self.backend, gpu_stream, nx+1, ny+1, halo_x, halo_y, Bi_host)
+        
+        if self.backend == 'host':
+            self._hostBoundaryConditions()
+            self.Bm = HostArray2D(gpu_stream, nx, ny, halo_x, halo_y, self._hostInitBm())
+            return
 
         # Define OpenCL parameters
         self.local_size = (block_width, block_height, 1) 
@@ -1370,7 +1447,7 @@ class Bathymetry:
         
         # Allocate Bm
         Bm_host = np.zeros((self.halo_ny, self.halo_nx), dtype=np.float32, order='C')
-        self.Bm = CUDAArray2D(gpu_stream, nx, ny, halo_x, halo_y, Bm_host)
+        self.Bm = Array2D(self.backend, gpu_stream, nx, ny, halo_x, halo_y, Bm_host)
 
         # Load kernel for finding Bm from Bi
         self.initBm_kernel = gpu_ctx.get_kernel("initBm_kernel.cu", defines={'block_width': block_width, 'block_height': block_height})
@@ -1400,6 +1477,15 @@ class Bathymetry:
             
         return Bi_cpu, Bm_cpu
 
+    def tileActivityMap(self, tile_width, tile_height):
+        """
+        Returns the tile activity map (see tileActivityMap) of the interior domain,
+        where the land cells are the cells with Bm equal to the mask value.
+        """
+        Bm = self.Bm.download(self.gpu_stream)
+        land_mask = Bm[self.halo_y:self.halo_y+self.ny, self.halo_x:self.halo_x+self.nx] == self.mask_value
+        return tileActivityMap(land_mask, tile_width, tile_height)
+
     def release(self):
         """
         Frees the allocated memory buffers on the GPU 
@@ -1412,6 +1498,10 @@ class Bathymetry:
         
         assert ((h.ny_halo, h.nx_halo) == (self.halo_ny, self.halo_nx)), \
             "h0 not the correct shape: " + str(h0.shape) + ", but should be " + str((self.halo_ny, self.halo_nx))
+        
+        if self.backend == 'host':
+            h.data -= self.Bm.data
+            return
 
         # Call kernel        
         self.waterElevationToDepth.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
@@ -1426,6 +1516,11 @@ class Bathymetry:
             "h0 not the correct shape: " + str(h0.shape) + ", but should be " + str((self.halo_ny, self.halo_nx))
         assert ((w.ny_halo, w.nx_halo) == (self.halo_ny, self.halo_nx)), \
             "w not the correct shape: " + str(w.shape) + ", but should be " + str((self.halo_ny, self.halo_nx))
+        
+        if self.backend == 'host':
+            np.add(h.data, self.Bm.data, out=w.data)
+            return
+        
         # Call kernel        
         self.waterDepthToElevation.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
                                    self.halo_nx, self.halo_ny, \
@@ -1457,7 +1552,110 @@ class Bathymetry:
                 self.global_size, self.local_size, self.gpu_stream, \
                 self.nx, self.ny, self.halo_x, self.halo_y, \
                 self.Bi.data.gpudata, self.Bi.pitch)
-                 
-                 
-                 
-                 
+
+    def _hostBoundaryConditions(self):
+        """
+        Host version of the periodic_ and closed_boundary_intersections kernels
+        """
+        nx, ny, hx, hy = self.nx, self.ny, self.halo_x, self.halo_y
+        Bi = self.Bi.data
+
+        if self.boundary_conditions.isPeriodicNorthSouth():
+            Bi[:hy, :] = Bi[ny:ny+hy, :]
+            Bi[ny+hy:, :] = Bi[hy:2*hy+1, :]
+        else:
+            for j in range(hy):
+                Bi[j, :] = Bi[2*hy-j, :]
+            for j in range(hy):
+                Bi[ny+2*hy-j, :] = Bi[ny+j, :]
+
+        if self.boundary_conditions.isPeriodicEastWest():
+            Bi[:, :hx] = Bi[:, nx:nx+hx]
+            Bi[:, nx+hx:] = Bi[:, hx:2*hx+1]
+        else:
+            for i in range(hx):
+                Bi[:, i] = Bi[:, 2*hx-i]
+            for i in range(hx):
+                Bi[:, nx+2*hx-i] = Bi[:, nx+i]
+
+    def _hostInitBm(self):
+        """
+        Host version of the initBm kernel
+        """
+        dry = np.abs(self.Bi.data - self.mask_value) <= np.float32(1.0e-3)
+        Bi = np.where(dry, np.float32(1.0e-30), self.Bi.data)
+        wet = (~dry).astype(np.float32)
+
+        a, b, c, d = Bi[:-1, :-1], Bi[1:, :-1], Bi[:-1, 1:], Bi[1:, 1:]
+        wet_count = wet[:-1, :-1] + wet[1:, :-1] + wet[:-1, 1:] + wet[1:, 1:]
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Bm = (a+b+c+d) / wet_count
+        return np.where(wet_count == 0, self.mask_value, Bm).astype(np.float32)
+
+
+
+def tileActivityMap(land_mask, tile_width, tile_height):
+    """
+    Splits the interior domain into tiles of tile_width x tile_height cells,
+    matching the thread blocks of the kernels, and returns a boolean array of 
+    shape (ceil(ny/tile_height), ceil(nx/tile_width)) that is True for the tiles
+    holding at least one cell that is not land.
+    land_mask: Boolean array of shape (ny, nx), True for land cells
+    """
+    ny, nx = land_mask.shape
+    tiles_x = int(np.ceil(nx / float(tile_width)))
+    tiles_y = int(np.ceil(ny / float(tile_height)))
+    
+    # Pad the domain with land up to a whole number of tiles
+    wet = np.zeros((tiles_y*tile_height, tiles_x*tile_width), dtype=bool)
+    wet[:ny, :nx] = np.logical_not(land_mask)
+    return wet.reshape(tiles_y, tile_height, tiles_x, tile_width).any(axis=(1, 3))
+
+
+def activeTileIndices(tile_activity_map):
+    """
+    Returns the flat indices tile_y*tiles_x + tile_x of the active tiles, 
+    in row-major order, as the int32 array expected by the kernels.
+    """
+    return np.flatnonzero(tile_activity_map).astype(np.int32)
+
+
+class ActiveTiles:
+    """
+    Class for launching a kernel on the active (partially wet) tiles of the domain only.
+    The kernel takes a pointer to the list of active tiles as argument (see activeTile 
+    in common.cu), and is launched with global_size, which is one block per active
+    tile. If all tiles are active (or none are), the full grid is launched with a 
+    NULL pointer instead, so that the kernel does not need to read the tile list.
+    """
+    
+    def __init__(self, gpu_stream, tile_activity_map):
+        self.tile_activity_map = tile_activity_map
+        self.num_tiles = tile_activity_map.size
+        self.indices = activeTileIndices(tile_activity_map)
+        self.num_active_tiles = len(self.indices)
+        
+        self.data = None
+        if self.num_active_tiles == 0 or self.num_active_tiles == self.num_tiles:
+            self.global_size = (tile_activity_map.shape[1], tile_activity_map.shape[0])
+        else:
+            self.global_size = (self.num_active_tiles, 1)
+            self.data = gpuarray.to_gpu_async(self.indices, stream=gpu_stream)
+    
+    def pointer(self):
+        """
+        Returns the kernel argument for the list of active tiles
+        """
+        if self.data is None:
+            return np.intp(0)
+        return self.data.gpudata
+    
+    def release(self):
+        """
+        Frees the tile list on the GPU
+        """
+        if self.data is not None:
+            self.data.gpudata.free()
+            self.data = None
+            self.global_size = (self.tile_activity_map.shape[1], self.tile_activity_map.shape[0])
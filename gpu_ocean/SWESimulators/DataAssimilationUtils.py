@@ -26,8 +26,9 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 
@@ -51,7 +52,193 @@ class ObservationType:
         'Provided observation type ' + str(obs_type) + ' is invalid'
 
 
+
+
+def probabilisticResamplingIndices(weights, random_state=np.random):
+    """
+    Draws N indices directly from the discrete distribution given by the N weights.
+    
+    weights: Normalized weights of the particles
+    random_state: Source of random numbers (np.random, a np.random.RandomState or a np.random.Generator)
+    """
+    num_particles = len(weights)
+    return random_state.choice(np.arange(num_particles), num_particles, p=weights)
+
+
+def _residualResamplingParts(weights, random_state=np.random):
+    """
+    Returns the deterministic and stochastic parts of residual resampling as two arrays of indices
+    """
+    num_particles = len(weights)
+    allIndices = np.arange(num_particles)
+    
+    # Deterministic resampling based on the integer part of N*weights, and
+    # stochastic resampling based on the decimal parts of N*weights
+    weightsTimesNInteger, decimalWeights = np.divmod(weights*num_particles, 1)
+    deterministicResampleIndices = np.repeat(allIndices, weightsTimesNInteger.astype(np.int64))
+    
+    num_stochastic = num_particles - len(deterministicResampleIndices)
+    if num_stochastic > 0:
+        decimalWeights = decimalWeights/np.sum(decimalWeights)
+        stochasticResampleIndices = random_state.choice(allIndices, num_stochastic, p=decimalWeights)
+    else:
+        stochasticResampleIndices = np.zeros(0, dtype=np.int64)
+    
+    return deterministicResampleIndices, stochasticResampleIndices
+
+
+def residualResamplingIndices(weights, random_state=np.random):
+    """
+    Each particle is first resampled floor(N*w) times, which in total gives M <= N indices. 
+    Afterwards, N-M indices are drawn from the discrete distribution given by the weights N*w % 1.
+    
+    weights: Normalized weights of the particles
+    random_state: Source of random numbers (np.random, a np.random.RandomState or a np.random.Generator)
+    """
+    deterministic, stochastic = _residualResamplingParts(weights, random_state)
+    return np.concatenate((deterministic, stochastic))
+
+
+def systematicResamplingIndices(weights, random_state=np.random):
+    """
+    Consider all weights as line lengths, so that all particles represent segments 
+    completely covering the line [0, 1]. Draw u ~ U[0,1/N], and select the particles 
+    representing the points u + i/N, i = 0,...,N-1 on the line.
+    Systematic resampling and stochastic universal sampling are the same scheme.
+    
+    The number of times particle k is selected is the number of points within its
+    segment [c_{k-1}, c_k), which is F(c_k) - F(c_{k-1}) with F(c) = ceil(N*c - N*u), 
+    so that the indices are computed in O(N) without searching or sorting.
+    Each particle is selected either floor(N*w) or ceil(N*w) times.
+    
+    weights: Normalized weights of the particles
+    random_state: Source of random numbers (np.random, a np.random.RandomState or a np.random.Generator)
+    """
+    num_particles = len(weights)
+    cumulativeWeights = np.cumsum(weights)
+    cumulativeWeights /= cumulativeWeights[-1]
+    
+    # Number of selection points u + i/N below each cumulative weight
+    startPos = random_state.random()
+    pointsBelow = np.clip(np.ceil(num_particles*cumulativeWeights - startPos), 0, num_particles).astype(np.int64)
+    pointsBelow[-1] = num_particles
+    
+    counts = np.diff(pointsBelow, prepend=0)
+    return np.repeat(np.arange(num_particles), counts)
+
+
+def metropolisHastingsResamplingIndices(weights, random_state=np.random):
+    """
+    Resampling based on the Monte Carlo Metropolis-Hasting algorithm.
+    The first particle is automatically selected. Particle i is then selected with the 
+    probability p = w_i/w_c, where c is the latest selected particle, otherwise c is selected again.
+    
+    The chain is computed without a Python loop over the particles. With the uniform 
+    numbers p_i drawn up front, particle k is accepted after c if r_k = w_k/p_k > w_c, 
+    so the successor of every particle c is the first k > c with r_k > w_c. These are 
+    found for all particles at once using a table of running maxima of r over 
+    power-of-two intervals, and the chain starting at particle 0 is then followed 
+    by pointer doubling. This is O(N log N), and gives the same indices as the 
+    sequential chain for the same random numbers.
+    
+    weights: Normalized weights of the particles
+    random_state: Source of random numbers (np.random, a np.random.RandomState or a np.random.Generator)
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    num_particles = len(weights)
+    if num_particles == 1:
+        return np.zeros(1, dtype=np.int64)
+    
+    # Draw U[0,1] for particles 1,...,N-1, in the same order as the sequential chain
+    p = np.zeros(num_particles)
+    p[1:] = random_state.random(num_particles-1)
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r = np.where(weights > 0, weights/p, 0.0)
+    r[0] = 0.0
+    
+    # Maxima of r over the intervals [k, k+2^l), padded with inf so that the 
+    # search ends at N when no particle is accepted
+    levels = int(np.ceil(np.log2(num_particles+1)))
+    size = 2**levels
+    padded = np.full(size, np.inf)
+    padded[:num_particles] = r
+    maxima = [padded]
+    for l in range(1, levels+1):
+        half = 2**(l-1)
+        maxima.append(np.maximum(maxima[-1][:-half], maxima[-1][half:]))
+    
+    # Successor of each particle: skip intervals where no particle is accepted
+    successor = np.arange(1, num_particles+1)
+    for l in range(levels, -1, -1):
+        length = 2**l
+        valid = successor <= size - length
+        skip = valid & (maxima[l][np.minimum(successor, size - length)] <= weights)
+        successor += length*skip
+    successor = np.append(successor, num_particles)
+    
+    # Mark the particles reachable from particle 0 by pointer doubling
+    on_chain = np.zeros(num_particles+1, dtype=bool)
+    on_chain[0] = True
+    jump = successor
+    while True:
+        on_chain[jump[on_chain]] = True
+        if np.all(jump[:num_particles] == num_particles):
+            break
+        jump = jump[jump]
+    
+    # Each particle is replaced by the latest accepted particle
+    accepted = np.where(on_chain[:num_particles], np.arange(num_particles), 0)
+    return np.maximum.accumulate(accepted)
+
+
+# Resampling schemes which return the indices to resample given the normalized weights.
+# Additional schemes can be registered by adding entries to this dict.
+RESAMPLERS = {
+    'probabilistic': probabilisticResamplingIndices,
+    'residual': residualResamplingIndices,
+    'stochastic_universal': systematicResamplingIndices,
+    'systematic': systematicResamplingIndices,
+    'metropolis_hastings': metropolisHastingsResamplingIndices,
+}
+
+
+def getResamplingIndices(weights, method='residual', random_state=None):
+    """
+    Generate the list of indices to resample, e.g., 
+    [0 0 0 1 1 5 6 6 7]
+    will resample 0 three times, 1 two times, 5 once, 6 two times, and 7 one time.
+    
+    weights: Weights of the particles, which are normalized here
+    method: Name of the resampling scheme in RESAMPLERS
+    random_state: Source of random numbers (np.random, a np.random.RandomState or a np.random.Generator). 
+        Uses the global numpy random state if None.
+    """
+    assert(method in RESAMPLERS), "Unknown resampling method '" + str(method) + "', expected one of " + str(list(RESAMPLERS.keys()))
+    weights = np.asarray(weights, dtype=np.float64)
+    assert(weights.ndim == 1 and len(weights) > 0), "Expected a one dimensional array of weights"
+    assert(np.all(weights >= 0) and np.sum(weights) > 0), "Weights must be non-negative with a positive sum"
+    
+    if random_state is None:
+        random_state = np.random
     
+    return RESAMPLERS[method](weights/np.sum(weights), random_state)
+
+
+def resample(ensemble, method='residual', reinitialization_variance=0, random_state=None):
+    """
+    Resamples the ensemble based on the weights of its particles, using the resampling scheme given by method.
+    
+    ensemble: The ensemble to be resampled, holding the ensemble particles, the observation, and measures to compute the weight of particles based on this information.
+    method: Name of the resampling scheme in RESAMPLERS
+    reinitialization_variance: The variance used for resampling of particles that are already resampled. These duplicates are sampled around the original particle.
+    If reinitialization_variance is zero, exact duplications are generated.
+    random_state: Source of random numbers. Uses the global numpy random state if None.
+    """
+    newSampleIndices = getResamplingIndices(ensemble.getGaussianWeight(), method, random_state)
+    ensemble.resample(newSampleIndices, reinitialization_variance)
+
+
 def probabilisticResampling(ensemble, reinitialization_variance=0):
     """
     Probabilistic resampling of the particles based on the attached observation.
@@ -63,20 +250,7 @@ def probabilisticResampling(ensemble, reinitialization_variance=0):
 
     Implementation based on the description in van Leeuwen (2009) 'Particle Filtering in Geophysical Systems', Section 3a.1)
     """
-    
-    # Obtain weights:
-    weights = ensemble.getGaussianWeight()
-    #weights = getCauchyWeight(ensemble.getDistances(), \
-    #                          ensemble.getObservationVariance())
-    
-    # Create array of possible indices to resample:
-    allIndices = np.arange(ensemble.getNumParticles())
-    
-    # Draw new indices based from discrete distribution based on weights
-    newSampleIndices = np.random.choice(allIndices, ensemble.getNumParticles(), p=weights)
-        
-    # Return a new set of particles
-    ensemble.resample(newSampleIndices, reinitialization_variance)
+    resample(ensemble, 'probabilistic', reinitialization_variance)
 
 
 def residualSampling(ensemble, reinitialization_variance=0, onlyDeterministic=False, onlyStochastic=False):
@@ -90,37 +264,20 @@ def residualSampling(ensemble, reinitialization_variance=0, onlyDeterministic=Fa
 
     Implementation based on the description in van Leeuwen (2009) 'Particle Filtering in Geophysical Systems', Section 3a.2)
     """
+    if not (onlyDeterministic or onlyStochastic):
+        resample(ensemble, 'residual', reinitialization_variance)
+        return
     
-    # Obtain weights:
-    #weights = getCauchyWeight(ensemble.getDistances(), \
-    #                          ensemble.getObservationVariance())
     weights = ensemble.getGaussianWeight()
-    
-    # Create array of possible indices to resample:
-    allIndices = np.arange(ensemble.getNumParticles())
-
-    # Deterministic resampling based on the integer part of N*weights:
-    weightsTimesN = weights*ensemble.getNumParticles()
-    weightsTimesNInteger = np.int64(np.floor(weightsTimesN))
-    deterministicResampleIndices = np.repeat(allIndices, weightsTimesNInteger)
-    
-    # Stochastic resampling based on the decimal parts of N*weights:
-    decimalWeights = np.mod(weightsTimesN, 1)
-    decimalWeights = decimalWeights/np.sum(decimalWeights)
-    stochasticResampleIndices = np.random.choice(allIndices, 
-                                                 ensemble.getNumParticles() - len(deterministicResampleIndices), 
-                                                 p=decimalWeights)
-    ### NOTE!
-    # In numpy v >= 1.13, np.divmod can be used to get weightsTimesNInteger and decimalWeights from one function call.
-    
+    deterministicResampleIndices, stochasticResampleIndices = _residualResamplingParts(weights/np.sum(weights))
     if onlyDeterministic:
         ensemble.resample(deterministicResampleIndices, reinitialization_variance)
     if onlyStochastic:
         ensemble.resample(stochasticResampleIndices, reinitialization_variance)
-    
+
+    # As in the original implementation, the partial resampling is followed by the full one
     ensemble.resample(np.concatenate((deterministicResampleIndices, stochasticResampleIndices)), \
                       reinitialization_variance)
-    
 
 
 def stochasticUniversalSampling(ensemble, reinitialization_variance=0):
@@ -133,34 +290,21 @@ def stochasticUniversalSampling(ensemble, reinitialization_variance=0):
     If reinitialization_variance is zero, exact duplications are generated.
 
     Implementation based on the description in van Leeuwen (2009) 'Particle Filtering in Geophysical Systems', Section 3a.3)
-    """   
-    
-    # Obtain weights:
-    #weights = getCauchyWeight(ensemble.getDistances(), \
-    #                          ensemble.getObservationVariance())
-    weights = ensemble.getGaussianWeight()
+    """
+    resample(ensemble, 'stochastic_universal', reinitialization_variance)
 
-    # Create array of possible indices to resample:
-    allIndices = np.array(range(ensemble.getNumParticles()))
-    
-    # Create histogram buckets based on the cumulative weights
-    cumulativeWeights = np.concatenate(([0.0], np.cumsum(weights)))
-    
-    # Find first starting position:
-    startPos = np.random.rand()/ensemble.getNumParticles()
-    lengths = 1.0/ensemble.getNumParticles()
-    #print startPos, lengths
-    selectionValues = allIndices*lengths + startPos
-    
-    # Create a histogram of selectionValues within the cumulativeWeights buckets
-    bucketValues, buckets = np.histogram(selectionValues, bins=cumulativeWeights)
-    
-    #newSampleIndices has now the number of times each index should be resampled
-    # We need to go from [0, 0, 1, 4, 0] to [2,3,3,3,3]
-    newSampleIndices = np.repeat(allIndices, bucketValues)
-    
-    # Return a new set of particles
-    ensemble.resample(newSampleIndices, reinitialization_variance)
+
+def systematicResampling(ensemble, reinitialization_variance=0):
+    """
+    Systematic resampling of particles based on the attached observation.
+    This is the same scheme as stochastic universal sampling, and each particle is 
+    resampled either floor(N*w) or ceil(N*w) times.
+
+    ensemble: The ensemble to be resampled, holding the ensemble particles, the observation, and measures to compute the weight of particles based on this information.
+    reinitialization_variance: The variance used for resampling of particles that are already resampled. These duplicates are sampled around the original particle.
+    If reinitialization_variance is zero, exact duplications are generated.
+    """
+    resample(ensemble, 'systematic', reinitialization_variance)
 
 
 def metropolisHastingSampling(ensemble,  reinitialization_variance=0):
@@ -174,26 +318,4 @@ def metropolisHastingSampling(ensemble,  reinitialization_variance=0):
 
     Implementation based on the description in van Leeuwen (2009) 'Particle Filtering in Geophysical Systems', Section 3a.4)
     """
-    
-    # Obtain weights:
-    #weights = getCauchyWeight(ensemble.getDistances(), \
-    #                          ensemble.getObservationVariance())
-    weights = ensemble.getGaussianWeight()
-    
-    # Create buffer for indices which should be in the new ensemble:
-    newSampleIndices = np.zeros_like(weights, dtype=int)
-    
-    # The first member is automatically a member of the new ensemble
-    newSampleIndices[0] = 0
-    
-    # Iterate through all weights, and apply the Metropolis-Hasting algorithm
-    for i in range(1, ensemble.getNumParticles()):
-        # Draw random number U[0,1]
-        p = np.random.rand()
-        if p < weights[i]/weights[newSampleIndices[i-1]]:
-            newSampleIndices[i] = i
-        else:
-            newSampleIndices[i] = newSampleIndices[i-1]
-    
-    # Return a new set of particles
-    ensemble.resample(newSampleIndices, reinitialization_variance)
+    resample(ensemble, 'metropolis_hastings', reinitialization_variance)
@@ -26,14 +26,7 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import numpy as np
-import scipy.integrate
-import warnings
 
-if scipy.__version__.startswith('1.4'):
-    from scipy.integrate.quadrature import AccuracyWarning
-else:
-    from scipy.integrate._quadrature import AccuracyWarning
-    
 from SWESimulators import CDKLM16, Common
 
 class DoubleJetPerturbationType:
@@ -173,9 +166,8 @@ class DoubleJetCase:
         self.base_cpu_hu = np.zeros(self.dataShape, dtype=np.float32)
         self.base_cpu_hv = np.zeros(self.dataShape, dtype=np.float32)
 
-        for i in range(self.dataShape[1]):
-            self.base_cpu_eta[:,i] += sim_h_init
-            self.base_cpu_hu[:,i] = redef_hu_init
+        self.base_cpu_eta += sim_h_init[:, np.newaxis]
+        self.base_cpu_hu[:, :] = redef_hu_init[:, np.newaxis]
     
         self.sim_args = {
             "gpu_ctx": gpu_ctx,
@@ -302,8 +294,6 @@ class DoubleJetCase:
         """
         Creates initial conditions with perturbations in eta according to the indices given as input.
         """
-        eta_pert = np.zeros(self.dataShape)
-        
         distance_between_longitudes_75 = 28.7e3 # m 
         distance_between_latitudes = 111e3 # m
         radius_y_cells = distance_between_longitudes_75*180/self.dx
@@ -314,64 +304,90 @@ class DoubleJetCase:
         pert_beta = self.phi_delta/5 # 1/30 # 1/15
         h_hat = 0.12*self.delta_eta
 
-        for j in range(self.ny+self.ghosts[2]+self.ghosts[0]):
-            for i in range(self.nx+self.ghosts[3]+self.ghosts[1]):
-
-                cell_diff_x_pos = i-mid_cell_x_pos
-                cell_diff_x_pos = min(abs(cell_diff_x_pos), abs(cell_diff_x_pos+self.nx), abs(cell_diff_x_pos-self.nx))
-                cell_diff_x_neg = i-mid_cell_x_neg
-                cell_diff_x_neg = min(abs(cell_diff_x_neg), abs(cell_diff_x_neg+self.nx), abs(cell_diff_x_neg-self.nx))
-
+        # Cell indices as a column (j) and a row (i), so that all cells are computed at once
+        j = np.arange(self.ny+self.ghosts[2]+self.ghosts[0], dtype=np.float64)[:, np.newaxis]
+        i = np.arange(self.nx+self.ghosts[3]+self.ghosts[1], dtype=np.float64)[np.newaxis, :]
 
-                squared_dist_y_pos = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_pos)*self.dy/distance_between_latitudes)**2
-                squared_dist_y_neg = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_neg)*self.dy/distance_between_latitudes)**2
-                squared_dist_x_pos = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_pos)*self.dx/(distance_between_longitudes_75))**2
-                squared_dist_x_neg = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_neg)*self.dx/(distance_between_longitudes_75))**2
+        # Periodic distance (in cells) along x from the center of each bump
+        cell_diff_x_pos = self._periodicCellDistance(i - mid_cell_x_pos)
+        cell_diff_x_neg = self._periodicCellDistance(i - mid_cell_x_neg)
 
-                lat = np.cos(75*np.pi/180) # approximation into the beta-plane
+        squared_dist_y_pos = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_pos)*self.dy/distance_between_latitudes)**2
+        squared_dist_y_neg = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_neg)*self.dy/distance_between_latitudes)**2
+        squared_dist_x_pos = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_pos)*self.dx/(distance_between_longitudes_75))**2
+        squared_dist_x_neg = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_neg)*self.dx/(distance_between_longitudes_75))**2
 
+        lat = np.cos(75*np.pi/180) # approximation into the beta-plane
 
-                eta_pert[j,i] += h_hat*lat*np.exp(-squared_dist_y_pos - squared_dist_x_pos) +\
-                                 h_hat*lat*np.exp(-squared_dist_y_neg - squared_dist_x_neg)
+        eta_pert = h_hat*lat*np.exp(-squared_dist_y_pos - squared_dist_x_pos) +\
+                   h_hat*lat*np.exp(-squared_dist_y_neg - squared_dist_x_neg)
 
         return self.sim_args, {"eta0": self.base_cpu_eta + eta_pert, "hu0": self.base_cpu_hu, "hv0": self.base_cpu_hv}
         
     ###-----------------------------------------------------------------
     ### Utility functions for creating the stable initial case
     ###-----------------------------------------------------------------
+    def _periodicCellDistance(self, cell_diff):
+        """
+        Absolute distance in number of cells, taking the periodic boundary in x into account
+        """
+        return np.minimum(np.minimum(np.abs(cell_diff), np.abs(cell_diff+self.nx)), np.abs(cell_diff-self.nx))
+    
+    # In-memory cache shared by all DoubleJetCase objects, mapping the parameters of the 
+    # steady state to the cross sections (sim_h_init, redef_hu_init)
+    steady_states = {}
+    
+    def _steadyStateKey(self):
+        """
+        The parameters that determine the steady-state solution
+        """
+        return (self.ny, self.dy, self.g, self.f, self.tan, self.earth_radius, self.u_max, self.h_0,
+                self.phi_0, self.phi_05, self.phi_1, 
+                self.phi_pos_min, self.phi_pos_max, self.phi_neg_min, self.phi_neg_max)
+    
+    @staticmethod
+    def clear_steady_state_cache():
+        """
+        Clears the in-memory cache of steady-state solutions
+        """
+        DoubleJetCase.steady_states = {}
+    
     def _initSteadyState(self):
         """
-        Main function for creating the unperturbed steady-state initial conditions
+        Main function for creating the unperturbed steady-state initial conditions.
+        The solution only depends on the parameters of the case, and is therefore 
+        computed once and reused by all DoubleJetCase objects with the same parameters.
         """
-        with warnings.catch_warnings():
-            warnings.filterwarnings('ignore', category=AccuracyWarning)
-            #warnings.simplefilter('ignore', scipy.integrate.quadrature.AccuracyWarning)
-            #warnings.simplefilter('ignore', AccuracyWarning)
-            #warnings.simplefilter('ignore',DeprecationWarning)
+        key = self._steadyStateKey()
+        if key not in DoubleJetCase.steady_states.keys():
+            DoubleJetCase.steady_states[key] = self._computeSteadyState()
+        sim_h_init, redef_hu_init = DoubleJetCase.steady_states[key]
+        return sim_h_init.copy(), redef_hu_init.copy()
         
-            # The initial conditions are created through four steps, here as a cross section along y
-            # 1. Calculate $u_{temp}$ based on the expression for initial $u$ from the paper
-            # 2. Calculate initial $h_{init}$ using the expression for $u_{temp}$.
-            # 3. Re-calculate initial $u_{init}$ by using the expression for geostrophic balance on the initial $h_{init}$.
-            # 4. Obtain $hu_{init} = h_{init} u_{init}$.
+    def _computeSteadyState(self):
+        """
+        Computes the unperturbed steady-state cross sections along y
+        """
+        # The initial conditions are created through four steps, here as a cross section along y
+        # 1. Calculate $u_{temp}$ based on the expression for initial $u$ from the paper
+        # 2. Calculate initial $h_{init}$ using the expression for $u_{temp}$.
+        # 3. Re-calculate initial $u_{init}$ by using the expression for geostrophic balance on the initial $h_{init}$.
+        # 4. Obtain $hu_{init} = h_{init} u_{init}$.
+        # Steps 1 and 2 are done together in _generate_h0.
 
-            dy_phi = (self.phi_1 - self.phi_0)/self.ny
-            sim_phi = np.linspace(self.phi_0 - 2*dy_phi, self.phi_1 + 2*dy_phi, self.ny+4)
-            
-            # 1)
-            sim_u_init = self._init_u(sim_phi)
-            
-            # 2)
-            sim_h_init = self._generate_h0(sim_phi, self.phi_0)
+        dy_phi = (self.phi_1 - self.phi_0)/self.ny
+        sim_phi = np.linspace(self.phi_0 - 2*dy_phi, self.phi_1 + 2*dy_phi, self.ny+4)
+        
+        # 1) and 2)
+        sim_h_init = self._generate_h0(sim_phi, self.phi_0)
 
-            sim_h_init_mean = np.mean(sim_h_init)
-            
-            # Calculate hu which is in geotrophic balance wrt sim_h_init (it's slope is equal to the slope of eta)
-            redef_hu_init = np.zeros_like(sim_h_init)
-            for j in range(1, len(redef_hu_init)-1):
-                redef_hu_init[j] = - (self.g*sim_h_init_mean/self.f)*(sim_h_init[j+1]-sim_h_init[j-1])/(2*self.dy)
+        sim_h_init_mean = np.mean(sim_h_init)
+        
+        # Calculate hu which is in geotrophic balance wrt sim_h_init (it's slope is equal to the slope of eta)
+        redef_hu_init = np.zeros_like(sim_h_init)
+        redef_hu_init[1:-1] = - (self.g*sim_h_init_mean/self.f)*(sim_h_init[2:]-sim_h_init[:-2])/(2*self.dy)
 
-            return sim_h_init, redef_hu_init
+        return sim_h_init, redef_hu_init
 
     
     def _init_u_scalar(self, lat):
@@ -391,12 +407,12 @@ class DoubleJetCase:
         if np.isscalar(lat):
             return steps*self._init_u_scalar(lat)
         else:
-            out = np.zeros_like(lat)
-            for i in range(len(lat)):
-                if lat[i] > self.phi_0 and lat[i] <= self.phi_1:
-                    out[i] = self._init_u_scalar(lat[i])
-                if out[i] == np.inf:
-                    out[i] = 0.0
+            lat = np.asarray(lat)
+            with np.errstate(over='ignore', divide='ignore'):
+                u_pos =  (self.u_max/self.e_n) *np.exp(1/((lat-self.phi_pos_min)*(lat-self.phi_pos_max)))
+                u_neg = -(self.u_max/self.e_n) *np.exp(1/((lat-self.phi_neg_min)*(lat-self.phi_neg_max)))
+            out = np.where(lat < self.phi_05, u_pos, u_neg)
+            out[(lat <= self.phi_0) | (lat > self.phi_1) | (out == np.inf)] = 0.0
             return steps*out
     
     # Integrand for initialization of h
@@ -406,12 +422,27 @@ class DoubleJetCase:
         """
         return self.earth_radius*self._init_u(lat)*(self.f + (self.tan/self.earth_radius)*self._init_u(lat))
     
-    def _generate_h0(self, lat, lat_0):
+    def _generate_h0(self, lat, lat_0, quadrature_points=8):
         """
-        Initializing gh according to galewsky
+        Initializing gh according to galewsky.
+        The integral from lat_0 to every latitude in lat is computed as a single cumulative 
+        integral, using a Gauss-Legendre rule on each interval between consecutive latitudes.
+        The integrand is discontinuous at phi_0, phi_05 and phi_1, so these are included as 
+        interval end points.
         """
-        gh0 = np.zeros_like(lat)
-
-        for i in range(lat.size):
-            gh0[i] = self.g*self.h_0 - scipy.integrate.quadrature(self._init_h_integrand, self.phi_0, lat[i])[0]
+        lat = np.asarray(lat, dtype=np.float64)
+        nodes = np.unique(np.concatenate((lat.ravel(), [lat_0, self.phi_0, self.phi_05, self.phi_1])))
+        
+        # Quadrature points and weights for all intervals [nodes[k], nodes[k+1]]
+        x, w = np.polynomial.legendre.leggauss(quadrature_points)
+        half_width = 0.5*(nodes[1:] - nodes[:-1])
+        centers = 0.5*(nodes[1:] + nodes[:-1])
+        points = centers[:, np.newaxis] + half_width[:, np.newaxis]*x[np.newaxis, :]
+        interval_integrals = half_width*np.sum(w[np.newaxis, :]*self._init_h_integrand(points), axis=1)
+        
+        # Integral from nodes[0] to each node, shifted so that it starts at lat_0
+        cumulative = np.concatenate(([0.0], np.cumsum(interval_integrals)))
+        cumulative -= cumulative[np.searchsorted(nodes, lat_0)]
+        
+        gh0 = self.g*self.h_0 - cumulative[np.searchsorted(nodes, lat)]
         return gh0/self.g
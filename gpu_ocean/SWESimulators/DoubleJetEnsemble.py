@@ -20,15 +20,16 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import abc
 import warnings 
 
 
-import pycuda.driver as cuda
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 from SWESimulators import CDKLM16
 from SWESimulators import GPUDrifterCollection
@@ -39,15 +40,6 @@ from SWESimulators import DoubleJetCase
 from SWESimulators import DataAssimilationUtils as dautils
 
 
-
-try:
-    from importlib import reload
-except:
-    pass
-
-reload(BaseOceanStateEnsemble)
-reload(OceanNoiseEnsemble)
-
 class DoubleJetEnsemble(OceanNoiseEnsemble.OceanNoiseEnsemble):
     """
     Class that holds an ensemble of ocean states initialized from the double 
@@ -24,15 +24,17 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import abc
 import warnings 
 import os, sys, datetime
+import concurrent.futures
 
-import pycuda.driver as cuda
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 from SWESimulators import BaseOceanStateEnsemble
 from SWESimulators import Common
@@ -41,14 +43,26 @@ from SWESimulators import Observation
 from SWESimulators import DataAssimilationUtils as dautils
 from SWESimulators import Observation
 from SWESimulators import SimReader 
+from SWESimulators import SimWriter
 from SWESimulators import ParticleInfo
 
 
+def readInitialStates(filenames, read_function=CDKLM16.CDKLM16.readInitialState, num_threads=1):
+    """
+    Reads each of the unique files in filenames once with read_function, and returns
+    a dict from file name to the initial state read from it.
+    With num_threads > 1, the files are read in parallel threads. This requires that
+    netCDF4 is built against thread-safe netCDF and HDF5 libraries.
+    """
+    unique_filenames = sorted(set(filenames))
+    if num_threads > 1 and len(unique_filenames) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
+            initial_states = list(executor.map(read_function, unique_filenames))
+    else:
+        initial_states = [read_function(filename) for filename in unique_filenames]
+    return dict(zip(unique_filenames, initial_states))
+
 
-try:
-    from importlib import reload
-except:
-    pass
 
 
 class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
@@ -67,7 +81,9 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                  write_netcdf_directory = None,
                  observation_type = dautils.ObservationType.UnderlyingFlow,
                  randomize_initial_ensemble=False,
-                 compensate_for_eta = True):
+                 compensate_for_eta = True,
+                 num_loader_threads = 1,
+                 shared_netcdf_file = False):
         """
         Initalizing ensemble from files.
         
@@ -90,6 +106,10 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
             randomize_initial_ensemble: Whether the ensemble should be generated by random from the available
                initial conditions.
             compensate_for_eta: Whether or not the observations should be adjusted by the eta from the particle states.
+            num_loader_threads: Number of threads reading the initial conditions. Each file is read only once,
+               also when it is used for several particles.
+            shared_netcdf_file: Write all ensemble members to one netCDF file along an ensemble_member dimension
+               (see SimWriter.SimNetCDFEnsembleWriter), instead of one file per member.
         """
         
         #print('Welcome to the EnsembleFromFile')
@@ -136,6 +156,9 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
         # Flag to writing ensemble simulation result to file:
         self.cont_write_netcdf = cont_write_netcdf
         self.use_lcg = use_lcg
+        self.num_loader_threads = num_loader_threads
+        self.shared_netcdf_file = shared_netcdf_file
+        self.ensemble_writer = None
         
         # We will not simulate the true state, but read it from file:
         self.simulate_true_state = False
@@ -191,18 +214,29 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                                                         self.numParticles-num_files, 
                                                         replace=True)
             
+        # Read each of the initial conditions in use only once
+        initial_states = readInitialStates([self.ensemble_init_nc_files[file_id] for file_id in file_ids],
+                                           num_threads=self.num_loader_threads)
         
         for particle_id in range(self.numParticles):
             file_id = file_ids[particle_id]
             new_netcdf_filename = None
-            if self.cont_write_netcdf:
+            if self.cont_write_netcdf and not self.shared_netcdf_file:
                 filename_only = "ensemble_member_" + str(particle_id).zfill(4) + ".nc"
                 new_netcdf_filename = os.path.join(self.write_netcdf_directory, filename_only)
-            self.particles[particle_id] = CDKLM16.CDKLM16.fromfilename(self.gpu_ctx, 
-                                                                       self.ensemble_init_nc_files[file_id],
-                                                                       cont_write_netcdf=self.cont_write_netcdf,
-                                                                       new_netcdf_filename=new_netcdf_filename,
-                                                                       use_lcg=self.use_lcg)
+            self.particles[particle_id] = CDKLM16.CDKLM16.fromInitialState(self.gpu_ctx, 
+                                                                           initial_states[self.ensemble_init_nc_files[file_id]],
+                                                                           cont_write_netcdf=self.cont_write_netcdf and not self.shared_netcdf_file,
+                                                                           new_netcdf_filename=new_netcdf_filename,
+                                                                           use_lcg=self.use_lcg)
+        initial_states = None
+        
+        if self.cont_write_netcdf and self.shared_netcdf_file:
+            sim = self.particles[0]
+            self.ensemble_writer = SimWriter.SimNetCDFEnsembleWriter(self.particles, 
+                                                                     filename=os.path.join(self.write_netcdf_directory, "ensemble"),
+                                                                     ignore_ghostcells=sim.ignore_ghostcells,
+                                                                     offset_x=sim.offset_x, offset_y=sim.offset_y)
 
     def _initializeParticleInfo(self):
         self.particleInfos = [None]*self.numParticles
@@ -225,6 +259,9 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
         
 
     def cleanUp(self):
+        if self.ensemble_writer is not None:
+            self.ensemble_writer.__exit__(0,0,0)
+            self.ensemble_writer = None
         for particle in self.particles:
             if particle is not None:
                 particle.cleanUp()
@@ -314,6 +351,9 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                     print('skipping dead particle ' + str(p))
         self.t = observation_time
         
+        if write_now and self.ensemble_writer is not None:
+            self.ensemble_writer.writeTimestep(active=self.particlesActive)
+        
         
     def observeTrueDrifters(self, applyDrifterSet=True, ignoreBuoys=False):
         return self.observations.get_drifter_position(self.t, applyDrifterSet=applyDrifterSet, ignoreBuoys=ignoreBuoys)
@@ -378,7 +418,8 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
         
         assert(self.particlesActive[particle_id]), 'Particle was already deactivated!'
     
-        if self.cont_write_netcdf:
+        # In a shared file, the particle is stored as missing values from the next write
+        if self.cont_write_netcdf and self.ensemble_writer is None:
             self.particles[particle_id].writeState()
         self.particles[particle_id].cleanUp()
         
@@ -386,6 +427,9 @@ class EnsembleFromFiles(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
 
     
     def writeEnsembleToNetCDF(self):
+        if self.ensemble_writer is not None:
+            self.ensemble_writer.writeTimestep(active=self.particlesActive)
+            return
         for p in range(self.getNumParticles()):
             # Only active particles are considered
             if self.particlesActive[p]:
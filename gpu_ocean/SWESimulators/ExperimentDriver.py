@@ -0,0 +1,467 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements a resumable driver for data assimilation
+and drift trajectory forecasting experiments. The assimilation cycles,
+the state samples within them, and the forecast are described by an
+ExperimentPlan, and carried out on an ExperimentModel by the
+ExperimentDriver, which checkpoints its progress at cycle boundaries
+and runs the forecasts for groups of particles in one pass over the
+forecast observation times.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import logging
+import os
+import pickle
+import shutil
+import time
+
+import numpy as np
+
+from SWESimulators import Observation, GPUDrifterCollection
+
+
+class AssimilationCycle(object):
+    """
+    One assimilation cycle of an ExperimentPlan: The model is stepped to each of the
+    sample times, and the state is sampled at each of them. If assimilate is set, the
+    observations at end_t are assimilated before the final sample.
+    """
+    def __init__(self, index, start_t, end_t, sample_times, assimilate, write_output):
+        self.index = index
+        self.start_t = start_t
+        self.end_t = end_t
+        self.sample_times = sample_times
+        self.assimilate = assimilate
+        self.write_output = write_output
+
+    def __repr__(self):
+        return "AssimilationCycle(" + str(self.index) + ", " + str(self.start_t) + " -> " + str(self.end_t) + ")"
+
+
+class ExperimentPlan(object):
+    """
+    Plan of a data assimilation experiment, consisting of num_cycles assimilation
+    cycles of cycle_length seconds, followed by a forecast of forecast_duration seconds.
+    """
+
+    def __init__(self, start_t, num_cycles, cycle_length, sample_interval=None, assimilate=True,
+                 output_interval=None, forecast_duration=0, forecast_observation_interval=300,
+                 forecast_output_interval=None):
+        """
+        start_t: Simulation time at the start of the experiment
+        num_cycles: Number of assimilation cycles
+        cycle_length: Time between each assimilation, in seconds
+        sample_interval: Time between each state sample within a cycle (default cycle_length)
+        assimilate: Assimilate the observations at the end of each cycle (False for a pure ensemble run)
+        output_interval: Time between each write of the ensemble state and state samples (None for no output)
+        forecast_duration: Length of the forecast after the last cycle, in seconds (0 for no forecast)
+        forecast_observation_interval: Time between each observation of the forecast drifters
+        forecast_output_interval: Time between each write of the forecast states (None for no output)
+        """
+        if sample_interval is None:
+            sample_interval = cycle_length
+        assert(cycle_length % sample_interval == 0), "cycle_length must be a multiple of sample_interval"
+        assert(output_interval is None or output_interval % cycle_length == 0), \
+            "output_interval must be a multiple of cycle_length"
+        assert(forecast_duration % forecast_observation_interval == 0), \
+            "forecast_duration must be a multiple of forecast_observation_interval"
+        assert(forecast_output_interval is None or forecast_output_interval % forecast_observation_interval == 0), \
+            "forecast_output_interval must be a multiple of forecast_observation_interval"
+
+        self.start_t = start_t
+        self.num_cycles = num_cycles
+        self.cycle_length = cycle_length
+        self.sample_interval = sample_interval
+        self.assimilate = assimilate
+        self.output_interval = output_interval
+        self.forecast_duration = forecast_duration
+        self.forecast_observation_interval = forecast_observation_interval
+        self.forecast_output_interval = forecast_output_interval
+
+        samples_per_cycle = cycle_length // sample_interval
+        self.cycles = [None]*num_cycles
+        for i in range(num_cycles):
+            cycle_start_t = start_t + i*cycle_length
+            sample_times = cycle_start_t + sample_interval*np.arange(1, samples_per_cycle+1)
+            write_output = output_interval is not None and ((i+1)*cycle_length) % output_interval == 0
+            self.cycles[i] = AssimilationCycle(i, cycle_start_t, cycle_start_t + cycle_length,
+                                               sample_times, assimilate, write_output)
+
+        self.forecast_start_t = start_t + num_cycles*cycle_length
+        self.forecast_end_t = self.forecast_start_t + forecast_duration
+        num_forecast_observations = forecast_duration // forecast_observation_interval
+        self.forecast_observation_times = self.forecast_start_t + \
+            forecast_observation_interval*np.arange(1, num_forecast_observations+1)
+        if forecast_output_interval is None:
+            self.forecast_output_times = np.array([])
+        else:
+            self.forecast_output_times = self.forecast_start_t + \
+                forecast_output_interval*np.arange(1, forecast_duration//forecast_output_interval+1)
+
+    def getDescription(self):
+        """
+        Dict with the parameters of the plan, which is stored with the checkpoints
+        to make sure that an experiment is resumed with the same plan
+        """
+        return {'start_t': self.start_t, 'num_cycles': self.num_cycles,
+                'cycle_length': self.cycle_length, 'sample_interval': self.sample_interval,
+                'assimilate': self.assimilate, 'output_interval': self.output_interval,
+                'forecast_duration': self.forecast_duration,
+                'forecast_observation_interval': self.forecast_observation_interval,
+                'forecast_output_interval': self.forecast_output_interval}
+
+
+
+class ExperimentModel(object):
+    """
+    Interface between the ExperimentDriver and the ensemble (or a mock model).
+    Forecast functions take a list of particle ids, which are forecast together.
+    """
+
+    def startCycle(self, cycle):
+        """Called before the model is stepped through the given assimilation cycle"""
+        pass
+
+    def step(self, t, model_error_final_step=True):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def assimilate(self, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def sample(self, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def writeOutput(self, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def saveCheckpoint(self, path):
+        """Writes the model state to the (new) directory path"""
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def loadCheckpoint(self, path):
+        """Restores the model state written by saveCheckpoint"""
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def getForecastParticles(self):
+        """Ids of the particles to run forecasts for"""
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def startForecast(self, particle_ids, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def stepForecast(self, particle_ids, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def observeForecast(self, particle_ids, t):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def writeForecastOutput(self, particle_ids, t):
+        pass
+
+    def finishForecast(self, particle_ids):
+        """Writes the forecasts of the given particles to file"""
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+
+
+class ExperimentDriver(object):
+    """
+    Runs an ExperimentPlan on an ExperimentModel.
+
+    With a checkpoint directory, the model state is checkpointed every checkpoint_interval
+    assimilation cycles and after the last cycle, and the forecasts are registered as they
+    are written. A new driver with the same checkpoint directory then resumes the
+    experiment after the last completed cycle (or forecast group).
+    """
+
+    PROGRESS_FILE = "progress.json"
+
+    def __init__(self, model, plan, checkpoint_dir=None, checkpoint_interval=1, forecast_group_size=None):
+        """
+        model: ExperimentModel to run the experiment on
+        plan: ExperimentPlan to carry out
+        checkpoint_dir: Directory to store the checkpoints in (None for no checkpoints)
+        checkpoint_interval: Number of assimilation cycles between each checkpoint
+        forecast_group_size: Number of particles whose forecasts are run in the same pass over the
+            observation times (default all). The particles of a group are stepped one after the
+            other, and the progress is checkpointed after each group.
+        """
+        self.logger = logging.getLogger(__name__)
+        self.model = model
+        self.plan = plan
+        self.checkpoint_dir = checkpoint_dir
+        self.checkpoint_interval = checkpoint_interval
+        self.forecast_group_size = forecast_group_size
+
+        self.completed_cycles = 0
+        self.completed_forecasts = []
+        self.model_state = None
+
+        if self.checkpoint_dir is not None:
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+            if os.path.isfile(self._progressFile()):
+                self.resume()
+
+    def _progressFile(self):
+        return os.path.join(self.checkpoint_dir, self.PROGRESS_FILE)
+
+    def resume(self):
+        """
+        Restores the model from the last checkpoint
+        """
+        with open(self._progressFile(), 'r') as f:
+            progress = json.load(f)
+        if progress['plan'] != json.loads(json.dumps(self.plan.getDescription())):
+            raise RuntimeError("The checkpoint in " + self.checkpoint_dir + " is from a different experiment plan")
+
+        self.completed_cycles = progress['completed_cycles']
+        self.completed_forecasts = progress['completed_forecasts']
+        self.model_state = progress['model_state']
+        if self.model_state is not None:
+            self.model.loadCheckpoint(os.path.join(self.checkpoint_dir, self.model_state))
+        self.logger.info("Resuming after %d of %d assimilation cycles and %d forecasts",
+                         self.completed_cycles, self.plan.num_cycles, len(self.completed_forecasts))
+
+    def _saveProgress(self):
+        # Written to a temporary file first, so that the progress file is never broken
+        progress = {'plan': self.plan.getDescription(),
+                    'completed_cycles': self.completed_cycles,
+                    'completed_forecasts': self.completed_forecasts,
+                    'model_state': self.model_state}
+        tmp_file = self._progressFile() + ".tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(progress, f)
+        os.replace(tmp_file, self._progressFile())
+
+    def saveCheckpoint(self):
+        """
+        Checkpoints the model state after the completed cycles. The previous model
+        state is removed once the progress file refers to the new one.
+        """
+        tic = time.time()
+        previous_state = self.model_state
+        self.model_state = "model_state_" + str(self.completed_cycles).zfill(5)
+        path = os.path.join(self.checkpoint_dir, self.model_state)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        self.model.saveCheckpoint(path)
+        self._saveProgress()
+
+        if previous_state is not None and previous_state != self.model_state:
+            shutil.rmtree(os.path.join(self.checkpoint_dir, previous_state), ignore_errors=True)
+        self.logger.info("Checkpoint after cycle %d written in %.2f s", self.completed_cycles, time.time()-tic)
+
+    def isAssimilationDone(self):
+        return self.completed_cycles == self.plan.num_cycles
+
+    def isDone(self):
+        return self.isAssimilationDone() and len(self.getPendingForecasts()) == 0
+
+    def run(self, max_cycles=None):
+        """
+        Runs the (remaining) experiment. With max_cycles, at most max_cycles assimilation
+        cycles are run before returning. Returns True when the experiment is completed.
+        """
+        self.runAssimilation(max_cycles=max_cycles)
+        if not self.isAssimilationDone():
+            return False
+        self.runForecast()
+        return True
+
+    def runAssimilation(self, max_cycles=None):
+        cycles = self.plan.cycles[self.completed_cycles:]
+        if max_cycles is not None:
+            cycles = cycles[:max_cycles]
+
+        for cycle in cycles:
+            self.runCycle(cycle)
+            self.completed_cycles += 1
+
+            if self.checkpoint_dir is not None and \
+                    (self.completed_cycles % self.checkpoint_interval == 0 or self.isAssimilationDone()):
+                self.saveCheckpoint()
+
+    def runCycle(self, cycle):
+        self.model.startCycle(cycle)
+        num_samples = len(cycle.sample_times)
+        for i, t in enumerate(cycle.sample_times):
+            # The final step before an assimilation is taken without model error
+            assimilate_now = cycle.assimilate and i == num_samples-1
+            self.model.step(t, model_error_final_step=not assimilate_now)
+            if assimilate_now:
+                self.model.assimilate(t)
+            self.model.sample(t)
+
+        if cycle.write_output:
+            self.model.writeOutput(cycle.end_t)
+        self.logger.debug("Done with %s", str(cycle))
+
+    def getPendingForecasts(self):
+        completed = set(self.completed_forecasts)
+        return [p for p in self.model.getForecastParticles() if p not in completed]
+
+    def runForecast(self):
+        """
+        Runs the forecasts for groups of forecast_group_size particles. Each particle
+        of a group is stepped in turn from one observation time to the next
+        """
+        if self.plan.forecast_duration == 0:
+            return
+        pending = self.getPendingForecasts()
+        group_size = self.forecast_group_size if self.forecast_group_size is not None else max(len(pending), 1)
+        output_times = set(np.round(self.plan.forecast_output_times).tolist())
+
+        for group_start in range(0, len(pending), group_size):
+            group = pending[group_start:group_start+group_size]
+            tic = time.time()
+
+            self.model.startForecast(group, self.plan.forecast_start_t)
+            for t in self.plan.forecast_observation_times:
+                self.model.stepForecast(group, t)
+                self.model.observeForecast(group, t)
+                if np.round(t) in output_times:
+                    self.model.writeForecastOutput(group, t)
+            self.model.finishForecast(group)
+
+            self.completed_forecasts += [int(p) for p in group]
+            if self.checkpoint_dir is not None:
+                self._saveProgress()
+            self.logger.info("Forecast for particles %s done in %.1f s", str(group), time.time()-tic)
+
+
+
+class EnsembleExperimentModel(ExperimentModel):
+    """
+    ExperimentModel for an EnsembleFromFiles, with IEWPF 2 stage (or no) data assimilation,
+    and forecasts of all the (true) drifters written as Observation files.
+    """
+
+    def __init__(self, ensemble, iewpf=None, particle_info_prefix=None, forecast_file_base=None):
+        """
+        ensemble: EnsembleFromFiles
+        iewpf: IEWPFOcean used for the data assimilation (None for no data assimilation)
+        particle_info_prefix: Prefix of the state sample (ParticleInfo) files
+        forecast_file_base: Prefix of the forecast (Observation) files
+        """
+        self.ensemble = ensemble
+        self.iewpf = iewpf
+        self.particle_info_prefix = particle_info_prefix
+        self.forecast_file_base = forecast_file_base
+
+        self.drifter_cells = None
+        self.forecast_drifter_positions = None
+        self.forecast_observations = {}
+
+    def startCycle(self, cycle):
+        self.drifter_cells = self.ensemble.getDrifterCells()
+
+    def step(self, t, model_error_final_step=True):
+        self.ensemble.stepToObservation(t, model_error_final_step=model_error_final_step)
+
+    def assimilate(self, t):
+        if self.iewpf is not None:
+            self.iewpf.iewpf_2stage(self.ensemble, perform_step=False)
+
+    def sample(self, t):
+        self.ensemble.registerStateSample(self.drifter_cells)
+
+    def writeOutput(self, t):
+        if self.particle_info_prefix is not None:
+            self.ensemble.dumpParticleInfosToFile(self.particle_info_prefix)
+        self.ensemble.writeEnsembleToNetCDF()
+
+    def saveCheckpoint(self, path):
+        os.makedirs(path)
+        for p in range(self.ensemble.getNumParticles()):
+            if self.ensemble.particlesActive[p]:
+                sim = self.ensemble.particles[p]
+                eta0, hu0, hv0 = sim.download()
+                eta1, hu1, hv1 = sim.downloadPrevTimestep()
+                np.savez(os.path.join(path, "particle_" + str(p).zfill(4) + ".npz"),
+                         eta0=eta0, hu0=hu0, hv0=hv0, eta1=eta1, hu1=hu1, hv1=hv1,
+                         t=sim.t, total_time_steps=sim.total_time_steps)
+
+        with open(os.path.join(path, "ensemble.pickle"), 'wb') as f:
+            pickle.dump({'t': self.ensemble.t,
+                         'particles_active': list(self.ensemble.particlesActive),
+                         'particle_infos': self.ensemble.particleInfos,
+                         'particle_info_dump_counter': self.ensemble._particleInfoFileDumpCounter}, f)
+
+    def loadCheckpoint(self, path):
+        with open(os.path.join(path, "ensemble.pickle"), 'rb') as f:
+            ensemble_state = pickle.load(f)
+
+        for p in range(self.ensemble.getNumParticles()):
+            if not ensemble_state['particles_active'][p]:
+                if self.ensemble.particlesActive[p]:
+                    self.ensemble.deactivateParticle(p, msg='Deactivated before the checkpoint')
+                continue
+
+            sim = self.ensemble.particles[p]
+            with np.load(os.path.join(path, "particle_" + str(p).zfill(4) + ".npz")) as state:
+                sim.upload(state['eta0'], state['hu0'], state['hv0'], state['eta1'], state['hu1'], state['hv1'])
+                sim.t = float(state['t'])
+                sim.total_time_steps = int(state['total_time_steps'])
+            sim.updateDt()
+
+        self.ensemble.t = ensemble_state['t']
+        self.ensemble.particleInfos = ensemble_state['particle_infos']
+        self.ensemble._particleInfoFileDumpCounter = ensemble_state['particle_info_dump_counter']
+
+    def getForecastParticles(self):
+        return [p for p in range(self.ensemble.getNumParticles()) if self.ensemble.particlesActive[p]]
+
+    def startForecast(self, particle_ids, t):
+        if self.forecast_drifter_positions is None:
+            # Read all drifters (even those that are not used in the assimilation)
+            self.forecast_drifter_positions = self.ensemble.observeTrueDrifters(applyDrifterSet=False, ignoreBuoys=True)
+        num_drifters = len(self.forecast_drifter_positions)
+
+        for p in particle_ids:
+            sim = self.ensemble.particles[p]
+            drifters = GPUDrifterCollection.GPUDrifterCollection(self.ensemble.gpu_ctx, num_drifters,
+                                                                 boundaryConditions=self.ensemble.getBoundaryConditions(),
+                                                                 domain_size_x=self.ensemble.getDomainSizeX(),
+                                                                 domain_size_y=self.ensemble.getDomainSizeY())
+            drifters.setDrifterPositions(self.forecast_drifter_positions)
+            sim.attachDrifters(drifters)
+
+            self.forecast_observations[p] = Observation.Observation()
+            self.forecast_observations[p].add_observation_from_sim(sim)
+
+    def stepForecast(self, particle_ids, t):
+        for p in particle_ids:
+            self.ensemble.particles[p].dataAssimilationStep(t, write_now=False)
+
+    def observeForecast(self, particle_ids, t):
+        for p in particle_ids:
+            self.forecast_observations[p].add_observation_from_sim(self.ensemble.particles[p])
+
+    def writeForecastOutput(self, particle_ids, t):
+        for p in particle_ids:
+            self.ensemble.particles[p].writeState()
+
+    def finishForecast(self, particle_ids):
+        for p in particle_ids:
+            if self.forecast_file_base is not None:
+                self.forecast_observations[p].to_pickle(self.forecast_file_base + str(p).zfill(4) + ".bz2")
+            del self.forecast_observations[p]
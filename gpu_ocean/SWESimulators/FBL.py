@@ -33,6 +33,7 @@ import gc
 from SWESimulators import Common, SimWriter, SimReader
 from SWESimulators import Simulator
 from SWESimulators import WindStress
+from SWESimulators import Instrumentation
    
 
 class FBL(Simulator.Simulator):
@@ -177,6 +178,7 @@ class FBL(Simulator.Simulator):
                                                  self.ny, \
                                                  self.boundary_conditions
         )
+        Instrumentation.attach(self.bc_kernel, self)
         
         # Bit-wise boolean for wall boundary conditions
         self.wall_bc = np.int32(0)
@@ -301,15 +303,7 @@ class FBL(Simulator.Simulator):
                 
             wind_stress_t = np.float32(self.update_wind_stress(self.step_kernel, self.fblStepKernel))
 
-            self.fblStepKernel.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
-                    self.nx, self.ny, \
-                    self.dx, self.dy, local_dt, \
-                    self.g, self.f, self.coriolis_beta, self.y_zero_reference_cell, self.r, \
-                    self.H.data.gpudata, self.H.pitch, \
-                    self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch, \
-                    self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch, \
-                    self.gpu_data.h0.data.gpudata, self.gpu_data.h0.pitch, \
-                    self.wall_bc, wind_stress_t)
+            self.callKernel(local_dt, wind_stress_t)
             
             # Fix U boundary
             self.bc_kernel.boundaryConditionU(self.gpu_stream, self.gpu_data.hu0)
@@ -327,6 +321,18 @@ class FBL(Simulator.Simulator):
             self.sim_writer.writeTimestep(self)
             
         return self.t
+
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def callKernel(self, local_dt, wind_stress_t):
+        self.fblStepKernel.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
+                self.nx, self.ny, \
+                self.dx, self.dy, local_dt, \
+                self.g, self.f, self.coriolis_beta, self.y_zero_reference_cell, self.r, \
+                self.H.data.gpudata, self.H.pitch, \
+                self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch, \
+                self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch, \
+                self.gpu_data.h0.data.gpudata, self.gpu_data.h0.pitch, \
+                self.wall_bc, wind_stress_t)
     
 
 class FBL_boundary_conditions:
@@ -417,6 +423,7 @@ class FBL_boundary_conditions:
        
     
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionU(self, gpu_stream, hu0):
         """
         Updates hu according to boundary conditions
@@ -463,6 +470,7 @@ class FBL_boundary_conditions:
                     hu0.data.gpudata, hu0.pitch)
         
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionV(self, gpu_stream, hv0):
         """
         Updates hv according to periodic boundary conditions
@@ -509,6 +517,7 @@ class FBL_boundary_conditions:
         
         
 
+    @Instrumentation.instrument(Instrumentation.KERNEL)
     def boundaryConditionEta(self, gpu_stream, eta0):
         """
         Updates eta boundary conditions (ghost cells)
@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements headless rendering of animation frames from
+the netCDF files written by SimNetCDFWriter and SimNetCDFEnsembleWriter.
+The files are streamed one timestep at a time, and the fields are decimated
+to the target pixel resolution before derived quantities such as velocity,
+speed and vorticity are computed. Frames are rendered to image files by a
+pool of worker processes with the Agg backend of matplotlib, so that no
+display is needed, and can be joined into a movie with ffmpeg.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import multiprocessing
+import os
+import shutil
+import subprocess
+
+import numpy as np
+
+from SWESimulators import OceanographicUtilities, LazyImport
+netCDF4 = LazyImport.lazyImport('netCDF4')
+
+
+# Desingularization used when computing velocities from hu and hv (as in PlotHelper.genVelocity)
+DESINGULARIZATION_EPS = 1.0e-5
+
+
+def decimationFactors(shape, resolution):
+    """
+    Integer decimation factors (y, x) so that a field of the given shape is
+    reduced to at least the given resolution (in pixels, as (ny, nx))
+    """
+    return (max(1, int(shape[0] // resolution[0])), max(1, int(shape[1] // resolution[1])))
+
+
+def decimate(field, factors, method='mean'):
+    """
+    Decimates a 2D field by the factors (y, x).
+    method='mean' averages the (unmasked) values in each block, and drops incomplete blocks
+    at the end of each axis. method='stride' picks every factor'th value.
+    """
+    fy, fx = factors
+    if method == 'stride':
+        return field[::fy, ::fx]
+    assert(method == 'mean'), 'Unknown decimation method ' + str(method) + ', expected mean or stride'
+    if fy == 1 and fx == 1:
+        return field
+    ny, nx = field.shape[0]//fy, field.shape[1]//fx
+    blocks = field[:ny*fy, :nx*fx].reshape(ny, fy, nx, fx)
+    if np.ma.is_masked(field):
+        return np.ma.mean(blocks, axis=(1, 3))
+    return np.mean(np.ma.getdata(blocks), axis=(1, 3))
+
+
+###---------------------------
+### Derived fields
+###---------------------------
+# Each function takes the dict of decimated fields from FrameSource.readTimestep
+# (eta, hu, hv and h at cell centers) and the decimated grid spacing.
+
+def _velocity(fields, name):
+    return OceanographicUtilities.desingularise(fields['h'], fields[name], DESINGULARIZATION_EPS)
+
+def _fieldU(fields, dx, dy):
+    return _velocity(fields, 'hu')
+
+def _fieldV(fields, dx, dy):
+    return _velocity(fields, 'hv')
+
+def _fieldSpeed(fields, dx, dy):
+    u, v = _velocity(fields, 'hu'), _velocity(fields, 'hv')
+    return np.sqrt(u*u + v*v)
+
+def _fieldVorticity(fields, dx, dy):
+    u, v = _velocity(fields, 'hu'), _velocity(fields, 'hv')
+    du_dy = np.gradient(np.ma.filled(u, 0.0), dy, axis=0)
+    dv_dx = np.gradient(np.ma.filled(v, 0.0), dx, axis=1)
+    curl = dv_dx - du_dy
+    if np.ma.is_masked(u):
+        curl = np.ma.array(curl, mask=np.ma.getmaskarray(u))
+    return curl
+
+# Maps the name of each field that can be rendered to (function, colormap, title, symmetric).
+# The function is None for the fields read from file. Symmetric fields get color limits
+# centered around zero. Additional fields can be registered by adding entries to this dict.
+FIELDS = {
+    'eta':       (None,            'coolwarm', '$\\eta$',            True),
+    'hu':        (None,            'coolwarm', '$hu$',               True),
+    'hv':        (None,            'coolwarm', '$hv$',               True),
+    'h':         (None,            'Blues',    '$h$',                False),
+    'u':         (_fieldU,         'coolwarm', '$u$',                True),
+    'v':         (_fieldV,         'coolwarm', '$v$',                True),
+    'speed':     (_fieldSpeed,     'Oranges',  'Speed',              False),
+    'vorticity': (_fieldVorticity, 'seismic',  'Vorticity',          True)
+}
+
+
+def frameTimes(times, num_frames=None):
+    """
+    Times of num_frames frames evenly spaced between the first and last time
+    (as in norkyst_plotting.ncAnimation), or the times themselves if num_frames is None
+    """
+    times = np.asarray(times, dtype=np.float64)
+    if num_frames is None:
+        return times.copy()
+    if num_frames == 1:
+        return times[-1:].copy()
+    return times[0] + np.arange(num_frames)/(num_frames-1)*(times[-1] - times[0])
+
+
+class FrameSource(object):
+    """
+    Streams decimated fields from a file written by SimNetCDFWriter or SimNetCDFEnsembleWriter.
+    Only the timesteps needed for each frame are read, and the file is opened lazily, so that
+    the source can be used from worker processes.
+    """
+
+    def __init__(self, filename, resolution=(720, 1280), decimation='mean', member=None, interior_only=True):
+        """
+        filename: netCDF file to read
+        resolution: Target resolution (ny, nx) in pixels of each field
+        decimation: 'mean' to average blocks of cells, or 'stride' to read only every n'th cell
+        member: For ensemble files, the position along the ensemble_member dimension,
+            or 'mean' for the ensemble mean
+        interior_only: Leave out the ghost cells
+        """
+        assert(decimation in ['mean', 'stride']), 'Unknown decimation method ' + str(decimation)
+        self.filename = filename
+        self.resolution = resolution
+        self.decimation = decimation
+        self.member = member
+        self._ncfile = None
+
+        ncfile = self._open()
+        self.times = ncfile.variables['time'][:].astype(np.float64)
+        self.is_ensemble = 'ensemble_member' in ncfile.dimensions
+        assert(self.is_ensemble or member is None), 'member can only be given for ensemble files'
+        assert(not self.is_ensemble or member is not None), 'member must be given for ensemble files'
+
+        # Interior cells at the cell centers
+        ny, nx = ncfile.variables['eta'].shape[-2:]
+        self.interior = (slice(0, ny), slice(0, nx))
+        if interior_only and str(ncfile.getncattr('ignore_ghostcells')) != 'True':
+            south, north = ncfile.getncattr('ghost_cells_south'), ncfile.getncattr('ghost_cells_north')
+            west, east = ncfile.getncattr('ghost_cells_west'), ncfile.getncattr('ghost_cells_east')
+            self.interior = (slice(south, ny-north), slice(west, nx-east))
+        shape = (self.interior[0].stop - self.interior[0].start, self.interior[1].stop - self.interior[1].start)
+        self.factors = decimationFactors(shape, resolution)
+        self.dx = float(ncfile.getncattr('dx'))*self.factors[1]
+        self.dy = float(ncfile.getncattr('dy'))*self.factors[0]
+
+        self.Hm = self._decimate(ncfile.variables['Hm'][self.interior])
+        self.shape = self.Hm.shape
+
+    def _open(self):
+        if self._ncfile is None:
+            self._ncfile = netCDF4.Dataset(self.filename, 'r')
+        return self._ncfile
+
+    def close(self):
+        if self._ncfile is not None:
+            self._ncfile.close()
+            self._ncfile = None
+
+    def __getstate__(self):
+        # Open files are not passed on to worker processes
+        state = self.__dict__.copy()
+        state['_ncfile'] = None
+        return state
+
+    def _decimate(self, field):
+        field = decimate(field, self.factors, self.decimation)
+        # Drop incomplete blocks also when striding, so that all fields have the same shape
+        ny, nx = self.interior[0].stop - self.interior[0].start, self.interior[1].stop - self.interior[1].start
+        return field[:ny//self.factors[0], :nx//self.factors[1]]
+
+    def _readField(self, name, index):
+        var = self._open().variables[name]
+        ys, xs = self.interior
+        if self.decimation == 'stride':
+            # Only read the cells that are kept
+            ys = slice(ys.start, ys.stop, self.factors[0])
+            xs = slice(xs.start, xs.stop, self.factors[1])
+
+        if not self.is_ensemble:
+            data = self._readStaggered(var, (index,), ys, xs)
+        elif self.member == 'mean':
+            data = np.ma.mean(self._readStaggered(var, (index, slice(None)), ys, xs), axis=0)
+        else:
+            data = self._readStaggered(var, (index, self.member), ys, xs)
+
+        if self.decimation == 'stride':
+            ny, nx = self.shape
+            return data[:ny, :nx]
+        return self._decimate(data)
+
+    def _readStaggered(self, var, index, ys, xs):
+        """
+        Reads var at the cell centers. Values on cell faces (hu and hv on staggered grids)
+        are averaged to the cell centers, as in SimNetCDFWriter._diagnosticFields.
+        """
+        ny, nx = self._open().variables['eta'].shape[-2:]
+        var_ny, var_nx = var.shape[-2:]
+        if (var_ny, var_nx) == (ny, nx):
+            return var[index + (ys, xs)]
+
+        if var_nx == nx + 1:
+            x_faces = var[index + (ys, slice(xs.start, xs.stop + 1))]
+            return 0.5*(x_faces[..., :-1][..., ::xs.step or 1] + x_faces[..., 1:][..., ::xs.step or 1])
+        if var_nx == nx - 1:
+            # Only faces between cells (as in FBL)
+            inner_faces = var[index + (ys, slice(None))]
+            x_faces = np.ma.zeros(inner_faces.shape[:-1] + (nx+1,), dtype=np.float32)
+            x_faces[..., 1:-1] = inner_faces
+            x_faces = x_faces[..., xs.start:xs.stop+1]
+            return 0.5*(x_faces[..., :-1][..., ::xs.step or 1] + x_faces[..., 1:][..., ::xs.step or 1])
+        assert(var_ny == ny + 1), 'Unexpected shape ' + str(var.shape) + ' of ' + var.name
+        y_faces = var[index + (slice(ys.start, ys.stop + 1), xs)]
+        step = ys.step or 1
+        return 0.5*(y_faces[..., :-1, :][..., ::step, :] + y_faces[..., 1:, :][..., ::step, :])
+
+    def readTimestep(self, index):
+        """
+        Returns a dict with the decimated eta, hu, hv and h at the given timestep
+        """
+        fields = {name: self._readField(name, index) for name in ['eta', 'hu', 'hv']}
+        fields['h'] = self.Hm + fields['eta']
+        return fields
+
+    def getFrame(self, t, field_names):
+        """
+        Returns a dict with the given fields at time t, interpolated linearly between the
+        neighbouring timesteps. Derived fields are computed from the decimated state.
+        """
+        k = min(max(int(np.searchsorted(self.times, t)), 1), len(self.times)-1) if len(self.times) > 1 else 0
+        j = max(k-1, 0)
+        s = 0.0 if k == j else (t - self.times[j])/(self.times[k] - self.times[j])
+        s = min(max(s, 0.0), 1.0)
+
+        if s <= 0.0:
+            fields = self.readTimestep(j)
+        elif s >= 1.0:
+            fields = self.readTimestep(k)
+        else:
+            fields = self.readTimestep(j)
+            next_fields = self.readTimestep(k)
+            fields = {name: (1-s)*fields[name] + s*next_fields[name] for name in fields.keys()}
+
+        frame = {}
+        for name in field_names:
+            assert(name in FIELDS), 'Unknown field ' + str(name) + ', expected one of ' + str(list(FIELDS.keys()))
+            function = FIELDS[name][0]
+            frame[name] = fields[name] if function is None else function(fields, self.dx, self.dy)
+        return frame
+
+
+class FrameRenderer(object):
+    """
+    Renders frames with one panel per field from a FrameSource to image files,
+    using worker processes and the Agg backend (no display needed).
+    """
+
+    def __init__(self, source, fields=None, limits=None, title=None,
+                 figsize=None, dpi=100, num_processes=None):
+        """
+        source: FrameSource to render
+        fields: Names of the fields (keys in FIELDS) to render, one panel each (default eta)
+        limits: Dict of (vmin, vmax) for each field. Missing limits are computed from the last frame.
+        title: Title shown together with the time of each frame
+        figsize: Figure size in inches (default fits the panels at the source resolution)
+        dpi: Resolution of the images
+        num_processes: Number of worker processes (default os.cpu_count(), 1 renders serially)
+        """
+        self.logger = logging.getLogger(__name__)
+        if fields is None:
+            fields = ['eta']
+        for name in fields:
+            assert(name in FIELDS), 'Unknown field ' + str(name) + ', expected one of ' + str(list(FIELDS.keys()))
+        self.source = source
+        self.fields = list(fields)
+        self.limits = dict(limits) if limits is not None else {}
+        self.title = title if title is not None else os.path.basename(source.filename)
+        self.dpi = dpi
+        if figsize is None:
+            ny, nx = source.shape
+            figsize = (len(self.fields)*4.0*max(1.0, nx/ny) + 1.0, 4.0*max(1.0, ny/nx) + 0.5)
+        self.figsize = figsize
+        self.num_processes = num_processes if num_processes is not None else os.cpu_count()
+
+    def computeLimits(self, t):
+        """
+        Sets the missing color limits from the frame at time t
+        """
+        missing = [name for name in self.fields if name not in self.limits]
+        if len(missing) == 0:
+            return
+        frame = self.source.getFrame(t, missing)
+        for name in missing:
+            max_value = float(np.ma.max(np.abs(frame[name])))
+            max_value = max_value if max_value > 0.0 else 1.0
+            if FIELDS[name][3]:
+                self.limits[name] = (-max_value, max_value)
+            else:
+                self.limits[name] = (float(np.ma.min(frame[name])), float(np.ma.max(frame[name])))
+
+    def renderFrame(self, t, filename):
+        """
+        Renders the frame at time t to the given png file
+        """
+        from matplotlib.figure import Figure
+        from matplotlib.backends.backend_agg import FigureCanvasAgg
+        import datetime
+
+        frame = self.source.getFrame(t, self.fields)
+        ny, nx = self.source.shape
+        extent = [0, nx*self.source.dx/1000, 0, ny*self.source.dy/1000]
+
+        fig = Figure(figsize=self.figsize, dpi=self.dpi)
+        FigureCanvasAgg(fig)
+        fig.suptitle("Time = {:0>8} ({:s})".format(str(datetime.timedelta(seconds=int(t))), self.title))
+        for i, name in enumerate(self.fields):
+            ax = fig.add_subplot(1, len(self.fields), i+1)
+            vmin, vmax = self.limits[name]
+            im = ax.imshow(frame[name], interpolation="none", origin='lower',
+                           cmap=FIELDS[name][1], vmin=vmin, vmax=vmax, extent=extent)
+            fig.colorbar(im, ax=ax, shrink=0.9)
+            ax.set_title(FIELDS[name][2])
+        
+        # Write to a temporary file first, so that an interruption never leaves a broken frame
+        tmp_filename = filename + ".tmp"
+        fig.savefig(tmp_filename, dpi=self.dpi, format='png')
+        os.replace(tmp_filename, filename)
+
+    def renderFrames(self, output_dir, num_frames=None, prefix="frame", overwrite=False):
+        """
+        Renders num_frames frames evenly spaced in time (one per timestep if None) to
+        output_dir/<prefix>_%05d.png, and returns the filenames.
+        Existing frames are kept unless overwrite is True, so that an interrupted
+        rendering continues where it stopped.
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        times = frameTimes(self.source.times, num_frames)
+        self.computeLimits(times[-1])
+
+        filenames = [os.path.join(output_dir, prefix + "_%05d.png" % i) for i in range(len(times))]
+        pending = [(t, f) for t, f in zip(times, filenames) if overwrite or not os.path.isfile(f)]
+        self.logger.info("Rendering %d frames (%d already rendered)", len(pending), len(times) - len(pending))
+
+        # The workers open the file themselves
+        self.source.close()
+        if self.num_processes > 1 and len(pending) > 1:
+            pool = multiprocessing.Pool(min(self.num_processes, len(pending)),
+                                        initializer=_initWorker, initargs=(self,))
+            try:
+                for _ in pool.imap_unordered(_renderFrame, pending):
+                    pass
+            finally:
+                pool.terminate()
+                pool.join()
+        else:
+            for t, filename in pending:
+                self.renderFrame(t, filename)
+        return filenames
+
+
+# The renderer used in the worker processes, set by the pool initializer
+_worker_renderer = None
+
+def _initWorker(renderer):
+    global _worker_renderer
+    _worker_renderer = renderer
+
+def _renderFrame(args):
+    t, filename = args
+    _worker_renderer.renderFrame(t, filename)
+
+
+def writeMovie(output_dir, movie_filename, prefix="frame", fps=10):
+    """
+    Joins the frames rendered by FrameRenderer.renderFrames into a movie using ffmpeg
+    """
+    ffmpeg = shutil.which('ffmpeg')
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg is needed to write movies, but was not found")
+    subprocess.check_call([ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps),
+                           '-i', os.path.join(output_dir, prefix + "_%05d.png"),
+                           '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2', '-pix_fmt', 'yuv420p', movie_filename])
+    return movie_filename
@@ -32,17 +32,21 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import gc
-import pycuda.driver as cuda
-from scipy.special import lambertw, gammainc
-from scipy.optimize import newton
+import os
+import hashlib
+import tempfile
+cuda = LazyImport.lazyImport('pycuda.driver')
+special = LazyImport.lazyImport('scipy.special')
 import logging
 
-from SWESimulators import Common, OceanStateNoise, config, EnsemblePlot
+from SWESimulators import Common, OceanStateNoise, config
+EnsemblePlot = LazyImport.lazyImport('SWESimulators.EnsemblePlot')
 
 class IEWPFOcean:
     """
@@ -51,19 +55,29 @@ class IEWPFOcean:
     
     Input to constructor:
     ensemble: An object of super-type BaseOceanStateEnsemble.
+    use_cache: Reuse the precomputed S and local SVD matrices from earlier runs
+    cache_dir: Directory for the cache on disk (default: see default_cache_dir())
+    backend: Array backend (see Common.Array2D). With backend='host', no GPU is used,
+            and only the batched CPU methods (e.g., iewpfUpdate_batched_CPU) are available.
             
     """
     def __init__(self, ensemble, debug=False, show_errors=False,
-                 block_width=16, block_height=16):
+                 block_width=16, block_height=16, use_cache=True, cache_dir=None,
+                 backend=None):
         
         self.logger = logging.getLogger(__name__)
         self.logger_level = config.GPUOceanLoggerLevels.IEWPF_DEBUG
         
+        self.backend = Common.getArrayBackend(backend)
         self.gpu_ctx = ensemble.gpu_ctx
-        self.master_stream = cuda.Stream()
+        self.master_stream = None
+        if self.backend != 'host':
+            self.master_stream = cuda.Stream()
         
         self.debug = debug
         self.show_errors = show_errors
+        self.use_cache = use_cache
+        self.cache_dir = cache_dir
         
         # Store information needed internally in the class
         self.dx = np.float32(ensemble.getDx()) 
@@ -120,15 +134,18 @@ class IEWPFOcean:
         
         # Create constant matrix S = (HQH^T + R)^-1 and copy to the GPU
         # The matrix represents the combined "observed model error" and observation error.
-        self.S_host, self.S_device = None, None
-        self.S_host = self._createS(ensemble)
-        self.S_device = Common.CUDAArray2D(self.master_stream, 2, 2, 0, 0, self.S_host)
-        
         # Create constant localized SVD matrix and copy to the GPU.
         # This matrix is defined for the coarse grid, and ignores all use of the interpolation operator.
+        # Both matrices are reused from the cache if they have been computed before with the same parameters.
+        self.S_host, self.S_device = None, None
         self.localSVD_host, self.localSVD_device = None, None
-        self.localSVD_host = self._generateLocaleSVDforP(ensemble)
-        self.localSVD_device = Common.CUDAArray2D(self.master_stream, 49, 49, 0, 0, self.localSVD_host)
+        self.S_host, self.localSVD_host = self._getPrecomputedMatrices(ensemble)
+        self.S_device = Common.Array2D(self.backend, self.master_stream, 2, 2, 0, 0, self.S_host)
+        self.localSVD_device = Common.Array2D(self.backend, self.master_stream, 49, 49, 0, 0, self.localSVD_host)
+        
+        if self.backend == 'host':
+            # No kernels
+            return
     
         
         self.iewpf_kernels = self.gpu_ctx.get_kernel("iewpf_kernels.cu", \
@@ -777,8 +794,8 @@ class IEWPFOcean:
         The implicit equation that should be zero when we solve for alpha.
         This form does not assume that N_x is large.
         """
-        lhs = gammainc(Nx/2, alpha*gamma/2)
-        rhs = gammainc(Nx/2, gamma/2)
+        lhs = special.gammainc(Nx/2, alpha*gamma/2)
+        rhs = special.gammainc(Nx/2, gamma/2)
         expo = np.exp(-c_star/2)
         return lhs - expo*rhs
     
@@ -821,8 +838,8 @@ class IEWPFOcean:
             self.log("Using the Lambert W:")
             lambert_arg = -(gamma/self.Nx)*np.exp(-gamma/self.Nx)*np.exp(-c_star/self.Nx)
             self.log("\tLambert W arg: " + str(lambert_arg))
-            lambert_min1 = lambertw(lambert_arg, k=-1)
-            lambert_zero = lambertw(lambert_arg, k=0)
+            lambert_min1 = special.lambertw(lambert_arg, k=-1)
+            lambert_zero = special.lambertw(lambert_arg, k=0)
 
             alpha_scale = -(self.Nx/gamma)
             alpha_min1 = alpha_scale*np.real(lambert_min1)
@@ -963,6 +980,126 @@ class IEWPFOcean:
     
         
     
+    ###---------------------------
+    ### Cache for precomputed matrices
+    ###---------------------------
+    
+    # In-memory cache shared by all IEWPFOcean objects, mapping a hash of the 
+    # parameters to the precomputed (S_host, localSVD_host) matrices.
+    precomputed_matrices = {}
+    
+    @staticmethod
+    def default_cache_dir():
+        """
+        Directory for the cache on disk: $GPU_OCEAN_IEWPF_CACHE if set, 
+        otherwise gpu_ocean/iewpf under $XDG_CACHE_HOME (default ~/.cache).
+        """
+        if "GPU_OCEAN_IEWPF_CACHE" in os.environ:
+            return os.environ["GPU_OCEAN_IEWPF_CACHE"]
+        cache_home = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+        return os.path.join(cache_home, "gpu_ocean", "iewpf")
+    
+    def _precomputedMatricesHash(self, ensemble):
+        """
+        Creates a hash of all parameters that S and the local SVD block depend on.
+        The coarse grid is given by nx, ny and the interpolation factor.
+        """
+        params_hasher = hashlib.md5()
+        params = [self.nx, self.ny, self.dx, self.dy, self.interpolation_factor,
+                  self.soar_q0, self.soar_L, self.geoBalanceConst]
+        for param in params:
+            params_hasher.update(str(param).encode('utf-8'))
+        params_hasher.update(np.asarray(ensemble.getObservationCov(), dtype=np.float64).tobytes())
+        return "iewpf_" + params_hasher.hexdigest()
+    
+    def _getPrecomputedMatrices(self, ensemble):
+        """
+        Returns the matrices S and U*sqrt(Sigma) for the local SVD block, either from
+        the in-memory cache, the cache on disk, or by computing them from scratch.
+        """
+        matrices_hash = self._precomputedMatricesHash(ensemble)
+        
+        cache_path = self.cache_dir if self.cache_dir is not None else IEWPFOcean.default_cache_dir()
+        cached_filename = os.path.join(cache_path, matrices_hash + ".npz")
+        
+        # If we have the matrices in our hashmap, return them
+        if (self.use_cache and matrices_hash in IEWPFOcean.precomputed_matrices.keys()):
+            self.logger.debug("Found IEWPF matrices cached in hashmap (%s)", matrices_hash)
+            S, localSVD = IEWPFOcean.precomputed_matrices[matrices_hash]
+            return S.copy(), localSVD.copy()
+        
+        # If we have them on disk, return them
+        elif (self.use_cache and os.path.isfile(cached_filename)):
+            self.logger.debug("Found IEWPF matrices cached on disk (%s)", matrices_hash)
+            with np.load(cached_filename) as cached:
+                S = np.matrix(cached['S'], dtype=np.float32)
+                localSVD = np.array(cached['localSVD'], dtype=np.float32, order='C')
+            
+        # Otherwise, compute them
+        else:
+            self.logger.debug("Computing IEWPF matrices (%s)", matrices_hash)
+            # The local SVD is built from S, so S has to be available in self
+            self.S_host = self._createS(ensemble)
+            S = self.S_host
+            localSVD = self._generateLocaleSVDforP(ensemble)
+            if (self.use_cache):
+                self._saveCachedMatrices(cache_path, cached_filename, S, localSVD)
+        
+        if (self.use_cache):
+            IEWPFOcean.precomputed_matrices[matrices_hash] = (S.copy(), localSVD.copy())
+        return S, localSVD
+    
+    def _saveCachedMatrices(self, cache_path, cached_filename, S, localSVD):
+        """
+        Writes the matrices to a temporary file that is moved into place, so that
+        other processes (e.g., MPI ranks) never read a partially written file.
+        """
+        os.makedirs(cache_path, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_path, suffix=".npz.tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                np.savez(f, S=S, localSVD=localSVD)
+            os.replace(tmp_filename, cached_filename)
+        except:
+            if os.path.isfile(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+    
+    def checkPrecomputedMatrices(self, ensemble, places=5):
+        """
+        Computes S and the local SVD block from scratch, and checks that they agree with
+        the matrices in use (which might come from the cache).
+        Since the matrix square root is not unique, the local SVD block is compared through
+        the full matrix (U*sqrt(Sigma))*(U*sqrt(Sigma))^T.
+        Returns True if all values agree to the given number of decimal places.
+        """
+        S_in_use, localSVD_in_use = self.S_host, self.localSVD_host
+        try:
+            S_fresh = self._createS(ensemble)
+            self.S_host = S_fresh
+            localSVD_fresh = self._generateLocaleSVDforP(ensemble)
+        finally:
+            self.S_host = S_in_use
+        
+        full_in_use = np.dot(localSVD_in_use, localSVD_in_use.transpose())
+        full_fresh  = np.dot(localSVD_fresh,  localSVD_fresh.transpose())
+        
+        tol = 10.0**(-places)
+        S_ok   = np.allclose(S_in_use, S_fresh, rtol=tol, atol=0.0)
+        SVD_ok = np.allclose(full_in_use, full_fresh, rtol=0.0, atol=tol)
+        if not (S_ok and SVD_ok):
+            self.logger.warning("Cached IEWPF matrices differ from freshly computed matrices (S: %s, localSVD: %s)", 
+                                str(S_ok), str(SVD_ok))
+        return bool(S_ok and SVD_ok)
+    
+    @staticmethod
+    def clear_precomputed_cache():
+        """
+        Clears the in-memory cache of precomputed matrices (the cache on disk is kept)
+        """
+        IEWPFOcean.precomputed_matrices = {}
+    
+    
     ###---------------------------
     ### Download GPU buffers
     ###---------------------------
@@ -1570,14 +1707,14 @@ class IEWPFOcean:
 
         # 7) Solving the Lambert W function
         lambert_W_arg = -(gamma/self.Nx)*np.exp(a/self.Nx)*np.exp(-gamma/self.Nx)
-        alpha_min1 = -(self.Nx/gamma)*np.real(lambertw(lambert_W_arg, k=-1))
-        alpha_zero = -(self.Nx/gamma)*np.real(lambertw(lambert_W_arg))
+        alpha_min1 = -(self.Nx/gamma)*np.real(special.lambertw(lambert_W_arg, k=-1))
+        alpha_zero = -(self.Nx/gamma)*np.real(special.lambertw(lambert_W_arg))
         if self.debug: print ("Check a against the Lambert W requirement: ", a, " < ", - self.Nx + gamma - self.Nx*np.log(gamma/self.Nx), " = ", a <  - self.Nx + gamma - self.Nx*np.log(gamma/self.Nx))
         if self.debug: print ("-e^-1 < z < 0 : ", -1.0/np.exp(1), " < ", lambert_W_arg, " < ", 0, " = ", \
             (-1.0/np.exp(1) < lambert_W_arg, lambert_W_arg < 0))
         if self.debug: print ("Obtained (alpha k=-1, alpha k=0): ", (alpha_min1, alpha_zero))
-        if self.debug: print ("The two branches from Lambert W: ", (lambertw(lambert_W_arg), lambertw(lambert_W_arg, k=-1)))
-        if self.debug: print ("The two branches from Lambert W: ", (np.real(lambertw(lambert_W_arg)), np.real(lambertw(lambert_W_arg, k=-1))))
+        if self.debug: print ("The two branches from Lambert W: ", (special.lambertw(lambert_W_arg), special.lambertw(lambert_W_arg, k=-1)))
+        if self.debug: print ("The two branches from Lambert W: ", (np.real(special.lambertw(lambert_W_arg)), np.real(special.lambertw(lambert_W_arg, k=-1))))
 
         alpha = alpha_zero
         if lambert_W_arg > (-1.0/np.exp(1)) :
@@ -1603,7 +1740,7 @@ class IEWPFOcean:
         #oldDebug = self.debug
         #self.debug = True
         if self.debug: print ("--------------------------------------")
-        if self.debug: print ("Obtained (lambert_ans k=0, lambert_ans k=-1): ", (lambertw(lambert_W_arg), lambertw(lambert_W_arg, k=-1)))
+        if self.debug: print ("Obtained (lambert_ans k=0, lambert_ans k=-1): ", (special.lambertw(lambert_W_arg), special.lambertw(lambert_W_arg, k=-1)))
         if self.debug: print ("Obtained (alpha k=0, alpha k=-1): ", (alpha_zero, alpha_min1))
         if self.debug: print ("Checking implicit equation with alpha (k=0, k=-1): ", \
             (self._old_implicitEquation(alpha_zero, gamma, self.Nx, a, c), 
@@ -1624,3 +1761,266 @@ class IEWPFOcean:
         hv_a  += alpha*xi[2]
         if self.debug: self.showMatrices(eta_a, hu_a, "final x = x_a + alpha*xi", hv_a)
 
+    
+    
+    ###-------------------------------
+    ### Batched IEWPF CPU functions
+    ###-------------------------------
+    # Vectorized versions of the CPU functions above, in which all particles 
+    # are processed at once. The ocean states are stored as arrays of shape 
+    # [numParticles, ny, nx], and all innovations as [numParticles, numDrifters, 2].
+    
+    def iewpf_batched_CPU(self, ensemble, infoPlots=None, it=None, perform_step=True,
+                          random_numbers=None):
+        """
+        The complete one-stage IEWPF algorithm implemented on the CPU, in which all
+        particles and all observations are treated as batched array operations.
+        Follows the same steps as the GPU method iewpf(self, ...).
+        
+        random_numbers (optional) - N(0,I) samples of shape [numParticles, rand_ny, rand_nx].
+            If None, they are drawn from the random_state of each particle's model error.
+        """
+        # Step -1: Deterministic step
+        if perform_step:
+            t = ensemble.step_truth(ensemble.getDt(), stochastic=True)
+            t = ensemble.step_particles(ensemble.getDt(), stochastic=False)
+            
+        # Step 0: Obtain innovations
+        observed_drifter_positions = ensemble.observeTrueDrifters()
+        innovations = ensemble.getInnovations()
+        numParticles = ensemble.getNumParticles()
+        w_rest = -np.log(1.0/numParticles)*np.ones(numParticles)
+        
+        # save plot before
+        if infoPlots is not None:
+            self._keepPlot(ensemble, infoPlots, it, 1)
+        
+        # Download all ocean states
+        eta = np.zeros((numParticles, self.ny, self.nx))
+        hu  = np.zeros((numParticles, self.ny, self.nx))
+        hv  = np.zeros((numParticles, self.ny, self.nx))
+        for p in range(numParticles):
+            eta[p], hu[p], hv[p] = ensemble.particles[p].download(interior_domain_only=True)
+        
+        if random_numbers is None:
+            random_numbers = self._drawRandomNumbers_batched_CPU(ensemble)
+        
+        sim = ensemble.particles[0]
+        H = sim.downloadBathymetry()[0]
+        eta, hu, hv = self.iewpfUpdate_batched_CPU(sim.small_scale_model_error, 
+                                                   eta, hu, hv, H, sim.f, sim.coriolis_beta, sim.g,
+                                                   observed_drifter_positions, innovations, 
+                                                   random_numbers, w_rest=w_rest)
+        
+        # Fix boundaries and upload the resulting states to the GPU
+        eta = self._expand_to_periodic_boundaries_batched(eta, 2)
+        hu  = self._expand_to_periodic_boundaries_batched(hu,  2)
+        hv  = self._expand_to_periodic_boundaries_batched(hv,  2)
+        for p in range(numParticles):
+            ensemble.particles[p].upload(eta[p], hu[p], hv[p])
+        
+        # save plot after
+        if infoPlots is not None:
+            self._keepPlot(ensemble, infoPlots, it, 3)
+    
+    
+    def iewpfUpdate_batched_CPU(self, noise, eta, hu, hv, H, f, beta, g,
+                                observed_drifter_positions, innovations, random_numbers,
+                                w_rest=None):
+        """
+        The IEWPF update of all particles, operating on host arrays only.
+        
+        noise - OceanStateNoise object holding the model error parameters
+        eta, hu, hv - interior ocean states, shape [numParticles, ny, nx]
+        H - bathymetry on cell intersections (as from downloadBathymetry()[0])
+        observed_drifter_positions - shape [numDrifters, 2]
+        innovations - shape [numParticles, numDrifters, 2]
+        random_numbers - N(0,I) samples, shape [numParticles, rand_ny, rand_nx]
+        
+        Returns the updated eta, hu, hv.
+        """
+        numParticles = innovations.shape[0]
+        if w_rest is None:
+            w_rest = -np.log(1.0/numParticles)*np.ones(numParticles)
+        
+        # Kalman gain term and phi = d^T S d for all particles
+        K_eta, K_hu, K_hv, phi = self.applyKalmanGain_batched_CPU(noise, H, f, beta, g,
+                                                                  observed_drifter_positions, 
+                                                                  innovations)
+        
+        # Step 1: Find maximum weight
+        target_weight = np.max(w_rest + phi)
+        self.log("c values (batched):\n" + str(w_rest + phi))
+        self.log("w_target (batched) --> " + str(target_weight))
+        
+        # Sample xi \sim N(0, P), and get gamma in the process
+        p_eta, p_hu, p_hv, gamma = self.drawFromP_batched_CPU(noise, H, f, beta, g,
+                                                              observed_drifter_positions,
+                                                              random_numbers)
+        
+        # Solve implicit equation
+        c_star = target_weight - (phi + w_rest)
+        alpha = self.solveImplicitEquation_batched(gamma, c_star)
+        scale = np.sqrt(alpha)[:, np.newaxis, np.newaxis]
+        
+        # Add Kalman gain and scaled sample from P to the state vector
+        eta = eta + K_eta + scale*p_eta[:, 2:-2, 2:-2]
+        hu  = hu  + K_hu  + scale*p_hu
+        hv  = hv  + K_hv  + scale*p_hv
+        return eta, hu, hv
+    
+    
+    def _drawRandomNumbers_batched_CPU(self, ensemble):
+        """
+        Draws xi \sim N(0, I) for all particles on the host.
+        """
+        noise = ensemble.particles[0].small_scale_model_error
+        xi = np.zeros((ensemble.getNumParticles(), noise.rand_ny, noise.rand_nx))
+        for p in range(ensemble.getNumParticles()):
+            xi[p] = ensemble.particles[p].small_scale_model_error.random_state.standard_normal((noise.rand_ny, noise.rand_nx))
+        return xi
+    
+    
+    def _drifterCellIds_CPU(self, observed_drifter_positions):
+        """
+        Finds the cell indices (no ghost cells) of all drifters.
+        Returns cell_id_x, cell_id_y as integer arrays of length numDrifters.
+        """
+        positions = np.asarray(observed_drifter_positions)
+        cell_id_x = np.floor(positions[:, 0]/self.dx).astype(np.int64)
+        cell_id_y = np.floor(positions[:, 1]/self.dy).astype(np.int64)
+        return cell_id_x, cell_id_y
+    
+    
+    def _apply_local_SVD_to_global_xi_batched_CPU(self, global_xi, pos_x, pos_y):
+        """
+        Vectorized version of _apply_local_SVD_to_global_xi_CPU.
+        
+        global_xi has shape [..., ny, nx], and is modified so that 
+        xi = U*sqrt(Sigma)*xi in the 7x7 area centered at the drifter cell (pos_x, pos_y)
+        for all leading dimensions at once.
+        
+        The function assumes periodic boundary conditions in both dimensions.
+        """
+        global_j = (pos_y - 3 + np.arange(7)) % self.ny
+        global_i = (pos_x - 3 + np.arange(7)) % self.nx
+        
+        local_xi = global_xi[..., global_j[:, np.newaxis], global_i[np.newaxis, :]]
+        local_xi = local_xi.reshape(local_xi.shape[:-2] + (49,))
+        
+        local_xi = np.dot(local_xi, np.asarray(self.localSVD_host, dtype=np.float64).transpose())
+        
+        global_xi[..., global_j[:, np.newaxis], global_i[np.newaxis, :]] = \
+            local_xi.reshape(local_xi.shape[:-1] + (7, 7))
+    
+    
+    def drawFromP_batched_CPU(self, noise, H, f, beta, g, observed_drifter_positions, random_numbers):
+        """
+        Vectorized version of drawFromP_CPU, applying the local SVD blocks for all 
+        drifters to the random numbers of all particles.
+        The input random_numbers [numParticles, rand_ny, rand_nx] are left untouched.
+        
+        Returns p_eta [numParticles, ny+4, nx+4], p_hu, p_hv [numParticles, ny, nx] 
+        and gamma [numParticles].
+        """
+        xi = np.array(random_numbers, dtype=np.float64)
+        
+        # Find gamma = xi^T xi for each particle
+        gamma = np.sum(xi**2, axis=(-2, -1))
+        
+        # For each drifter, apply the local sqrt SVD-term
+        cell_id_x, cell_id_y = self._drifterCellIds_CPU(observed_drifter_positions)
+        for drifter in range(len(cell_id_x)):
+            self._apply_local_SVD_to_global_xi_batched_CPU(xi, cell_id_x[drifter], cell_id_y[drifter])
+        
+        # Apply SOAR and geostrophic balance
+        p_eta, p_hu, p_hv = noise._obtainOceanPerturbations_batched_CPU(xi, H, f, beta, g)
+        return p_eta, p_hu, p_hv, gamma
+    
+    
+    def _kalmanGainStencils_CPU(self):
+        """
+        Returns the four 7x7 SOAR stencils that spread the geostrophic balance 
+        contributions from the [north, east, south, west] neighbours of the observed 
+        cell, as used in applyKalmanGain_CPU.
+        """
+        north_east_south_west_index = [[4,3], [3,4], [2,3], [3,2]]
+        stencils = np.zeros((4, 7, 7))
+        for k, (j, i) in enumerate(north_east_south_west_index):
+            for b in range(j-2, j+3):
+                for a in range(i-2, i+3):
+                    stencils[k, b, a] = self._SOAR_Q_CPU(a, b, i, j)
+        return stencils
+    
+    
+    def applyKalmanGain_batched_CPU(self, noise, H, f, beta, g,
+                                    all_observed_drifter_positions, innovations):
+        """
+        Vectorized version of applyKalmanGain_CPU(..., returnKalmanGainTerm=True) for all 
+        particles at once.
+        Creating Kalman gain type fields, K = QH^T S d, for all particles.
+        
+        innovations has shape [numParticles, numDrifters, 2].
+        Returns K_eta, K_hu, K_hv [numParticles, ny, nx] and phi [numParticles].
+        """
+        innovations = np.asarray(innovations, dtype=np.float64)
+        numParticles, numDrifters = innovations.shape[0], innovations.shape[1]
+        
+        # 1) Solve linear problems e = S d and find phi = d^T S d
+        e = np.einsum('ij,pdj->pdi', np.asarray(self.S_host, dtype=np.float64), innovations)
+        phi = np.sum(innovations*e, axis=(1, 2))
+        
+        # 2.1) U_GB^T H^T e, giving the [north, east, south, west] values
+        local_huhv = np.zeros((numParticles, numDrifters, 4))
+        local_huhv[:, :, 0] = -e[:, :, 0]*self.geoBalanceConst/self.dy # north
+        local_huhv[:, :, 2] =  e[:, :, 0]*self.geoBalanceConst/self.dy # south
+        local_huhv[:, :, 1] =  e[:, :, 1]*self.geoBalanceConst/self.dx # east
+        local_huhv[:, :, 3] = -e[:, :, 1]*self.geoBalanceConst/self.dx # west
+        
+        # 2.1.3) Q^{1/2}
+        local_eta = np.einsum('pdk,kji->pdji', local_huhv, self._kalmanGainStencils_CPU())
+        
+        # 2.2.1) Map local_eta to global buffers, one for each particle and drifter
+        K_eta_tmp = np.zeros((numParticles, numDrifters, self.ny, self.nx))
+        cell_id_x, cell_id_y = self._drifterCellIds_CPU(all_observed_drifter_positions)
+        for drifter in range(numDrifters):
+            global_j = (cell_id_y[drifter] - 3 + np.arange(7)) % self.ny
+            global_i = (cell_id_x[drifter] - 3 + np.arange(7)) % self.nx
+            np.add.at(K_eta_tmp, 
+                      (slice(None), drifter, global_j[:, np.newaxis], global_i[np.newaxis, :]),
+                      local_eta[:, drifter])
+        
+        # 2.2.3) Apply soar + geo-balance, and sum the contributions from all drifters
+        K_eta, K_hu, K_hv = noise._obtainOceanPerturbations_batched_CPU(K_eta_tmp, H, f, beta, g)
+        K_eta = np.sum(K_eta[:, :, 2:-2, 2:-2], axis=1)
+        K_hu  = np.sum(K_hu, axis=1)
+        K_hv  = np.sum(K_hv, axis=1)
+        
+        return K_eta, K_hu, K_hv, phi
+    
+    
+    def solveImplicitEquation_batched(self, gamma, c_star):
+        """
+        Vectorized version of solveImplicitEquation, solving the scalar implicit 
+        equation for all particles using the Lambert W function (k=0 branch).
+        Returns alpha for all particles.
+        """
+        gamma = np.asarray(gamma, dtype=np.float64)
+        c_star = np.asarray(c_star, dtype=np.float64)
+        
+        lambert_arg = -(gamma/self.Nx)*np.exp(-gamma/self.Nx)*np.exp(-c_star/self.Nx)
+        alpha_scale = -(self.Nx/gamma)
+        alpha = alpha_scale*np.real(special.lambertw(lambert_arg, k=0))
+        
+        self.log("alpha (batched): " + str(alpha))
+        return alpha
+    
+    
+    def _expand_to_periodic_boundaries_batched(self, interior, ghostcells):
+        """
+        Vectorized version of _expand_to_periodic_boundaries for buffers of shape [..., ny, nx].
+        """
+        if ghostcells == 0:
+            return interior
+        pad_width = [(0, 0)]*(interior.ndim - 2) + [(ghostcells, ghostcells)]*2
+        return np.pad(interior, pad_width, mode='wrap')
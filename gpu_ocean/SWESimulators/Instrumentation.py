@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements an opt-in instrumentation registry, which
+records call counts, wall time and bytes moved for kernel launches,
+host-device transfers and file I/O. The records can be reported per
+simulator, per ensemble and per MPI rank.
+
+Instrumentation is disabled by default, in which case an instrumented
+function only costs one extra function call and a check of a module
+variable. Usage:
+
+    from SWESimulators import Instrumentation
+    Instrumentation.enable()
+    ... run simulations ...
+    print(Instrumentation.summary(group_by=['ensemble', 'category', 'name']))
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import itertools
+import time
+
+import numpy as np
+
+
+# Categories of instrumented operations
+KERNEL = 'kernel'
+TRANSFER = 'transfer'
+FILE_IO = 'file_io'
+
+# The fields records can be grouped by in report()
+GROUP_FIELDS = ['rank', 'ensemble', 'simulator', 'category', 'name']
+
+# Module state.
+# Kept as module variables so that the check in disabled mode is as cheap as possible.
+enabled = False
+synchronize_calls = False
+rank = 0
+
+# (rank, owner label, category, name) -> [calls, wall time, bytes]
+_records = {}
+
+# owner label -> ensemble name
+_ensembles = {}
+
+# Counter for generating unique owner labels
+_label_counter = itertools.count()
+
+
+def enable(synchronize=False):
+    """
+    Enables the instrumentation.
+    If synchronize is True, the GPU stream of the owner is synchronized after each
+    instrumented call, so that the wall time includes the execution time of
+    asynchronous kernels (at the cost of serializing the execution).
+    """
+    global enabled, synchronize_calls
+    enabled = True
+    synchronize_calls = synchronize
+
+def disable():
+    global enabled
+    enabled = False
+
+def is_enabled():
+    return enabled
+
+def reset():
+    """
+    Removes all records (but keeps owner labels and ensemble assignments).
+    """
+    _records.clear()
+
+def set_rank(new_rank):
+    """
+    Sets the MPI rank that new records are registered under.
+    """
+    global rank
+    rank = int(new_rank)
+
+
+
+###---------------------------
+### Owners
+###---------------------------
+
+def label(owner):
+    """
+    Returns the label used for records from the given object, and creates a
+    unique label (class name and a counter) if the object does not have one.
+    """
+    owner_label = getattr(owner, 'instrumentation_label', None)
+    if owner_label is None:
+        owner_label = owner.__class__.__name__ + "_" + str(next(_label_counter))
+        try:
+            owner.instrumentation_label = owner_label
+        except AttributeError:
+            pass
+    return owner_label
+
+def attach(child, parent):
+    """
+    Makes records from child (e.g., the boundary condition object of a simulator)
+    count as records from parent.
+    """
+    child.instrumentation_label = label(parent)
+
+def assign_ensemble(owners, ensemble_name):
+    """
+    Assigns a list of owners (typically the particles of an ensemble) to an ensemble.
+    """
+    for owner in owners:
+        if owner is not None:
+            _ensembles[label(owner)] = str(ensemble_name)
+
+
+
+###---------------------------
+### Recording
+###---------------------------
+
+def record(category, name, owner_label, elapsed, nbytes=0, calls=1):
+    """
+    Adds a record to the registry.
+    Normally called through the instrument decorator.
+    """
+    key = (rank, owner_label, category, name)
+    entry = _records.get(key)
+    if entry is None:
+        _records[key] = [calls, elapsed, nbytes]
+    else:
+        entry[0] += calls
+        entry[1] += elapsed
+        entry[2] += nbytes
+
+def nbytes_of(data):
+    """
+    Counts the number of bytes in a numpy array, or in a (nested) list or tuple
+    of numpy arrays. Other objects count as zero bytes.
+    """
+    if isinstance(data, np.ndarray):
+        return int(data.nbytes)
+    if isinstance(data, (list, tuple)):
+        return sum(nbytes_of(element) for element in data)
+    return 0
+
+def _synchronize(owner):
+    gpu_stream = getattr(owner, 'gpu_stream', None)
+    if gpu_stream is not None:
+        gpu_stream.synchronize()
+
+def instrument(category, name=None, owner=None, nbytes=None):
+    """
+    Decorator for instrumenting a method.
+
+    category: One of KERNEL, TRANSFER or FILE_IO
+    name: Name of the record (defaults to the name of the method)
+    owner: Function (self, *args, **kwargs) -> object that the record belongs to.
+        Defaults to self.
+    nbytes: Function (self, result, *args, **kwargs) -> number of bytes moved.
+    """
+    def decorator(function):
+        record_name = function.__name__ if name is None else name
+
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            if not enabled:
+                return function(self, *args, **kwargs)
+
+            owner_object = self if owner is None else owner(self, *args, **kwargs)
+            tic = time.perf_counter()
+            result = function(self, *args, **kwargs)
+            if synchronize_calls:
+                _synchronize(owner_object)
+            elapsed = time.perf_counter() - tic
+
+            bytes_moved = 0 if nbytes is None else nbytes(self, result, *args, **kwargs)
+            record(category, record_name, label(owner_object), elapsed, bytes_moved)
+            return result
+        return wrapper
+    return decorator
+
+
+
+###---------------------------
+### Reporting
+###---------------------------
+
+def records():
+    """
+    Returns all records as a list of dicts with the keys
+    rank, ensemble, simulator, category, name, calls, time and bytes.
+    """
+    rows = []
+    for (record_rank, owner_label, category, name), (calls, elapsed, nbytes) in _records.items():
+        rows.append({'rank': record_rank,
+                     'ensemble': _ensembles.get(owner_label, None),
+                     'simulator': owner_label,
+                     'category': category,
+                     'name': name,
+                     'calls': calls,
+                     'time': elapsed,
+                     'bytes': nbytes})
+    return rows
+
+def report(group_by=GROUP_FIELDS, rows=None):
+    """
+    Aggregates records over all fields not in group_by.
+    E.g., group_by=['rank'] gives the totals per rank, and
+    group_by=['ensemble', 'category'] gives kernel, transfer and file I/O totals
+    for each ensemble.
+
+    rows: Records to aggregate (defaults to records()), e.g., from gather().
+
+    Returns a list of dicts sorted by descending time.
+    """
+    for field in group_by:
+        assert(field in GROUP_FIELDS), 'Can not group records by ' + str(field)
+    if rows is None:
+        rows = records()
+
+    totals = {}
+    for row in rows:
+        key = tuple(row[field] for field in group_by)
+        total = totals.setdefault(key, [0, 0.0, 0])
+        total[0] += row['calls']
+        total[1] += row['time']
+        total[2] += row['bytes']
+
+    result = []
+    for key, (calls, elapsed, nbytes) in totals.items():
+        entry = dict(zip(group_by, key))
+        entry.update({'calls': calls, 'time': elapsed, 'bytes': nbytes})
+        result.append(entry)
+    result.sort(key=lambda entry: entry['time'], reverse=True)
+    return result
+
+def summary(group_by=GROUP_FIELDS, rows=None):
+    """
+    Returns the report as a human readable table.
+    """
+    lines = []
+    header = "".join("{:<24s}".format(field) for field in group_by)
+    lines.append(header + "{:>10s} {:>12s} {:>14s}".format("calls", "time [s]", "MB"))
+    for entry in report(group_by, rows):
+        line = "".join("{:<24s}".format(str(entry[field])) for field in group_by)
+        lines.append(line + "{:>10d} {:>12.6f} {:>14.3f}".format(entry['calls'], entry['time'],
+                                                                 entry['bytes']/(1024.0*1024.0)))
+    return "\n".join(lines)
+
+def gather(comm, root=0):
+    """
+    Gathers the records from all MPI ranks in comm.
+    Returns the records from all ranks on the root rank, and None elsewhere.
+    """
+    all_rows = comm.gather(records(), root=root)
+    if all_rows is None:
+        return None
+    return [row for rank_rows in all_rows for row in rank_rows]
@@ -35,6 +35,7 @@ import gc
 from SWESimulators import Common, SimWriter, SimReader
 from SWESimulators import Simulator
 from SWESimulators import WindStress
+from SWESimulators import Instrumentation
 
 class KP07(Simulator.Simulator):
     """
@@ -190,6 +191,7 @@ class KP07(Simulator.Simulator):
                                                            ghost_cells_x, \
                                                            ghost_cells_y, \
                                                            self.boundary_conditions)
+        Instrumentation.attach(self.bc_kernel, self)
         
         if self.write_netcdf:
             self.sim_writer = SimWriter.SimNetCDFWriter(self, ignore_ghostcells=self.ignore_ghostcells, \
@@ -292,74 +294,23 @@ class KP07(Simulator.Simulator):
                 break
         
             if (self.use_rk2):
-                self.swe_2D.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
-                        self.nx, self.ny, \
-                        self.dx, self.dy, local_dt, \
-                        self.g, \
-                        self.theta, \
-                        self.f, \
-                        self.coriolis_beta, \
-                        self.y_zero_reference_cell, \
-                        self.r, \
-                        np.int32(0), \
-                        self.gpu_data.h0.data.gpudata,  self.gpu_data.h0.pitch,  \
-                        self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch, \
-                        self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch, \
-                        self.gpu_data.h1.data.gpudata,  self.gpu_data.h1.pitch,  \
-                        self.gpu_data.hu1.data.gpudata, self.gpu_data.hu1.pitch, \
-                        self.gpu_data.hv1.data.gpudata, self.gpu_data.hv1.pitch, \
-                        self.bathymetry.Bi.data.gpudata, self.bathymetry.Bi.pitch, \
-                        self.bathymetry.Bm.data.gpudata, self.bathymetry.Bm.pitch, \
-                        self.boundary_conditions.north, self.boundary_conditions.east, self.boundary_conditions.south, self.boundary_conditions.west, \
-                        wind_stress_t)
+                self.callKernel(self.gpu_data.h0, self.gpu_data.hu0, self.gpu_data.hv0, \
+                                self.gpu_data.h1, self.gpu_data.hu1, self.gpu_data.hv1, \
+                                local_dt, wind_stress_t, 0)
                 
                 self.bc_kernel.boundaryCondition(self.gpu_stream, \
                         self.gpu_data.h1, self.gpu_data.hu1, self.gpu_data.hv1)
                 
-                self.swe_2D.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
-                        self.nx, self.ny, \
-                        self.dx, self.dy, local_dt, \
-                        self.g, \
-                        self.theta, \
-                        self.f, \
-                        self.coriolis_beta, \
-                        self.y_zero_reference_cell, \
-                        self.r, \
-                        np.int32(1), \
-                        self.gpu_data.h1.data.gpudata,  self.gpu_data.h1.pitch,  \
-                        self.gpu_data.hu1.data.gpudata, self.gpu_data.hu1.pitch, \
-                        self.gpu_data.hv1.data.gpudata, self.gpu_data.hv1.pitch, \
-                        self.gpu_data.h0.data.gpudata,  self.gpu_data.h0.pitch,  \
-                        self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch, \
-                        self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch, \
-                        self.bathymetry.Bi.data.gpudata, self.bathymetry.Bi.pitch, \
-                        self.bathymetry.Bm.data.gpudata, self.bathymetry.Bm.pitch, \
-                        self.boundary_conditions.north, self.boundary_conditions.east, self.boundary_conditions.south, self.boundary_conditions.west, \
-                        wind_stress_t)
+                self.callKernel(self.gpu_data.h1, self.gpu_data.hu1, self.gpu_data.hv1, \
+                                self.gpu_data.h0, self.gpu_data.hu0, self.gpu_data.hv0, \
+                                local_dt, wind_stress_t, 1)
                 
                 self.bc_kernel.boundaryCondition(self.gpu_stream, \
                         self.gpu_data.h0, self.gpu_data.hu0, self.gpu_data.hv0) 
             else:
-                self.swe_2D.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
-                        self.nx, self.ny, \
-                        self.dx, self.dy, local_dt, \
-                        self.g, \
-                        self.theta, \
-                        self.f, \
-                        self.coriolis_beta, \
-                        self.y_zero_reference_cell, \
-                        self.r, \
-                        np.int32(0), \
-                        self.gpu_data.h0.data.gpudata,  self.gpu_data.h0.pitch,  \
-                        self.gpu_data.hu0.data.gpudata, self.gpu_data.hu0.pitch, \
-                        self.gpu_data.hv0.data.gpudata, self.gpu_data.hv0.pitch, \
-                        self.gpu_data.h1.data.gpudata,  self.gpu_data.h1.pitch,  \
-                        self.gpu_data.hu1.data.gpudata, self.gpu_data.hu1.pitch, \
-                        self.gpu_data.hv1.data.gpudata, self.gpu_data.hv1.pitch, \
-                        self.bathymetry.Bi.data.gpudata, self.bathymetry.Bi.pitch, \
-                        self.bathymetry.Bm.data.gpudata, self.bathymetry.Bm.pitch, \
-                        self.boundary_conditions.north, self.boundary_conditions.east, self.boundary_conditions.south, self.boundary_conditions.west, \
-                        wind_stress_t)
+                self.callKernel(self.gpu_data.h0, self.gpu_data.hu0, self.gpu_data.hv0, \
+                                self.gpu_data.h1, self.gpu_data.hu1, self.gpu_data.hv1, \
+                                local_dt, wind_stress_t, 0)
                 self.gpu_data.swap()
                 self.bc_kernel.boundaryCondition(self.gpu_stream, \
                         self.gpu_data.h0, self.gpu_data.hu0, self.gpu_data.hv0)
@@ -371,6 +322,32 @@ class KP07(Simulator.Simulator):
             self.sim_writer.writeTimestep(self)
             
         return self.t
+
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def callKernel(self, \
+                   h_in, hu_in, hv_in, \
+                   h_out, hu_out, hv_out, \
+                   local_dt, wind_stress_t, rk_step):
+        self.swe_2D.prepared_async_call(self.global_size, self.local_size, self.gpu_stream, \
+                self.nx, self.ny, \
+                self.dx, self.dy, local_dt, \
+                self.g, \
+                self.theta, \
+                self.f, \
+                self.coriolis_beta, \
+                self.y_zero_reference_cell, \
+                self.r, \
+                np.int32(rk_step), \
+                h_in.data.gpudata,  h_in.pitch,  \
+                hu_in.data.gpudata, hu_in.pitch, \
+                hv_in.data.gpudata, hv_in.pitch, \
+                h_out.data.gpudata,  h_out.pitch,  \
+                hu_out.data.gpudata, hu_out.pitch, \
+                hv_out.data.gpudata, hv_out.pitch, \
+                self.bathymetry.Bi.data.gpudata, self.bathymetry.Bi.pitch, \
+                self.bathymetry.Bm.data.gpudata, self.bathymetry.Bm.pitch, \
+                self.boundary_conditions.north, self.boundary_conditions.east, self.boundary_conditions.south, self.boundary_conditions.west, \
+                wind_stress_t)
     
     
     
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements lazy imports of heavy and GPU specific
+dependencies (pycuda, matplotlib, pandas, netCDF4, scipy, ...), so that
+they are only loaded when the feature that needs them is used.
+
+Importing these packages at start-up is costly, in particular for many MPI
+ranks importing from a shared file system, and pycuda is not available at
+all on CPU-only nodes.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import importlib
+import sys
+
+
+class LazyModule(object):
+    """
+    Stand-in for a module which is imported on first attribute access, e.g.,
+        cuda = LazyImport.lazyImport('pycuda.driver')
+        ...
+        cuda.Event() # pycuda.driver is imported here
+    If the module is missing, the ImportError is raised on first use.
+    """
+    def __init__(self, name):
+        self.__dict__['_lazy_name'] = name
+        self.__dict__['_lazy_module'] = None
+
+    def _load(self):
+        if self._lazy_module is None:
+            self.__dict__['_lazy_module'] = importlib.import_module(self._lazy_name)
+        return self._lazy_module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        if self._lazy_module is None:
+            return "<lazy module '" + self._lazy_name + "' (not loaded)>"
+        return repr(self._lazy_module)
+
+
+def lazyImport(name):
+    """
+    Returns the module if it is already imported, and otherwise a LazyModule
+    which imports it on first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def isLoaded(module):
+    """
+    True if the (possibly lazy) module has been imported
+    """
+    if isinstance(module, LazyModule):
+        return module._lazy_module is not None
+    return True
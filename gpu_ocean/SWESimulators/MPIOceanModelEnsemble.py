@@ -32,6 +32,7 @@ import json
 
 from SWESimulators import OceanModelEnsemble, Common, Observation, OceanStateNoise
 from SWESimulators import DataAssimilationUtils as dautils
+from SWESimulators import Instrumentation
 
 
 class MPIOceanModelEnsemble:
@@ -48,10 +49,12 @@ class MPIOceanModelEnsemble:
                  observation_file, observation_type=dautils.ObservationType.UnderlyingFlow,
                  local_ensemble_size=None, 
                  sim_args={}, data_args={},
-                 ensemble_args={}, metadata={}):
+                 ensemble_args={}, metadata={},
+                 resampling_method='residual'):
         """
         Initialize the ensemble. Only rank 0 should receive the optional arguments.
         The constructor handles initialization across nodes
+        resampling_method: Name of the resampling scheme in DataAssimilationUtils.RESAMPLERS
         """
         self.logger = logging.getLogger(__name__ + "_rank=" + str(comm.rank))
         self.logger.debug("Initializing")
@@ -64,6 +67,7 @@ class MPIOceanModelEnsemble:
         #Broadcast general information about ensemble
         ##########################
         self.comm = comm
+        Instrumentation.set_rank(self.comm.rank)
         self.num_nodes = self.comm.size
         assert self.comm.size >= 1, "You appear to not be using enough MPI nodes (at least one required)"
         
@@ -125,6 +129,9 @@ class MPIOceanModelEnsemble:
         ##############################
         ensemble_args = self.comm.bcast(ensemble_args, root=0)
         
+        self.resampling_method = self.comm.bcast(resampling_method, root=0)
+        assert(self.resampling_method in dautils.RESAMPLERS), "Unknown resampling method " + str(self.resampling_method)
+        
         
         #Create ensemble on local node
         ##############################
@@ -347,37 +354,15 @@ class MPIOceanModelEnsemble:
         Generate list of indices to resample, e.g., 
         [0 0 0 1 1 5 6 6 7]
         will resample 0 three times, 1 two times, 5 once, 6 two times, and 7 one time. 
-
-
-
-        Residual resampling of particles based on the attached observation.
-        Each particle is first resampled floor(N*w) times, which in total given M <= N particles. Afterwards, N-M particles are drawn from the discrete distribution given by weights N*w % 1.
-
-        ensemble: The ensemble to be resampled, holding the ensemble particles, the observation, and measures to compute the weight of particles based on this information.
-        reinitialization_variance: The variance used for resampling of particles that are already resampled. These duplicates are sampled around the original particle.
-        If reinitialization_variance is zero, exact duplications are generated.
-
-        Implementation based on the description in van Leeuwen (2009) 'Particle Filtering in Geophysical Systems', Section 3a.2)
+        
+        The indices are computed on rank 0 using the resampling scheme given by 
+        self.resampling_method (residual resampling by default), see 
+        DataAssimilationUtils.getResamplingIndices.
         """
 
         resampling_indices = None
         if (self.comm.rank == 0):
-            num_particles = self.num_nodes * self.local_ensemble_size
-            # Create array of possible indices to resample:
-            allIndices = np.arange(num_particles)
-
-            # Deterministic resampling based on the integer part of N*weights:
-            weightsTimesN = global_gaussian_weights*num_particles
-            weightsTimesNInteger = np.int64(np.floor(weightsTimesN))
-            deterministic = np.repeat(allIndices, weightsTimesNInteger)
-            
-            # Stochastic resampling based on the decimal parts of N*weights:
-            decimalWeights = np.mod(weightsTimesN, 1)
-            decimalWeights = decimalWeights/np.sum(decimalWeights)
-
-            stochastic = np.random.choice(allIndices, num_particles - len(deterministic), p=decimalWeights)
-
-            resampling_indices = np.sort(np.concatenate((deterministic, stochastic)))
+            resampling_indices = np.sort(dautils.getResamplingIndices(global_gaussian_weights, self.resampling_method))
             
         return resampling_indices
     
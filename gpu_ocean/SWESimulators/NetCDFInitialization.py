@@ -27,11 +27,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
 import datetime, os, copy
-from netCDF4 import Dataset
-import pyproj
-from scipy.ndimage.morphology import binary_erosion, grey_dilation
 
-from SWESimulators import Common, WindStress, OceanographicUtilities
+from SWESimulators import Common, WindStress, OceanographicUtilities, LazyImport
+netCDF4 = LazyImport.lazyImport('netCDF4')
+pyproj = LazyImport.lazyImport('pyproj')
+ndimage = LazyImport.lazyImport('scipy.ndimage')
 
 
 def getBoundaryConditionsData(source_url_list, timestep_indices, timesteps, x0, x1, y0, y1, norkyst_data):
@@ -72,7 +72,7 @@ def getBoundaryConditionsData(source_url_list, timestep_indices, timesteps, x0,
     bc_index = 0
     for i in range(num_files):
         try:
-            ncfile = Dataset(source_url_list[i])
+            ncfile = netCDF4.Dataset(source_url_list[i])
 
             H = ncfile.variables['h'][y0-1:y1+1, x0-1:x1+1]
             
@@ -157,7 +157,7 @@ def getWindSourceterm(source_url_list, timestep_indices, timesteps, x0, x1, y0,
     
     for i in range(num_files):
         try:
-            ncfile = Dataset(source_url_list[i])
+            ncfile = netCDF4.Dataset(source_url_list[i])
             u_wind_list[i] = ncfile.variables['Uwind'][timestep_indices[i], y0:y1, x0:x1]
             v_wind_list[i] = ncfile.variables['Vwind'][timestep_indices[i], y0:y1, x0:x1]
         except Exception as e:
@@ -311,7 +311,7 @@ def getInitialConditions(source_url_list, x0, x1, y0, y1, \
     source_url = source_url_list[0]
     if norkyst_data:
         try:
-            ncfile = Dataset(source_url)
+            ncfile = netCDF4.Dataset(source_url)
             H_m = ncfile.variables['h'][y0-1:y1+1, x0-1:x1+1]
             eta0 = ncfile.variables['zeta'][0, y0-1:y1+1, x0-1:x1+1]
             u0 = ncfile.variables['ubar'][0, y0:y1, x0:x1]
@@ -331,7 +331,7 @@ def getInitialConditions(source_url_list, x0, x1, y0, y1, \
         time_str = 'time'
     else:
         try:
-            ncfile = Dataset(source_url)
+            ncfile = netCDF4.Dataset(source_url)
             H_m = ncfile.variables['h'][y0-1:y1+1, x0-1:x1+1]
             eta0 = ncfile.variables['zeta'][0, y0-1:y1+1, x0-1:x1+1]
             u0 = ncfile.variables['ubar'][0, y0:y1, x0:x1+1]
@@ -377,7 +377,7 @@ def getInitialConditions(source_url_list, x0, x1, y0, y1, \
         
     for i in range(num_files):
         try:
-            ncfile = Dataset(source_url_list[i])
+            ncfile = netCDF4.Dataset(source_url_list[i])
             if (timestep_indices[i] is not None):
                 timesteps[i] = ncfile.variables[time_str][timestep_indices[i][:]]
             else:
@@ -402,9 +402,9 @@ def getInitialConditions(source_url_list, x0, x1, y0, y1, \
     H_m_mask = eta0.mask.copy()
     H_m = np.ma.array(H_m, mask=H_m_mask)
     for i in range(erode_land):
-        new_water = H_m.mask ^ binary_erosion(H_m.mask)
+        new_water = H_m.mask ^ ndimage.binary_erosion(H_m.mask)
         eps = 1.0e-5 #Make new Hm slighlyt different from land_value
-        eta0_dil = grey_dilation(eta0.filled(0.0), size=(3,3))
+        eta0_dil = ndimage.grey_dilation(eta0.filled(0.0), size=(3,3))
         H_m[new_water] = land_value+eps
         eta0[new_water] = eta0_dil[new_water]
         
@@ -495,7 +495,7 @@ def getWind(source_url_list, timestep_indices, timesteps, x0, x1, y0, y1):
     
     for i in range(num_files):
         try:
-            ncfile = Dataset(source_url_list[i])
+            ncfile = netCDF4.Dataset(source_url_list[i])
             u_wind_list[i] = ncfile.variables['Uwind'][timestep_indices[i], y0:y1, x0:x1]
             v_wind_list[i] = ncfile.variables['Vwind'][timestep_indices[i], y0:y1, x0:x1]
         except Exception as e:
@@ -24,13 +24,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import numpy as np
-import pandas as pd
 
 
-from SWESimulators import CDKLM16
-from SWESimulators import GPUDrifterCollection
 from SWESimulators import DataAssimilationUtils as dautils
-
+from SWESimulators import LazyImport
+pd = LazyImport.lazyImport('pandas')
 
 
 
@@ -157,15 +155,12 @@ class Observation:
             eta, hu, hv = sim.download(interior_domain_only=True)
             H = sim.downloadBathymetry()[1][2:-2, 2:-2] # H in cell centers
             
-            for i in range(len(buoy_observations)):
-                # buoy index
-                x = self.buoy_indices[i, 0]
-                y = self.buoy_indices[i, 1]
-                
-                # Observe current, and we know the depth, but not eta
-                eta_ignorance_factor = H[y, x] / (H[y, x] + eta[y, x])
-                buoy_observations[i, 0] = hu[y, x] * eta_ignorance_factor
-                buoy_observations[i, 1] = hv[y, x] * eta_ignorance_factor
+            # Observe current, and we know the depth, but not eta
+            x = self.buoy_indices[:, 0]
+            y = self.buoy_indices[:, 1]
+            eta_ignorance_factor = H[y, x] / (H[y, x] + eta[y, x])
+            buoy_observations[:, 0] = hu[y, x] * eta_ignorance_factor
+            buoy_observations[:, 1] = hv[y, x] * eta_ignorance_factor
             
             buoy_obs_errors = np.random.normal(size=buoy_observations.shape)
             
@@ -236,7 +231,7 @@ class Observation:
         self.buoy_positions[:,0] = (self.buoy_positions[:, 0] + 0.5)*dx
         self.buoy_positions[:,1] = (self.buoy_positions[:, 1] + 0.5)*dy
         
-        self.read_buoy = [True]*self.buoy_indices.shape[0]
+        self.read_buoy = np.ones(self.buoy_indices.shape[0], dtype=bool)
         
         self.register_buoys = True
         
@@ -248,42 +243,35 @@ class Observation:
         (12 x 20) = 240 buoys are defined equally spaced throughout the domain.
         This cover slightly more than 0.1% of the state space.
         """
-        buoy_indices = []
-        y = 0
+        y0 = 0
         x0 = 0
         if avoid_boundary:
-            y = int(frequency_y/2)
+            y0 = int(frequency_y/2)
             x0 = int(frequency_x/2)
-        while y < self.ny:
-            x = x0
-            while x < self.nx:
-                if self.land_mask is None:
-                    buoy_indices.append([x, y])
-                if not self.land_mask[y, x]:
-                    buoy_indices.append([x, y])
-                x = x + frequency_x
-            y = y + frequency_y
-        self.setBuoyCells(np.array(buoy_indices, dtype=np.int32))
+        
+        # Buoys ordered row by row, i.e., with x running fastest
+        y, x = np.meshgrid(np.arange(y0, self.ny, frequency_y), np.arange(x0, self.nx, frequency_x), indexing='ij')
+        buoy_indices = np.stack((x.ravel(), y.ravel()), axis=1).astype(np.int32)
+        if self.land_mask is not None:
+            buoy_indices = buoy_indices[~np.asarray(self.land_mask, dtype=bool)[buoy_indices[:, 1], buoy_indices[:, 0]]]
+        self.setBuoyCells(buoy_indices)
     
     def setBuoyReadingArea(self, area='all'):
         if self.observation_type == dautils.ObservationType.StaticBuoys:
             if area == "south":
-                for i in range(len(self.buoy_indices)):
-                    self.read_buoy[i] = self.buoy_indices[i,1] < self.ny/2
+                self.read_buoy = self.buoy_indices[:, 1] < self.ny/2
             elif area == "west":
-                for i in range(len(self.buoy_indices)):
-                    self.read_buoy[i] = self.buoy_indices[i,0] < self.nx/2
+                self.read_buoy = self.buoy_indices[:, 0] < self.nx/2
             elif area == 'all':
-                self.read_buoy = [True]*self.buoy_indices.shape[0]
+                self.read_buoy = np.ones(self.buoy_indices.shape[0], dtype=bool)
             else:
                 assert(area == 'all'), 'Invalid area. Must be all, south or west'
                 
     def setBuoySet(self, buoySet):
         assert(self.observation_type == dautils.ObservationType.StaticBuoys)
          
-        self.read_buoy = [False]*self.buoy_indices.shape[0]
-        for i in buoySet:
-            self.read_buoy[i] = True
+        self.read_buoy = np.zeros(self.buoy_indices.shape[0], dtype=bool)
+        self.read_buoy[np.asarray(buoySet, dtype=np.int64)] = True
             
             
     ############################
@@ -312,7 +300,7 @@ class Observation:
             self.buoy_indices[:,1] = np.floor(self.buoy_indices[:, 1]/dy)
             self.buoy_indices = self.buoy_indices.astype(np.int32)
         
-            self.read_buoy = [True]*self.buoy_indices.shape[0]
+            self.read_buoy = np.ones(self.buoy_indices.shape[0], dtype=bool)
         
     def _check_observation_type(self):
         """
@@ -483,13 +471,6 @@ class Observation:
         
         
         
-    def _detect_jump(self, pos0, pos1, jump_limit=100000):
-        ds = np.sqrt((pos1[0] - pos0[0])**2 + \
-                     (pos1[1] - pos0[1])**2)
-        if ds > jump_limit:
-            return True
-        return False
-
     def get_drifter_path(self, drifter_id, start_t, end_t, 
                          in_km=True, keepDomainSize=True, assume_no_boundary_trouble=False):
         """
@@ -508,7 +489,18 @@ class Observation:
                                         instaed of [..., 9.8, 9.9, 0.0, 0.1, 0.2, ...]
         - assume_no_boundary_trouble: Boolean - If this is true, we can speed up the processing.
         """
-        paths = []
+        return self.get_drifter_paths([drifter_id], start_t, end_t, in_km=in_km, keepDomainSize=keepDomainSize, 
+                                      assume_no_boundary_trouble=assume_no_boundary_trouble)[0]
+    
+    def get_drifter_paths(self, drifter_ids, start_t, end_t, 
+                          in_km=True, keepDomainSize=True, assume_no_boundary_trouble=False, jump_limit=100000):
+        """
+        Creates the lists of paths for all the given drifters in the given time interval 
+        in one go, with the same parameters and results as get_drifter_path.
+        Returns a list with the list of paths for each drifter in drifter_ids.
+        The jumps through the periodic boundary are found for all drifters at once, 
+        as steps between consecutive positions longer than jump_limit.
+        """
         # self.get_observation_times() would not include the starting time 
         # (and thereby, the starting position), so we need to extract these directly.
         observation_times = self.obs_df.time.values[::self.observationInterval].copy()
@@ -516,61 +508,64 @@ class Observation:
         start_obs_index = np.searchsorted(observation_times, start_t)
         end_obs_index   = min(np.searchsorted(observation_times, end_t)+1, len(observation_times))
         
-        total_num_observations = end_obs_index - start_obs_index
-        
-        # Filter the given drifter based from the data frame only once for efficiency
-        all_drifter_positions_df = self.obs_df[self.drifter_positions_key].values[::self.observationInterval].copy()
-        all_drifter_positions = np.stack(all_drifter_positions_df, axis=0)[:, drifter_id,:]
-        
-        path = np.zeros((total_num_observations, 2))
-        path_index = 0
-        boundary_correction = np.array([0, 0])
+        drifter_ids = np.atleast_1d(drifter_ids)
+        num_drifters = len(drifter_ids)
+        if end_obs_index <= start_obs_index:
+            return [[np.zeros((0, 2))] for d in range(num_drifters)]
         
+        # Positions of the given drifters at the observation times in the window, 
+        # as an array of shape (num_times, num_drifters, 2)
+        drifter_positions_df = self.obs_df[self.drifter_positions_key].values[::self.observationInterval][start_obs_index:end_obs_index]
+        positions = np.stack(drifter_positions_df, axis=0)[:, drifter_ids, :].astype(np.float64)
         
         if assume_no_boundary_trouble:
-            # Get the trajectory directly from all_drifter_positions
-            path[:,:] = all_drifter_positions[start_obs_index:end_obs_index, :].copy()
-            paths.append(path)
+            # Get the trajectories directly from the positions
+            paths = [[positions[:, d, :]] for d in range(num_drifters)]
         
         else:
-            # Look carefully through all_drifter_positions and fix issues at the boundary
-            for i in range(start_obs_index, end_obs_index):
-                obs_t = observation_times[i]
-                if obs_t < start_t or obs_t > end_t:
-                    continue
-                current_pos = all_drifter_positions[i, :]
-                if path_index > 0:
-                    if self._detect_jump(path[path_index-1,:], current_pos + boundary_correction):
-                        if keepDomainSize:
-                            paths.append(path[:path_index,:])
-                            
-                            path_index = 0
-                            path = np.zeros((total_num_observations, 2))
-                        else:
-                            xdiff = current_pos[0] + boundary_correction[0] - path[path_index-1, 0] 
-                            ydiff = current_pos[1] + boundary_correction[1] - path[path_index-1, 1] 
-                            
-                            if min(abs(xdiff - self.domain_size_x), abs(xdiff + self.domain_size_x)) < abs(xdiff):
-                                # The jump is in x
-                                if abs(xdiff - self.domain_size_x) < abs(xdiff + self.domain_size_x):
-                                    boundary_correction[0] -= self.domain_size_x
-                                else:
-                                    boundary_correction[0] += self.domain_size_x
-                            
-                            if min(abs(ydiff - self.domain_size_y), abs(ydiff + self.domain_size_y)) < abs(ydiff):
-                                if abs(ydiff - self.domain_size_y) < abs(ydiff + self.domain_size_y):
-                                    boundary_correction[1] -= self.domain_size_y
-                                else:
-                                    boundary_correction[1] += self.domain_size_y
-                                    
-                path[path_index,:] = current_pos + boundary_correction
+            obs_t = observation_times[start_obs_index:end_obs_index]
+            positions = positions[(obs_t >= start_t) & (obs_t <= end_t)]
+            
+            step = np.diff(positions, axis=0)
+            jumps = np.sqrt(step[:, :, 0]**2 + step[:, :, 1]**2) > jump_limit
+            
+            if keepDomainSize:
+                # Split the paths after each jump
+                paths = [np.split(positions[:, d, :], np.flatnonzero(jumps[:, d]) + 1) for d in range(num_drifters)]
                 
-                path_index += 1
-            paths.append(path[:path_index, :])
-        if in_km:
-            for p in range(len(paths)):
-                paths[p] /= 1000
+            else:
+                # Move the drifter one domain size back for each jump through the boundary
+                domain_size = np.array([self.domain_size_x, self.domain_size_y], dtype=np.float64)
+                through_boundary = np.minimum(np.abs(step - domain_size), np.abs(step + domain_size)) < np.abs(step)
+                corrections = np.where(np.abs(step - domain_size) < np.abs(step + domain_size), -domain_size, domain_size)
+                corrections = np.where(jumps[:, :, np.newaxis] & through_boundary, corrections, 0.0)
+                
+                jump_indices = np.flatnonzero(np.any(corrections != 0, axis=(1, 2)))
+                boundary_correction = np.zeros_like(positions)
+                if len(jump_indices) > 0:
+                    # get_drifter_path accumulates the corrections in an integer array, truncating 
+                    # the sum after each jump. For whole-number domain sizes, this is the integer sum 
+                    # of the corrections. Otherwise, a drifter crossing back loses the fractional 
+                    # part differently depending on the accumulated correction, so the identical 
+                    # result is only obtained by truncating after each jump. The jumps are few.
+                    corrections = corrections[jump_indices]
+                    if np.array_equal(np.trunc(domain_size), domain_size):
+                        accumulated = np.cumsum(corrections.astype(np.int64), axis=0)
+                    else:
+                        accumulated = np.trunc(corrections)
+                        for j in range(1, len(jump_indices)):
+                            accumulated[j] = np.trunc(accumulated[j-1] + corrections[j])
+                    last_jump = np.searchsorted(jump_indices + 1, np.arange(len(positions)), side='right') - 1
+                    boundary_correction[last_jump >= 0] = accumulated[last_jump[last_jump >= 0]]
                 
+                positions = positions + boundary_correction
+                paths = [[positions[:, d, :]] for d in range(num_drifters)]
         
+        if in_km:
+            for drifter_paths in paths:
+                for p in range(len(drifter_paths)):
+                    drifter_paths[p] = drifter_paths[p] / 1000
+        else:
+            paths = [[path.copy() for path in drifter_paths] for drifter_paths in paths]
         
         return paths
@@ -26,6 +26,7 @@ import numpy as np
 import logging
 
 from SWESimulators import CDKLM16, Common, GPUDrifterCollection, BaseOceanStateEnsemble, ParticleInfo, Observation
+from SWESimulators import Instrumentation, SimWriter
 
 class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
     """
@@ -36,10 +37,13 @@ class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                  observation_variance = 0.01**2, 
                  initialization_variance_factor_ocean_field = 0.0,
                  super_dir_name=None, netcdf_filename=None,
-                 rank=0):
+                 rank=0, shared_netcdf_file=False):
         """
         Constructor which creates numParticles slighly different ocean models
-        based on the same initial conditions
+        based on the same initial conditions.
+        If shared_netcdf_file is True and sim_args contains write_netcdf=True, all particles 
+        (on all MPI processes if sim_args contains comm) are written to one netCDF file after 
+        each modelStep, instead of one file per particle.
         """
         
         self.logger = logging.getLogger(__name__)
@@ -69,13 +73,30 @@ class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
         self.particles = [None] * numParticles
         self.particleInfos = [None] * numParticles
         self.drifterForecast = [None] * numParticles
+        
+        # With a shared file, the particles do not write their own files
+        shared_netcdf_file = shared_netcdf_file and self.sim_args.get('write_netcdf', False)
+        particle_sim_args = dict(self.sim_args)
+        if shared_netcdf_file:
+            particle_sim_args['write_netcdf'] = False
+        
         for i in range(numParticles):
-            self.particles[i] = CDKLM16.CDKLM16(self.gpu_ctx, **self.sim_args, **data_args, local_particle_id=i, 
+            self.particles[i] = CDKLM16.CDKLM16(self.gpu_ctx, **particle_sim_args, **data_args, local_particle_id=i, 
                                                 super_dir_name=super_dir_name, netcdf_filename=netcdf_filename)
             self.particleInfos[i] = ParticleInfo.ParticleInfo()
                     
             if self.initialization_variance_factor_ocean_field != 0.0:
                 self.particles[i].perturbState(q0_scale=self.initialization_variance_factor_ocean_field)
+        Instrumentation.assign_ensemble(self.particles, Instrumentation.label(self))
+        
+        self.ensemble_writer = None
+        if shared_netcdf_file:
+            sim = self.particles[0]
+            self.ensemble_writer = SimWriter.SimNetCDFEnsembleWriter(self.particles, super_dir_name=super_dir_name, 
+                                                                     filename=netcdf_filename, 
+                                                                     ignore_ghostcells=sim.ignore_ghostcells,
+                                                                     offset_x=sim.offset_x, offset_y=sim.offset_y,
+                                                                     comm=self.sim_args.get('comm', None))
             
     
     def attachDrifters(self, drifter_positions):
@@ -95,6 +116,9 @@ class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                 self.drifterForecast[i].add_observation_from_sim(self.particles[i])
     
     def cleanUp(self):
+        if self.ensemble_writer is not None:
+            self.ensemble_writer.__exit__(0,0,0)
+            self.ensemble_writer = None
         for oceanState in self.particles:
             if oceanState is not None:
                 oceanState.cleanUp()
@@ -105,15 +129,19 @@ class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
     def modelStep(self, sub_t, rank, update_dt=True):
         """
         Function which makes all particles step until time t.
+        If update_dt is True, the time step of each particle is updated
+        according to its dt_policy (see TimestepPolicy).
         """
         self.logger.debug("Stepping all particles (ocean models) %f in time", sub_t)
         particle = 0
         for p in self.particles:
             self.t = p.step(sub_t)
             if(update_dt):
-                p.updateDt()
+                p.dt_policy.update(p)
                 self.logger.debug("[" + str(rank) + "]: Particle " + str(particle) + " has dt " + str(p.dt))
             particle += 1
+        if self.ensemble_writer is not None:
+            self.ensemble_writer.writeTimestep()
         return self.t
     
     def updateDt(self):
@@ -121,8 +149,12 @@ class OceanModelEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
         Function that updates dt for all particles.
         """
         self.logger.debug("Updating dt on all particles (ocean models)")
+        # Request all reductions before waiting for any of them,
+        # so that the particles are reduced concurrently
+        for p in self.particles:
+            p.requestMaxDt()
         for p in self.particles:
-            p.updateDt()
+            p.dt = p.courant_number*p.readMaxDt()
     
     def dumpParticleSample(self, drifter_cells):
         for i in range(self.numParticles):
@@ -23,15 +23,15 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-import matplotlib
-from matplotlib import pyplot as plt
-import matplotlib.gridspec as gridspec
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+gridspec = LazyImport.lazyImport('matplotlib.gridspec')
 import numpy as np
 import time
 import warnings
 
 
-import pycuda.driver as cuda
+cuda = LazyImport.lazyImport('pycuda.driver')
 
 from SWESimulators import CDKLM16
 from SWESimulators import GPUDrifterCollection
@@ -39,6 +39,7 @@ from SWESimulators import WindStress
 from SWESimulators import Common
 from SWESimulators import DataAssimilationUtils as dautils
 from SWESimulators import BaseOceanStateEnsemble
+from SWESimulators import Instrumentation
 
 
 class OceanNoiseEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
@@ -266,6 +267,7 @@ class OceanNoiseEnsemble(BaseOceanStateEnsemble.BaseOceanStateEnsemble):
                                                  initialization_cov_drifters=self.initialization_cov_drifters,
                                                  domain_size_x=self.nx*self.dx, domain_size_y=self.ny*self.dy)
             self.particles[i].attachDrifters(drifters)
+        Instrumentation.assign_ensemble(self.particles, Instrumentation.label(self))
           
         # Initialize and attach drifters to all particles.
         #self._initialize_drifters(driftersPerOceanModel)
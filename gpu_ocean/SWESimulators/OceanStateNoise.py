@@ -24,16 +24,18 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-from matplotlib import pyplot as plt
+from SWESimulators import LazyImport
+plt = LazyImport.lazyImport('matplotlib.pyplot')
 import numpy as np
 
-import pycuda.driver as cuda
-from pycuda.curandom import XORWOWRandomNumberGenerator
+cuda = LazyImport.lazyImport('pycuda.driver')
+curandom = LazyImport.lazyImport('pycuda.curandom')
 
 import gc
 
 from SWESimulators import Common
 from SWESimulators import config
+from SWESimulators import Instrumentation
 from SWESimulators import FBL, CTCS
 
 class OceanStateNoise(object):
@@ -52,7 +54,8 @@ class OceanStateNoise(object):
                  use_lcg=False,
                  angle=np.array([[0]], dtype=np.float32),
                  coriolis_f=np.array([[0]], dtype=np.float32),
-                 block_width=16, block_height=16):
+                 block_width=16, block_height=16,
+                 backend=None):
         """
         Initiates a class that generates small scale geostrophically balanced perturbations of
         the ocean state.
@@ -66,6 +69,9 @@ class OceanStateNoise(object):
         use_lcg: LCG is a linear algorithm for generating a serie of pseudo-random numbers
         angle: Angle of rotation from North to y-axis as a texture (cuda.Array) or numpy array
         (block_width, block_height): The size of each GPU block
+        backend: Array backend (see Common.Array2D). With backend='host', the random numbers and
+            perturbations are computed with numpy on the host, and no GPU is needed. The host backend
+            requires interpolation_factor = 1, a constant Coriolis parameter and zero angle.
         """
 
         self.use_lcg = use_lcg
@@ -78,17 +84,19 @@ class OceanStateNoise(object):
         self.rng = None
         self.seed = None
         self.host_seed = None
+        self.active_tiles = None # Blocks with wet cells, see setActiveTiles
         
         self.gpu_ctx = gpu_ctx
         self.gpu_stream = gpu_stream
+        self.backend = Common.getArrayBackend(backend)
         
         self.nx = np.int32(nx)
         self.ny = np.int32(ny)
         self.dx = np.float32(dx)
         self.dy = np.float32(dy)
-        self.staggered = np.int(0)
+        self.staggered = int(0)
         if staggered:
-            self.staggered = np.int(1)
+            self.staggered = int(1)
             
         # The cutoff parameter is hard-coded.
         # The size of the cutoff determines the computational radius in the
@@ -102,6 +110,9 @@ class OceanStateNoise(object):
         assert (nx % interpolation_factor == 0), 'nx must be divisible by the interpolation factor'
         assert (ny % interpolation_factor == 0), 'ny must be divisible by the interpolation factor'
         self.interpolation_factor = np.int32(interpolation_factor)
+        if self.backend == 'host':
+            assert(interpolation_factor == 1), 'The host backend requires interpolation_factor = 1'
+            assert(np.all(np.asarray(angle) == 0)), 'The host backend requires zero angle'
         
         # The size of the coarse grid 
         self.coarse_nx = np.int32(nx/self.interpolation_factor)
@@ -137,9 +148,10 @@ class OceanStateNoise(object):
             self.host_seed = self.host_seed.astype(np.uint64, order='C')
         
         if not self.use_lcg:
-            self.rng = XORWOWRandomNumberGenerator()
+            if self.backend != 'host':
+                self.rng = curandom.XORWOWRandomNumberGenerator()
         else:
-            self.seed = Common.CUDAArray2D(gpu_stream, self.seed_nx, self.seed_ny, 0, 0, self.host_seed, double_precision=True, integers=True)
+            self.seed = Common.Array2D(self.backend, gpu_stream, self.seed_nx, self.seed_ny, 0, 0, self.host_seed, double_precision=True, integers=True)
         
         # Constants for the SOAR function:
         self.soar_q0 = np.float32(self.dx/100000)
@@ -152,23 +164,39 @@ class OceanStateNoise(object):
         
         # Allocate memory for random numbers (xi)
         self.random_numbers_host = np.zeros((self.rand_ny, self.rand_nx), dtype=np.float32, order='C')
-        self.random_numbers = Common.CUDAArray2D(self.gpu_stream, self.rand_nx, self.rand_ny, 0, 0, self.random_numbers_host)
+        self.random_numbers = Common.Array2D(self.backend, self.gpu_stream, self.rand_nx, self.rand_ny, 0, 0, self.random_numbers_host)
         
         # Allocate a second buffer for random numbers (nu)
         self.perpendicular_random_numbers_host = np.zeros((self.rand_ny, self.rand_nx), dtype=np.float32, order='C')
-        self.perpendicular_random_numbers = Common.CUDAArray2D(self.gpu_stream, self.rand_nx, self.rand_ny, 0, 0, self.random_numbers_host)
+        self.perpendicular_random_numbers = Common.Array2D(self.backend, self.gpu_stream, self.rand_nx, self.rand_ny, 0, 0, self.random_numbers_host)
         
         
         # Allocate memory for coarse buffer if needed
         # Two ghost cells in each direction needed for bicubic interpolation 
         self.coarse_buffer_host = np.zeros((self.coarse_ny+4, self.coarse_nx+4), dtype=np.float32, order='C')
-        self.coarse_buffer = Common.CUDAArray2D(self.gpu_stream, self.coarse_nx, self.coarse_ny, 2, 2, self.coarse_buffer_host)
+        self.coarse_buffer = Common.Array2D(self.backend, self.gpu_stream, self.coarse_nx, self.coarse_ny, 2, 2, self.coarse_buffer_host)
 
         # Allocate extra memory needed for reduction kernels.
         # Currently: A single GPU buffer with 3x1 elements: [xi^T * xi, nu^T * nu, xi^T * nu]
         self.reduction_buffer = None
         reduction_buffer_host = np.zeros((1,3), dtype=np.float32)
-        self.reduction_buffer = Common.CUDAArray2D(self.gpu_stream, 3, 1, 0, 0, reduction_buffer_host)
+        self.reduction_buffer = Common.Array2D(self.backend, self.gpu_stream, 3, 1, 0, 0, reduction_buffer_host)
+        
+        #Compute kernel launch parameters
+        self.local_size = (block_width, block_height, 1)
+        
+        self.local_size_reductions  = (128, 1, 1)
+        self.global_size_reductions = (1,   1)
+        
+        # Launch one thread for each seed, which in turns generates two iid N(0,1)
+        self.global_size_random_numbers = ( \
+                       int(np.ceil(self.seed_nx / float(self.local_size[0]))), \
+                       int(np.ceil(self.seed_ny / float(self.local_size[1]))) \
+                     ) 
+        
+        if self.backend == 'host':
+            # No kernels or textures
+            return
        
         # Generate kernels
         self.kernels = gpu_ctx.get_kernel("ocean_noise.cu", \
@@ -204,22 +232,10 @@ class OceanStateNoise(object):
         self.soarKernel.prepare("iifffffiiPiPii")
         
         self.geostrophicBalanceKernel = self.kernels.get_function("geostrophicBalance")
-        self.geostrophicBalanceKernel.prepare("iiffiiffffPiPiPiPiPif")
+        self.geostrophicBalanceKernel.prepare("iiffiiffffPiPiPiPiPifP")
         
         self.bicubicInterpolationKernel = self.kernels.get_function("bicubicInterpolation")
-        self.bicubicInterpolationKernel.prepare("iiiiffiiiiffiiffffPiPiPiPiPif")
-        
-        #Compute kernel launch parameters
-        self.local_size = (block_width, block_height, 1)
-        
-        self.local_size_reductions  = (128, 1, 1)
-        self.global_size_reductions = (1,   1)
-        
-        # Launch one thread for each seed, which in turns generates two iid N(0,1)
-        self.global_size_random_numbers = ( \
-                       int(np.ceil(self.seed_nx / float(self.local_size[0]))), \
-                       int(np.ceil(self.seed_ny / float(self.local_size[1]))) \
-                     ) 
+        self.bicubicInterpolationKernel.prepare("iiiiffiiiiffiiffffPiPiPiPiPifP")
         
         # Launch on thread for each random number (in order to create perpendicular random numbers)
         self.global_size_perpendicular = ( \
@@ -289,6 +305,8 @@ class OceanStateNoise(object):
             self.perpendicular_random_numbers.release()
         if self.reduction_buffer is not None:
             self.reduction_buffer.release()
+        if self.active_tiles is not None:
+            self.active_tiles.release()
         self.gpu_ctx = None
         gc.collect()
         
@@ -298,6 +316,16 @@ class OceanStateNoise(object):
         staggered = False
         if isinstance(sim, FBL.FBL) or isinstance(sim, CTCS.CTCS):
             staggered = True
+        if sim.gpu_ctx is None:
+            # Simulator without a GPU (CPUSimulators)
+            return cls(None, None,
+                       sim.nx, sim.ny, sim.dx, sim.dy,
+                       sim.boundary_conditions, staggered,
+                       soar_q0=soar_q0, soar_L=soar_L,
+                       interpolation_factor=interpolation_factor,
+                       use_lcg=use_lcg,
+                       block_width=block_width, block_height=block_height,
+                       backend='host')
         return cls(sim.gpu_ctx, sim.gpu_stream,
                    sim.nx, sim.ny, sim.dx, sim.dy,
                    sim.boundary_conditions, staggered,
@@ -308,6 +336,20 @@ class OceanStateNoise(object):
                    use_lcg=use_lcg,
                    block_width=block_width, block_height=block_height)
 
+    def setActiveTiles(self, bathymetry):
+        """
+        Restricts the perturbation of the ocean state to the blocks of the domain
+        holding at least one wet cell according to the given Common.Bathymetry. 
+        Land cells in fully dry blocks then keep their values, instead of being set to zero.
+        Ignored by the host backend, which perturbs all cells.
+        """
+        if self.backend == 'host':
+            return
+        if self.active_tiles is not None:
+            self.active_tiles.release()
+        tile_activity_map = bathymetry.tileActivityMap(self.local_size[0], self.local_size[1])
+        self.active_tiles = Common.ActiveTiles(self.gpu_stream, tile_activity_map)
+
     def getSeed(self):
         assert(self.use_lcg), "getSeed is only valid if LCG is used as pseudo-random generator."
         
@@ -335,7 +377,9 @@ class OceanStateNoise(object):
         return self.reduction_buffer.download(self.gpu_stream)
     
     def generateNormalDistribution(self):
-        if not self.use_lcg:
+        if self.backend == 'host':
+            self._hostUpdateRandom(self.random_numbers, True)
+        elif not self.use_lcg:
             self.rng.fill_normal(self.random_numbers.data, stream=self.gpu_stream)
         else:
             self.normalDistributionKernel.prepared_async_call(self.global_size_random_numbers, self.local_size, self.gpu_stream,
@@ -345,7 +389,9 @@ class OceanStateNoise(object):
                                                               self.random_numbers.data.gpudata, self.random_numbers.pitch)
     
     def generateNormalDistributionPerpendicular(self):
-        if not self.use_lcg:
+        if self.backend == 'host':
+            self._hostUpdateRandom(self.perpendicular_random_numbers, True)
+        elif not self.use_lcg:
             self.rng.fill_normal(self.perpendicular_random_numbers.data, stream=self.gpu_stream)
         else:
             self.normalDistributionKernel.prepared_async_call(self.global_size_random_numbers, self.local_size, self.gpu_stream,
@@ -356,7 +402,9 @@ class OceanStateNoise(object):
 
     def generateUniformDistribution(self):
         # Call kernel -> new random numbers
-        if not self.use_lcg:
+        if self.backend == 'host':
+            self._hostUpdateRandom(self.random_numbers, False)
+        elif not self.use_lcg:
             self.rng.fill_uniform(self.random_numbers.data, stream=self.gpu_stream)
         else:
             self.uniformDistributionKernel.prepared_async_call(self.global_size_random_numbers, self.local_size, self.gpu_stream,
@@ -365,12 +413,24 @@ class OceanStateNoise(object):
                                                                self.seed.data.gpudata, self.seed.pitch,
                                                                self.random_numbers.data.gpudata, self.random_numbers.pitch)
 
+    @Instrumentation.instrument(Instrumentation.KERNEL, owner=lambda self, sim, *args, **kwargs: sim)
     def perturbSim(self, sim, q0_scale=1.0, update_random_field=True, 
                    perturbation_scale=1.0, perpendicular_scale=0.0,
                    align_with_cell_i=None, align_with_cell_j=None, stream=None):
         """
         Generating a perturbed ocean state and adding it to sim's ocean state 
         """
+        if self.backend == 'host':
+            # CPU simulator (Arakawa A grid), see CPUSimulators.CPUCDKLM16
+            eta, hu, hv = sim.download()
+            self._perturbOceanStateHost(eta, hu, hv, sim.bathymetry.Bi.data,
+                                        sim.f, sim.coriolis_beta, sim.g,
+                                        sim.ghost_cells_x, sim.ghost_cells_y,
+                                        q0_scale, update_random_field,
+                                        perturbation_scale, perpendicular_scale,
+                                        sim.bathymetry.mask_value)
+            sim.upload(eta, hu, hv)
+            return
         self.perturbOceanState(sim.gpu_data.h0, sim.gpu_data.hu0, sim.gpu_data.hv0,
                                sim.bathymetry.Bi,
                                sim.f, beta=sim.coriolis_beta, 
@@ -412,6 +472,14 @@ class OceanStateNoise(object):
             The default value align_with_cell=None corresponds to zero offset between the coarse and fine grid.
         """
         
+        if self.backend == 'host':
+            self._perturbOceanStateHost(eta.data, hu.data, hv.data, H.data, f, beta, g,
+                                        ghost_cells_x, ghost_cells_y,
+                                        q0_scale, update_random_field,
+                                        perturbation_scale, perpendicular_scale,
+                                        land_mask_value)
+            return
+        
         if stream is None:
             stream = self.gpu_stream
         
@@ -450,8 +518,14 @@ class OceanStateNoise(object):
                                                 self.coarse_buffer.data.gpudata, self.coarse_buffer.pitch,
                                                 np.int32(1))
         
+        global_size = self.global_size_geo_balance
+        active_tiles = np.intp(0)
+        if self.active_tiles is not None:
+            global_size = self.active_tiles.global_size
+            active_tiles = self.active_tiles.pointer()
+        
         if self.interpolation_factor > 1:
-            self.bicubicInterpolationKernel.prepared_async_call(self.global_size_geo_balance, self.local_size, stream,
+            self.bicubicInterpolationKernel.prepared_async_call(global_size, self.local_size, stream,
                                                                 self.nx, self.ny, 
                                                                 np.int32(ghost_cells_x), np.int32(ghost_cells_y),
                                                                 self.dx, self.dy,
@@ -469,10 +543,11 @@ class OceanStateNoise(object):
                                                                 hu.data.gpudata, hu.pitch,
                                                                 hv.data.gpudata, hv.pitch,
                                                                 H.data.gpudata, H.pitch,
-                                                                land_mask_value)
+                                                                land_mask_value,
+                                                                active_tiles)
 
         else:
-            self.geostrophicBalanceKernel.prepared_async_call(self.global_size_geo_balance, self.local_size, stream,
+            self.geostrophicBalanceKernel.prepared_async_call(global_size, self.local_size, stream,
                                                               self.nx, self.ny,
                                                               self.dx, self.dy,
                                                               np.int32(ghost_cells_x), np.int32(ghost_cells_y),
@@ -485,7 +560,8 @@ class OceanStateNoise(object):
                                                               hu.data.gpudata, hu.pitch,
                                                               hv.data.gpudata, hv.pitch,
                                                               H.data.gpudata, H.pitch,
-                                                              land_mask_value)
+                                                              land_mask_value,
+                                                              active_tiles)
     
     def _obtain_coarse_grid_offset(self, fine_index_i, fine_index_j):
         
@@ -509,6 +585,8 @@ class OceanStateNoise(object):
         Calculates sum(xi^2), where xi \sim N(0,I)
         Calling a kernel that sums the square of all elements in the random buffer
         """
+        if self.backend == 'host':
+            return np.sum(self.random_numbers.data.astype(np.float64)**2)
         self.squareSumKernel.prepared_async_call(self.global_size_reductions,
                                                  self.local_size_reductions, 
                                                  self.gpu_stream,
@@ -559,6 +637,64 @@ class OceanStateNoise(object):
         self._makePerpendicular()
     
     
+    ##### Host backend ####
+    
+    def _hostUpdateRandom(self, buffer, normalDist):
+        """
+        Fills the given host buffer with new random numbers, either with the
+        LCG (as the GPU kernels) or from the numpy random state.
+        """
+        if self.use_lcg:
+            self._CPUUpdateRandom(normalDist)
+            buffer.upload(None, self.random_numbers_host)
+        elif normalDist:
+            buffer.upload(None, self.random_state.standard_normal((self.rand_ny, self.rand_nx)))
+        else:
+            buffer.upload(None, self.random_state.rand(self.rand_ny, self.rand_nx))
+    
+    def _perturbOceanStateHost(self, eta, hu, hv, Hi, f, beta, g,
+                               ghost_cells_x, ghost_cells_y,
+                               q0_scale, update_random_field, 
+                               perturbation_scale, perpendicular_scale,
+                               land_mask_value):
+        """
+        Host version of perturbOceanState, following the SOAR and geostrophicBalance kernels.
+        eta, hu, hv: numpy arrays with ghost cells, which are perturbed in place
+        Hi: numpy array with the bathymetry on the cell intersections
+        """
+        if update_random_field:
+            self.generateNormalDistribution()
+        
+        # The SOAR function is linear in q0
+        d_eta = self._applyQ_batched_CPU(self.random_numbers.data, perturbation_scale*q0_scale)
+        if perpendicular_scale > 0:
+            d_eta += self._applyQ_batched_CPU(self.perpendicular_random_numbers.data, perpendicular_scale*q0_scale)
+        d_eta = d_eta.astype(np.float32)
+        
+        nx, ny = int(self.nx), int(self.ny)
+        rows = slice(ghost_cells_y, ghost_cells_y + ny)
+        cols = slice(ghost_cells_x, ghost_cells_x + nx)
+        
+        Hc = Hi[ghost_cells_y:ghost_cells_y + ny + 1, ghost_cells_x:ghost_cells_x + nx + 1]
+        dry_cell = (Hc[:-1, :-1] == land_mask_value) | (Hc[:-1, 1:] == land_mask_value) | \
+                   (Hc[1:,  :-1] == land_mask_value) | (Hc[1:,  1:] == land_mask_value)
+        H_mid = np.float32(0.25)*(Hc[:-1, :-1] + Hc[:-1, 1:] + Hc[1:, :-1] + Hc[1:, 1:])
+        
+        tj = np.arange(ghost_cells_y, ghost_cells_y + ny, dtype=np.float32)[:, np.newaxis]
+        coriolis = np.float32(f) + np.float32(beta)*(tj + np.float32(0.5))*self.dy
+        
+        with np.errstate(invalid='ignore', over='ignore'):
+            h_mid = d_eta[2:-2, 2:-2] + H_mid + eta[rows, cols]
+            eta_diff_x = (d_eta[2:-2, 3:-1] - d_eta[2:-2, 1:-3])/(np.float32(2.0)*self.dx)
+            eta_diff_y = (d_eta[3:-1, 2:-2] - d_eta[1:-3, 2:-2])/(np.float32(2.0)*self.dy)
+            d_hu = -(np.float32(g)/coriolis)*h_mid*eta_diff_y
+            d_hv =  (np.float32(g)/coriolis)*h_mid*eta_diff_x
+        
+        eta[rows, cols] = np.where(dry_cell, 0.0, eta[rows, cols] + d_eta[2:-2, 2:-2])
+        hu[rows, cols]  = np.where(dry_cell, 0.0, hu[rows, cols] + d_hu)
+        hv[rows, cols]  = np.where(dry_cell, 0.0, hv[rows, cols] + d_hv)
+    
+    
     ##### CPU versions of the above functions ####
     
     def getSeedCPU(self):
@@ -806,9 +942,72 @@ class OceanStateNoise(object):
                 d_hv[j,i] = (g/coriolis)*h_mid*eta_diff_x   
     
         return d_eta, d_hu, d_hv
-    
-    
-    
+
+
+    def _applyQ_batched_CPU(self, random_numbers, perturbation_scale=1):
+        """
+        Vectorized version of _applyQ_CPU.
+        random_numbers has shape [..., rand_ny, rand_nx], so that several random fields
+        (e.g., one per particle) can be processed at once.
+
+        The resulting size is [..., coarse_ny+4, coarse_nx+4].
+        """
+        ny_halo = int(self.coarse_ny + (2 + self.cutoff)*2)
+        nx_halo = int(self.coarse_nx + (2 + self.cutoff)*2)
+
+        # Read xi with ghost cells, in the same way as _applyQ_CPU
+        global_j = np.arange(ny_halo)
+        if self.periodicNorthSouth:
+            global_j = (global_j - self.cutoff - 2) % self.rand_ny
+        global_i = np.arange(nx_halo)
+        if self.periodicEastWest:
+            global_i = (global_i - self.cutoff - 2) % self.rand_nx
+        local_xi = np.asarray(random_numbers, dtype=np.float64)[..., global_j[:, None], global_i[None, :]]
+
+        # The SOAR weights only depend on the offset between the cells,
+        # so the convolution is a sum of (2*cutoff+1)^2 shifted arrays.
+        out_ny = int(self.coarse_ny + 4)
+        out_nx = int(self.coarse_nx + 4)
+        Qxi = np.zeros(local_xi.shape[:-2] + (out_ny, out_nx))
+        for offset_y in range(2*self.cutoff+1):
+            for offset_x in range(2*self.cutoff+1):
+                Q = self._SOAR_Q_CPU(self.cutoff, self.cutoff, offset_x, offset_y)
+                Qxi += Q*local_xi[..., offset_y:offset_y+out_ny, offset_x:offset_x+out_nx]
+
+        return perturbation_scale*Qxi
+
+
+    def _obtainOceanPerturbations_batched_CPU(self, random_numbers, H, f, beta, g, perturbation_scale=1):
+        """
+        Vectorized version of _obtainOceanPerturbations_CPU, taking the random field(s)
+        as input rather than reading self.random_numbers_host.
+        random_numbers has shape [..., rand_ny, rand_nx], and the results are
+        d_eta [..., ny+4, nx+4], d_hu [..., ny, nx] and d_hv [..., ny, nx].
+
+        Only supports interpolation_factor == 1.
+        """
+        assert(self.interpolation_factor == 1), 'The batched CPU perturbations require interpolation_factor = 1'
+
+        d_eta = self._applyQ_batched_CPU(random_numbers, perturbation_scale)
+
+        # H_mid, read from the same part of H as in _obtainOceanPerturbations_CPU
+        H_mid = 0.25*(H[:self.ny,   :self.nx] + H[1:self.ny+1,   :self.nx] + \
+                      H[:self.ny, 1:self.nx+1] + H[1:self.ny+1, 1:self.nx+1])
+
+        coriolis = f + beta*(np.arange(self.ny) + 2)*self.dy
+        coriolis = coriolis[:, None]
+
+        h_mid = d_eta[..., 2:-2, 2:-2] + H_mid
+
+        eta_diff_y = (d_eta[..., 3:-1, 2:-2] - d_eta[..., 1:-3, 2:-2])/(2.0*self.dy)
+        d_hu = -(g/coriolis)*h_mid*eta_diff_y
+
+        eta_diff_x = (d_eta[..., 2:-2, 3:-1] - d_eta[..., 2:-2, 1:-3])/(2.0*self.dx)
+        d_hv = (g/coriolis)*h_mid*eta_diff_x
+
+        return d_eta, d_hu, d_hv
+
+
     def _interpolate_CPU(self, coarse_eta, interpolation_order=3):
         """
         Interpolates values coarse_eta defined on the coarse grid onto the computational grid.
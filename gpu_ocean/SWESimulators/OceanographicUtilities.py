@@ -18,29 +18,34 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 import numpy as np
-from scipy import interpolate 
 
 
 def fillMaskedValues(input, steps=5):
-
-    def fillStep(a):
-        valid = np.zeros(a.shape)
-        valid[~a.mask] = 1
+    """
+    Fills masked values with the average of their unmasked neighbours, growing the
+    unmasked region by (up to) one cell per step. Only positive averages are filled.
+    Stops early when a step does not fill any more cells.
+    """
+    data = np.ma.getdata(input).copy()
+    mask = np.ma.getmaskarray(input).copy()
+    
+    for i in range(steps):
+        valid = np.zeros(data.shape)
+        valid[~mask] = 1
         valid[1:-1, 1:-1] += valid[:-2, 1:-1] + valid[2:, 1:-1] + valid[1:-1, :-2] + valid[1:-1, 2:]
         valid[valid == 0] = -1 #avoid divide by zero below
-
-        values = np.copy(a.filled(0))
+        
+        values = np.where(mask, 0, data).astype(data.dtype)
         values[1:-1, 1:-1] += values[:-2, 1:-1] + values[2:, 1:-1] + values[1:-1, :-2] + values[1:-1, 2:]
         values = values / valid
-        values[~a.mask] = 0
-
-        a[values > 0] = values[values > 0]
-    
-    retval = np.ma.copy(input)
-    for i in range(steps):
-        fillStep(retval)
         
-    return retval
+        fill = mask & (values > 0)
+        if not fill.any():
+            break
+        data[fill] = values[fill]
+        mask[fill] = False
+        
+    return np.ma.array(data, mask=mask, fill_value=np.ma.array(input).fill_value)
 
 
 
@@ -68,136 +73,147 @@ def intersectionsToMidpoints(a_i):
     return values
 
     
+def _genIntersections(values, mask, use_minmod):
+    """
+    Evaluates the piecewise planar reconstruction of the midpoint values in the
+    four corners of each cell, and averages the corners of the unmasked cells 
+    which join in each intersection.
+    values is a plain array, and mask is True for masked cells.
+    Returns the intersection values and the number of unmasked cells around each intersection
+    """
+    if (use_minmod):
+        dx = minmodX(values)
+        dy = minmodY(values)
+    else:
+        dx, dy = np.gradient(values)
+    
+    #Set slope for masked cells to zero
+    dx[mask] = 0.0
+    dy[mask] = 0.0
+    
+    # d - c
+    # | X |
+    # a - b
+    # Evaluate the piecewise planar surface in the four corners of cell X
+    a_a = values - 0.5*dx - 0.5*dy
+    a_b = values + 0.5*dx - 0.5*dy
+    a_c = values + 0.5*dx + 0.5*dy
+    a_d = values - 0.5*dx + 0.5*dy
+    
+    # Now take the average reconstructed value from the four cells which join
+    # in a single cell.
+    # d - c   d - c
+    # | X |   | X |
+    # a - b   a - b
+    #       Y   
+    # d - c   d - c
+    # | X |   | X |
+    # a - b   a - b
+    a_a = a_a[1:, 1:] * (1-mask[1:, 1:])
+    a_b = a_b[:-1, 1:] * (1-mask[:-1, 1:])
+    a_c = a_c[:-1, :-1] * (1-mask[:-1, :-1])
+    a_d = a_d[1:, :-1] * (1-mask[1:, :-1])
+    
+    # First count number of valid cells 
+    # for each intersection
+    count = 4 - (np.int32(mask[1:, 1:]) \
+            + np.int32(mask[:-1, 1:]) \
+            + np.int32(mask[:-1, :-1]) \
+            + np.int32(mask[1:, :-1]))
+    
+    # Then set the average
+    intersections = values[1:, 1:] + values[:-1, 1:] + values[:-1, :-1] + values[1:, :-1]
+    wet = count > 0
+    intersections[wet] = (a_a[wet] + a_b[wet] + a_c[wet] + a_d[wet]) / count[wet]
+    
+    return intersections, count
+    
+    
 def midpointsToIntersections(a_m, iterations=20, tolerance=5e-3, use_minmod=False, dt=0.125, land_value=0.0, compute_convergence=False):
     """
-    Converts cell values at midpoints to cell values at midpoints using a cubic
-    interpolating spline to generate first guess, followed by an iterative update. 
+    Converts cell values at midpoints to cell values at intersections using a piecewise
+    planar reconstruction to generate first guess, followed by an iterative update. 
+    
+    The update stops after the given number of iterations, or when the mean absolute
+    change of an iteration is less than tolerance times the change of the first
+    iteration (use tolerance=None to always run all iterations).
+    The mean absolute changes are returned as convergence['l_1']. With compute_convergence,
+    the l_2 and l_inf norms of the changes are returned as well.
     """
-    def genIntersections(midpoints, use_minmod):
-        if (use_minmod):
-            dx = minmodX(midpoints.data)
-            dy = minmodY(midpoints.data)
-        else:
-            dx, dy = np.gradient(midpoints.data)
-            
-        mask = None
-        if (np.ma.is_masked(midpoints)):
-            mask = midpoints.mask
-        else:
-            mask = np.zeros(midpoints.shape, dtype=np.bool)
-        
-        #Set slope for masked cells to zero
-        dx[mask] = 0.0
-        dy[mask] = 0.0
-        
-        # d - c
-        # | X |
-        # a - b
-        # Evaluate the piecewise planar surface in the four corners of cell X
-        a_a = midpoints.data - 0.5*dx - 0.5*dy
-        a_b = midpoints.data + 0.5*dx - 0.5*dy
-        a_c = midpoints.data + 0.5*dx + 0.5*dy
-        a_d = midpoints.data - 0.5*dx + 0.5*dy
-        
-        
-        # Now take the average reconstructed value from the four cells which join
-        # in a single cell.
-        # d - c   d - c
-        # | X |   | X |
-        # a - b   a - b
-        #       Y   
-        # d - c   d - c
-        # | X |   | X |
-        # a - b   a - b
-        a_a = a_a[1:, 1:] * (1-mask[1:, 1:])
-        a_b = a_b[:-1, 1:] * (1-mask[:-1, 1:])
-        a_c = a_c[:-1, :-1] * (1-mask[:-1, :-1])
-        a_d = a_d[1:, :-1] * (1-mask[1:, :-1])
-        
-        # First count number of valid cells 
-        # for each intersection
-        count = 4 - (np.int32(mask[1:, 1:]) \
-                + np.int32(mask[:-1, 1:]) \
-                + np.int32(mask[:-1, :-1]) \
-                + np.int32(mask[1:, :-1]))
-
-        # Then set the average
-        values = midpoints.data[1:, 1:] + midpoints.data[:-1, 1:] + midpoints.data[:-1, :-1] + midpoints.data[1:, :-1]
-        values[count>0] = (a_a[count>0] + a_b[count>0] + a_c[count>0] + a_d[count>0]) / count[count>0]
-
-        #Create mask
-        out_mask = (count == 0)
-        
-        return np.ma.array(values, mask=out_mask, fill_value=midpoints.fill_value)
+    values = np.ma.getdata(a_m)
+    mask = np.ma.getmaskarray(a_m)
     
-    vmax = a_m.max()
-    vmin = a_m.min()
+    vmax = np.ma.max(a_m)
+    vmin = np.ma.min(a_m)
     
     # Generate initial guess
-    a_i = genIntersections(a_m, use_minmod=use_minmod)
-    a_i = np.clip(a_i, vmin, vmax)
+    a_i, count = _genIntersections(values, mask, use_minmod)
+    np.clip(a_i, vmin, vmax, out=a_i)
+    
+    # Intersections which are updated, i.e., which have at least one unmasked cell
+    wet = count > 0
+    num_wet = np.sum(wet)
     
-    a_i_old = None
-    if (compute_convergence):
-        a_i_old = a_i.copy()
+    # Cells which contribute to the delta averaged onto each intersection in the heat equation step.
+    # The partial sums are formed in the same order and with the same handling of masked cells 
+    # as masked array arithmetic (which keeps the partial sum when a masked term is added).
+    corner_masks = [mask[:-1, :-1], mask[:-1, 1:], mask[1:, 1:], mask[1:, :-1]]
+    partial_masks = [corner_masks[0]]
+    for corner_mask in corner_masks[1:]:
+        partial_masks += [partial_masks[-1] | corner_mask]
+    update = (count > 2) & wet
+    a_i_old = a_i.copy()
     
     # Iteratively refine intersections estimate
     #Use kind of a heat equation explisit solver with a source term from the error
-    gauss_sigma = 1
-    delta = np.zeros_like(a_m)
-    u_mask = a_i.mask.copy() #binary_dilation(a_i.mask)
+    delta = np.zeros(values.shape, dtype=values.dtype)
+    delta_i = np.zeros(a_i.shape)
     
     convergence = {'l_1': [], 'l_2': [], 'l_inf': []}
-    for i in range(2*iterations+1):        
-        delta[1:-1,1:-1] = a_m.data[1:-1,1:-1] - intersectionsToMidpoints(a_i.data)
-        
-        if (np.ma.is_masked(a_m)):
-            delta = np.ma.array(delta, mask=a_m.mask.copy())
-        else:
-            delta = np.ma.array(delta, mask=np.zeros(a_m.shape, dtype=np.bool))
+    converged = False
+    for i in range(2*iterations+1):
+        delta[1:-1,1:-1] = values[1:-1,1:-1] - intersectionsToMidpoints(a_i)
         
         if (i%2 == 0):
-            count = 4 - (np.int32(delta.mask[1:, 1:]) \
-                    + np.int32(delta.mask[:-1, 1:]) \
-                    + np.int32(delta.mask[:-1, :-1]) \
-                    + np.int32(delta.mask[1:, :-1]))
-            delta_sum = (delta[:-1, :-1] + delta[:-1, 1:] + delta[1:, 1:] + delta[1:, :-1])
-            delta_i = np.zeros(a_i.shape)
-            delta_i[count>2] = delta_sum[count>2] / count[count>2]
-            a_i[~u_mask] += dt*delta_i[~u_mask]
+            delta_sum = delta[:-1, :-1]
+            for corners, partial_mask in zip([delta[:-1, 1:], delta[1:, 1:], delta[1:, :-1]], partial_masks[1:]):
+                delta_sum = np.where(partial_mask, delta_sum, delta_sum + corners)
+            delta_avg = np.where(partial_masks[-1], delta_sum, delta_sum.astype(np.float64) / 4)
+            delta_i[update] = delta_avg[update]
+            a_i[wet] += dt*delta_i[wet]
             
             # Heat equation
             kappa = 1
             dx = 1
             dy = 1
-            u = a_i.data.copy()
-            
-            #rand = (np.random.random_sample(a_i.shape) - 0.5)*l_inf*1e-2
-            #u[~a_i.mask] += rand[~a_i.mask]
+            u = a_i.copy()
             
             u[1:-1, 1:-1] = u[1:-1, 1:-1] \
                             + kappa*dt/(dx*dx)*(u[1:-1, :-2] - 2*u[1:-1, 1:-1] + u[1:-1, 2:]) \
                             + kappa*dt/(dy*dy)*(u[:-2, 1:-1] - 2*u[1:-1, 1:-1] + u[2:, 1:-1])
-            a_i[~u_mask] = u[~u_mask]
+            a_i[wet] = u[wet]
         else:
             # Intersections fix 
-            a_i[~a_i.mask] = a_i[~a_i.mask] + genIntersections(delta, use_minmod=use_minmod)[~a_i.mask]
+            delta_intersections, _ = _genIntersections(delta, mask, use_minmod)
+            a_i[wet] = a_i[wet] + delta_intersections[wet]
                 
-        a_i = np.clip(a_i, vmin, vmax)
-        a_i.mask = u_mask
+        np.clip(a_i, vmin, vmax, out=a_i)
+        
+        # Always end with a heat equation step, as for the full number of iterations
+        if (converged):
+            break
         
         #Stop criteria
-        if (compute_convergence and i % 2 == 1):
-            d = a_i - a_i_old
-            a_i_old = a_i.copy()
-            d[u_mask] = 0.0
-            convergence['l_1'] += [np.sum(np.abs(d))/np.sum(~u_mask)]
-            convergence['l_2'] += [np.sum(np.abs(d**2))**(1/2)/np.sum(~u_mask)]
-            convergence['l_inf'] += [np.max(np.abs(d))]
-            if (convergence['l_1'][0] / convergence['l_1'][0] < tolerance):
-                break
+        if (i % 2 == 1 and num_wet > 0):
+            d = a_i[wet] - a_i_old[wet]
+            a_i_old[:] = a_i
+            convergence['l_1'] += [np.sum(np.abs(d))/num_wet]
+            if (compute_convergence):
+                convergence['l_2'] += [np.sum(np.abs(d**2))**(1/2)/num_wet]
+                convergence['l_inf'] += [np.max(np.abs(d))]
+            converged = tolerance is not None and convergence['l_1'][-1] <= tolerance*convergence['l_1'][0]
 
-    return a_i, convergence
+    return np.ma.array(a_i, mask=~wet, fill_value=np.ma.array(a_m).fill_value), convergence
 
 
     
@@ -252,23 +268,53 @@ def minmodX(eta, theta=1.3):
     return np.transpose(D)
 
     
-def rescaleMidpoints(data, nx1, ny1, **kwargs):
+def linearResample(data, x1, y1):
+    """
+    Bilinear interpolation of data, given at the integer indices, to the points (x1[i], y1[j])
+    inside the grid. Interpolates along x first and then along y, so the cost is linear
+    in the size of the input and output grids (equivalent to interp2d with kind='linear')
+    """
+    def weights(x, n):
+        i = np.clip(np.floor(x).astype(np.int64), 0, n-2)
+        return i, x - i
+    
+    values = np.ma.getdata(data)
+    i, s = weights(np.asarray(x1, dtype=np.float64), values.shape[1])
+    j, t = weights(np.asarray(y1, dtype=np.float64), values.shape[0])
+    
+    rows = (1.0-s)*values[:, i] + s*values[:, i+1]
+    return (1.0-t)[:, np.newaxis]*rows[j, :] + t[:, np.newaxis]*rows[j+1, :]
+
+
+def subsampleTexture(data, factor):
+    """
+    Subsamples a cell centered field by the given factor (at least 2x2 cells),
+    as used for the coriolis and angle textures of CDKLM16
+    """
+    ny, nx = data.shape 
+    dx, dy = 1/nx, 1/ny
+    
+    new_nx, new_ny = max(2, nx//factor), max(2, ny//factor)
+    new_dx, new_dy = 1/new_nx, 1/new_ny
+    x_new = np.linspace(0.5*new_dx, 1-0.5*new_dx, new_nx)
+    y_new = np.linspace(0.5*new_dy, 1-0.5*new_dy, new_ny)
+    # Linear interpolation from the cell centers at (i+0.5)*dx
+    return linearResample(data, x_new/dx - 0.5, y_new/dy - 0.5)
+    
+    
+def rescaleMidpoints(data, nx1, ny1):
     ny0, nx0 = data.shape
     
     if (nx0 > nx1 and ny0 > ny1):
         # Subsample - non volume preserving        
-        x0 = np.linspace(0.5, nx0-0.5, nx0)
-        y0 = np.linspace(0.5, ny0-0.5, ny0)
-        
-        data_int = interpolate.interp2d(x0, y0, data, kind='linear', **kwargs)
-        
         dx1 = nx0 / nx1
         dy1 = ny0 / ny1
         
         x1 = np.linspace(0.5*dx1, nx0-0.5*dx1, nx1)
         y1 = np.linspace(0.5*dy1, ny0-0.5*dy1, ny1)
         
-        out_data = data_int(x1, y1)
+        # Midpoints are at x0 = 0.5, 1.5, ..., nx0-0.5
+        out_data = linearResample(data, x1-0.5, y1-0.5)
         if np.ma.is_masked(data):
             x1, y1 = np.meshgrid(x1, y1)
             out_mask = data.mask[y1.round().astype(np.int32), x1.round().astype(np.int32)]
@@ -302,20 +348,15 @@ def rescaleMidpoints(data, nx1, ny1, **kwargs):
         
         return nx0/nx1, ny0/ny1, out_data
 
-def rescaleIntersections(data, nx1, ny1, **kwargs):
+def rescaleIntersections(data, nx1, ny1):
     ny0, nx0 = data.shape
         
     if (nx0 > nx1 and ny0 > ny1):
         # Subsample - using linear interpolation
-        x0 = np.linspace(0, nx0-1, nx0)
-        y0 = np.linspace(0, ny0-1, ny0)
-        
-        data_int = interpolate.interp2d(x0, y0, data, kind='linear', **kwargs)
-        
         x1 = np.linspace(0, nx0-1, nx1)
         y1 = np.linspace(0, ny0-1, ny1)
         
-        out_data = data_int(x1, y1)
+        out_data = linearResample(data, x1, y1)
         if np.ma.is_masked(data):
             x1, y1 = np.meshgrid(x1, y1)
             out_mask = data.mask[y1.round().astype(np.int32), x1.round().astype(np.int32)]
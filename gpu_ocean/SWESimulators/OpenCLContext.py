@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements device selection, work-group sizes and
+kernel compilation for the OpenCL scheme CTCS2Layer,
+so that it can run on both GPU and CPU OpenCL devices (e.g., POCL).
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import logging
+
+import pyopencl as cl
+
+
+# Default work-group sizes (block_width, block_height).
+# CPU runtimes run one work-group per core and vectorize the work-items
+# along the first dimension, so wide and short work-groups work best there.
+GPU_WORK_GROUP_SIZE = (16, 16)
+CPU_WORK_GROUP_SIZE = (32, 4)
+
+# Kernel compile options per device type.
+# We keep IEEE semantics (no -cl-fast-relaxed-math), so that results only
+# differ from the GPU by fused multiply-adds.
+GPU_COMPILE_OPTIONS = []
+CPU_COMPILE_OPTIONS = ["-cl-mad-enable", "-cl-no-signed-zeros"]
+
+
+def chooseWorkGroupSize(is_cpu, max_work_group_size, max_work_item_sizes, \
+                        block_width=None, block_height=None, preferred_vector_width=1):
+    """
+    Chooses the work-group size (block_width, block_height) for a device.
+    Explicitly given block_width/block_height are kept (if the device supports them),
+    the others are taken from the device type defaults.
+    On CPU devices, block_width is rounded up to a multiple of the preferred
+    float vector width, so that the vectorized work-items fill whole vectors.
+    The block is shrunk (height first) until it fits the device limits.
+    """
+    default_width, default_height = CPU_WORK_GROUP_SIZE if is_cpu else GPU_WORK_GROUP_SIZE
+    width = default_width if block_width is None else int(block_width)
+    height = default_height if block_height is None else int(block_height)
+
+    if is_cpu and block_width is None and preferred_vector_width > 1:
+        width = -(-width // preferred_vector_width) * preferred_vector_width
+
+    width = min(width, max_work_item_sizes[0])
+    height = min(height, max_work_item_sizes[1])
+    while width*height > max_work_group_size:
+        if height > 1:
+            height = height // 2
+        else:
+            width = width // 2
+
+    assert(width > 0 and height > 0), "Could not find a valid work-group size"
+    if (block_width is not None and width != block_width) or \
+       (block_height is not None and height != block_height):
+        raise RuntimeError("The device does not support work-groups of " + \
+                           str((block_width, block_height)) + " work-items")
+    return (width, height)
+
+
+def compileOptions(is_cpu):
+    """
+    Kernel compile options for the device type
+    """
+    return list(CPU_COMPILE_OPTIONS if is_cpu else GPU_COMPILE_OPTIONS)
+
+
+
+class OpenCLContext(object):
+    """
+    Class which keeps track of the OpenCL context and device, and compiles kernels for it
+    """
+    def __init__(self, device_type=None, platform_name=None, device=0, cl_ctx=None):
+        """
+        device_type: 'cpu', 'gpu' or None (any device type)
+        platform_name: Only use platforms with this (case insensitive) substring in their name, e.g., 'portable' for POCL
+        device: Index among the matching devices
+        cl_ctx: Use this existing pyopencl.Context instead of creating one (the other arguments are then ignored)
+        """
+        self.logger = logging.getLogger(__name__)
+        self.module_path = os.path.dirname(os.path.realpath(__file__))
+        self.kernels = {}
+
+        if cl_ctx is None:
+            cl_ctx = cl.Context([OpenCLContext.findDevice(device_type, platform_name, device)])
+        self.cl_ctx = cl_ctx
+        self.device = self.cl_ctx.devices[0]
+        self.is_cpu = bool(self.device.type & cl.device_type.CPU)
+
+        self.logger.info("Using OpenCL device '%s' on platform '%s' (%s)", \
+                         self.device.name, self.device.platform.name, "CPU" if self.is_cpu else "GPU")
+
+    @staticmethod
+    def findDevice(device_type=None, platform_name=None, device=0):
+        """
+        Returns the device-th OpenCL device of the given type, on platforms matching platform_name
+        """
+        cl_device_type = {None: cl.device_type.ALL,
+                          'cpu': cl.device_type.CPU,
+                          'gpu': cl.device_type.GPU}[device_type]
+
+        devices = []
+        for platform in cl.get_platforms():
+            if platform_name is not None and platform_name.lower() not in platform.name.lower():
+                continue
+            try:
+                devices += platform.get_devices(device_type=cl_device_type)
+            except cl.Error:
+                # Platforms without devices of the given type raise DEVICE_NOT_FOUND
+                continue
+
+        if len(devices) == 0:
+            raise RuntimeError("No OpenCL device of type " + str(device_type) + \
+                               " found on platform " + str(platform_name))
+        return devices[device % len(devices)]
+
+    @classmethod
+    def fromContext(cls, cl_ctx):
+        """
+        Wraps a pyopencl.Context (or returns the given OpenCLContext unchanged)
+        """
+        if isinstance(cl_ctx, OpenCLContext):
+            return cl_ctx
+        return cls(cl_ctx=cl_ctx)
+
+    def __str__(self):
+        return "OpenCLContext " + self.device.name
+
+    def workGroupSize(self, block_width=None, block_height=None):
+        """
+        Work-group size (block_width, block_height) suited for the device
+        """
+        return chooseWorkGroupSize(self.is_cpu, self.device.max_work_group_size, \
+                                   self.device.max_work_item_sizes, \
+                                   block_width, block_height, \
+                                   self.device.preferred_vector_width_float)
+
+    def get_kernel(self, kernel_filename, defines={}, options=[]):
+        """
+        Reads a kernel file from gpu_kernels and builds it for the device,
+        with the given defines prepended and the device type compile options.
+        """
+        kernel_dir = os.path.join(self.module_path, "gpu_kernels")
+        build_options = compileOptions(self.is_cpu) + list(options) + ["-I", kernel_dir]
+
+        key = (kernel_filename, str(sorted(defines.items())), str(build_options))
+        if key in self.kernels:
+            return self.kernels[key]
+
+        self.logger.debug("Building %s with %s", kernel_filename, str(build_options))
+        kernel_string = ""
+        for name, value in defines.items():
+            kernel_string += "#define {:s} {:s}\n".format(str(name), str(value))
+        with open(os.path.join(kernel_dir, kernel_filename), "r") as kernel_file:
+            kernel_string += kernel_file.read()
+
+        self.kernels[key] = cl.Program(self.cl_ctx, kernel_string).build(options=build_options)
+        return self.kernels[key]
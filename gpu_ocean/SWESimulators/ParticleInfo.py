@@ -26,12 +26,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import numpy as np
-import pandas as pd
 
 
-from SWESimulators import CDKLM16
-from SWESimulators import GPUDrifterCollection
 from SWESimulators import DataAssimilationUtils as dautils
+from SWESimulators import LazyImport
+pd = LazyImport.lazyImport('pandas')
 
 
 
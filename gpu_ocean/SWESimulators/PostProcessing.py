@@ -0,0 +1,406 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements parallel and restartable post-processing of
+data assimilation experiments. Result files are streamed through a process
+pool and reduced into
+ - rank histograms and spread-skill statistics, from the npz files written
+   by rank_histogram_experiment.py, and
+ - forecast error and spread curves, from the pickled Observation files
+   of drifter forecasts.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import logging
+import multiprocessing
+import os
+import pickle
+import zlib
+
+import numpy as np
+
+from SWESimulators import Observation
+
+
+def fileFilter(path_to_dir, ext=None, prefix=None):
+    """
+    Sorted list of the files in path_to_dir with the given extension and prefix
+    (the file_filter function used in the analysis notebooks)
+    """
+    filenames = os.listdir(path_to_dir)
+    if prefix:
+        filenames = [f for f in filenames if f.startswith(prefix)]
+    if ext:
+        filenames = [f for f in filenames if f.endswith(ext)]
+    return sorted(os.path.join(path_to_dir, f) for f in filenames)
+
+
+def fileSeed(filename, seed):
+    """
+    Seed for the random numbers used when processing a file. It only depends on
+    the file name, so results do not depend on the order the files are processed in.
+    """
+    return (zlib.crc32(os.path.basename(filename).encode('utf-8')) + seed) % (2**32)
+
+
+
+class Reduction(object):
+    """
+    Base class for reductions of result files.
+    processFile(filename) reads one file and returns a (small) result, and runs in the
+    worker processes. accumulate(result) adds the result to self.state, and runs in the
+    main process. processFile must not depend on self.state.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.reset()
+
+    def reset(self):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def processFile(self, filename):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def accumulate(self, result):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+    def getResult(self):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+
+
+class RankHistogramReduction(Reduction):
+    """
+    Rank histograms and spread-skill statistics from the npz files written by
+    rank_histogram_experiment.py. Each file holds the ensemble of the fields
+    as arrays of shape (ny, ensemble_size), and the true values (true_<field>)
+    as arrays of shape (ny,).
+    """
+
+    def __init__(self, ensemble_size, y_indices=None, fields=None,
+                 truth=None, perturbation_stddev=None, seed=0):
+        """
+        ensemble_size: Number of ensemble members in each file
+        y_indices: Cells (rows) to make rank histograms for (default all)
+        fields: Fields to make rank histograms for (default eta, hu and hv)
+        truth: Dict with true values for each field, for files without true_<field>
+        perturbation_stddev: Dict with standard deviation of the random (observation)
+            perturbations added to the ensemble members for each field, e.g. {'hu': 1, 'hv': 1}
+            (default no perturbations)
+        seed: Seed for the perturbations (combined with the file name)
+        """
+        self.ensemble_size = ensemble_size
+        self.y_indices = None if y_indices is None else np.asarray(y_indices, dtype=np.int32)
+        if fields is None:
+            fields = ['eta', 'hu', 'hv']
+        if perturbation_stddev is None:
+            perturbation_stddev = {}
+        self.fields = list(fields)
+        self.truth = truth
+        self.perturbation_stddev = perturbation_stddev
+        self.seed = seed
+        super(RankHistogramReduction, self).__init__()
+
+    def reset(self):
+        self.state = {'num_files': 0, 'num_cells': None, 't': None}
+        for field in self.fields:
+            self.state[field] = None
+
+    def processFile(self, filename):
+        rng = np.random.RandomState(fileSeed(filename, self.seed))
+        result = {}
+        with np.load(filename) as data:
+            result['t'] = float(data['t'])
+            for field in self.fields:
+                ensemble = data[field]
+                if ('true_' + field) in data.files:
+                    truth = data['true_' + field]
+                else:
+                    assert(self.truth is not None), "No true values for " + field + " in " + filename
+                    truth = self.truth[field]
+                assert(ensemble.shape[1] == self.ensemble_size), \
+                    "Expected " + str(self.ensemble_size) + " ensemble members, got " + str(ensemble.shape[1])
+
+                if self.y_indices is not None:
+                    ensemble = ensemble[self.y_indices, :]
+                    truth = truth[self.y_indices]
+                ensemble = ensemble.astype(np.float64)
+
+                stddev = self.perturbation_stddev.get(field, 0.0)
+                if stddev > 0.0:
+                    ensemble = ensemble + rng.normal(scale=stddev, size=ensemble.shape)
+
+                # Rank of the truth is the number of ensemble members below it,
+                # as np.searchsorted on the sorted ensemble
+                ranks = np.sum(ensemble < truth[:, np.newaxis], axis=1)
+
+                mean = np.mean(ensemble, axis=1)
+                result[field] = {'ranks': ranks,
+                                 'squared_error': (mean - truth)**2,
+                                 'variance': np.var(ensemble, axis=1, ddof=1)}
+        return result
+
+    def accumulate(self, result):
+        for field in self.fields:
+            num_cells = len(result[field]['ranks'])
+            if self.state[field] is None:
+                self.state['num_cells'] = num_cells
+                self.state[field] = {'rank_histogram': np.zeros((num_cells, self.ensemble_size+1), dtype=np.int64),
+                                     'squared_error': np.zeros(num_cells),
+                                     'variance': np.zeros(num_cells)}
+
+            acc = self.state[field]
+            np.add.at(acc['rank_histogram'], (np.arange(num_cells), result[field]['ranks']), 1)
+            acc['squared_error'] += result[field]['squared_error']
+            acc['variance'] += result[field]['variance']
+
+        self.state['num_files'] += 1
+        if self.state['t'] is None:
+            self.state['t'] = result['t']
+
+    def getResult(self):
+        """
+        Returns a dict with the following for each field:
+            rank_histogram: Counts of shape (num_cells, ensemble_size+1)
+            total: Rank histogram summed over all cells
+            rmse: Root mean square error of the ensemble mean in each cell
+            spread: Root mean ensemble variance in each cell
+            spread_skill: sqrt((Ne+1)/Ne)*spread/rmse, which is 1 on average for a reliable ensemble
+        and the number of files and the time of the first file.
+        """
+        assert(self.state['num_files'] > 0), "No files have been processed"
+        n = self.state['num_files']
+        Ne = self.ensemble_size
+        result = {'num_files': n, 't': self.state['t']}
+        for field in self.fields:
+            acc = self.state[field]
+            rmse = np.sqrt(acc['squared_error']/n)
+            spread = np.sqrt(acc['variance']/n)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spread_skill = np.sqrt((Ne+1)/Ne)*spread/rmse
+            result[field] = {'rank_histogram': acc['rank_histogram'].copy(),
+                             'total': np.sum(acc['rank_histogram'], axis=0),
+                             'rmse': rmse, 'spread': spread, 'spread_skill': spread_skill}
+        return result
+
+
+
+class ForecastErrorReduction(Reduction):
+    """
+    Forecast error and spread curves of drifter forecasts, from one pickled Observation
+    file per ensemble member (the forecast_*.bz2 files), compared to the true drifter
+    observations.
+
+    For each evaluation time, the forecast error is the mean squared distance between
+    the forecast and the true drifter positions, and the spread is the mean squared
+    distance between the forecast and the ensemble mean drifter positions. Both are
+    averaged over the ensemble members (ignoring lost drifters, with nan positions).
+    """
+
+    def __init__(self, true_observation_file, times, domain_size_x, domain_size_y, nx, ny,
+                 drifter_set=None, in_km=True):
+        """
+        true_observation_file: Pickled Observation with the true drifter positions
+        times: Simulation times to evaluate the forecasts at
+        domain_size_x, domain_size_y, nx, ny: Domain, used to follow drifters through periodic boundaries
+        drifter_set: Drifters to average the errors over (default all)
+        in_km: Compute distances in km rather than m
+        """
+        self.times = np.asarray(times, dtype=np.float64)
+        self.domain_size_x = domain_size_x
+        self.domain_size_y = domain_size_y
+        self.nx = nx
+        self.ny = ny
+        self.drifter_set = drifter_set
+        self.in_km = in_km
+
+        self.true_paths = self.readPaths(true_observation_file)
+        super(ForecastErrorReduction, self).__init__()
+
+    def readPaths(self, filename):
+        """
+        Reads the drifter paths at self.times from a pickled Observation.
+        Drifters passing through the periodic boundary are followed continuously
+        (as get_drifter_path with keepDomainSize=False).
+        Returns an array of shape (num_times, num_drifters, 2)
+        """
+        observation = Observation.Observation(domain_size_x=self.domain_size_x,
+                                              domain_size_y=self.domain_size_y,
+                                              nx=self.nx, ny=self.ny)
+        observation.read_pickle(filename)
+
+        obs_times = observation.obs_df[observation.time_key].values.astype(np.float64)
+        positions = np.stack(observation.obs_df[observation.drifter_positions_key].values, axis=0).astype(np.float64)
+        if self.drifter_set is not None:
+            positions = positions[:, self.drifter_set, :]
+
+        # Unwrap the jumps through the periodic boundaries
+        domain_size = np.array([self.domain_size_x, self.domain_size_y], dtype=np.float64)
+        jumps = np.nan_to_num(np.round(np.diff(positions, axis=0) / domain_size))
+        positions[1:] -= np.cumsum(jumps, axis=0) * domain_size
+
+        time_indices = np.searchsorted(obs_times, np.round(self.times))
+        assert(np.all(time_indices < len(obs_times)) and np.all(obs_times[np.minimum(time_indices, len(obs_times)-1)] == np.round(self.times))), \
+            "Not all evaluation times are found in " + filename
+
+        paths = positions[time_indices]
+        if self.in_km:
+            paths /= 1000
+        return paths
+
+    def reset(self):
+        num_times, num_drifters, _ = self.true_paths.shape
+        self.state = {'num_files': 0,
+                      'count': np.zeros((num_times, num_drifters), dtype=np.int64),
+                      'sum': np.zeros((num_times, num_drifters, 2)),
+                      'sum_squares': np.zeros((num_times, num_drifters)),
+                      'squared_error': np.zeros((num_times, num_drifters))}
+
+    def processFile(self, filename):
+        return self.readPaths(filename)
+
+    def accumulate(self, paths):
+        assert(paths.shape == self.true_paths.shape), "Forecast paths do not match the true paths"
+        valid = ~np.any(np.isnan(paths), axis=2)
+        paths = np.where(valid[:, :, np.newaxis], paths, 0.0)
+
+        self.state['count'] += valid
+        self.state['sum'] += paths
+        self.state['sum_squares'] += np.sum(paths**2, axis=2)
+        self.state['squared_error'] += valid*np.sum((paths - self.true_paths)**2, axis=2)
+        self.state['num_files'] += 1
+
+    def getResult(self):
+        """
+        Returns a dict with
+            times: The evaluation times
+            error, spread: Mean over the drifters, for each time
+            error_per_drifter, spread_per_drifter: Arrays of shape (num_times, num_drifters)
+        """
+        assert(self.state['num_files'] > 0), "No files have been processed"
+        count = self.state['count']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            error = self.state['squared_error']/count
+            mean = self.state['sum']/count[:, :, np.newaxis]
+            spread = self.state['sum_squares']/count - np.sum(mean**2, axis=2)
+        spread = np.maximum(spread, 0.0)
+
+        return {'times': self.times.copy(), 'num_files': self.state['num_files'],
+                'error': np.nanmean(error, axis=1), 'spread': np.nanmean(spread, axis=1),
+                'error_per_drifter': error, 'spread_per_drifter': spread}
+
+
+
+# The reduction used in the worker processes, set by the pool initializer
+_worker_reduction = None
+
+def _initWorker(reduction):
+    global _worker_reduction
+    _worker_reduction = reduction
+
+def _processFile(filename):
+    return _worker_reduction.processFile(filename)
+
+
+class PostProcessor(object):
+    """
+    Streams result files through a process pool into a reduction.
+
+    With a checkpoint file, the reduction state and the processed files are stored
+    regularly, so that an interrupted post-processing continues where it stopped.
+    The files are reduced in the given order, so the result does not depend on the
+    number of processes nor on restarts.
+    """
+
+    def __init__(self, reduction, filenames, checkpoint_file=None, checkpoint_interval=10, num_processes=None):
+        """
+        reduction: Reduction to apply
+        filenames: Files to process
+        checkpoint_file: File to store the progress in (None for no checkpoints)
+        checkpoint_interval: Number of files between each checkpoint
+        num_processes: Number of worker processes (default os.cpu_count(), 1 processes the files serially)
+        """
+        self.logger = logging.getLogger(__name__)
+        self.reduction = reduction
+        self.filenames = list(filenames)
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.num_processes = num_processes if num_processes is not None else os.cpu_count()
+        self.processed = []
+
+        if self.checkpoint_file is not None and os.path.isfile(self.checkpoint_file):
+            self.loadCheckpoint()
+
+    def loadCheckpoint(self):
+        with open(self.checkpoint_file, 'rb') as f:
+            checkpoint = pickle.load(f)
+        if checkpoint['reduction'] != type(self.reduction).__name__:
+            raise RuntimeError("Checkpoint " + self.checkpoint_file + " is for a " + checkpoint['reduction'])
+        self.reduction.state = checkpoint['state']
+        self.processed = checkpoint['processed']
+        self.logger.info("Restarting after %d processed files", len(self.processed))
+
+    def saveCheckpoint(self):
+        # Write to a temporary file first, so that an interruption never leaves a broken checkpoint
+        tmp_file = self.checkpoint_file + ".tmp"
+        with open(tmp_file, 'wb') as f:
+            pickle.dump({'reduction': type(self.reduction).__name__,
+                         'state': self.reduction.state,
+                         'processed': self.processed}, f)
+        os.replace(tmp_file, self.checkpoint_file)
+
+    def getPendingFiles(self):
+        processed = set(self.processed)
+        return [f for f in self.filenames if f not in processed]
+
+    def run(self, max_files=None):
+        """
+        Processes the pending files (at most max_files of them), and returns the result of the reduction
+        """
+        pending = self.getPendingFiles()
+        if max_files is not None:
+            pending = pending[:max_files]
+        self.logger.info("Processing %d files (%d already processed)", len(pending), len(self.processed))
+
+        pool = None
+        if self.num_processes > 1 and len(pending) > 1:
+            pool = multiprocessing.Pool(min(self.num_processes, len(pending)),
+                                        initializer=_initWorker, initargs=(self.reduction,))
+            results = pool.imap(_processFile, pending)
+        else:
+            results = map(self.reduction.processFile, pending)
+
+        try:
+            for i, (filename, result) in enumerate(zip(pending, results)):
+                self.reduction.accumulate(result)
+                self.processed.append(filename)
+                if self.checkpoint_file is not None and (i+1) % self.checkpoint_interval == 0:
+                    self.saveCheckpoint()
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            if self.checkpoint_file is not None:
+                self.saveCheckpoint()
+
+        return self.getResult()
+
+    def getResult(self):
+        return self.reduction.getResult()
@@ -27,10 +27,11 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
 import datetime
-from netCDF4 import Dataset
-import matplotlib.pyplot as plt
-from matplotlib import animation, rc
-from SWESimulators import PlotHelper, Common
+from SWESimulators import Common, Instrumentation, LazyImport
+netCDF4 = LazyImport.lazyImport('netCDF4')
+plt = LazyImport.lazyImport('matplotlib.pyplot')
+animation = LazyImport.lazyImport('matplotlib.animation')
+PlotHelper = LazyImport.lazyImport('SWESimulators.PlotHelper')
 
 
 class SimNetCDFReader:
@@ -40,7 +41,7 @@ class SimNetCDFReader:
         self.filename = filename
         self.ignore_ghostcells = ignore_ghostcells
         
-        self.ncfile = Dataset(filename, 'r')
+        self.ncfile = netCDF4.Dataset(filename, 'r')
         
         self.ghostCells = [self.ncfile.getncattr('ghost_cells_north'), \
                            self.ncfile.getncattr('ghost_cells_east'), \
@@ -89,14 +90,49 @@ class SimNetCDFReader:
     def getTimes(self):
         return self.ncfile.variables['time'][:]
     
+    def getDiagnosticNames(self):
+        """
+        Returns the names of the scalar diagnostics stored in the file (see SimWriter.DIAGNOSTICS)
+        """
+        if 'diagnostics' not in self.ncfile.ncattrs():
+            return []
+        return str(self.ncfile.getncattr('diagnostics')).split()
+    
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
+    def getDiagnostic(self, name):
+        """
+        Returns the time series of the given scalar diagnostic, without reading the ocean state
+        """
+        assert(name in self.getDiagnosticNames()), 'Diagnostic ' + str(name) + ' is not stored in ' + self.filename
+        return self.ncfile.variables[name][:]
+    
     def getLastTimeStep(self):
         return self.getTimeStep(-1)
         
-    def getTimeStep(self, index):
+    def getEnsembleMemberIds(self):
+        """
+        Returns the ids of the ensemble members stored in the file (see SimWriter.SimNetCDFEnsembleWriter),
+        or None if the file holds a single simulation
+        """
+        if 'ensemble_member' not in self.ncfile.variables:
+            return None
+        return self.ncfile.variables['ensemble_member'][:].astype(np.int64).tolist()
+        
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
+    def getTimeStep(self, index, member=None):
+        """
+        Returns eta, hu, hv and t at the given timestep. 
+        For ensemble files, member is the position along the ensemble_member dimension.
+        """
         time = self.ncfile.variables['time']
-        eta  = self.ncfile.variables['eta'][index, :, :]
-        hu = self.ncfile.variables['hu'][index, :, :]
-        hv = self.ncfile.variables['hv'][index, :, :]
+        if member is None:
+            eta  = self.ncfile.variables['eta'][index, :, :]
+            hu = self.ncfile.variables['hu'][index, :, :]
+            hv = self.ncfile.variables['hv'][index, :, :]
+        else:
+            eta  = self.ncfile.variables['eta'][index, member, :, :]
+            hu = self.ncfile.variables['hu'][index, member, :, :]
+            hv = self.ncfile.variables['hv'][index, member, :, :]
         if self.ignore_ghostcells:
             eta = eta[self.ghostCells[2]:-self.ghostCells[0], \
                       self.ghostCells[3]:-self.ghostCells[1]]
@@ -135,6 +171,7 @@ class SimNetCDFReader:
     
     
         
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
     def getStateAtTimeStep(self, index, etaOnly=False):
         time = self.ncfile.variables['time']
         eta = self.ncfile.variables['eta'][index, :, :]
@@ -26,11 +26,125 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import numpy as np
 import datetime
-from netCDF4 import Dataset
 import subprocess
-import matplotlib.pyplot as plt
 import os as os
 import time
+import logging
+
+from SWESimulators import Instrumentation, OceanographicUtilities, LazyImport
+netCDF4 = LazyImport.lazyImport('netCDF4')
+
+
+###---------------------------
+### Scalar diagnostics
+###---------------------------
+# The diagnostics are computed from the state that is written for each timestep,
+# and are stored as small time series variables so that the health of a run can 
+# be checked without reading the full state.
+# Each diagnostic function takes the dict of fields returned by 
+# SimNetCDFWriter._diagnosticFields and the simulator, and returns a scalar.
+
+def _diagnosticMass(fields, sim):
+    return np.ma.sum(fields['h'])*sim.dx*sim.dy
+
+def _diagnosticEnergy(fields, sim):
+    kinetic = 0.5*np.ma.sum(fields['hu']*fields['u'] + fields['hv']*fields['v'])
+    potential = 0.5*sim.g*np.ma.sum(fields['eta']*fields['eta'])
+    return (kinetic + potential)*sim.dx*sim.dy
+
+def _diagnosticMaxU(fields, sim):
+    return np.ma.max(np.abs(fields['u']))
+
+def _diagnosticMaxV(fields, sim):
+    return np.ma.max(np.abs(fields['v']))
+
+def _diagnosticMaxSpeed(fields, sim):
+    return np.ma.max(np.sqrt(fields['u']*fields['u'] + fields['v']*fields['v']))
+
+def _diagnosticCFL(fields, sim):
+    c = np.sqrt(sim.g*np.ma.maximum(fields['h'], 0.0))
+    return sim.dt*np.ma.max(np.ma.maximum((np.abs(fields['u']) + c)/sim.dx, 
+                                          (np.abs(fields['v']) + c)/sim.dy))
+
+def _diagnosticNaNCount(fields, sim):
+    return fields['nan_count']
+
+def _diagnosticNumIterations(fields, sim):
+    return sim.num_iterations
+
+def _diagnosticDt(fields, sim):
+    return sim.dt
+
+# Maps the name of each diagnostic to (function, units, long name).
+# Additional diagnostics can be registered by adding entries to this dict.
+DIAGNOSTICS = {
+    'mass':           (_diagnosticMass,          'meter3',          'total water volume'),
+    'energy':         (_diagnosticEnergy,        'meter5 second-2', 'total energy divided by water density'),
+    'max_u':          (_diagnosticMaxU,          'meter second-1',  'maximum absolute x-velocity'),
+    'max_v':          (_diagnosticMaxV,          'meter second-1',  'maximum absolute y-velocity'),
+    'max_speed':      (_diagnosticMaxSpeed,      'meter second-1',  'maximum speed'),
+    'cfl':            (_diagnosticCFL,           '1',               'maximum CFL number for dt'),
+    'nan_count':      (_diagnosticNaNCount,      '1',               'number of NaN values in eta, hu and hv'),
+    'num_iterations': (_diagnosticNumIterations, '1',               'number of timesteps taken'),
+    'dt':             (_diagnosticDt,            'second',          'timestep size')
+}
+
+DEFAULT_DIAGNOSTICS = ['mass', 'energy', 'max_u', 'max_v', 'max_speed', 'cfl', 'nan_count', 'num_iterations', 'dt']
+
+# Desingularization used when computing velocities from hu and hv
+DIAGNOSTICS_DESINGULARIZATION_EPS = 1.0e-5
+
+
+###---------------------------
+### Storage profiles
+###---------------------------
+# A storage profile describes how the state variables (eta, hu, hv) are stored:
+#   complevel: zlib compression level (1-9), or 0 for no compression.
+#   shuffle:   Use the HDF5 shuffle filter together with compression.
+#   chunking:  'field' for one chunk per timestep (fast whole-field writes),
+#              'timeseries' for chunks spanning many timesteps over a small area 
+#              (fast reads of time series at a point), None for the netCDF 
+#              library default, or an explicit tuple of (time, y, x) chunk sizes.
+#   packing:   None to store float32, or a dict mapping variable names to the 
+#              maximum absolute error allowed. Packed variables are stored as int16 
+#              with scale_factor = 2*error and add_offset = 0, so that the 
+#              representable range is +/- 32767*scale_factor. Values outside 
+#              this range are clipped (and counted), and NaNs are stored as missing.
+# Readers using netCDF4 (such as SimReader) unpack the variables automatically.
+# Additional profiles can be registered by adding entries to this dict.
+STORAGE_PROFILES = {
+    # zlib compressed float32 with the library default chunking
+    'default':    {'complevel': 4, 'shuffle': True, 'chunking': None, 'packing': None},
+    # Uncompressed float32, one chunk per timestep 
+    'fast':       {'complevel': 0, 'shuffle': False, 'chunking': 'field', 'packing': None},
+    # 1 mm error in eta and 1 cm^2/s error in hu and hv (range +/- 65 m and +/- 655 m^2/s)
+    'packed':     {'complevel': 1, 'shuffle': True, 'chunking': 'field', 
+                   'packing': {'eta': 1.0e-3, 'hu': 1.0e-2, 'hv': 1.0e-2}},
+    # zlib compressed float32, chunked for reading long time series 
+    'timeseries': {'complevel': 1, 'shuffle': True, 'chunking': 'timeseries', 'packing': None}
+}
+
+# Chunk shape (time, y, x) used by the 'timeseries' chunking, limited by the domain size
+TIMESERIES_CHUNK_SHAPE = (64, 32, 32)
+
+# Fill value for missing data in packed variables
+PACKED_FILL_VALUE = np.int16(-32768)
+
+def getStorageProfile(storage_profile):
+    """
+    Returns the storage profile dict for the given profile name or dict.
+    Keys missing in a dict are taken from the 'default' profile.
+    """
+    if isinstance(storage_profile, str):
+        assert(storage_profile in STORAGE_PROFILES), 'Unknown storage profile ' + str(storage_profile) + ', expected one of ' + str(list(STORAGE_PROFILES.keys()))
+        return dict(STORAGE_PROFILES[storage_profile])
+    
+    profile = dict(STORAGE_PROFILES['default'])
+    for key in storage_profile.keys():
+        assert(key in profile), 'Unknown storage profile option ' + str(key)
+    profile.update(storage_profile)
+    return profile
+
 
 class SimNetCDFWriter:
     """Write simulator output to file in netCDF-format, following the CF convention.
@@ -43,22 +157,46 @@ class SimNetCDFWriter:
         ignore_ghostcells: Ghost cells will not be written to file if set to True.
         offset_x: Offset simulator origo with offset_x*dx in x-dimension, before writing to netCDF. 
         offset_y: Offset simulator origo with offset_y*dy in y-dimension, before writing to netCDF.
+        diagnostics: Names of scalar diagnostics (keys in DIAGNOSTICS) that are computed and stored
+            as time series for each timestep written by writeTimestep.
+        storage_profile: Name of a profile in STORAGE_PROFILES, or a dict with profile options,
+            controlling compression, chunking and packing of eta, hu and hv.
     """
     def __init__(self, sim, super_dir_name=None, filename=None, num_layers=1, staggered_grid=False, \
                  ignore_ghostcells=False, \
-                 offset_x=0, offset_y=0):
+                 offset_x=0, offset_y=0, \
+                 diagnostics=DEFAULT_DIAGNOSTICS, \
+                 storage_profile='default'):
 
+        self.logger = logging.getLogger(__name__)
+        
         # Parallel netCDF4 write?
         # TODO: Implement check/test for feature or take as an argument
-        self.write_parallel = False
+        self.write_parallel = self._useParallelWrite(sim)
         
         # OpenCL queue:
         self.gpu_stream = sim.gpu_stream
+        
+        # File I/O is recorded as belonging to the simulator
+        Instrumentation.attach(self, sim)
 
         # Write options:
         self.ignore_ghostcells = ignore_ghostcells
+        self.diagnostics = list(diagnostics)
+        for name in self.diagnostics:
+            assert(name in DIAGNOSTICS), 'Unknown diagnostic ' + str(name) + ', expected one of ' + str(list(DIAGNOSTICS.keys()))
         self.staggered_grid = staggered_grid
         self.num_layers = num_layers
+        self.storage_profile = getStorageProfile(storage_profile)
+        self.storage_profile_name = storage_profile if isinstance(storage_profile, str) else 'custom'
+        if self.storage_profile['packing'] is not None:
+            for name in self.storage_profile['packing'].keys():
+                assert(name in ['eta', 'hu', 'hv']), 'Only eta, hu and hv can be packed, got ' + str(name)
+        
+        # Storage statistics
+        self.write_time = 0.0
+        self.num_values_written = 0
+        self.num_clipped_values = 0
 
         # Identification of solution
         self.timestamp = datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%S")
@@ -139,17 +277,8 @@ class SimNetCDFWriter:
             
             
         # Organize directory and create file:
-        if(sim.comm):
-            os.makedirs(self.dir_name, exist_ok=True)
-            if(self.write_parallel):
-                # FIXME: Needs to be updated to handle more than one member/particle per MPI process
-                self.ncfile = Dataset(self.output_file_name,'w', clobber=True, parallel=True)
-            else:
-                self.output_file_name = self.output_file_name.replace('.nc', '_' + str(sim.comm.rank) + '_' + str(sim.local_particle_id) + '.nc')
-                self.ncfile = Dataset(self.output_file_name,'w', clobber=True, parallel=False)
-        else:
-            os.makedirs(self.dir_name, exist_ok=True)
-            self.ncfile = Dataset(self.output_file_name,'w', clobber=True, parallel=False)
+        self._openFile(sim)
+        self.ensemble_member_ids = self._ensembleMemberIds(sim)
         self.ncfile.Conventions = "CF-1.4"
         
         # Write global attributes
@@ -180,6 +309,7 @@ class SimNetCDFWriter:
         self.ncfile.ghost_cells_east  = self.ghost_cells_east
         self.ncfile.ghost_cells_south = self.ghost_cells_south
         self.ncfile.ghost_cells_west  = self.ghost_cells_west
+        self.ncfile.storage_profile = self.storage_profile_name
         
         
         # Write parameters related to stochastic model error and data assimilation
@@ -212,7 +342,7 @@ class SimNetCDFWriter:
             self.ncfile.createDimension('x', nx)
             self.ncfile.createDimension('y', ny)
         if (not self.ignore_ghostcells) and (self.staggered_grid):
-            if (self.simulator_short == 'FBL'):
+            if (self.simulator_short in ['FBL', 'CPUFBL']):
                 # Adjusting global domain size according to FBL scheme stencil requirements
                 self.ncfile.createDimension('x_hu',   nx + self.ghost_cells_tot_x - 1)
                 self.ncfile.createDimension('y_hu',   ny + self.ghost_cells_tot_y)
@@ -226,12 +356,14 @@ class SimNetCDFWriter:
         if not self.staggered_grid: 
             self.ncfile.createDimension('x_Hi', nx + self.ghost_cells_tot_x + 1)
             self.ncfile.createDimension('y_Hi', ny + self.ghost_cells_tot_y + 1)
-        if (sim.comm and self.write_parallel):
-            # FIXME: Needs to be updated to handle more than one member/particle per MPI process
-            self.ncfile.createDimension('ensemble_member', sim.comm.size)
+        if self.ensemble_member_ids is not None:
+            self.ncfile.createDimension('ensemble_member', len(self.ensemble_member_ids))
         
         #Create axis
         self.nc_time = self.ncfile.createVariable('time', np.dtype('float32').char, 'time')
+        if self.write_parallel:
+            # Writes that extend the unlimited time dimension must be collective
+            self.nc_time.set_collective(True)
         x = self.ncfile.createVariable('x', np.dtype('float32').char, 'x')
         y = self.ncfile.createVariable('y', np.dtype('float32').char, 'y')
 
@@ -262,13 +394,12 @@ class SimNetCDFWriter:
             x_Hi.axis = "X"
             y_Hi.axis = "Y"
             
-        if (sim.comm and self.write_parallel):
-            # FIXME: Needs to be updated to handle more than one member/particle per MPI process
+        if self.ensemble_member_ids is not None:
             ensemble_member = self.ncfile.createVariable('ensemble_member', np.dtype('float32').char, 'ensemble_member')
             ensemble_member.long_name = "ensemble run number"
             ensemble_member.standard_name = "realization"
             ensemble_member._CoordinateAxisType = "Ensemble"
-            ensemble_member[:] = range(0, sim.rank.size)
+            ensemble_member[:] = self.ensemble_member_ids
 
         #Create bogus projection variable
         self.nc_proj = self.ncfile.createVariable('projection_stere', np.dtype('int32').char)
@@ -291,7 +422,7 @@ class SimNetCDFWriter:
             y[:] = np.linspace(offset_y, ny*dy, ny)
             
         if not self.ignore_ghostcells and self.staggered_grid:
-            if (self.simulator_short == 'FBL'):
+            if (self.simulator_short in ['FBL', 'CPUFBL']):
                 # Adjusting global domain size according to FBL scheme stencil requirements
                 x_hu[:] = np.linspace(-self.ghost_cells_west*dx, \
                                       (nx + self.ghost_cells_east)*dx, \
@@ -363,30 +494,28 @@ class SimNetCDFWriter:
             self.nc_Hi.units = 'meter'
             self.nc_Hi[:] = self.Hi
         
-        # FIXME: Needs to be updated to handle more than one member/particle per MPI process
-        if(sim.comm and self.write_parallel):
-            self.nc_eta = self.ncfile.createVariable('eta', np.dtype('float32').char, ('time', 'ensemble_member', 'y', 'x'), zlib=True)
-            self.nc_eta.set_collective(True)
+        if self.ensemble_member_ids is not None:
+            self.nc_eta = self._createStateVariable('eta', ('time', 'ensemble_member', 'y', 'x'))
             if not self.ignore_ghostcells and self.staggered_grid:
-                self.nc_hu = self.ncfile.createVariable('hu', np.dtype('float32').char, ('time', 'ensemble_member', 'y_hu', 'x_hu'), zlib=True)
-                self.nc_hu.set_collective(True)
-                self.nc_hv = self.ncfile.createVariable('hv', np.dtype('float32').char, ('time', 'ensemble_member', 'y_hv', 'x_hv'), zlib=True)
-                self.nc_hv.set_collective(True)
+                self.nc_hu = self._createStateVariable('hu', ('time', 'ensemble_member', 'y_hu', 'x_hu'))
+                self.nc_hv = self._createStateVariable('hv', ('time', 'ensemble_member', 'y_hv', 'x_hv'))
             else:
-                self.nc_hu = self.ncfile.createVariable('hu', np.dtype('float32').char, ('time', 'ensemble_member', 'y', 'x'), zlib=True)
+                self.nc_hu = self._createStateVariable('hu', ('time', 'ensemble_member', 'y', 'x'))
+                self.nc_hv = self._createStateVariable('hv', ('time', 'ensemble_member', 'y', 'x'))
+            if self.write_parallel:
+                self.nc_eta.set_collective(True)
                 self.nc_hu.set_collective(True)
-                self.nc_hv = self.ncfile.createVariable('hv', np.dtype('float32').char, ('time', 'ensemble_member', 'y', 'x'), zlib=True)
                 self.nc_hv.set_collective(True)
         else:
             if(sim.comm):
                 self.ncfile.ensemble_member = sim.comm.rank
-            self.nc_eta = self.ncfile.createVariable('eta', np.dtype('float32').char, ('time', 'y', 'x'), zlib=True)
+            self.nc_eta = self._createStateVariable('eta', ('time', 'y', 'x'))
             if not self.ignore_ghostcells and self.staggered_grid:
-                self.nc_hu = self.ncfile.createVariable('hu', np.dtype('float32').char, ('time', 'y_hu', 'x_hu'), zlib=True)
-                self.nc_hv = self.ncfile.createVariable('hv', np.dtype('float32').char, ('time', 'y_hv', 'x_hv'), zlib=True)
+                self.nc_hu = self._createStateVariable('hu', ('time', 'y_hu', 'x_hu'))
+                self.nc_hv = self._createStateVariable('hv', ('time', 'y_hv', 'x_hv'))
             else:
-                self.nc_hu = self.ncfile.createVariable('hu', np.dtype('float32').char, ('time', 'y', 'x'), zlib=True)
-                self.nc_hv = self.ncfile.createVariable('hv', np.dtype('float32').char, ('time', 'y', 'x'), zlib=True)
+                self.nc_hu = self._createStateVariable('hu', ('time', 'y', 'x'))
+                self.nc_hv = self._createStateVariable('hv', ('time', 'y', 'x'))
             
         self.nc_eta.standard_name = 'water_surface_height_above_reference_datum'
         self.nc_hu.standard_name = 'x_sea_water_velocity'
@@ -402,12 +531,59 @@ class SimNetCDFWriter:
         self.nc_eta.units = 'meter'
         self.nc_hu.units = 'meter second-1'
         self.nc_hv.units = 'meter second-1'
+
+        # Scalar diagnostics for each timestep
+        self.ncfile.diagnostics = " ".join(self.diagnostics)
+        self.nc_diagnostics = {}
+        for name in self.diagnostics:
+            function, units, long_name = DIAGNOSTICS[name]
+            if self.ensemble_member_ids is not None:
+                self.nc_diagnostics[name] = self.ncfile.createVariable(name, np.dtype('float64').char, ('time', 'ensemble_member'))
+            else:
+                self.nc_diagnostics[name] = self.ncfile.createVariable(name, np.dtype('float64').char, ('time',))
+            self.nc_diagnostics[name].units = units
+            self.nc_diagnostics[name].long_name = long_name
+            if self.write_parallel:
+                self.nc_diagnostics[name].set_collective(True)
  
         # Init conditions should be added as the first element in the above arrays!
         self.i = 0
-        self.writeTimestep(sim)
+        self._writeInitialState(sim)
 
        
+    def _useParallelWrite(self, sim):
+        """
+        Whether the file is written with parallel netCDF by all MPI processes
+        """
+        return False
+    
+    def _openFile(self, sim):
+        """
+        Creates the directory and opens self.ncfile for writing
+        """
+        os.makedirs(self.dir_name, exist_ok=True)
+        if(sim.comm):
+            if(self.write_parallel):
+                # FIXME: Needs to be updated to handle more than one member/particle per MPI process
+                self.ncfile = netCDF4.Dataset(self.output_file_name,'w', clobber=True, parallel=True)
+            else:
+                self.output_file_name = self.output_file_name.replace('.nc', '_' + str(sim.comm.rank) + '_' + str(sim.local_particle_id) + '.nc')
+                self.ncfile = netCDF4.Dataset(self.output_file_name,'w', clobber=True, parallel=False)
+        else:
+            self.ncfile = netCDF4.Dataset(self.output_file_name,'w', clobber=True, parallel=False)
+    
+    def _ensembleMemberIds(self, sim):
+        """
+        Returns the values of the ensemble_member coordinate, or None if the file has no ensemble_member dimension
+        """
+        if (sim.comm and self.write_parallel):
+            # FIXME: Needs to be updated to handle more than one member/particle per MPI process
+            return list(range(sim.comm.size))
+        return None
+    
+    def _writeInitialState(self, sim):
+        self.writeTimestep(sim)
+        
     def __str__(self):
         msg = ""
         theMap = vars(self)
@@ -435,54 +611,63 @@ class SimNetCDFWriter:
         
         
     def __exit__(self, exc_type, exc_value, traceback):
+        self.storage_statistics = self.getStorageStatistics()
         print("Closing file " + self.output_file_name + " ...")
+        self.logger.info("Wrote %d timesteps (%.1f MB) at %.1f MB/s, compression ratio %.2f (%s storage profile)",
+                         self.i, self.storage_statistics['raw_bytes']/1.0e6, self.storage_statistics['throughput']/1.0e6,
+                         self.storage_statistics['compression_ratio'], self.storage_profile_name)
         self.ncfile.close()
         
         
 
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: self._bytesPerTimestep())
     def writeTimestep(self, sim):
         eta, hu, hv = sim.download()
         if (self.ignore_ghostcells):
             # FIXME: Needs to be updated to handle more than one member/particle per MPI process
             if(sim.comm and self.write_parallel):
                 self.nc_time[self.i] = sim.t
-                self.nc_eta[self.i, sim.ensemble_member, :] = eta[1:-1, 1:-1]
-                self.nc_hu[self.i, sim.ensemble_member, :] = hu[1:-1, 1:-2]
-                self.nc_hv[self.i, sim.ensemble_member, :] = hv[1:-2, 1:-1]
+                self._writeField(self.nc_eta, (self.i, sim.ensemble_member), eta[1:-1, 1:-1])
+                self._writeField(self.nc_hu, (self.i, sim.ensemble_member), hu[1:-1, 1:-2])
+                self._writeField(self.nc_hv, (self.i, sim.ensemble_member), hv[1:-2, 1:-1])
             else:
                 self.nc_time[self.i] = sim.t
-                self.nc_eta[self.i, :] = eta[1:-1, 1:-1]
-                self.nc_hu[self.i, :] = hu[1:-1, 1:-2]
-                self.nc_hv[self.i, :] = hv[1:-2, 1:-1]
+                self._writeField(self.nc_eta, (self.i,), eta[1:-1, 1:-1])
+                self._writeField(self.nc_hu, (self.i,), hu[1:-1, 1:-2])
+                self._writeField(self.nc_hv, (self.i,), hv[1:-2, 1:-1])
         else:
             # FIXME: Needs to be updated to handle more than one member/particle per MPI process
             if(sim.comm and self.write_parallel):
                 self.nc_time[self.i] = sim.t
-                self.nc_eta[self.i, sim.ensemble_member, :] = eta
-                self.nc_hu[self.i, sim.ensemble_member, :] = hu
-                self.nc_hv[self.i, sim.ensemble_member, :] = hv
+                self._writeField(self.nc_eta, (self.i, sim.ensemble_member), eta)
+                self._writeField(self.nc_hu, (self.i, sim.ensemble_member), hu)
+                self._writeField(self.nc_hv, (self.i, sim.ensemble_member), hv)
             else:
                 self.nc_time[self.i] = sim.t
-                self.nc_eta[self.i, :] = eta
-                self.nc_hu[self.i, :] = hu
-                self.nc_hv[self.i, :] = hv
+                self._writeField(self.nc_eta, (self.i,), eta)
+                self._writeField(self.nc_hu, (self.i,), hu)
+                self._writeField(self.nc_hv, (self.i,), hv)
+        
+        self._writeDiagnostics(sim, eta, hu, hv)
                        
         self.i += 1
 
             
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: self._bytesPerTimestep())
     def write(self, t, eta, hu, hv, eta2=None, hu2=None, hv2=None):
+        # Note: Diagnostics are only written by writeTimestep, as they require the simulator
         if (self.ignore_ghostcells):
             self.nc_time[self.i] = t
             #self.nc_eta[i, :] = eta[1:-1, 1:-1]
             #self.nc_u[i, :] = u[1:-1, 1:-1]
             #self.nc_v[i, :] = v[1:-1, 1:-1]
-            self.nc_hu[self.i, :] = hu[1:-2, 1:-1]
-            self.nc_hv[self.i, :] = hv[1:-1, 1:-2]
+            self._writeField(self.nc_hu, (self.i,), hu[1:-2, 1:-1])
+            self._writeField(self.nc_hv, (self.i,), hv[1:-1, 1:-2])
         else:
             self.nc_time[self.i] = t
-            self.nc_eta[self.i, :] = eta
-            self.nc_hu[self.i, :] = hu
-            self.nc_hv[self.i, :] = hv
+            self._writeField(self.nc_eta, (self.i,), eta)
+            self._writeField(self.nc_hu, (self.i,), hu)
+            self._writeField(self.nc_hv, (self.i,), hv)
             
         if(self.num_layers == 2):
             if (self.ignore_ghostcells):
@@ -497,6 +682,138 @@ class SimNetCDFWriter:
         self.i += 1
 
 
+    def _writeDiagnostics(self, sim, eta, hu, hv):
+        """
+        Computes and writes the scalar diagnostics for the current timestep
+        """
+        values = self._computeDiagnostics(sim, eta, hu, hv)
+        for name in self.diagnostics:
+            if(sim.comm and self.write_parallel):
+                self.nc_diagnostics[name][self.i, sim.ensemble_member] = values[name]
+            else:
+                self.nc_diagnostics[name][self.i] = values[name]
+    
+    def _computeDiagnostics(self, sim, eta, hu, hv):
+        """
+        Returns a dict with the value of each of the scalar diagnostics for the given state
+        """
+        if len(self.diagnostics) == 0:
+            return {}
+        
+        fields = self._diagnosticFields(sim, eta, hu, hv)
+        return {name: DIAGNOSTICS[name][0](fields, sim) for name in self.diagnostics}
+    
+    def _diagnosticFields(self, sim, eta, hu, hv):
+        """
+        Returns a dict with the interior cell-centered fields used for computing diagnostics 
+        (eta, hu, hv, h, u, v), and the number of NaN values in the full state.
+        On staggered grids, hu and hv are averaged from the cell faces to the cell centers.
+        """
+        nan_count = 0
+        for field in [eta, hu, hv]:
+            nan_count += np.count_nonzero(np.isnan(np.ma.getdata(field)) & ~np.ma.getmaskarray(field))
+        
+        if self.staggered_grid:
+            hu_faces, hv_faces = hu, hv
+            hu = np.zeros(eta.shape, dtype=hu_faces.dtype)
+            hv = np.zeros(eta.shape, dtype=hv_faces.dtype)
+            if hu_faces.shape[1] == eta.shape[1] + 1:
+                hu[:, :] = 0.5*(hu_faces[:, :-1] + hu_faces[:, 1:])
+            else:
+                # Only faces between cells (as in FBL)
+                hu[:, 1:-1] = 0.5*(hu_faces[:, :-1] + hu_faces[:, 1:])
+            hv[:, :] = 0.5*(hv_faces[:-1, :] + hv_faces[1:, :])
+        
+        interior = (slice(self.ghost_cells_south, self.ghost_cells_south + sim.ny), 
+                    slice(self.ghost_cells_west,  self.ghost_cells_west  + sim.nx))
+        fields = {'eta': eta[interior], 'hu': hu[interior], 'hv': hv[interior], 
+                  'nan_count': nan_count}
+        fields['h'] = self.Hm[interior] + fields['eta']
+        fields['u'] = OceanographicUtilities.desingularise(fields['h'], fields['hu'], DIAGNOSTICS_DESINGULARIZATION_EPS)
+        fields['v'] = OceanographicUtilities.desingularise(fields['h'], fields['hv'], DIAGNOSTICS_DESINGULARIZATION_EPS)
+        return fields
+
+    def _createStateVariable(self, name, dimensions):
+        """
+        Creates the state variable name (eta, hu or hv) with compression, chunking 
+        and packing according to the storage profile
+        """
+        profile = self.storage_profile
+        kwargs = {}
+        if profile['complevel'] > 0:
+            kwargs['zlib'] = True
+            kwargs['complevel'] = profile['complevel']
+            kwargs['shuffle'] = profile['shuffle']
+        
+        # Chunk shape, with one chunk along the ensemble_member dimension per member
+        shape = [len(self.ncfile.dimensions[dim]) for dim in dimensions]
+        chunking = profile['chunking']
+        if chunking == 'field':
+            kwargs['chunksizes'] = [1]*(len(shape)-2) + shape[-2:]
+        elif chunking == 'timeseries':
+            kwargs['chunksizes'] = [TIMESERIES_CHUNK_SHAPE[0]] + [1]*(len(shape)-3) + \
+                                   [min(TIMESERIES_CHUNK_SHAPE[1], shape[-2]), min(TIMESERIES_CHUNK_SHAPE[2], shape[-1])]
+        elif chunking is not None:
+            assert(len(chunking) == 3), 'Explicit chunk shapes must be given as (time, y, x), got ' + str(chunking)
+            kwargs['chunksizes'] = [chunking[0]] + [1]*(len(shape)-3) + \
+                                   [min(chunking[1], shape[-2]), min(chunking[2], shape[-1])]
+        
+        if profile['packing'] is not None and name in profile['packing']:
+            error_bound = profile['packing'][name]
+            assert(error_bound > 0), 'The packing error bound must be positive, got ' + str(error_bound)
+            var = self.ncfile.createVariable(name, np.dtype('int16').char, dimensions, 
+                                             fill_value=PACKED_FILL_VALUE, **kwargs)
+            var.scale_factor = np.float32(2*error_bound)
+            var.add_offset = np.float32(0.0)
+            var.packing_error_bound = np.float32(error_bound)
+        else:
+            var = self.ncfile.createVariable(name, np.dtype('float32').char, dimensions, **kwargs)
+        return var
+    
+    def _writeField(self, var, index, data):
+        """
+        Writes data to var[index], clipping packed variables to their representable range
+        """
+        if var.dtype == np.int16:
+            max_value = 32767*var.scale_factor
+            data = np.ma.masked_invalid(data)
+            self.num_clipped_values += int(np.ma.count(np.ma.masked_inside(data, -max_value, max_value)))
+            data = np.ma.array(np.ma.clip(data, -max_value, max_value).filled(0.0), mask=np.ma.getmaskarray(data))
+        
+        tic = time.time()
+        var[index] = data
+        self.write_time += time.time() - tic
+        self.num_values_written += int(np.size(data))
+    
+    def getStorageStatistics(self):
+        """
+        Returns a dict with statistics of the state variables written so far:
+            raw_bytes: Size of eta, hu and hv written as uncompressed float32
+            file_bytes: Current size of the file
+            compression_ratio: raw_bytes/file_bytes
+            write_time: Seconds spent writing eta, hu and hv 
+            throughput: raw_bytes/write_time
+            clipped_values: Number of values clipped to the range of packed variables
+        """
+        self.ncfile.sync()
+        raw_bytes = 4*self.num_values_written
+        file_bytes = os.path.getsize(self.output_file_name)
+        return {'raw_bytes': raw_bytes,
+                'file_bytes': file_bytes,
+                'compression_ratio': raw_bytes/max(file_bytes, 1),
+                'write_time': self.write_time,
+                'throughput': raw_bytes/max(self.write_time, 1.0e-9),
+                'clipped_values': self.num_clipped_values}
+
+    def _bytesPerTimestep(self):
+        """
+        Number of bytes written to the state variables for each timestep
+        """
+        nbytes = 0
+        for var in [self.nc_eta, self.nc_hu, self.nc_hv]:
+            nbytes += int(np.prod(var.shape[1:]))*var.dtype.itemsize
+        return nbytes*self.num_layers
+        
     def _addText(self, ax, msg):
         bp = 70 # breakpoint
         if len(msg) > bp:
@@ -526,3 +843,132 @@ class SimNetCDFWriter:
         self._addText(ax, 'wind type: ' + str(self.wind_stress))
         
         ax.axis([0, 6, 0, 3])
+
+
+
+class SimNetCDFEnsembleWriter(SimNetCDFWriter):
+    """Write the output of many ensemble members to one netCDF file, along the ensemble_member dimension.
+
+    Coordinates, bathymetry and metadata are written only once, and the states of all local 
+    members at the same time level are written together. All members must use the same grid 
+    and bathymetry. 
+    With an MPI communicator, the members of all processes are written to one shared file when 
+    parallel netCDF is used. Otherwise, each process writes its local members to its own file,
+    and the ensemble_member coordinate holds the global member ids.
+
+    Args:
+        sims: The local ensemble members.
+        comm: MPI communicator, or None if all members are local. Members are numbered 
+            consecutively by rank.
+        write_parallel: Use parallel netCDF. If None, it is used when netCDF4 supports it 
+            and comm has more than one process.
+        The remaining arguments are as for SimNetCDFWriter.
+    """
+    def __init__(self, sims, super_dir_name=None, filename=None, staggered_grid=False, \
+                 ignore_ghostcells=False, \
+                 offset_x=0, offset_y=0, \
+                 diagnostics=DEFAULT_DIAGNOSTICS, \
+                 storage_profile='default', \
+                 comm=None, write_parallel=None):
+        
+        assert(len(sims) > 0), 'The ensemble writer needs at least one ensemble member'
+        self.sims = list(sims)
+        for sim in self.sims[1:]:
+            assert(sim.nx == self.sims[0].nx and sim.ny == self.sims[0].ny), 'All ensemble members must use the same grid'
+        
+        # Global ids of the local members
+        self.comm = comm
+        if comm is None:
+            first_member_id = 0
+            self.ensemble_size = len(self.sims)
+        else:
+            local_ensemble_sizes = comm.allgather(len(self.sims))
+            first_member_id = int(np.sum(local_ensemble_sizes[:comm.rank]))
+            self.ensemble_size = int(np.sum(local_ensemble_sizes))
+        self.local_member_ids = list(range(first_member_id, first_member_id + len(self.sims)))
+        
+        if write_parallel is None:
+            write_parallel = (comm is not None) and (comm.size > 1) and bool(netCDF4.__has_parallel4_support__)
+        assert(not write_parallel or comm is not None), 'Parallel netCDF requires an MPI communicator'
+        self._write_parallel = write_parallel
+        
+        # Position of the local members along the ensemble_member dimension
+        if write_parallel:
+            self.member_slice = slice(first_member_id, first_member_id + len(self.sims))
+        else:
+            self.member_slice = slice(0, len(self.sims))
+        
+        super().__init__(self.sims[0], super_dir_name=super_dir_name, filename=filename, \
+                         staggered_grid=staggered_grid, ignore_ghostcells=ignore_ghostcells, \
+                         offset_x=offset_x, offset_y=offset_y, \
+                         diagnostics=diagnostics, storage_profile=storage_profile)
+        self.ncfile.ensemble_size = self.ensemble_size
+        
+    def _useParallelWrite(self, sim):
+        return self._write_parallel
+    
+    def _openFile(self, sim):
+        os.makedirs(self.dir_name, exist_ok=True)
+        if self.write_parallel:
+            self.ncfile = netCDF4.Dataset(self.output_file_name, 'w', clobber=True, parallel=True, comm=self.comm)
+        else:
+            if self.comm is not None and self.comm.size > 1:
+                self.output_file_name = self.output_file_name.replace('.nc', '_' + str(self.comm.rank) + '.nc')
+            self.ncfile = netCDF4.Dataset(self.output_file_name, 'w', clobber=True, parallel=False)
+    
+    def _ensembleMemberIds(self, sim):
+        if self.write_parallel:
+            return list(range(self.ensemble_size))
+        return self.local_member_ids
+    
+    def _writeInitialState(self, sim):
+        self.writeTimestep()
+    
+    @Instrumentation.instrument(Instrumentation.FILE_IO, nbytes=lambda self, result, *args, **kwargs: self._bytesPerTimestep())
+    def writeTimestep(self, active=None):
+        """
+        Writes the current state of all local members as one time level.
+        Members where active is False are not downloaded, and are stored as missing values.
+        With parallel netCDF, all processes must call this function collectively.
+        """
+        num_members = len(self.sims)
+        if active is None:
+            active = [True]*num_members
+        assert(len(active) == num_members), 'Expected one active flag per local member, got ' + str(len(active))
+        
+        # Download all members, and write them with one call per variable
+        eta = np.ma.masked_all((num_members,) + self.nc_eta.shape[2:], dtype=np.float32)
+        hu  = np.ma.masked_all((num_members,) + self.nc_hu.shape[2:],  dtype=np.float32)
+        hv  = np.ma.masked_all((num_members,) + self.nc_hv.shape[2:],  dtype=np.float32)
+        diagnostics = {name: np.ma.masked_all(num_members, dtype=np.float64) for name in self.diagnostics}
+        t = None
+        for k in range(num_members):
+            if not active[k]:
+                continue
+            sim = self.sims[k]
+            if t is None:
+                t = sim.t
+            eta_k, hu_k, hv_k = sim.download()
+            for name, value in self._computeDiagnostics(sim, eta_k, hu_k, hv_k).items():
+                diagnostics[name][k] = value
+            if self.ignore_ghostcells:
+                # As in SimNetCDFWriter.writeTimestep
+                eta_k, hu_k, hv_k = eta_k[1:-1, 1:-1], hu_k[1:-1, 1:-2], hv_k[1:-2, 1:-1]
+            eta[k], hu[k], hv[k] = eta_k, hu_k, hv_k
+        if t is None:
+            t = self.sims[0].t
+        
+        self.nc_time[self.i] = t
+        self._writeField(self.nc_eta, (self.i, self.member_slice), eta)
+        self._writeField(self.nc_hu, (self.i, self.member_slice), hu)
+        self._writeField(self.nc_hv, (self.i, self.member_slice), hv)
+        for name in self.diagnostics:
+            self.nc_diagnostics[name][self.i, self.member_slice] = diagnostics[name]
+        
+        self.i += 1
+    
+    def _bytesPerTimestep(self):
+        """
+        Number of bytes written to the state variables of the local members for each timestep
+        """
+        return super()._bytesPerTimestep()*len(self.sims)//len(self.ensemble_member_ids)
@@ -26,20 +26,14 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 #Import packages we need
 import numpy as np
-import pycuda
-import pycuda.driver as cuda
-from SWESimulators import Common, SimWriter
+from SWESimulators import LazyImport
+cuda = LazyImport.lazyImport('pycuda.driver')
+from SWESimulators import Common, SimWriter, Instrumentation, WindStress
 import gc
+import time
 from abc import ABCMeta, abstractmethod
 import logging
 
-try:
-    from importlib import reload
-except:
-    pass
-    
-reload(Common)
-
 class Simulator(object):
     """
     Baseclass for different numerical schemes, all 'solving' the SW equations.
@@ -87,6 +81,11 @@ class Simulator(object):
         self.f = np.float32(f)
         self.r = np.float32(r)
         self.coriolis_beta = np.float32(coriolis_beta)
+        
+        # The kernels only read wind stress tables, so parametric wind stress 
+        # is evaluated once at the start time
+        if isinstance(wind_stress, WindStress.BaseWindStress):
+            wind_stress = wind_stress.toWindStress([t], nx, ny, dx, dy)
         self.wind_stress = wind_stress
         self.y_zero_reference_cell = np.float32(y_zero_reference_cell)
         
@@ -179,6 +178,9 @@ class Simulator(object):
         
         #Helper function to upload data to the GPU as a texture
         def setTexture(texref, numpy_array):       
+            if Instrumentation.enabled:
+                tic = time.perf_counter()
+            
             #Upload data to GPU and bind to texture reference
             texref.set_array(cuda.np_to_array(numpy_array, order="C"))
             
@@ -188,6 +190,10 @@ class Simulator(object):
             texref.set_address_mode(1, cuda.address_mode.CLAMP)
             texref.set_flags(cuda.TRSF_NORMALIZED_COORDINATES) #Use [0, 1] indexing
             
+            if Instrumentation.enabled:
+                Instrumentation.record(Instrumentation.TRANSFER, "wind_stress_texture", Instrumentation.label(self), 
+                                       time.perf_counter() - tic, numpy_array.nbytes)
+            
         #If time interval has changed, upload new data
         if (new_t0 != old_t0):
             self.gpu_stream.synchronize()
@@ -269,6 +275,8 @@ class Simulator(object):
         self.drifters.setGPUStream(self.gpu_stream)
         self.drifter_t = 0.0
     
+    @Instrumentation.instrument(Instrumentation.TRANSFER,
+                                nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
     def download(self, interior_domain_only=False):
         """
         Download the latest time step from the GPU
@@ -285,6 +293,8 @@ class Simulator(object):
             return self.gpu_data.download(self.gpu_stream)
     
     
+    @Instrumentation.instrument(Instrumentation.TRANSFER,
+                                nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
     def downloadPrevTimestep(self):
         """
         Download the second-latest time step from the GPU
@@ -323,6 +333,8 @@ class Simulator(object):
         
         
         
+    @Instrumentation.instrument(Instrumentation.TRANSFER,
+                                nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(args))
     def upload(self, eta0, hu0, hv0, eta1=None, hu1=None, hv1=None):
         """
         Reinitialize simulator with a new ocean state.
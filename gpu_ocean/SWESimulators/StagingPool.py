@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements a pool of reusable host staging buffers for
+the asynchronous uploads of CUDAArray2D. The buffers are page-locked (pinned),
+so that the uploads can use DMA and overlap with the host, and are kept in the
+pool keyed on shape and dtype, so that the simulators of an ensemble share
+them instead of allocating new host arrays for every upload. Downloads and
+texture uploads are synchronous, and do not go through the pool.
+The pool keeps statistics on hits, misses and bytes.
+
+The pool is capped by max_bytes. Buffers that do not fit under the cap are
+allocated for the single transfer only. In host-only mode, the buffers are
+ordinary numpy arrays, so that the pooling policy can be used and tested
+without a GPU. The pool is disabled by default, as the pinned memory it holds
+is only freed by clear() or disable(). Usage:
+
+    from SWESimulators import StagingPool
+    StagingPool.enable(max_bytes=512*1024**2)
+    ... run simulations ...
+    print(StagingPool.statistics())
+    StagingPool.disable()
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import collections
+
+import numpy as np
+
+from SWESimulators import LazyImport
+cuda = LazyImport.lazyImport('pycuda.driver')
+
+
+class StagingPool(object):
+    """
+    Pool of host staging buffers, keyed on shape and dtype.
+    Buffers are taken from the pool by acquire() and given back by release().
+    """
+
+    def __init__(self, max_bytes=256*1024**2, host_only=False):
+        """
+        max_bytes: Maximum number of bytes held by the pool (free and in use)
+        host_only: Use ordinary numpy arrays instead of page-locked memory (no GPU needed)
+        """
+        assert(max_bytes >= 0), "max_bytes must be non-negative"
+        self.max_bytes = int(max_bytes)
+        self.host_only = host_only
+
+        # (shape, dtype) -> free buffers as [buffer, event] pairs, the least recently released first
+        self._free = collections.OrderedDict()
+
+        # id -> buffer for the buffers owned by the pool (free and in use)
+        self._owned = {}
+        self.bytes_held = 0
+
+        self.reset_statistics()
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.bypasses = 0
+        self.evictions = 0
+        self.bytes_hit = 0
+        self.bytes_allocated = 0
+        self.peak_bytes_held = self.bytes_held
+
+    def acquire(self, shape, dtype=np.float32):
+        """
+        Returns a C-contiguous host buffer of the given shape and dtype,
+        reused from the pool if a free one has completed its last transfer.
+        """
+        shape = tuple(int(n) for n in np.atleast_1d(shape))
+        dtype = np.dtype(dtype)
+        key = (shape, dtype.str)
+
+        free = self._free.get(key)
+        if free:
+            for i, (buffer, event) in enumerate(free):
+                if event is None or event.query():
+                    del free[i]
+                    self.hits += 1
+                    self.bytes_hit += buffer.nbytes
+                    return buffer
+
+        self.misses += 1
+        nbytes = int(np.prod(shape))*dtype.itemsize
+        if nbytes <= self.max_bytes:
+            self._evict(self.max_bytes - nbytes)
+        buffer = self._allocate(shape, dtype)
+        self.bytes_allocated += nbytes
+        if self.bytes_held + nbytes > self.max_bytes:
+            # Does not fit under the cap: used for this transfer only
+            self.bypasses += 1
+            return buffer
+
+        self._owned[id(buffer)] = buffer
+        self.bytes_held += nbytes
+        self.peak_bytes_held = max(self.peak_bytes_held, self.bytes_held)
+        return buffer
+
+    def release(self, buffer, gpu_stream=None):
+        """
+        Gives the buffer back to the pool.
+        If gpu_stream is given, the buffer is not reused before the work
+        enqueued on the stream so far (e.g., an asynchronous upload) has completed.
+        """
+        if self._owned.get(id(buffer)) is not buffer:
+            return
+        event = None
+        if gpu_stream is not None and not self.host_only:
+            event = cuda.Event()
+            event.record(gpu_stream)
+        key = (buffer.shape, buffer.dtype.str)
+        self._free.setdefault(key, []).append([buffer, event])
+        self._free.move_to_end(key)
+
+    def clear(self):
+        """
+        Frees all buffers that are not in use
+        """
+        self._evict(0)
+
+    def statistics(self):
+        """
+        Returns a dict with the pool statistics
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'bypasses': self.bypasses,
+                'evictions': self.evictions,
+                'bytes_hit': self.bytes_hit,
+                'bytes_allocated': self.bytes_allocated,
+                'bytes_held': self.bytes_held,
+                'peak_bytes_held': self.peak_bytes_held,
+                'free_buffers': sum(len(free) for free in self._free.values()),
+                'max_bytes': self.max_bytes,
+                'host_only': self.host_only}
+
+    def _allocate(self, shape, dtype):
+        if self.host_only:
+            return np.empty(shape, dtype=dtype)
+        return cuda.pagelocked_empty(shape, dtype)
+
+    def _evict(self, max_bytes_held):
+        """
+        Frees free buffers, the least recently released first, until at most
+        max_bytes_held bytes are held. Buffers with pending transfers are kept.
+        """
+        for key in list(self._free.keys()):
+            if self.bytes_held <= max_bytes_held:
+                break
+            free = self._free[key]
+            for entry in list(free):
+                if self.bytes_held <= max_bytes_held:
+                    break
+                buffer, event = entry
+                if event is not None and not event.query():
+                    continue
+                free.remove(entry)
+                del self._owned[id(buffer)]
+                self.bytes_held -= buffer.nbytes
+                self.evictions += 1
+            if not free:
+                del self._free[key]
+
+
+
+###---------------------------
+### Module pool
+###---------------------------
+
+# The pool used by the simulators, or None if staging is disabled (default).
+# Kept as a module variable so that the check in disabled mode is as cheap as possible.
+pool = None
+
+def enable(max_bytes=256*1024**2, host_only=False):
+    """
+    Replaces the pool used by the simulators by a new, empty pool
+    """
+    global pool
+    if pool is not None:
+        pool.clear()
+    pool = StagingPool(max_bytes=max_bytes, host_only=host_only)
+
+def disable():
+    """
+    Frees the free buffers of the pool, and makes the simulators allocate 
+    new host arrays for each transfer, as without the pool
+    """
+    global pool
+    if pool is not None:
+        pool.clear()
+    pool = None
+
+def is_enabled():
+    return pool is not None
+
+def acquire(shape, dtype=np.float32):
+    """
+    Returns a staging buffer from the module pool, or a new numpy array if staging is disabled
+    """
+    if pool is None:
+        return np.empty(shape, dtype=dtype)
+    return pool.acquire(shape, dtype)
+
+def release(buffer, gpu_stream=None):
+    """
+    Gives a buffer from acquire() back to the module pool
+    """
+    if pool is not None:
+        pool.release(buffer, gpu_stream)
+
+def statistics():
+    """
+    Returns the statistics of the module pool (None if staging is disabled)
+    """
+    if pool is None:
+        return None
+    return pool.statistics()
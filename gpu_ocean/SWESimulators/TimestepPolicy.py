@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements policies for adaptive time stepping, deciding
+when a simulator should recompute its time step from the CFL condition.
+
+Recomputing dt requires a reduction over the domain on the GPU followed by
+a download of the result, which forces the host to wait for the GPU. The
+policies in this module reduce how often, and how hard, the host waits.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+def maxTimestepHost(eta, hu, hv, Hm, dx, dy, g, courant_number=1.0):
+    """
+    Host reference for the maximum allowed time step according to the CFL
+    conditions of CDKLM16, scaled with the provided courant number.
+    eta, hu, hv and Hm are the interior cell values.
+    """
+    h = eta + Hm
+    gravityWaves = np.sqrt(g*h)
+    u = hu/h
+    v = hv/h
+
+    max_dt = 0.25*min(dx/np.max(np.abs(u)+gravityWaves),
+                      dy/np.max(np.abs(v)+gravityWaves) )
+
+    return courant_number*max_dt
+
+
+class TimestepPolicy(object):
+    """
+    Base class for adaptive time step policies.
+
+    The policy is called through update(sim) before each time step, and
+    sets sim.dt. It only relies on the following methods of the simulator:
+        sim.requestMaxDt(): Starts computing the maximum dt (without courant number)
+            of the current state, without waiting for the result
+        sim.maxDtReady(): True if the result of the latest request is available
+        sim.readMaxDt(): Waits for the latest request and returns its result
+    """
+
+    def __init__(self, courant_number=None):
+        """
+        courant_number: Scaling of the CFL time step. Defaults to sim.courant_number
+        """
+        self.courant_number = courant_number
+        self.reset()
+
+    def reset(self):
+        """
+        Forgets all state, so that the next update recomputes dt
+        """
+        self.num_updates = 0
+        self.num_recomputes = 0
+        self.pending = False
+
+    def _courantNumber(self, sim):
+        if self.courant_number is None:
+            return sim.courant_number
+        return self.courant_number
+
+    def _recompute(self, sim, safety_factor=1.0):
+        """
+        Requests and waits for the maximum dt of the current state
+        """
+        sim.requestMaxDt()
+        self._setDt(sim, sim.readMaxDt(), safety_factor)
+        self.pending = False
+        self.num_recomputes += 1
+
+    def _setDt(self, sim, max_dt, safety_factor=1.0):
+        sim.dt = np.float32(safety_factor*self._courantNumber(sim)*max_dt)
+
+    def update(self, sim):
+        raise NotImplementedError("This function must be implemented in the subclass")
+
+
+class EveryStepTimestep(TimestepPolicy):
+    """
+    Recomputes dt from the current state before every time step.
+    This is the original behaviour of CDKLM16.step(update_dt=True), and
+    synchronizes the host with the GPU once per step.
+    """
+
+    def update(self, sim):
+        self._recompute(sim)
+        self.num_updates += 1
+
+
+class LaggedTimestep(TimestepPolicy):
+    """
+    Uses the maximum dt of the previous state, scaled with a safety factor.
+
+    Each update reads the reduction requested in the previous update, and
+    requests a new reduction of the current state. Since the previous request
+    was queued before the previous time step, the host only waits for work that
+    is already well underway, and the GPU queue is never drained.
+    The safety factor accounts for the state changing during one time step.
+    """
+
+    def __init__(self, courant_number=None, safety_factor=0.9):
+        """
+        safety_factor: Scaling of the lagged time step, in (0, 1]
+        """
+        assert(safety_factor > 0 and safety_factor <= 1), "safety_factor must be in (0, 1]"
+        self.safety_factor = safety_factor
+        super(LaggedTimestep, self).__init__(courant_number=courant_number)
+
+    def update(self, sim):
+        if self.pending:
+            self._setDt(sim, sim.readMaxDt(), self.safety_factor)
+            self.num_recomputes += 1
+        else:
+            # No earlier estimate exists, so use the current state
+            self._recompute(sim, self.safety_factor)
+
+        sim.requestMaxDt()
+        self.pending = True
+        self.num_updates += 1
+
+
+class PeriodicTimestep(TimestepPolicy):
+    """
+    Recomputes dt from the current state every interval steps, and keeps dt fixed in between.
+
+    With guard enabled, a reduction is also requested in every step. Its result
+    is only checked if it is ready (maxDtReady), so the host never waits for it.
+    If the check shows that the current dt exceeds the (guard_factor scaled)
+    CFL time step, dt is recomputed immediately.
+    """
+
+    def __init__(self, courant_number=None, interval=10, guard=True, guard_factor=1.0):
+        """
+        interval: Number of time steps between each recompute of dt
+        guard: Check the CFL condition in between recomputes when possible
+        guard_factor: The guard triggers when dt > guard_factor*courant_number*max_dt
+        """
+        assert(interval > 0), "interval must be positive"
+        self.interval = interval
+        self.guard = guard
+        self.guard_factor = guard_factor
+        super(PeriodicTimestep, self).__init__(courant_number=courant_number)
+
+    def reset(self):
+        super(PeriodicTimestep, self).reset()
+        self.steps_since_recompute = 0
+        self.num_guard_triggers = 0
+
+    def _guardTriggered(self, sim):
+        if not (self.pending and sim.maxDtReady()):
+            return False
+
+        guard_max_dt = sim.readMaxDt()
+        self.pending = False
+        return sim.dt > self.guard_factor*self._courantNumber(sim)*guard_max_dt
+
+    def update(self, sim):
+        recompute = self.num_updates == 0 or self.steps_since_recompute >= self.interval
+        if not recompute and self.guard and self._guardTriggered(sim):
+            recompute = True
+            self.num_guard_triggers += 1
+
+        if recompute:
+            self._recompute(sim)
+            self.steps_since_recompute = 0
+        elif self.guard:
+            sim.requestMaxDt()
+            self.pending = True
+
+        self.steps_since_recompute += 1
+        self.num_updates += 1
@@ -85,7 +85,12 @@ class WIND_STRESS_PARAMS(Structure):
                 ("wind_direction", c_float)]
 
 class BaseWindStress(object):
-    """Superclass for wind stress params."""
+    """Superclass for parametric wind stress.
+    
+    The kernels only read wind stress tables (WindStress), so the parametric
+    wind stresses are evaluated on the CPU by evaluate(), and turned into 
+    tables by toWindStress() or windStressTables().
+    """
     
     __metaclass__ = ABCMeta
 
@@ -102,9 +107,45 @@ class BaseWindStress(object):
         """Return correct WindStressParams struct (defined above AND in common.cu)"""
         pass
     
+    @abstractmethod
+    def evaluate(self, t, x, y):
+        """
+        Return the wind stress (X, Y) divided by the density of sea water, 
+        at the times t (s) and positions x, y (m). 
+        t, x and y are broadcast against each other.
+        """
+        pass
+    
     def csize(self):
         """Return size (in bytes) of WindStressParams struct (defined above AND in common.cu)"""
         return sizeof(WIND_STRESS_PARAMS)
+    
+    def toWindStress(self, t, nx, ny, dx, dy):
+        """
+        Return the wind stress table at the times t in the cell centers of an nx*ny grid
+        """
+        return windStressTables(self, t, nx, ny, dx, dy)[0]
+
+    
+def _stressAmplitude(tau0, rho):
+    """tau0/rho, with no stress when the density of sea water is not given"""
+    if rho == 0:
+        return 0.0
+    return np.float64(tau0)/np.float64(rho)
+
+def windDragCoefficient(wind_speed):
+    """C_drag as defined by Engedahl (1995)"""
+    return np.where(wind_speed < 11, 0.0012, 0.00049 + 0.000065*wind_speed)
+
+def _rotateClockwise(X, Y, degrees):
+    """
+    Rotates the vectors (X, Y) clockwise, which is the same as adding degrees
+    to the (clockwise) wind direction.
+    """
+    angle = np.radians(degrees)
+    cos = np.cos(angle)
+    sin = np.sin(angle)
+    return X*cos + Y*sin, Y*cos - X*sin
 
 class NoWindStress(BaseWindStress):
     """No wind stress."""
@@ -120,6 +161,10 @@ class NoWindStress(BaseWindStress):
         """Return correct WindStressParams struct (defined in common.cu)"""
         wind_stress = WIND_STRESS_PARAMS(wind_stress_type=self.type())
         return wind_stress
+    
+    def evaluate(self, t, x, y):
+        zero = np.zeros(np.broadcast(t, x, y).shape)
+        return zero, zero.copy()
 
 class GenericUniformWindStress(BaseWindStress):
     """Generic uniform wind stress.
@@ -127,15 +172,17 @@ class GenericUniformWindStress(BaseWindStress):
     rho_air: Density of air (approx. 1.3 kg / m^3 at 0 deg. C and 1013.25 mb)
     speed: Wind speed in m/s
     direction: Wind direction in degrees (clockwise, 0 being wind blowing from north towards south)
+    rho: Density of sea water (1025.0 kg / m^3)
     """
 
     def __init__(self, \
                  rho_air=0, \
-                 wind_speed=0, wind_direction=0):
-        assert(False), "This is a deprecated wind stress definition. Please use the WindStress class!"
+                 wind_speed=0, wind_direction=0, \
+                 rho=1025.0):
         self.rho_air = np.float32(rho_air)
         self.wind_speed = np.float32(wind_speed)
         self.wind_direction = np.float32(wind_direction)
+        self.rho = np.float32(rho)
 
     def type(self):
         """Mapping to wind_stress_type (defined in common.cu)"""
@@ -148,6 +195,14 @@ class GenericUniformWindStress(BaseWindStress):
                                   wind_speed=self.wind_speed,
                                   wind_direction=self.wind_direction)
         return wind_stress
+    
+    def evaluate(self, t, x, y):
+        # tau_s = rho_air * C_drag * |W|W, with the wind blowing towards direction + 180 degrees
+        speed = np.float64(self.wind_speed)
+        stress = _stressAmplitude(self.rho_air*windDragCoefficient(speed)*speed*speed, self.rho)
+        direction = np.radians(np.float64(self.wind_direction))
+        shape = np.broadcast(t, x, y).shape
+        return np.full(shape, -stress*np.sin(direction)), np.full(shape, -stress*np.cos(direction))
 
 class UniformAlongShoreWindStress(BaseWindStress):
     """Uniform along shore wind stress.
@@ -159,7 +214,6 @@ class UniformAlongShoreWindStress(BaseWindStress):
 
     def __init__(self, \
                  tau0=0, rho=0, alpha=0):
-        assert(False), "This is a deprecated wind stress definition. Please use the WindStress class!"
         self.tau0 = np.float32(tau0)
         self.rho = np.float32(rho)
         self.alpha = np.float32(alpha)
@@ -175,9 +229,14 @@ class UniformAlongShoreWindStress(BaseWindStress):
                                   rho=self.rho,
                                   alpha=self.alpha)
         return wind_stress
+    
+    def evaluate(self, t, x, y):
+        X = _stressAmplitude(self.tau0, self.rho) * np.exp(-np.float64(self.alpha)*y)
+        X = np.broadcast_to(X, np.broadcast(t, x, y).shape)
+        return X, np.zeros_like(X)
 
 class BellShapedAlongShoreWindStress(BaseWindStress):
-    """Bell shaped along shore wind stress.
+    """Bell shaped along shore wind stress, which is turned off after 48 hours.
     
     xm: Maximum wind stress for bell shaped wind stress
     tau0: Amplitude of wind stress (Pa)
@@ -187,7 +246,6 @@ class BellShapedAlongShoreWindStress(BaseWindStress):
 
     def __init__(self, \
                  xm=0, tau0=0, rho=0, alpha=0):
-        assert(False), "This is a deprecated wind stress definition. Please use the WindStress class!"
         self.xm = np.float32(xm)
         self.tau0 = np.float32(tau0)
         self.rho = np.float32(rho)
@@ -205,6 +263,14 @@ class BellShapedAlongShoreWindStress(BaseWindStress):
                                   rho=self.rho,
                                   alpha=self.alpha)
         return wind_stress
+    
+    def evaluate(self, t, x, y):
+        alpha = np.float64(self.alpha)
+        a = alpha*(x - np.float64(self.xm))
+        X = _stressAmplitude(self.tau0, self.rho) * np.exp(-a*a) * np.exp(-alpha*y)
+        X = np.where(np.asarray(t) <= 48.0*3600.0, X, 0.0)
+        X = np.broadcast_to(X, np.broadcast(t, x, y).shape)
+        return X, np.zeros_like(X)
 
 class MovingCycloneWindStress(BaseWindStress):
     """Moving cyclone wind stress.
@@ -214,18 +280,22 @@ class MovingCycloneWindStress(BaseWindStress):
     y0: Initial y position of moving cyclone (dy*(ny/2) - v0*3600.0*48.0)
     u0: Translation speed along x for moving cyclone (30.0/sqrt(5.0))
     v0: Translation speed along y for moving cyclone (-0.5*u0)
+    tau0: Amplitude of wind stress (Pa)
+    rho: Density of sea water (1025.0 kg / m^3)
     """
 
     def __init__(self, \
                  Rc=0, \
                  x0=0, y0=0, \
-                 u0=0, v0=0):
-        assert(False), "This is a deprecated wind stress definition. Please use the WindStress class!"
+                 u0=0, v0=0, \
+                 tau0=0, rho=0):
         self.Rc = np.float32(Rc)
         self.x0 = np.float32(x0)
         self.y0 = np.float32(y0)
         self.u0 = np.float32(u0)
         self.v0 = np.float32(v0)
+        self.tau0 = np.float32(tau0)
+        self.rho = np.float32(rho)
 
     def type(self):
         """Mapping to wind_stress_type (defined in common.cu)"""
@@ -240,3 +310,68 @@ class MovingCycloneWindStress(BaseWindStress):
                                   u0=self.u0,
                                   v0=self.v0)
         return wind_stress
+    
+    def evaluate(self, t, x, y):
+        amplitude = _stressAmplitude(self.tau0, self.rho)
+        if amplitude == 0 or self.Rc == 0:
+            zero = np.zeros(np.broadcast(t, x, y).shape)
+            return zero, zero.copy()
+        
+        Rc = np.float64(self.Rc)
+        a = x - np.float64(self.x0) - np.float64(self.u0)*t
+        b = y - np.float64(self.y0) - np.float64(self.v0)*t
+        c = 1.0 - np.sqrt(a*a + b*b)/Rc
+        amplitude = amplitude * np.exp(-0.5*c*c) / Rc
+        return -amplitude*b, amplitude*a
+
+
+def perturbWindDirection(wind_stress, max_wind_direction_perturbation, num_members=1, random_state=None):
+    """
+    Returns num_members copies of the wind stress table, where the wind direction of each 
+    member and table time is perturbed by +/- max_wind_direction_perturbation (degrees).
+    The perturbations of all members are drawn and applied in one batch.
+    wind_stress: WindStress table
+    random_state: numpy RandomState (default is the global numpy random state)
+    """
+    X = np.array(wind_stress.X, dtype=np.float64)
+    Y = np.array(wind_stress.Y, dtype=np.float64)
+    return _windStressMembers(wind_stress.t, X, Y, num_members, max_wind_direction_perturbation, random_state)
+
+def windStressTables(wind_stress, t, nx, ny, dx, dy, \
+                     num_members=1, max_wind_direction_perturbation=0, random_state=None):
+    """
+    Evaluates a parametric wind stress in the cell centers of an nx*ny grid 
+    at all the times t in one batch, and returns a list of num_members WindStress tables.
+    With max_wind_direction_perturbation > 0, the wind direction of each member 
+    and table time is perturbed by +/- max_wind_direction_perturbation (degrees).
+    wind_stress: Parametric wind stress (BaseWindStress)
+    random_state: numpy RandomState (default is the global numpy random state)
+    """
+    t = np.atleast_1d(np.asarray(t, dtype=np.float64))
+    x = (np.arange(nx) + 0.5)*dx
+    y = (np.arange(ny) + 0.5)*dy
+    shape = (len(t), ny, nx)
+    X, Y = wind_stress.evaluate(t[:, np.newaxis, np.newaxis], x[np.newaxis, np.newaxis, :], y[np.newaxis, :, np.newaxis])
+    X = np.broadcast_to(X, shape)
+    Y = np.broadcast_to(Y, shape)
+    return _windStressMembers(t, X, Y, num_members, max_wind_direction_perturbation, random_state)
+
+def _windStressMembers(t, X, Y, num_members, max_wind_direction_perturbation, random_state):
+    """
+    Makes num_members WindStress tables from the (num_times, ny, nx) stress X, Y, 
+    with per member and table time perturbations of the wind direction
+    """
+    if max_wind_direction_perturbation > 0:
+        if random_state is None:
+            random_state = np.random
+        # max perturbation +/- max_wind_direction_perturbation deg within original wind direction
+        perturbation = 2.0*(random_state.rand(num_members, len(t)) - 0.5) * max_wind_direction_perturbation
+        X, Y = _rotateClockwise(X[np.newaxis], Y[np.newaxis], perturbation[:, :, np.newaxis, np.newaxis])
+    else:
+        X = np.broadcast_to(X, (num_members,) + X.shape)
+        Y = np.broadcast_to(Y, (num_members,) + Y.shape)
+    X = np.ascontiguousarray(X, dtype=np.float32)
+    Y = np.ascontiguousarray(Y, dtype=np.float32)
+    
+    t = list(t)
+    return [WindStress(t=t, X=list(X[m]), Y=list(Y[m])) for m in range(num_members)]
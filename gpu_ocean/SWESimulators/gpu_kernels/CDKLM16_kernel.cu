@@ -451,7 +451,10 @@ __global__ void cdklm_swe_2D(
 
         // Boundary conditions (1: wall, 2: periodic, 3: open boundary (flow relaxation scheme))
         // Note: these are packed north, east, south, west boolean bits into an int
-        const int boundary_conditions_) {
+        const int boundary_conditions_,
+
+        // Tiles with wet cells, or NULL to compute all tiles (see activeTile in common.cu)
+        const int* active_tiles_) {
             
     //const float land_value_ = 1.0e20;
 
@@ -461,12 +464,13 @@ __global__ void cdklm_swe_2D(
     const int ty = threadIdx.y;
 
     //Index of block within domain
-    const int bx = blockDim.x * blockIdx.x;
-    const int by = blockDim.y * blockIdx.y;
+    const int2 tile = activeTile(active_tiles_, (NX + block_width - 1) / block_width);
+    const int bx = blockDim.x * tile.x;
+    const int by = blockDim.y * tile.y;
 
     //Index of cell within domain
-    const int ti = blockIdx.x * blockDim.x + threadIdx.x + 2; //Skip global ghost cells, i.e., +2
-    const int tj = blockIdx.y * blockDim.y + threadIdx.y + 2;
+    const int ti = bx + threadIdx.x + 2; //Skip global ghost cells, i.e., +2
+    const int tj = by + threadIdx.y + 2;
 
     // Our physical variables
     // Input is [eta, hu, hv]
@@ -824,4 +824,20 @@ __device__ float desingularize(const float& h, const float& hu, const float& eps
 }
 
 
+
+/**
+  * Returns the index (x, y) of the tile (block of cells) handled by this thread block.
+  * If active_tiles_ is NULL, the kernel is launched with one block per tile.
+  * Otherwise, the kernel is launched with one block per active tile along x, and
+  * active_tiles_ holds the tile indices tile_y*num_tiles_x_ + tile_x (see Common.ActiveTiles).
+  */
+__device__ int2 activeTile(const int* active_tiles_, const int num_tiles_x_) {
+    if (active_tiles_ == 0) {
+        return make_int2(blockIdx.x, blockIdx.y);
+    }
+    const int tile = active_tiles_[blockIdx.x];
+    return make_int2(tile % num_tiles_x_, tile / num_tiles_x_);
+}
+
+
 #endif // COMMON_CU
@@ -396,7 +396,10 @@ __global__ void geostrophicBalance(
 
         // Ocean data parameter - size [nx + 5, ny + 5]
         float* Hi_ptr_, const int Hi_pitch_,
-        const float land_value_
+        const float land_value_,
+
+        // Tiles with wet cells, or NULL to compute all tiles (see activeTile in common.cu)
+        const int* active_tiles_
     ) {
 
     //Index of cell within block
@@ -404,8 +407,9 @@ __global__ void geostrophicBalance(
     const int ty = threadIdx.y;
 
     //Index of start of block within domain
-    const int bx = blockDim.x * blockIdx.x + ghost_cells_x_; // Compansating for ghost cells
-    const int by = blockDim.y * blockIdx.y + ghost_cells_y_; // Compensating for ghost cells
+    const int2 tile = activeTile(active_tiles_, (nx_ + blockDim.x - 1) / blockDim.x);
+    const int bx = blockDim.x * tile.x + ghost_cells_x_; // Compansating for ghost cells
+    const int by = blockDim.y * tile.y + ghost_cells_y_; // Compensating for ghost cells
 
     //Index of cell within domain
     const int ti = bx + tx;
@@ -545,7 +549,10 @@ __global__ void bicubicInterpolation(
 
         // Ocean data parameter - size [nx + 5, ny + 5]
         float* Hi_ptr_, const int Hi_pitch_,
-        const float land_value_
+        const float land_value_,
+
+        // Tiles with wet cells, or NULL to compute all tiles (see activeTile in common.cu)
+        const int* active_tiles_
     ) {
     
     // Each thread is responsible for one grid point in the computational grid.
@@ -557,8 +564,9 @@ __global__ void bicubicInterpolation(
     const int ty = threadIdx.y;
 
     //Index of start of block within domain
-    const int bx = blockDim.x * blockIdx.x + ghost_cells_x_; // Compansating for ghost cells
-    const int by = blockDim.y * blockIdx.y + ghost_cells_y_; // Compensating for ghost cells
+    const int2 tile = activeTile(active_tiles_, (nx_ + blockDim.x - 1) / blockDim.x);
+    const int bx = blockDim.x * tile.x + ghost_cells_x_; // Compansating for ghost cells
+    const int by = blockDim.y * tile.y + ghost_cells_y_; // Compensating for ghost cells
 
     //Index of cell within domain
     const int ti = bx + tx;
@@ -467,15 +467,10 @@ def plotAllDrifters(obs, drifter_ids=None,background = False, url = None, color_
     if drifter_ids is None:
         drifter_ids = np.arange(obs.get_num_drifters(ignoreBuoys=True))
     
-    num_drifters = len(drifter_ids)
-    
-    drifter_paths = [None]*num_drifters
-
     forecast_start_t = 0
     forecast_end_t = end*3600
 
-    for i in range(num_drifters):
-        drifter_paths[i] = obs.get_drifter_path(drifter_ids[i], forecast_start_t, forecast_end_t, in_km = False)
+    drifter_paths = obs.get_drifter_paths(drifter_ids, forecast_start_t, forecast_end_t, in_km = False)
 
     if ax is None:
         ax = createForecastCanvas(obs, background = background,url = url,domain = domain, hour = end, zoom_element = zoom_element, zoom = zoom)
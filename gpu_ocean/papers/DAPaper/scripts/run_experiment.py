@@ -52,6 +52,9 @@ parser.add_argument('--num_days', type=int, default=7)
 parser.add_argument('--num_hours', type=int, default=24) 
 parser.add_argument('--forecast_days', type=int, default=3)
 parser.add_argument('--profiling', action='store_true')
+parser.add_argument('--checkpoint_interval', type=int, default=12) # in 5 minute cycles
+parser.add_argument('--forecast_group_size', type=int, default=10) # particles forecast per pass, checkpointed after each pass
+parser.add_argument('--resume', type=str, default=None) # experiment folder to resume
 
 
 args = parser.parse_args()
@@ -79,11 +82,21 @@ assert len(os.listdir(truth_path)) == 2 or len(os.listdir(truth_path)) == 3, \
 
 timestamp = datetime.datetime.now().strftime("%Y_%m_%d-%H_%M_%S")
 media_dir = args.media_dir
-destination_dir = os.path.join(media_dir, "da_experiment_" +  timestamp + "/")
-os.makedirs(destination_dir)
+if args.resume is None:
+    destination_dir = os.path.join(media_dir, "da_experiment_" +  timestamp + "/")
+    os.makedirs(destination_dir)
 
-# Copy the truth into the destination folder
-shutil.copytree(truth_path, os.path.join(destination_dir, 'truth'))
+    # Copy the truth into the destination folder
+    shutil.copytree(truth_path, os.path.join(destination_dir, 'truth'))
+    netcdf_dir = destination_dir
+else:
+    destination_dir = args.resume
+    assert os.path.isdir(destination_dir), "Experiment folder to resume does not exist: " + str(destination_dir)
+
+    # Keep the NetCDF files from the interrupted run
+    netcdf_dir = os.path.join(destination_dir, "resumed_" + timestamp + "/")
+    os.makedirs(netcdf_dir)
+checkpoint_dir = os.path.join(destination_dir, 'checkpoint')
 
 # Define misc filenames
 log_file = os.path.join(destination_dir, 'description.txt')
@@ -92,8 +105,11 @@ particleInfoPrefix = os.path.join(destination_dir, 'particle_info_')
 forecastFileBase = os.path.join(destination_dir, 'forecast_member_')
 
 
-with open(log_file, 'w') as f:
-    f.write('Data Assimilation experiment ' + timestamp + '\n')
+with open(log_file, 'a') as f:
+    if args.resume is not None:
+        f.write('\nResumed ' + timestamp + '\n')
+    else:
+        f.write('Data Assimilation experiment ' + timestamp + '\n')
     f.write('----------------------------------------------' + '\n')
 
 def logParams():
@@ -168,6 +184,8 @@ from SWESimulators import IEWPFOcean
 from SWESimulators import GPUDrifterCollection
 # For ObservationType:
 from SWESimulators import DataAssimilationUtils as dautils
+# For running the experiment:
+from SWESimulators import ExperimentDriver
 
 toc = time.time()
 log("\n{:02.4f} s: ".format(toc-tic) + 'GPU Ocean packages imported', True)
@@ -201,7 +219,7 @@ ensemble = EnsembleFromFiles.EnsembleFromFiles(gpu_ctx, args.ensemble_size, \
                                                args.observation_variance,
                                                cont_write_netcdf = cont_write_netcdf,
                                                use_lcg = True,
-                                               write_netcdf_directory = destination_dir,
+                                               write_netcdf_directory = netcdf_dir,
                                                observation_type=observation_type)
 
 # Configure observations according to the selected drifters:
@@ -238,14 +256,35 @@ else:
 #   DATA ASSIMILATION
 #
 
-obstime = 3*24*60*60
-
-master_tic = time.time()
-
 numDays = args.num_days 
 numHours = args.num_hours 
 forecast_days = args.forecast_days
 
+# Assimilation every 5 minutes, with state samples every minute, 
+# and output at the end of each day, followed by the forecast
+plan = ExperimentDriver.ExperimentPlan(start_time, num_cycles=numDays*numHours*12, 
+                                       cycle_length=5*60, sample_interval=60,
+                                       assimilate=(method == 'iewpf2'),
+                                       output_interval=numHours*60*60,
+                                       forecast_duration=forecast_days*24*60*60,
+                                       forecast_observation_interval=5*60,
+                                       forecast_output_interval=24*60*60)
+forecast_end_time = plan.forecast_end_t
+
+model = ExperimentDriver.EnsembleExperimentModel(ensemble, iewpf=iewpf,
+                                                 particle_info_prefix=particleInfoPrefix,
+                                                 forecast_file_base=forecastFileBase)
+
+tic = time.time()
+driver = ExperimentDriver.ExperimentDriver(model, plan, 
+                                           checkpoint_dir=None if profiling else checkpoint_dir,
+                                           checkpoint_interval=args.checkpoint_interval,
+                                           forecast_group_size=args.forecast_group_size)
+toc = time.time()
+if driver.completed_cycles > 0:
+    log("{:02.4f} s: ".format(toc-tic) + "Resumed after " + str(driver.completed_cycles) + " cycles and " + \
+        str(len(driver.completed_forecasts)) + " forecasts", True)
+
 
 log('---------- Starting simulation --------------') 
 log('--- numDays:       ' + str(numDays))
@@ -253,118 +292,32 @@ log('--- numHours:      ' + str(numHours))
 log('--- forecast_days: ' + str(forecast_days))
 log('---------------------------------------------') 
 
-
-for day in range(numDays):
-    log('-------- Starting day ' + str(day))
-    
-    for hour in range(numHours):
-        
-        for fiveMin in range(12):
-            
-            drifter_cells = ensemble.getDrifterCells()
-            
-            if method == "iewpf2":
-                for minute in range(5):
-                    obstime += 60
-                    ensemble.stepToObservation(obstime, model_error_final_step=(minute<4))
-
-                    if minute == 4:
-                        iewpf.iewpf_2stage(ensemble, perform_step=False)
-
-                    ensemble.registerStateSample(drifter_cells)
-                # Done minutes
-            elif method == "none":
-                for minute in range(5):
-                    obstime += 60
-                    ensemble.stepToObservation(obstime, model_error_final_step=True)
-                    ensemble.registerStateSample(drifter_cells)
-                # Done minutes
-                
-        # Done five minutes
-    
-        toc = time.time()
-        log("{:04.1f} s: ".format(toc-master_tic) + " Done simulating hour " + str(hour + 1) + " of day " + str(day + 3))
-    # Done hours
-
-    ensemble.dumpParticleInfosToFile(particleInfoPrefix)
-    
-    ensemble.writeEnsembleToNetCDF()
-    
-# Done days
-
+master_tic = time.time()
+for day in range(driver.completed_cycles//(numHours*12), numDays):
+    driver.runAssimilation(max_cycles=numHours*12 - driver.completed_cycles % (numHours*12))
+    toc = time.time()
+    log("{:04.1f} s: ".format(toc-master_tic) + " Done simulating day " + str(day + 3))
 
 
 ### -------------------------------------------------
 #   Start forecast
 #
 
-
 log('-----------------------------------------------------------')
 log('-----------   STARTING FORECAST              --------------')
 log('-----------------------------------------------------------')
 
-forecast_start_time = obstime
-
-# Read all drifters (even those that are not used in the assimilation)
-drifter_start_positions = ensemble.observeTrueDrifters(applyDrifterSet=False, ignoreBuoys=True)
-num_drifters = len(drifter_start_positions)
-
-forecast_end_time = forecast_start_time + forecast_days*24*60*60
-
-observation_intervals = 5*60
-netcdf_intervals = 24*60*60
-
-netcdf_iterations = int((forecast_end_time - forecast_start_time)/netcdf_intervals)
-observations_iterations = int(netcdf_intervals/observation_intervals)
-
-
 for particle_id in range(ensemble.getNumParticles()):
-    
-    if ensemble.particlesActive[particle_id]:
-
-        sim = ensemble.particles[particle_id]
-
-        tic = time.time()
-        next_obs_time = sim.t
-
-
-        drifters = GPUDrifterCollection.GPUDrifterCollection(gpu_ctx, num_drifters,
-                                                             boundaryConditions=ensemble.getBoundaryConditions(), 
-                                                             domain_size_x=ensemble.getDomainSizeX(), domain_size_y=ensemble.getDomainSizeY())
-        drifters.setDrifterPositions(drifter_start_positions)
-        sim.attachDrifters(drifters)
-
-        forecast_file_name = forecastFileBase + str(particle_id).zfill(4) + ".bz2"
-
-        observations = Observation.Observation()
-        observations.add_observation_from_sim(sim)
-
-        for netcdf_it in range(netcdf_iterations):
-
-            for obs_it in range(observations_iterations):
-                next_obs_time += observation_intervals
-
-                # Step until next observation 
-                sim.dataAssimilationStep(next_obs_time, write_now=False)
-
-                # Store observation
-                observations.add_observation_from_sim(sim)
-
-
-            sim.writeState()
-
-        # Write forecast to file    
-        observations.to_pickle(forecast_file_name)
-
-        toc = time.time()
-        log("{:04.1f} s: ".format(toc-tic) + " Forecast for particle " + str(particle_id) + " done")
-        log("      Forecast written to " + forecast_file_name)
-    
-    else:
+    if not ensemble.particlesActive[particle_id]:
         log("Skipping forecast for particle " + str(particle_id) + ", as this particle is dead")
 
+tic = time.time()
+driver.run()
+toc = time.time()
+log("{:04.1f} s: ".format(toc-tic) + " Forecasts done")
+log("      Forecasts written to " + forecastFileBase + "*.bz2")
+
 
-            
 # Clean up simulation and close netcdf file
 tic = time.time()
 sim = None
@@ -8,7 +8,7 @@ from matplotlib import pyplot as plt
 from IPython.display import display
 from IPython.display import Video
 
-from SWESimulators import PlotHelper, Common, OceanographicUtilities
+from SWESimulators import PlotHelper, Common, OceanographicUtilities, FrameRenderer
 
 def plotSolution(fig, 
                  eta, hu, hv, h, dx, dy, 
@@ -186,6 +186,8 @@ def plotStatistics(filename):
         t = ncfile.variables['time'][:]
         num_iterations = ncfile.variables['num_iterations'][:]
 
+        # The max_u/max_v diagnostics recorded by SimNetCDFWriter include shallow 
+        # cells, which are masked out here, so the velocities are computed from the state
         num_timesteps = len(t)
         max_abs_u = np.zeros(num_timesteps)
         max_abs_v = np.zeros(num_timesteps)
@@ -316,6 +318,34 @@ def ncAnimation(filename, title=None, movie_frames=None, create_movie=True, fig=
     
     
     
+def ncRenderAnimation(filename, output_dir=None, title=None, movie_frames=None, 
+                      fields=None, limits=None, resolution=(360, 480), 
+                      num_processes=None, save_movie=True):
+    """
+    Headless alternative to ncAnimation for long runs. The file is streamed and decimated to 
+    the given resolution, and the frames are rendered in parallel to output_dir (see FrameRenderer).
+    """
+    if (title is None):
+        title = filename.replace('_', ' ').replace('.nc', '')
+    if (output_dir is None):
+        output_dir = filename.replace('.nc', '') + "_frames"
+    if (fields is None):
+        fields = ['eta', 'hu', 'hv']
+    
+    source = FrameRenderer.FrameSource(filename, resolution=resolution)
+    renderer = FrameRenderer.FrameRenderer(source, fields=fields, limits=limits, title=title, 
+                                           num_processes=num_processes)
+    renderer.renderFrames(output_dir, num_frames=movie_frames)
+    source.close()
+    
+    if (save_movie):
+        return Video(FrameRenderer.writeMovie(output_dir, filename + '.mp4'))
+    return output_dir
+    
+    
+    
+    
+    
 def refAnimation(source_url_list, case, movie_frames=None, timestep_indices=None, create_movie=True, fig=None, save_movie=True, **kwargs): 
     
     if type(source_url_list) is not list:
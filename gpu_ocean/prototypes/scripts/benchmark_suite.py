@@ -0,0 +1,789 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2018 SINTEF Digital
+Copyright (C) 2018 Norwegian Meteorological Institute
+
+This python program runs a suite of benchmarks of the performance critical
+parts of GPU Ocean (simulator stepping, noise generation, state uploads,
+observations, resampling, wind stress tables, netCDF I/O and the IEWPF update). Each benchmark is run on
+every backend that is available on the current machine, so that the suite
+can run both on GPU nodes and on CPU-only nodes.
+
+The results are written to a JSON file together with metadata about the
+environment, and can be compared against a previously saved baseline, in
+which case the program exits with a non-zero status if a benchmark has
+become slower than the given threshold allows.
+
+Example:
+    python benchmark_suite.py --output results.json
+    python benchmark_suite.py --baseline results.json --threshold 0.2 \
+                              --benchmark-threshold netcdf_write=0.5
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import sys, os
+current_dir = os.path.dirname(os.path.realpath(__file__))
+
+if os.path.isdir(os.path.abspath(os.path.join(current_dir, '../../SWESimulators'))):
+        sys.path.insert(0, os.path.abspath(os.path.join(current_dir, '../../')))
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import shutil
+import socket
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+
+
+###------------------------------------
+### Benchmark registry
+###------------------------------------
+
+class BenchmarkSkipped(Exception):
+    """
+    Raised by a benchmark setup function when the benchmark cannot be run
+    on the current machine (e.g., missing GPU or missing python packages).
+    """
+    pass
+
+
+# List of (name, backend, function), in the order they are registered
+benchmarks = []
+
+def benchmark(name, backend):
+    """
+    Decorator for registering a benchmark.
+
+    The decorated function takes the parsed command line arguments and the
+    benchmark context as input, does all required setup, and returns a tuple
+    (run, info), where run is a function without arguments containing the
+    code to be timed, and info is a dict with additional information about the
+    benchmark (e.g., problem size).
+    """
+    def register(setup_function):
+        benchmarks.append((name, backend, setup_function))
+        return setup_function
+    return register
+
+
+class BenchmarkContext:
+    """
+    Holds resources shared between benchmarks (CUDA context, temporary
+    directory), which are created lazily when a benchmark needs them.
+    """
+    def __init__(self):
+        self.gpu_ctx = None
+        self.gpu_ctx_error = None
+        self.tmp_dir = tempfile.mkdtemp(prefix="gpuocean_benchmark_")
+
+    def get_gpu_ctx(self):
+        if self.gpu_ctx is None and self.gpu_ctx_error is None:
+            try:
+                from SWESimulators import Common
+                self.gpu_ctx = Common.CUDAContext()
+            except Exception as e:
+                self.gpu_ctx_error = str(e)
+        if self.gpu_ctx is None:
+            raise BenchmarkSkipped("No CUDA context available: " + str(self.gpu_ctx_error))
+        return self.gpu_ctx
+
+    def synchronize(self):
+        if self.gpu_ctx is not None:
+            self.gpu_ctx.synchronize()
+
+    def cleanUp(self):
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+def require_import(module_name):
+    """
+    Imports a module from SWESimulators, and skips the benchmark if the
+    module (or one of its dependencies) is not available.
+    """
+    try:
+        module = __import__('SWESimulators.' + module_name, fromlist=[module_name])
+    except ImportError as e:
+        raise BenchmarkSkipped("Could not import " + module_name + ": " + str(e))
+    return module
+
+
+
+###------------------------------------
+### Helper functions for setting up benchmarks
+###------------------------------------
+
+def make_CDKLM16(ctx, args, **kwargs):
+    """
+    Creates a double periodic CDKLM16 simulator with a Gaussian bump
+    """
+    CDKLM16 = require_import('CDKLM16')
+    Common = require_import('Common')
+    gpu_ctx = ctx.get_gpu_ctx()
+
+    nx, ny = args.nx, args.ny
+    dx, dy = 200.0, 200.0
+    ghosts = [2,2,2,2]
+    dataShape = (ny + ghosts[0] + ghosts[2], nx + ghosts[1] + ghosts[3])
+
+    y, x = np.mgrid[0:dataShape[0], 0:dataShape[1]]
+    eta0 = 0.5*np.exp(-((x - 0.5*nx)**2 + (y - 0.5*ny)**2)/(0.05*nx*ny)).astype(np.float32)
+    hu0 = np.zeros(dataShape, dtype=np.float32)
+    hv0 = np.zeros(dataShape, dtype=np.float32)
+    Hi = np.ones((dataShape[0]+1, dataShape[1]+1), dtype=np.float32)*60.0
+
+    return CDKLM16.CDKLM16(gpu_ctx, eta0, hu0, hv0, Hi,
+                           nx, ny, dx, dy, 0.0, 9.81, 1.2e-4, 0.0,
+                           boundary_conditions=Common.BoundaryConditions(2,2,2,2),
+                           **kwargs)
+
+
+def make_CPUCDKLM16(args, **kwargs):
+    """
+    Creates the same case as make_CDKLM16 with CPUSimulators.CPUCDKLM16,
+    which needs a fixed time step.
+    """
+    CPUSimulators = require_import('CPUSimulators')
+    Common = require_import('Common')
+
+    nx, ny = args.nx, args.ny
+    dx, dy = 200.0, 200.0
+    g, H = 9.81, 60.0
+    dt = 0.25*dx/np.sqrt(g*H)
+    dataShape = (ny + 4, nx + 4)
+
+    y, x = np.mgrid[0:dataShape[0], 0:dataShape[1]]
+    eta0 = 0.5*np.exp(-((x - 0.5*nx)**2 + (y - 0.5*ny)**2)/(0.05*nx*ny)).astype(np.float32)
+    hu0 = np.zeros(dataShape, dtype=np.float32)
+    hv0 = np.zeros(dataShape, dtype=np.float32)
+    Hi = np.ones((dataShape[0]+1, dataShape[1]+1), dtype=np.float32)*H
+
+    return CPUSimulators.CPUCDKLM16(None, eta0, hu0, hv0, Hi,
+                                    nx, ny, dx, dy, dt, g, 1.2e-4, 0.0,
+                                    boundary_conditions=Common.BoundaryConditions(2,2,2,2),
+                                    **kwargs)
+
+
+class HostEnsemble:
+    """
+    Minimal ensemble of CPUCDKLM16 particles for timing the batched IEWPF
+    without a GPU. The true drifter positions and the innovations are drawn
+    once, so that only the IEWPF update and the host transfers are timed.
+    """
+    def __init__(self, particles, num_drifters, observation_variance, seed=1):
+        rng = np.random.RandomState(seed)
+        sim = particles[0]
+        self.gpu_ctx = None
+        self.particles = particles
+        self.num_drifters = num_drifters
+        self.observation_cov = np.eye(2)*observation_variance
+        self.drifter_positions = np.stack([rng.uniform(0, sim.nx*sim.dx, num_drifters),
+                                           rng.uniform(0, sim.ny*sim.dy, num_drifters)], axis=1)
+        self.innovations = rng.normal(scale=np.sqrt(observation_variance),
+                                      size=(len(particles), num_drifters, 2))
+
+    def getNx(self):
+        return self.particles[0].nx
+    def getNy(self):
+        return self.particles[0].ny
+    def getDx(self):
+        return self.particles[0].dx
+    def getDy(self):
+        return self.particles[0].dy
+    def getNumParticles(self):
+        return len(self.particles)
+    def getNumDrifters(self):
+        return self.num_drifters
+    def getObservationCov(self):
+        return self.observation_cov
+    def observeTrueDrifters(self):
+        return self.drifter_positions
+    def getInnovations(self):
+        return self.innovations
+
+
+class ResamplingEnsemble:
+    """
+    Minimal ensemble for timing the resampling algorithms in DataAssimilationUtils.
+    It provides the weights, and stores the resampled indices instead of copying
+    ocean states, so that only the index computations are timed.
+    """
+    def __init__(self, num_particles, seed=1):
+        rng = np.random.RandomState(seed)
+        weights = np.exp(-0.5*rng.chisquare(4, size=num_particles))
+        self.weights = weights/np.sum(weights)
+        self.num_particles = num_particles
+        self.indices = None
+
+    def getNumParticles(self):
+        return self.num_particles
+
+    def getGaussianWeight(self):
+        return self.weights
+
+    def resample(self, newSampleIndices, reinitialization_variance):
+        self.indices = newSampleIndices
+
+
+
+###------------------------------------
+### Benchmarks
+###------------------------------------
+
+@benchmark("simulator_step_CDKLM16", "cuda")
+def bench_step_CDKLM16(args, ctx):
+    sim = make_CDKLM16(ctx, args)
+    sim.step(5*sim.dt)
+    ctx.synchronize()
+    def run():
+        sim.step(args.steps*sim.dt)
+        ctx.synchronize()
+    return run, {'nx': args.nx, 'ny': args.ny, 'steps': args.steps}
+
+
+@benchmark("simulator_step_CDKLM16", "cpu")
+def bench_step_CPUCDKLM16(args, ctx):
+    sim = make_CPUCDKLM16(args)
+    sim.step(sim.dt)
+    def run():
+        sim.step(args.cpu_steps*sim.dt)
+    return run, {'nx': args.nx, 'ny': args.ny, 'steps': args.cpu_steps}
+
+
+@benchmark("noise_generation", "cuda")
+def bench_noise_cuda(args, ctx):
+    sim = make_CDKLM16(ctx, args, small_scale_perturbation=True, small_scale_perturbation_amplitude=1.0e-5)
+    def run():
+        sim.small_scale_model_error.perturbSim(sim)
+        ctx.synchronize()
+    return run, {'nx': args.nx, 'ny': args.ny}
+
+
+@benchmark("noise_generation", "cpu")
+def bench_noise_cpu(args, ctx):
+    sim = make_CPUCDKLM16(args, small_scale_perturbation=True, small_scale_perturbation_amplitude=1.0e-5)
+    def run():
+        sim.small_scale_model_error.perturbSim(sim)
+    return run, {'nx': args.nx, 'ny': args.ny}
+
+
+def _state_upload_benchmark(args, ctx, staging):
+    """
+    Uploads the ocean state of a CDKLM16 simulator, with or without the
+    pool of pinned staging buffers (see StagingPool)
+    """
+    StagingPool = require_import('StagingPool')
+    sim = make_CDKLM16(ctx, args)
+    eta, hu, hv = sim.download()
+    pool = StagingPool.StagingPool() if staging else None
+    def run():
+        # The module pool is swapped in for this benchmark only
+        previous_pool, StagingPool.pool = StagingPool.pool, pool
+        try:
+            for i in range(args.uploads):
+                sim.gpu_data.h0.upload(sim.gpu_stream, eta)
+                sim.gpu_data.hu0.upload(sim.gpu_stream, hu)
+                sim.gpu_data.hv0.upload(sim.gpu_stream, hv)
+            ctx.synchronize()
+        finally:
+            StagingPool.pool = previous_pool
+    return run, {'nx': args.nx, 'ny': args.ny, 'uploads': args.uploads}
+
+
+@benchmark("state_upload", "cuda")
+def bench_state_upload(args, ctx):
+    return _state_upload_benchmark(args, ctx, staging=False)
+
+
+@benchmark("state_upload_staging", "cuda")
+def bench_state_upload_staging(args, ctx):
+    return _state_upload_benchmark(args, ctx, staging=True)
+
+
+@benchmark("observation_extraction", "cpu")
+def bench_observation(args, ctx):
+    Observation = require_import('Observation')
+    dautils = require_import('DataAssimilationUtils')
+
+    num_times = 50
+    domain_size = 1000.0
+    rng = np.random.RandomState(1)
+    t = np.arange(num_times)*300.0
+    x = np.mod(np.cumsum(rng.normal(size=(args.drifters, num_times)), axis=1)*10.0, domain_size)
+    y = np.mod(np.cumsum(rng.normal(size=(args.drifters, num_times)), axis=1)*10.0, domain_size)
+
+    obs = Observation.Observation(observation_type=dautils.ObservationType.UnderlyingFlow,
+                                  domain_size_x=domain_size, domain_size_y=domain_size,
+                                  nx=args.nx, ny=args.ny, observation_variance=0.01**2)
+    obs.add_observations_from_arrays(t, x, y)
+    obs_times = obs.get_observation_times()
+    def run():
+        for obs_t in obs_times:
+            obs.get_observation(obs_t, waterDepth=60.0)
+    return run, {'drifters': args.drifters, 'observation_times': len(obs_times)}
+
+
+@benchmark("observation_drifter_paths", "cpu")
+def bench_observation_drifter_paths(args, ctx):
+    Observation = require_import('Observation')
+
+    num_times = 500
+    domain_size = 1000.0*args.nx
+    rng = np.random.RandomState(1)
+    t = np.arange(num_times)*300.0
+    x = np.mod(np.cumsum(rng.normal(size=(args.drifters, num_times)), axis=1)*2000.0, domain_size)
+    y = np.mod(np.cumsum(rng.normal(size=(args.drifters, num_times)), axis=1)*2000.0, domain_size)
+
+    obs = Observation.Observation(domain_size_x=domain_size, domain_size_y=domain_size)
+    obs.add_observations_from_arrays(t, x, y)
+    def run():
+        obs.get_drifter_paths(np.arange(args.drifters), 0, t[-1])
+        obs.get_drifter_paths(np.arange(args.drifters), 0, t[-1], keepDomainSize=False)
+    return run, {'drifters': args.drifters, 'observation_times': num_times}
+
+
+@benchmark("observation_buoy_setup", "cpu")
+def bench_observation_buoys(args, ctx):
+    Observation = require_import('Observation')
+    dautils = require_import('DataAssimilationUtils')
+
+    land_mask = np.zeros((args.ny, args.nx), dtype=bool)
+    land_mask[:args.ny//4, :args.nx//3] = True
+    obs = Observation.Observation(observation_type=dautils.ObservationType.StaticBuoys,
+                                  domain_size_x=args.nx*1000.0, domain_size_y=args.ny*1000.0,
+                                  nx=args.nx, ny=args.ny, land_mask=land_mask)
+    def run():
+        obs.setBuoyCellsByFrequency(2, 2)
+        obs.setBuoyReadingArea('south')
+        obs.setBuoySet(list(range(0, len(obs.buoy_indices), 3)))
+    return run, {'nx': args.nx, 'ny': args.ny}
+
+
+@benchmark("wind_stress_tables", "cpu")
+def bench_wind_stress_tables(args, ctx):
+    WindStress = require_import('WindStress')
+
+    num_members = 10
+    t = np.arange(24)*3600.0
+    dx = dy = 1000.0
+    u0 = 30.0/np.sqrt(5.0)
+    wind = WindStress.MovingCycloneWindStress(Rc=10*dx, x0=dx*args.nx/2 - u0*3600.0*12.0, y0=dy*args.ny/2,
+                                              u0=u0, v0=-0.5*u0, tau0=3.0, rho=1025.0)
+    rng = np.random.RandomState(1)
+    def run():
+        WindStress.windStressTables(wind, t, args.nx, args.ny, dx, dy, num_members=num_members,
+                                    max_wind_direction_perturbation=20.0, random_state=rng)
+    return run, {'nx': args.nx, 'ny': args.ny, 'times': len(t), 'members': num_members}
+
+
+def _referenceResidualIndices(weights):
+    """
+    Residual resampling as previously implemented in DataAssimilationUtils, kept as a baseline
+    """
+    num_particles = len(weights)
+    allIndices = np.arange(num_particles)
+    weightsTimesN = weights*num_particles
+    deterministic = np.repeat(allIndices, np.int64(np.floor(weightsTimesN)))
+    decimalWeights = np.mod(weightsTimesN, 1)
+    decimalWeights = decimalWeights/np.sum(decimalWeights)
+    stochastic = np.random.choice(allIndices, num_particles - len(deterministic), p=decimalWeights)
+    return np.concatenate((deterministic, stochastic))
+
+def _referenceStochasticUniversalIndices(weights):
+    """
+    Stochastic universal sampling using np.histogram, as previously implemented in DataAssimilationUtils
+    """
+    num_particles = len(weights)
+    allIndices = np.array(range(num_particles))
+    cumulativeWeights = np.concatenate(([0.0], np.cumsum(weights)))
+    selectionValues = allIndices/num_particles + np.random.rand()/num_particles
+    bucketValues, buckets = np.histogram(selectionValues, bins=cumulativeWeights)
+    return np.repeat(allIndices, bucketValues)
+
+def _referenceMetropolisHastingsIndices(weights):
+    """
+    Metropolis-Hastings chain walked in a Python loop, as previously implemented in DataAssimilationUtils
+    """
+    newSampleIndices = np.zeros_like(weights, dtype=int)
+    for i in range(1, len(weights)):
+        p = np.random.rand()
+        if p < weights[i]/weights[newSampleIndices[i-1]]:
+            newSampleIndices[i] = i
+        else:
+            newSampleIndices[i] = newSampleIndices[i-1]
+    return newSampleIndices
+
+REFERENCE_RESAMPLERS = {
+    'residual': _referenceResidualIndices,
+    'stochastic_universal': _referenceStochasticUniversalIndices,
+    'metropolis_hastings': _referenceMetropolisHastingsIndices,
+}
+
+
+def _resampling_benchmark(method):
+    def setup(args, ctx):
+        dautils = require_import('DataAssimilationUtils')
+        ensemble = ResamplingEnsemble(args.particles)
+        def run():
+            dautils.resample(ensemble, method)
+        return run, {'particles': args.particles}
+    return setup
+
+def _reference_resampling_benchmark(method):
+    def setup(args, ctx):
+        ensemble = ResamplingEnsemble(args.particles)
+        scheme = REFERENCE_RESAMPLERS[method]
+        def run():
+            ensemble.resample(scheme(ensemble.getGaussianWeight()), 0)
+        return run, {'particles': args.particles}
+    return setup
+
+# Same names as in DataAssimilationUtils.RESAMPLERS, which is not imported here
+for method in ['probabilistic', 'residual', 'stochastic_universal', 'systematic', 'metropolis_hastings']:
+    benchmark("resampling_" + method, "cpu")(_resampling_benchmark(method))
+for method in REFERENCE_RESAMPLERS.keys():
+    benchmark("resampling_reference_" + method, "cpu")(_reference_resampling_benchmark(method))
+
+
+def _write_netcdf_file(filename, nx, ny, num_timesteps):
+    """
+    Writes a file with the same variables and attributes as SimNetCDFWriter
+    with ignore_ghostcells=False.
+    """
+    from netCDF4 import Dataset
+    ghosts = 2
+    ncfile = Dataset(filename, 'w', clobber=True)
+    for attr in ['ghost_cells_north', 'ghost_cells_east', 'ghost_cells_south', 'ghost_cells_west']:
+        ncfile.setncattr(attr, ghosts)
+    ncfile.staggered_grid = 'False'
+    ncfile.createDimension('time', None)
+    ncfile.createDimension('x', nx + 2*ghosts)
+    ncfile.createDimension('y', ny + 2*ghosts)
+    nc_time = ncfile.createVariable('time', np.dtype('float32').char, 'time')
+    nc_vars = [ncfile.createVariable(var, np.dtype('float32').char, ('time', 'y', 'x'), zlib=True)
+               for var in ['eta', 'hu', 'hv']]
+
+    rng = np.random.RandomState(1)
+    field = rng.normal(size=(ny + 2*ghosts, nx + 2*ghosts)).astype(np.float32)
+    for i in range(num_timesteps):
+        nc_time[i] = i*60.0
+        for nc_var in nc_vars:
+            nc_var[i, :] = field
+    ncfile.close()
+
+
+def _netcdf_write_benchmark(sim, args, ctx):
+    SimWriter = require_import('SimWriter')
+    filename = os.path.join(ctx.tmp_dir, "sim_write_benchmark")
+    def run():
+        with SimWriter.SimNetCDFWriter(sim, filename=filename) as writer:
+            for i in range(args.timesteps-1):
+                writer.writeTimestep(sim)
+    mbytes = 3*4*(args.nx+4)*(args.ny+4)*args.timesteps/(1024.0*1024.0)
+    return run, {'nx': args.nx, 'ny': args.ny, 'timesteps': args.timesteps, 'megabytes': mbytes}
+
+
+@benchmark("netcdf_write", "cpu")
+def bench_netcdf_write(args, ctx):
+    try:
+        import netCDF4
+    except ImportError as e:
+        raise BenchmarkSkipped(str(e))
+    return _netcdf_write_benchmark(make_CPUCDKLM16(args), args, ctx)
+
+
+@benchmark("netcdf_write", "cuda")
+def bench_netcdf_write_sim(args, ctx):
+    return _netcdf_write_benchmark(make_CDKLM16(ctx, args), args, ctx)
+
+
+@benchmark("netcdf_read", "cpu")
+def bench_netcdf_read(args, ctx):
+    SimReader = require_import('SimReader')
+    filename = os.path.join(ctx.tmp_dir, "read_benchmark.nc")
+    _write_netcdf_file(filename, args.nx, args.ny, args.timesteps)
+    def run():
+        reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=True)
+        for i in range(reader.getNumTimeSteps()):
+            reader.getTimeStep(i)
+        reader.ncfile.close()
+    return run, {'nx': args.nx, 'ny': args.ny, 'timesteps': args.timesteps}
+
+
+def _make_iewpf_ensemble(args, ctx):
+    """
+    Creates a small OceanNoiseEnsemble with IEWPF, similar to the one in the unit tests.
+    """
+    CDKLM16 = require_import('CDKLM16')
+    Common = require_import('Common')
+    OceanNoiseEnsemble = require_import('OceanNoiseEnsemble')
+    IEWPFOcean = require_import('IEWPFOcean')
+    dautils = require_import('DataAssimilationUtils')
+    gpu_ctx = ctx.get_gpu_ctx()
+
+    nx, ny = args.iewpf_nx, args.iewpf_ny
+    dx, dy, dt = 4.0, 4.0, 0.05
+    g, f, H = 9.81, 0.05, 10.0
+    dataShape = (ny + 4, nx + 4)
+    eta0 = np.zeros(dataShape, dtype=np.float32)
+    hu0  = np.zeros(dataShape, dtype=np.float32)
+    hv0  = np.zeros(dataShape, dtype=np.float32)
+    Hi   = np.ones((ny + 5, nx + 5), dtype=np.float32)*H
+
+    sim = CDKLM16.CDKLM16(gpu_ctx, eta0, hu0, hv0, Hi, nx, ny, dx, dy, dt, g, f, 0.0,
+                          boundary_conditions=Common.BoundaryConditions(2,2,2,2),
+                          small_scale_perturbation=True,
+                          small_scale_perturbation_amplitude=0.5*dt*f/(g*H))
+    ensemble = OceanNoiseEnsemble.OceanNoiseEnsemble(gpu_ctx, args.iewpf_particles, sim,
+                                                     num_drifters=args.drifters,
+                                                     observation_type=dautils.ObservationType.DirectUnderlyingFlow,
+                                                     observation_variance=0.01**2)
+    iewpf = IEWPFOcean.IEWPFOcean(ensemble)
+    ensemble.step(100*dt)
+    return ensemble, iewpf
+
+
+@benchmark("iewpf_update", "cuda")
+def bench_iewpf_cuda(args, ctx):
+    ensemble, iewpf = _make_iewpf_ensemble(args, ctx)
+    def run():
+        iewpf.iewpf(ensemble, perform_step=False)
+        ctx.synchronize()
+    return run, {'nx': args.iewpf_nx, 'ny': args.iewpf_ny, 'particles': args.iewpf_particles}
+
+
+@benchmark("iewpf_update", "cpu")
+def bench_iewpf_cpu(args, ctx):
+    """
+    The batched CPU IEWPF on an ensemble of CPUCDKLM16 particles, using the
+    host backends of OceanStateNoise and IEWPFOcean (no GPU needed).
+    """
+    CPUSimulators = require_import('CPUSimulators')
+    Common = require_import('Common')
+    IEWPFOcean = require_import('IEWPFOcean')
+
+    nx, ny = args.iewpf_nx, args.iewpf_ny
+    dx, dy, dt = 4.0, 4.0, 0.05
+    g, f, H = 9.81, 0.05, 10.0
+    dataShape = (ny + 4, nx + 4)
+    eta0 = np.zeros(dataShape, dtype=np.float32)
+    hu0  = np.zeros(dataShape, dtype=np.float32)
+    hv0  = np.zeros(dataShape, dtype=np.float32)
+    Hi   = np.ones((ny + 5, nx + 5), dtype=np.float32)*H
+
+    particles = [CPUSimulators.CPUCDKLM16(None, eta0, hu0, hv0, Hi, nx, ny, dx, dy, dt, g, f, 0.0,
+                                          boundary_conditions=Common.BoundaryConditions(2,2,2,2),
+                                          small_scale_perturbation=True,
+                                          small_scale_perturbation_amplitude=0.5*dt*f/(g*H))
+                 for p in range(args.iewpf_particles)]
+    for sim in particles:
+        sim.step(10*dt)
+    ensemble = HostEnsemble(particles, args.drifters, 0.01**2)
+    iewpf = IEWPFOcean.IEWPFOcean(ensemble, backend='host',
+                                  cache_dir=os.path.join(ctx.tmp_dir, "iewpf_cache"))
+    def run():
+        iewpf.iewpf_batched_CPU(ensemble, perform_step=False)
+    return run, {'nx': args.iewpf_nx, 'ny': args.iewpf_ny, 'particles': args.iewpf_particles}
+
+
+
+###------------------------------------
+### Running, reporting and comparing
+###------------------------------------
+
+def environment_metadata():
+    """
+    Returns a dict describing the machine and software used for the benchmarks
+    """
+    metadata = {
+        'timestamp': datetime.datetime.now().isoformat(),
+        'hostname': socket.gethostname(),
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+    }
+    for package in ['scipy', 'pandas', 'netCDF4', 'pycuda']:
+        try:
+            metadata[package] = __import__(package).__version__
+        except Exception:
+            metadata[package] = None
+    try:
+        metadata['git_hash'] = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=current_dir,
+                                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except Exception:
+        metadata['git_hash'] = None
+    return metadata
+
+
+def time_benchmark(run, repeats, warmup, synchronize):
+    """
+    Runs the benchmark function warmup + repeats times, and returns
+    timing statistics for the last repeats runs.
+    """
+    for i in range(warmup):
+        run()
+    times = np.zeros(repeats)
+    for i in range(repeats):
+        synchronize()
+        tic = time.perf_counter()
+        run()
+        synchronize()
+        times[i] = time.perf_counter() - tic
+    return {
+        'min': float(np.min(times)),
+        'median': float(np.median(times)),
+        'mean': float(np.mean(times)),
+        'std': float(np.std(times)),
+        'repeats': repeats,
+        'times': times.tolist()
+    }
+
+
+def run_benchmarks(args, logger):
+    """
+    Runs all selected benchmarks, and returns a dict with results keyed on "name/backend"
+    """
+    ctx = BenchmarkContext()
+    results = {}
+    try:
+        for name, backend, setup in benchmarks:
+            key = name + "/" + backend
+            if args.only and not any(pattern in key for pattern in args.only):
+                continue
+            if args.backends and backend not in args.backends:
+                continue
+
+            try:
+                run, info = setup(args, ctx)
+                stats = time_benchmark(run, args.repeats, args.warmup, ctx.synchronize)
+                results[key] = {'name': name, 'backend': backend, 'status': 'ok', 'info': info}
+                results[key].update(stats)
+                logger.info("{:45s} median {:10.6f} s (min {:10.6f} s)".format(key, stats['median'], stats['min']))
+            except BenchmarkSkipped as e:
+                results[key] = {'name': name, 'backend': backend, 'status': 'skipped', 'reason': str(e)}
+                logger.info("{:45s} skipped ({:s})".format(key, str(e)))
+            except Exception as e:
+                results[key] = {'name': name, 'backend': backend, 'status': 'failed', 'reason': repr(e)}
+                logger.error("{:45s} FAILED ({:s})".format(key, repr(e)))
+    finally:
+        ctx.cleanUp()
+    return results
+
+
+def compare_to_baseline(results, baseline, threshold, benchmark_thresholds={}):
+    """
+    Compares the median times in results to those in baseline.
+    A benchmark has regressed if its median time is more than (1 + threshold)
+    times the baseline median. Thresholds for individual benchmarks can be
+    given in benchmark_thresholds, keyed on either "name" or "name/backend".
+
+    Returns a list of dicts, one for each benchmark present in both.
+    """
+    comparison = []
+    for key, result in results.items():
+        if result['status'] != 'ok':
+            continue
+        if key not in baseline or baseline[key].get('status') != 'ok':
+            continue
+
+        limit = benchmark_thresholds.get(key, benchmark_thresholds.get(result['name'], threshold))
+        ratio = result['median'] / baseline[key]['median']
+        comparison.append({
+            'benchmark': key,
+            'baseline_median': baseline[key]['median'],
+            'median': result['median'],
+            'ratio': ratio,
+            'threshold': limit,
+            'regression': bool(ratio > 1.0 + limit)
+        })
+    return comparison
+
+
+def parse_benchmark_thresholds(threshold_args):
+    thresholds = {}
+    for threshold_arg in threshold_args:
+        key, value = threshold_arg.split('=')
+        thresholds[key] = float(value)
+    return thresholds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the GPU Ocean benchmark suite.')
+    parser.add_argument('--nx', type=int, default=256)
+    parser.add_argument('--ny', type=int, default=256)
+    parser.add_argument('--steps', type=int, default=100, help='Simulator steps per repeat')
+    parser.add_argument('--cpu_steps', type=int, default=5, help='CPU simulator steps per repeat')
+    parser.add_argument('--timesteps', type=int, default=20, help='Timesteps per netCDF file')
+    parser.add_argument('--uploads', type=int, default=10, help='Ocean state uploads per repeat')
+    parser.add_argument('--particles', type=int, default=1000, help='Particles for resampling')
+    parser.add_argument('--drifters', type=int, default=16)
+    parser.add_argument('--iewpf_nx', type=int, default=40)
+    parser.add_argument('--iewpf_ny', type=int, default=40)
+    parser.add_argument('--iewpf_particles', type=int, default=10)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--warmup', type=int, default=1)
+    parser.add_argument('--only', type=str, nargs='*', default=None,
+                        help='Only run benchmarks whose "name/backend" contain one of these strings')
+    parser.add_argument('--backends', type=str, nargs='*', default=None, help='E.g., cpu cuda')
+    parser.add_argument('--output', type=str, default=None, help='JSON file for the results')
+    parser.add_argument('--baseline', type=str, default=None, help='JSON file with baseline results')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Allowed relative slowdown compared to the baseline')
+    parser.add_argument('--benchmark-threshold', type=str, nargs='*', default=[], dest='benchmark_thresholds',
+                        help='Thresholds for single benchmarks, as name=value or name/backend=value')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logger = logging.getLogger("benchmark_suite")
+
+    output = {
+        'environment': environment_metadata(),
+        'arguments': vars(args),
+        'results': run_benchmarks(args, logger)
+    }
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r') as baseline_file:
+            baseline = json.load(baseline_file)['results']
+        comparison = compare_to_baseline(output['results'], baseline, args.threshold,
+                                         parse_benchmark_thresholds(args.benchmark_thresholds))
+        output['comparison'] = comparison
+
+        logger.info("")
+        logger.info("Comparison to baseline " + args.baseline)
+        for entry in comparison:
+            logger.info("{:45s} {:6.2f}x baseline {:s}".format(entry['benchmark'], entry['ratio'],
+                                                               "REGRESSION" if entry['regression'] else ""))
+            if entry['regression']:
+                exit_code = 1
+
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(output, output_file, indent=2)
+        logger.info("Results written to " + args.output)
+
+    sys.exit(exit_code)
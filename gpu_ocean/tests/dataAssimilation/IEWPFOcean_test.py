@@ -24,6 +24,8 @@ import unittest
 import numpy as np
 import sys
 import gc
+import os
+import tempfile
 
 from testUtils import *
 
@@ -44,6 +46,9 @@ class IEWPFOceanTest(unittest.TestCase):
         
         self.gpu_ctx = Common.CUDAContext()
 
+        # Keeps the cache of precomputed matrices on disk out of the user's cache directory
+        self.cache_dir = tempfile.TemporaryDirectory()
+
         self.setUpAndStartEnsemble()
         
 
@@ -58,6 +63,7 @@ class IEWPFOceanTest(unittest.TestCase):
         if self.iewpf is not None:
             self.iewpf.cleanUp()
             del self.iewpf
+        self.cache_dir.cleanup()
         if self.gpu_ctx is not None:
             self.assertEqual(sys.getrefcount(self.gpu_ctx), 2)
             self.gpu_ctx = None
@@ -137,7 +143,7 @@ class IEWPFOceanTest(unittest.TestCase):
                                                               observation_variance = 0.01**2)
 
 
-        self.iewpf = IEWPFOcean.IEWPFOcean(self.ensemble)
+        self.iewpf = IEWPFOcean.IEWPFOcean(self.ensemble, cache_dir=self.cache_dir.name)
 
 
     def run_ensemble(self):
@@ -367,3 +373,104 @@ class IEWPFOceanTest(unittest.TestCase):
         gpu = self.ensemble.observeParticles(gpu=True)
                 
         assert2DListAlmostEqual(self, cpu.tolist(), gpu.tolist(), 6, "observation_operator_CPU_vs_GPU")
+        
+        
+    def test_local_SVD_to_global_batched_CPU_ref_data(self):
+        
+        # See comment for test_local_SVD_to_global_GPU_ref_data(self).
+        localSVD_from_file = np.loadtxt("iewpfRefData/localSVD.dat")
+        self.iewpf.localSVD_host = localSVD_from_file
+        
+        test_data = np.loadtxt("iewpfRefData/preLocalSVDtoGlobal.dat")
+        results_from_file = np.loadtxt("iewpfRefData/postLocalSVDtoGlobal.dat")
+        
+        # Apply the SVD block to two copies of the same field at once
+        batched_data = np.array([test_data, 2.0*test_data])
+        self.iewpf._apply_local_SVD_to_global_xi_batched_CPU(batched_data, 30, 30)
+        
+        assert2DListAlmostEqual(self, batched_data[0].tolist(), results_from_file.tolist(), 10, "test_local_SVD_to_global_batched_CPU 0")
+        assert2DListAlmostEqual(self, batched_data[1].tolist(), (2.0*results_from_file).tolist(), 10, "test_local_SVD_to_global_batched_CPU 1")
+        
+    def test_kalman_gain_batched_CPU(self):
+        self.run_ensemble()
+        innovations = self.ensemble.getInnovations()
+        observed_drifter_positions = self.ensemble.observeTrueDrifters()
+        
+        sim = self.ensemble.particles[0]
+        H = sim.downloadBathymetry()[0]
+        K_eta, K_hu, K_hv, phi = self.iewpf.applyKalmanGain_batched_CPU(sim.small_scale_model_error, H,
+                                                                        sim.f, sim.coriolis_beta, sim.g,
+                                                                        observed_drifter_positions,
+                                                                        innovations)
+        for p in range(self.ensembleSize):
+            etaCPU, huCPU, hvCPU, phiCPU = self.iewpf.applyKalmanGain_CPU(sim,
+                                                                          observed_drifter_positions,
+                                                                          innovations[p], returnKalmanGainTerm=True)
+            assert2DListAlmostEqual(self, K_eta[p].tolist(), etaCPU.tolist(), 10, "test_kalman_gain_batched_CPU eta")
+            assert2DListAlmostEqual(self, K_hu[p].tolist(),  huCPU.tolist(),  10, "test_kalman_gain_batched_CPU hu")
+            assert2DListAlmostEqual(self, K_hv[p].tolist(),  hvCPU.tolist(),  10, "test_kalman_gain_batched_CPU hv")
+            self.assertAlmostEqual(phi[p], phiCPU, places=6)
+            
+    def test_draw_from_P_batched_CPU(self):
+        observed_drifter_positions = np.array([[120, 120], [40, 120], [80, 40]], dtype=np.float32)
+        sim = self.ensemble.particles[0]
+        noise = sim.small_scale_model_error
+        H = sim.downloadBathymetry()[0]
+        
+        xi = np.random.normal(size=(2, noise.rand_ny, noise.rand_nx))
+        p_eta, p_hu, p_hv, gamma = self.iewpf.drawFromP_batched_CPU(noise, H,
+                                                                    sim.f, sim.coriolis_beta, sim.g,
+                                                                    observed_drifter_positions, xi)
+        for p in range(xi.shape[0]):
+            # Apply the SVD blocks and Q to a single random field the non-batched way
+            noise.random_numbers_host = xi[p].copy()
+            for drifter in range(observed_drifter_positions.shape[0]):
+                cell_id_x = int(np.floor(observed_drifter_positions[drifter,0]/sim.dx))
+                cell_id_y = int(np.floor(observed_drifter_positions[drifter,1]/sim.dy))
+                self.iewpf._apply_local_SVD_to_global_xi_CPU(noise.random_numbers_host, cell_id_x, cell_id_y)
+            eta, hu, hv = noise._obtainOceanPerturbations_CPU(H, sim.f, sim.coriolis_beta, sim.g)
+            
+            assert2DListAlmostEqual(self, p_eta[p].tolist(), eta.tolist(), 10, "test_draw_from_P_batched_CPU eta")
+            assert2DListAlmostEqual(self, p_hu[p].tolist(),  hu.tolist(),  10, "test_draw_from_P_batched_CPU hu")
+            assert2DListAlmostEqual(self, p_hv[p].tolist(),  hv.tolist(),  10, "test_draw_from_P_batched_CPU hv")
+            self.assertAlmostEqual(gamma[p], np.sum(xi[p]**2))
+            
+    def test_implicit_equation_batched(self):
+        gamma = np.array([4700.0, 4800.0, 4900.0])
+        c_star = np.array([0.0, 2.5, 10.0])
+        
+        alpha = self.iewpf.solveImplicitEquation_batched(gamma, c_star)
+        for p in range(len(gamma)):
+            alpha_ref = self.iewpf.solveImplicitEquation(gamma[p], 0.0, 0.0, c_star[p])
+            self.assertAlmostEqual(alpha[p], alpha_ref, places=10)
+            
+    def test_precomputed_matrices_cache(self):
+        # The matrices in use should agree with freshly computed ones
+        self.assertTrue(self.iewpf.checkPrecomputedMatrices(self.ensemble))
+        
+        # A new IEWPF object with the same parameters should get the same matrices,
+        # both from the in-memory cache and from the cache on disk
+        for clear_memory_cache in [False, True]:
+            if clear_memory_cache:
+                IEWPFOcean.IEWPFOcean.clear_precomputed_cache()
+            iewpf_cached = IEWPFOcean.IEWPFOcean(self.ensemble, cache_dir=self.cache_dir.name)
+            
+            assert2DListAlmostEqual(self, iewpf_cached.S_host.tolist(), self.iewpf.S_host.tolist(), 7, "S matrix cached")
+            assert2DListAlmostEqual(self, iewpf_cached.localSVD_host.tolist(), self.iewpf.localSVD_host.tolist(), 7, "SVD matrix cached")
+            self.assertTrue(iewpf_cached.checkPrecomputedMatrices(self.ensemble))
+            
+            iewpf_cached.cleanUp()
+            del iewpf_cached
+    
+    def test_precomputed_matrices_cache_dir(self):
+        # The cache on disk should be written to the given directory, without leftover temporary files
+        with tempfile.TemporaryDirectory() as cache_dir:
+            IEWPFOcean.IEWPFOcean.clear_precomputed_cache()
+            iewpf_cached = IEWPFOcean.IEWPFOcean(self.ensemble, cache_dir=cache_dir)
+            cached_files = os.listdir(cache_dir)
+            self.assertEqual(len(cached_files), 1)
+            self.assertTrue(cached_files[0].endswith(".npz"))
+            
+            assert2DListAlmostEqual(self, iewpf_cached.S_host.tolist(), self.iewpf.S_host.tolist(), 7, "S matrix cached")
+            iewpf_cached.cleanUp()
+            del iewpf_cached
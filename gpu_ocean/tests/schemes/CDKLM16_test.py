@@ -31,7 +31,7 @@ from testUtils import *
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.realpath(__file__)), '../../')))
 
-from SWESimulators import Common, CDKLM16
+from SWESimulators import Common, CDKLM16, TimestepPolicy
 
 
 class CDKLM16test(unittest.TestCase):
@@ -419,4 +419,89 @@ class CDKLM16test(unittest.TestCase):
         eta2, u2, v2 = loadResults("CDKLM16", "wallBC", "central", "bathymetry_")
 
         self.checkResults(eta1, u1, v1, eta2, u2, v2)
-       
+
+
+    def test_dt_policies(self):
+        self.setBoundaryConditions()
+        self.allocData()
+        addCentralBump(self.eta0, self.nx, self.ny, self.dx, self.dy, self.validDomain)
+
+        policies = [TimestepPolicy.EveryStepTimestep(),
+                    TimestepPolicy.LaggedTimestep(safety_factor=0.9),
+                    TimestepPolicy.PeriodicTimestep(interval=5)]
+        for policy in policies:
+            self.sim = CDKLM16.CDKLM16(self.gpu_ctx, \
+                                       self.eta0, self.u0, self.v0, self.Hi, \
+                                       self.nx, self.ny, \
+                                       self.dx, self.dy, self.dt, \
+                                       self.g, self.f, self.r, dt_policy=policy)
+            msg = type(policy).__name__
+            self.assertIsNot(self.sim.dt_policy, policy, msg=msg)
+
+            # The asynchronous reduction gives the same as the blocking updateDt
+            self.sim.requestMaxDt()
+            self.assertAlmostEqual(self.sim.readMaxDt()*self.sim.courant_number,
+                                   self.sim._getMaxTimestepHost(), places=5, msg=msg)
+
+            for i in range(10):
+                self.sim.step(5.0, update_dt=True)
+                self.assertLessEqual(self.sim.dt, 1.05*self.sim._getMaxTimestepHost(), msg=msg)
+            self.assertGreaterEqual(self.sim.dt_policy.num_updates, 10, msg=msg)
+
+            self.sim.cleanUp()
+            self.sim = None
+
+
+
+    def test_skip_dry_tiles(self):
+        self.setBoundaryConditions()
+        self.allocData()
+        self.f = 0.01
+        addCentralBump(self.eta0, self.nx, self.ny, self.dx, self.dy, self.validDomain)
+
+        # Land in the east, so that the blocks there are fully dry, and an island
+        Hi = np.ma.array(self.Hi, mask=False)
+        Hi.mask[:, 40:] = True
+        Hi.mask[10:14, 10:14] = True
+
+        sims = [CDKLM16.CDKLM16(self.gpu_ctx, \
+                                self.eta0, self.u0, self.v0, Hi, \
+                                self.nx, self.ny, \
+                                self.dx, self.dy, self.dt, \
+                                self.g, self.f, self.r, \
+                                small_scale_perturbation=True, use_lcg=True, \
+                                skip_dry_tiles=skip_dry_tiles) \
+                for skip_dry_tiles in [False, True]]
+        self.assertLess(sims[1].active_tiles.num_active_tiles, sims[1].active_tiles.num_tiles)
+
+        # Same random numbers in both simulators
+        sims[1].small_scale_model_error.seed.upload(sims[1].gpu_stream, sims[0].small_scale_model_error.getSeed())
+
+        land_mask = sims[0].downloadBathymetry(interior_domain_only=True)[1].mask
+        def checkWetCells(msg):
+            for full, tiled in zip(sims[0].download(interior_domain_only=True), \
+                                   sims[1].download(interior_domain_only=True)):
+                self.assertTrue(np.all(np.isfinite(full[~land_mask])), msg=msg)
+                self.assertTrue(np.array_equal(full[~land_mask], tiled[~land_mask]), msg=msg)
+
+        # Deterministic steps
+        for sim in sims:
+            sim.step(10*self.dt, apply_stochastic_term=False)
+        checkWetCells("deterministic")
+
+        # The geostrophically balanced perturbation alone
+        eta_before = sims[0].download(interior_domain_only=True)[0]
+        for sim in sims:
+            sim.perturbState()
+        checkWetCells("perturbState")
+        eta_after = sims[0].download(interior_domain_only=True)[0]
+        self.assertGreater(np.max(np.abs(eta_after - eta_before)[~land_mask]), 0.0)
+
+        # Stochastic steps
+        for sim in sims:
+            sim.step(10*self.dt)
+        checkWetCells("stochastic")
+
+        for sim in sims:
+            sim.cleanUp()
+        sims = None
@@ -142,6 +142,36 @@ class NetCDFtest(unittest.TestCase):
         self.checkResults(s_eta0, s_hu0, s_hv0, f_eta0, f_hu0, f_hv0)
         
         
+    def test_netcdf_cdklm_shared_initial_state(self):
+        doubleJetCase = DoubleJetCase.DoubleJetCase(self.gpu_ctx,
+                                                    DoubleJetCase.DoubleJetPerturbationType.IEWPFPaperCase)
+
+        doubleJetCase_args, doubleJetCase_init = doubleJetCase.getInitConditions()
+        netcdf_args = {
+            'write_netcdf': True,
+            'netcdf_filename': 'netcdf_test/netcdf_test_shared.nc'
+        }
+        self.sim = CDKLM16.CDKLM16(**doubleJetCase_args, **doubleJetCase_init, **netcdf_args)
+        self.sim.closeNetCDF()
+        
+        # Two simulators hotstarted from the same initial state read once
+        initial_state = CDKLM16.CDKLM16.readInitialState(netcdf_args['netcdf_filename'])
+        self.file_sim = CDKLM16.CDKLM16.fromInitialState(self.gpu_ctx, initial_state, cont_write_netcdf=False)
+        other_sim = CDKLM16.CDKLM16.fromInitialState(self.gpu_ctx, initial_state, cont_write_netcdf=False)
+        self.assertIsNot(self.file_sim.wind_stress, other_sim.wind_stress)
+        
+        s_eta0, s_hu0, s_hv0 = self.sim.download()
+        for sim in [self.file_sim, other_sim]:
+            f_eta0, f_hu0, f_hv0 = sim.download()
+            self.checkResults(s_eta0, s_hu0, s_hv0, f_eta0, f_hu0, f_hv0)
+            
+        # Stepping one of them does not change the other
+        dt = self.sim.dt
+        self.file_sim.step(10*dt, apply_stochastic_term=False)
+        o_eta0, o_hu0, o_hv0 = other_sim.download()
+        self.checkResults(s_eta0, s_hu0, s_hv0, o_eta0, o_hu0, o_hv0)
+        other_sim.cleanUp()
+        
          
     def checkResults(self, sim_eta, sim_hu, sim_hv, file_eta, file_hu, file_hv):
         diffEta = np.linalg.norm(sim_eta - file_hu) / np.max(np.abs(file_eta))
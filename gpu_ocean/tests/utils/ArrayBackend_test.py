@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the host array backend of
+Common.CUDAArray2D, SWEDataArakawaA, SWEDataArakawaC and Bathymetry, 
+and of writing and observing a simulator that uses it.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+import os
+import tempfile
+import shutil
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Common, CPUSimulators, Observation, SimWriter, SimReader
+from SWESimulators import DataAssimilationUtils as dautils
+
+
+class FixedDrifters:
+    def __init__(self, positions):
+        self.positions = positions
+
+    def getDrifterPositions(self):
+        return self.positions.copy()
+
+
+class ArrayBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 10
+        self.ny = 7
+        self.halo = 2
+        rng = np.random.RandomState(2)
+        self.h0 = rng.rand(self.ny+4, self.nx+4)
+        self.hu0 = rng.rand(self.ny+4, self.nx+4)
+        self.hv0 = rng.rand(self.ny+4, self.nx+4)
+
+    def tearDown(self):
+        Common.setArrayBackend('cuda')
+
+    def test_host_array(self):
+        array = Common.HostArray2D(None, self.nx, self.ny, self.halo, self.halo, self.h0)
+        self.assertEqual(array.backend, 'host')
+        self.assertEqual(array.pitch, (self.nx+4)*4)
+
+        # Stored as float32, and downloads are copies
+        data = array.download(None)
+        self.assertEqual(data.dtype, np.float32)
+        self.assertTrue(np.array_equal(data, self.h0.astype(np.float32)))
+        data[0, 0] = -1.0
+        self.assertNotEqual(array.download(None)[0, 0], -1.0)
+
+        # Uploads keep the buffer
+        buffer = array.data
+        array.upload(None, self.hu0)
+        self.assertIs(array.data, buffer)
+        self.assertTrue(np.array_equal(array.download(None), self.hu0.astype(np.float32)))
+
+        with self.assertRaises(AssertionError):
+            array.upload(None, self.hu0[1:, :])
+
+        # Masks are kept
+        masked = np.ma.array(self.hv0, mask=self.hv0 > 0.5)
+        array.upload(None, masked)
+        self.assertTrue(np.array_equal(array.download(None).mask, self.hv0 > 0.5))
+
+        array.release()
+        self.assertFalse(array.holds_data)
+        with self.assertRaises(RuntimeError):
+            array.download(None)
+        with self.assertRaises(RuntimeError):
+            array.upload(None, self.h0)
+
+    def test_copy_buffer(self):
+        a = Common.HostArray2D(None, self.nx, self.ny, self.halo, self.halo, self.h0)
+        b = Common.HostArray2D(None, self.nx, self.ny, self.halo, self.halo, self.hu0)
+        a.copyBuffer(None, b)
+        self.assertTrue(np.array_equal(a.download(None), self.hu0.astype(np.float32)))
+
+        # The copy is independent of the source
+        b.upload(None, self.hv0)
+        self.assertTrue(np.array_equal(a.download(None), self.hu0.astype(np.float32)))
+
+        c = Common.HostArray2D(None, self.nx-1, self.ny, self.halo, self.halo, self.h0[:, 1:])
+        with self.assertRaises(AssertionError):
+            a.copyBuffer(None, c)
+
+        d = Common.HostArray2D(None, self.nx, self.ny, self.halo, self.halo, self.h0, double_precision=True)
+        self.assertEqual(d.download(None).dtype, np.float64)
+        with self.assertRaises(AssertionError):
+            a.copyBuffer(None, d)
+
+    def test_swe_data_arakawa_a(self):
+        data = Common.SWEDataArakawaA(None, self.nx, self.ny, self.halo, self.halo,
+                                      self.h0, self.hu0, self.hv0, backend='host')
+        self.assertIsInstance(data.h0, Common.HostArray2D)
+
+        data.h1.upload(None, 2*self.h0)
+        data.swap()
+        h, hu, hv = data.download(None)
+        h_prev, hu_prev, hv_prev = data.downloadPrevTimestep(None)
+        self.assertTrue(np.array_equal(h, (2*self.h0).astype(np.float32)))
+        self.assertTrue(np.array_equal(h_prev, self.h0.astype(np.float32)))
+        self.assertTrue(np.array_equal(hu, hu_prev))
+        data.release()
+
+    def test_swe_data_arakawa_c(self):
+        nx, ny = self.nx, self.ny
+        h0 = np.ones((ny+2, nx+2))
+        hu0 = np.zeros((ny+2, nx+1))
+        hv0 = np.zeros((ny+3, nx+2))
+        data = Common.SWEDataArakawaC(None, nx, ny, 1, 1, h0, hu0, hv0, fbl=True, backend='host')
+        h, hu, hv = data.download(None, interior_domain_only=True)
+        self.assertEqual(h.shape, (ny, nx))
+        self.assertEqual(hu.shape, (ny, nx+1))
+        self.assertEqual(hv.shape, (ny+1, nx))
+
+    def test_default_backend(self):
+        self.assertEqual(Common.getArrayBackend(), 'cuda')
+        Common.setArrayBackend('host')
+        data = Common.SWEDataArakawaA(None, self.nx, self.ny, self.halo, self.halo,
+                                      self.h0, self.hu0, self.hv0)
+        self.assertEqual(data.backend, 'host')
+        with self.assertRaises(AssertionError):
+            Common.setArrayBackend('opencl')
+
+    def test_bathymetry(self):
+        nx, ny, halo = self.nx, self.ny, self.halo
+        rng = np.random.RandomState(3)
+        Bi = 10.0 + rng.rand(ny+5, nx+5).astype(np.float32)
+        bc = Common.BoundaryConditions(2, 2, 2, 2)
+        bathymetry = Common.Bathymetry(None, None, nx, ny, halo, halo, Bi, bc, backend='host')
+        Bi_out, Bm_out = bathymetry.download(None)
+
+        # Periodic ghost intersections
+        self.assertTrue(np.array_equal(Bi_out[:halo, :], Bi_out[ny:ny+halo, :]))
+        self.assertTrue(np.array_equal(Bi_out[:, nx+halo:], Bi_out[:, halo:2*halo+1]))
+
+        # Cell mid-points are the average of the corners
+        Bm_ref = (Bi_out[:-1, :-1] + Bi_out[1:, :-1] + Bi_out[:-1, 1:] + Bi_out[1:, 1:])/4
+        self.assertEqual(Bm_out.shape, (ny+4, nx+4))
+        self.assertTrue(np.allclose(Bm_out, Bm_ref, rtol=1.0e-6))
+
+        # Water elevation to depth
+        h = Common.HostArray2D(None, nx, ny, halo, halo, self.h0)
+        w = Common.HostArray2D(None, nx, ny, halo, halo, np.zeros_like(self.h0))
+        bathymetry.waterDepthToElevation(w, h)
+        self.assertTrue(np.allclose(w.download(None), self.h0 + Bm_out))
+        bathymetry.waterElevationToDepth(w)
+        self.assertTrue(np.allclose(w.download(None), self.h0, atol=1.0e-5))
+
+    def test_bathymetry_land(self):
+        nx, ny, halo = self.nx, self.ny, self.halo
+        Bi = np.ma.array(np.full((ny+5, nx+5), 20.0), mask=False)
+        Bi.mask[:, :6] = True
+        bathymetry = Common.Bathymetry(None, None, nx, ny, halo, halo, Bi, backend='host')
+        Bi_out, Bm_out = bathymetry.download(None)
+
+        # Cells with only dry corners are land, and partially dry cells average the wet corners
+        self.assertTrue(np.all(Bm_out.mask[:, :5]))
+        self.assertFalse(np.any(Bm_out.mask[:, 5:]))
+        self.assertTrue(np.allclose(Bm_out[:, 5:], 20.0))
+
+    def test_writer_and_observation(self):
+        # A CPU simulator, which keeps its state and bathymetry in host arrays
+        nx, ny, dx, dy = 16, 12, 100.0, 100.0
+        y, x = np.mgrid[0:ny+4, 0:nx+4]
+        eta0 = (0.1*np.exp(-((x - 10)**2 + (y - 8)**2)/8.0)).astype(np.float32)
+        hu0 = np.zeros_like(eta0)
+        hv0 = np.zeros_like(eta0)
+        Hi = np.ones((ny+5, nx+5), dtype=np.float32)*50.0
+        dt = 0.25*dx/np.sqrt(9.81*50.0)
+        sim = CPUSimulators.CPUCDKLM16(None, eta0, hu0, hv0, Hi, nx, ny, dx, dy, dt, 9.81, 1.2e-4, 0.0,
+                                       boundary_conditions=Common.BoundaryConditions(2, 2, 2, 2))
+        self.assertEqual(sim.bathymetry.Bi.backend, 'host')
+
+        tmp_dir = tempfile.mkdtemp(prefix="array_backend_")
+        try:
+            # Write the initial state and two timesteps, and read them back
+            filename = os.path.join(tmp_dir, "host_sim")
+            states = [sim.download()]
+            with SimWriter.SimNetCDFWriter(sim, filename=filename) as writer:
+                for i in range(2):
+                    sim.step(5*dt)
+                    writer.writeTimestep(sim)
+                    states.append(sim.download())
+
+            reader = SimReader.SimNetCDFReader(filename + ".nc", ignore_ghostcells=False)
+            self.assertEqual(reader.getNumTimeSteps(), 3)
+            for i in range(3):
+                eta, hu, hv, t = reader.getTimeStep(i)
+                for read, state in zip([eta, hu, hv], states[i]):
+                    self.assertTrue(np.array_equal(read, state))
+            self.assertTrue(np.array_equal(reader.getH(), sim.downloadBathymetry()[0]))
+            reader.ncfile.close()
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        # Observe static buoys (and drifters) from the host arrays
+        drifters = FixedDrifters(np.array([[150.0, 250.0], [820.0, 40.0]]))
+        sim.drifters = drifters
+        obs = Observation.Observation(observation_type=dautils.ObservationType.StaticBuoys,
+                                      domain_size_x=nx*dx, domain_size_y=ny*dy, nx=nx, ny=ny)
+        buoy_indices = np.array([[2, 3], [10, 8], [15, 11]])
+        obs.setBuoyCells(buoy_indices)
+        obs.add_observation_from_sim(sim)
+
+        eta, hu, hv = sim.download(interior_domain_only=True)
+        H = sim.downloadBathymetry()[1][2:-2, 2:-2]
+        buoy_observations = obs.obs_df.iloc[0][obs.buoy_observations_key]
+        for i, (bx, by) in enumerate(buoy_indices):
+            factor = H[by, bx] / (H[by, bx] + eta[by, bx])
+            self.assertEqual(buoy_observations[i, 0], hu[by, bx]*factor)
+            self.assertEqual(buoy_observations[i, 1], hv[by, bx]*factor)
+        self.assertTrue(np.array_equal(obs.obs_df.iloc[0][obs.drifter_positions_key], 
+                                       drifters.getDrifterPositions()))
@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests checking that the array-based
+functions in BathymetryAndICs give bit-identical results to the original
+cell-by-cell implementations (found in BathymetryAndICsReference).
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import contextlib
+import io
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import BathymetryAndICs
+from utils import BathymetryAndICsReference
+
+
+class BathymetryAndICsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 64
+        self.ny = 48
+
+        # Halo layouts [north, east, south, west] used by the different schemes
+        self.halos = [[0, 0, 0, 0], [1, 1, 1, 1], [2, 2, 2, 2], [1, 2, 3, 2]]
+
+        # Grid spacings where the bumps cover the whole domain, and where they only cover a part of it.
+        # With dx = 2.026 some coordinates have x**2 != x*x, which the scalar implementations give.
+        self.spacings = [(200.0, 200.0), (1.0, 2.0), (2.026, 2.779), (np.float32(1.5), np.float32(0.7))]
+        self.dtypes = [np.float32, np.float64]
+
+        self.rng = np.random.RandomState(42)
+
+    def tearDown(self):
+        pass
+
+    def makeArrays(self, halo, dtype, count=1, staggered=False):
+        """
+        Creates count arrays with random data covering the domain, halo and an extra row and column
+        """
+        shape = (self.ny + halo[0] + halo[2] + 1 + int(staggered), self.nx + halo[1] + halo[3] + 1 + int(staggered))
+        return [(self.rng.rand(*shape)*10.0).astype(dtype) for i in range(count)]
+
+    def checkFunction(self, name, args_func, num_arrays=1):
+        """
+        Calls the array-based and the reference version of the function with the given name
+        for all halo layouts, grid spacings and dtypes, and checks that the results are identical.
+        args_func(dx, dy, halo) gives the arguments after the arrays.
+        """
+        for halo in self.halos:
+            for dx, dy in self.spacings:
+                for dtype in self.dtypes:
+                    arrays = self.makeArrays(halo, dtype, num_arrays)
+                    reference_arrays = [array.copy() for array in arrays]
+                    args = args_func(dx, dy, halo)
+
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        getattr(BathymetryAndICs, name)(*arrays, *args)
+                        getattr(BathymetryAndICsReference, name)(*reference_arrays, *args)
+
+                    for array, reference_array in zip(arrays, reference_arrays):
+                        msg = name + " differs for halo=" + str(halo) + ", dx=" + str(dx) + ", dtype=" + str(dtype.__name__)
+                        self.assertEqual(array.dtype, reference_array.dtype, msg=msg)
+                        self.assertTrue(np.array_equal(array, reference_array), msg=msg + \
+                                        ", max diff " + str(np.max(np.abs(array - reference_array))))
+
+
+    def test_make_bumps(self):
+        for name in ['makeCornerBump', 'makeUpperCornerBump', 'makeLowerLeftBump']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo))
+        self.checkFunction('makeCentralBump', lambda dx, dy, halo: (60.0, self.nx, self.ny, dx, dy, halo))
+
+    def test_add_bumps(self):
+        for name in ['addCornerBump', 'addUpperCornerBump', 'addCentralBump', 'addLowerLeftBump']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo))
+        self.checkFunction('addBump', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, 0.3, 0.6, 0.01, halo))
+        self.checkFunction('addDebugBump', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, 0.7, 0.2, halo))
+        self.checkFunction('addWideDebugBump', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, 0.4, 0.4, 0.02, halo))
+        self.checkFunction('addCentralDamBreakStep', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, 0.7, halo))
+
+    def test_balanced_velocity_fields(self):
+        for name in ['initializeBalancedVelocityField', 'initializeBalancedVelocityFieldStaggered']:
+            self.checkFunction(name, lambda dx, dy, halo: (1.2e-4, 2.0e-11, 9.81, self.nx, self.ny, dx, dy, halo),
+                               num_arrays=4)
+            self.checkFunction(name, lambda dx, dy, halo: (np.float32(1.2e-4), np.float32(0.0), np.float32(9.81),
+                                                           self.nx, self.ny, dx, dy, halo),
+                               num_arrays=4)
+
+    def test_balanced_bump_over_point(self):
+        for staggered in [False, True]:
+            for dtype in self.dtypes:
+                for dx, dy in self.spacings:
+                    halo = [2, 2, 2, 2]
+                    eta = self.makeArrays(halo, dtype)[0]
+                    hu, hv = self.makeArrays(halo, dtype, 2, staggered=staggered)
+                    eta_ref, hu_ref, hv_ref = eta.copy(), hu.copy(), hv.copy()
+                    args = (self.nx, self.ny, dx, dy, halo, 0.4, 0.6, 0.5, 0.03, 1.2e-4, 60.0, 9.81)
+
+                    BathymetryAndICs.initializeBalancedBumpOverPoint(eta, hu, hv, *args)
+                    BathymetryAndICsReference.initializeBalancedBumpOverPoint(eta_ref, hu_ref, hv_ref, *args)
+
+                    self.assertTrue(np.array_equal(eta, eta_ref))
+                    self.assertTrue(np.array_equal(hu, hu_ref))
+                    self.assertTrue(np.array_equal(hv, hv_ref))
+
+    def test_bathymetries(self):
+        for name in ['makeBathymetryCrater', 'makeBathymetryCrazyness']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo))
+        for name in ['linearBathymetryX', 'linearBathymetryY', 'exponentialBathymetryY']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 10.0, 30.0))
+        for name in ['diagonalWallBathymetry', 'straightWallBathymetry']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 15.0))
+        self.checkFunction('addContinentalShelfBathymetry', lambda dx, dy, halo: (self.nx, self.ny, halo, 5.0, 50.0, 0.3))
+        self.checkFunction('addTopographyBump', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 3.0))
+
+    def test_dams(self):
+        self.checkFunction('addDiagonalDam', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 2.0))
+        self.checkFunction('addStraightDam', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 2.0))
+        self.checkFunction('addStraightDam', lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo, 2.0, 12.5))
+
+    def test_dual_vortex(self):
+        for name in ['addDualVortex', 'addDualVortexStaggered']:
+            self.checkFunction(name, lambda dx, dy, halo: (self.nx, self.ny, dx, dy, halo), num_arrays=3)
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements regression tests for the NumPy reference
+versions of the FBL, CTCS, KP07 and CDKLM16 schemes against the GPU results
+in timestep50. These tests do not require a GPU.
+
+Tolerances are the same as in the GPU regression tests in schemes/:
+5 decimals (absolute) for FBL and CTCS, and 4 decimals (relative to the
+largest reference value) for KP07. CDKLM16 is checked to a relative
+tolerance of 1e-4.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Common, CPUSimulators, WindStress
+
+
+class CPUSimulatorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 50
+        self.ny = 70
+
+        self.dx = 200.0
+        self.dy = 200.0
+
+        self.g = 9.81
+        self.f = 0.0
+        self.r = 0.0
+        self.A = 1
+
+        self.T = 50.0
+
+        self.sim = None
+
+    def tearDown(self):
+        if self.sim is not None:
+            self.sim.cleanUp()
+            self.sim = None
+
+    def boundaryConditions(self, bcSettings):
+        if bcSettings == 1:
+            return Common.BoundaryConditions()
+        elif bcSettings == 2:
+            return Common.BoundaryConditions(2,2,2,2)
+        elif bcSettings == 3:
+            # Periodic NS
+            return Common.BoundaryConditions(2,1,2,1)
+        else:
+            # Periodic EW
+            return Common.BoundaryConditions(1,2,1,2)
+
+    def checkMaxDiff(self, results, references, places, scaled=False):
+        for name, result, reference in zip(["eta", "hu", "hv"], results, references):
+            maxDiff = np.max(np.abs(result - reference))
+            if scaled:
+                maxDiff = maxDiff / np.max(np.abs(reference))
+            self.assertAlmostEqual(maxDiff, 0.0, places=places,
+                                   msg='Unexpected ' + name + ' difference! Max diff: ' + str(maxDiff))
+
+    ## FBL
+
+    def runFBL(self, bcSettings, makeBump, f=0.0, coriolis_beta=0.0, bathymetry=False):
+        ghosts = [1,1,1,1]
+        h0 = np.ones((self.ny+2, self.nx+2), dtype=np.float32) * 60
+        eta0 = np.zeros((self.ny+2, self.nx+2), dtype=np.float32)
+        u0 = np.zeros((self.ny+2, self.nx+1), dtype=np.float32)
+        v0 = np.zeros((self.ny+3, self.nx+2), dtype=np.float32)
+        if bathymetry:
+            makeBottomTopography(h0, self.nx, self.ny, self.dx, self.dy, ghosts, intersections=False)
+        makeBump(eta0, self.nx, self.ny, self.dx, self.dy, ghosts)
+
+        self.sim = CPUSimulators.CPUFBL(None, \
+                                        h0, eta0, u0, v0, \
+                                        self.nx, self.ny, \
+                                        self.dx, self.dy, 1.0, \
+                                        self.g, f, self.r, \
+                                        coriolis_beta=coriolis_beta, \
+                                        boundary_conditions=self.boundaryConditions(bcSettings))
+        t = self.sim.step(self.T)
+        self.assertAlmostEqual(t, self.T)
+        return self.sim.download(interior_domain_only=True)
+
+    def checkFBL(self, results, references, refRange):
+        # Reference arrays from periodic runs contain the periodic ghost cells
+        etaRef, uRef, vRef = references
+        etaRef = etaRef[refRange[2]:refRange[0], refRange[3]:refRange[1]]
+        uRef = uRef[refRange[2]:refRange[0], :]
+        vRef = vRef[:, refRange[3]:refRange[1]]
+        self.checkMaxDiff(results, [etaRef, uRef, vRef], places=5)
+
+    def test_FBL_wall_corner(self):
+        results = self.runFBL(1, makeCornerBump)
+        self.checkFBL(results, loadResults("FBL", "wallBC", "corner"), [None, None, 0, 0])
+
+    def test_FBL_periodic_corner(self):
+        results = self.runFBL(2, makeCornerBump)
+        self.checkFBL(results, loadResults("FBL", "periodicAll", "corner"), [-1, -1, 0, 0])
+
+    def test_FBL_periodicNS_corner(self):
+        results = self.runFBL(3, makeCornerBump)
+        self.checkFBL(results, loadResults("FBL", "periodicNS", "corner"), [-1, None, 0, 0])
+
+    def test_FBL_periodicEW_corner(self):
+        results = self.runFBL(4, makeCornerBump)
+        self.checkFBL(results, loadResults("FBL", "periodicEW", "corner"), [None, -1, 0, 0])
+
+    def test_FBL_betamodel_central(self):
+        results = self.runFBL(1, makeCentralBump, f=0.01, coriolis_beta=1e-6)
+        self.checkFBL(results, loadResults("FBL", "betamodel", "central"), [None, None, 0, 0])
+
+    def test_FBL_bathymetry_central(self):
+        results = self.runFBL(1, makeCentralBump, bathymetry=True)
+        self.checkFBL(results, loadResults("FBL", "wallBC", "central", "bathymetry_"), [None, None, 0, 0])
+
+    ## CTCS
+
+    def runCTCS(self, bcSettings, makeBump, f=0.0, coriolis_beta=0.0, bathymetry=False):
+        ghosts = [1,1,1,1]
+        h0 = np.ones((self.ny+2, self.nx+2), dtype=np.float32) * 60
+        eta0 = np.zeros((self.ny+2, self.nx+2), dtype=np.float32)
+        u0 = np.zeros((self.ny+2, self.nx+3), dtype=np.float32)
+        v0 = np.zeros((self.ny+3, self.nx+2), dtype=np.float32)
+        if bathymetry:
+            makeBottomTopography(h0, self.nx, self.ny, self.dx, self.dy, ghosts, intersections=False)
+        makeBump(eta0, self.nx, self.ny, self.dx, self.dy, ghosts)
+
+        self.sim = CPUSimulators.CPUCTCS(None, \
+                                         h0, eta0, u0, v0, \
+                                         self.nx, self.ny, \
+                                         self.dx, self.dy, 1.0, \
+                                         self.g, f, self.r, self.A, \
+                                         coriolis_beta=coriolis_beta, \
+                                         boundary_conditions=self.boundaryConditions(bcSettings))
+        self.sim.step(self.T)
+        return self.sim.download()
+
+    def checkCTCS(self, results, references):
+        etaRange = [-1, -1, 1, 1]
+        uRange = [-1, -2, 1, 2]
+        vRange = [-2, -1, 2, 1]
+        sliced = [[], []]
+        for i, data in enumerate([results, references]):
+            for array, r in zip(data, [etaRange, uRange, vRange]):
+                sliced[i].append(array[r[2]:r[0], r[3]:r[1]])
+        self.checkMaxDiff(sliced[0], sliced[1], places=5)
+
+    def test_CTCS_wall_corner(self):
+        results = self.runCTCS(1, makeCornerBump)
+        self.checkCTCS(results, loadResults("CTCS", "wallBC", "corner"))
+
+    def test_CTCS_periodic_corner(self):
+        results = self.runCTCS(2, makeCornerBump)
+        self.checkCTCS(results, loadResults("CTCS", "periodic", "corner"))
+
+    def test_CTCS_periodicNS_upperCorner(self):
+        results = self.runCTCS(3, makeUpperCornerBump)
+        self.checkCTCS(results, loadResults("CTCS", "periodicNS", "upperCorner"))
+
+    def test_CTCS_periodicEW_upperCorner(self):
+        results = self.runCTCS(4, makeUpperCornerBump)
+        self.checkCTCS(results, loadResults("CTCS", "periodicEW", "upperCorner"))
+
+    def test_CTCS_betamodel_central(self):
+        results = self.runCTCS(1, makeCentralBump, f=0.01, coriolis_beta=1e-6)
+        self.checkCTCS(results, loadResults("CTCS", "betamodel", "central"))
+
+    def test_CTCS_bathymetry_coriolis_central(self):
+        results = self.runCTCS(1, makeCentralBump, f=0.01, bathymetry=True)
+        self.checkCTCS(results, loadResults("CTCS", "coriolis", "central", "bathymetry_"))
+
+    ## KP07
+
+    def runKP07(self, bcSettings, addBump=None, f=0.0, Bi=None):
+        validDomain = np.array([2,2,2,2])
+        eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        u0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        v0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+        if Bi is not None:
+            Hi += Bi
+        if addBump is not None:
+            addBump(eta0, self.nx, self.ny, self.dx, self.dy, validDomain)
+
+        self.sim = CPUSimulators.CPUKP07(None, \
+                                         eta0, Hi, u0, v0, \
+                                         self.nx, self.ny, \
+                                         self.dx, self.dy, 0.95, \
+                                         self.g, f, self.r, \
+                                         boundary_conditions=self.boundaryConditions(bcSettings))
+        self.sim.step(self.T)
+        return self.sim.download()
+
+    def checkKP07(self, results, references):
+        sliced = [[array[2:-2, 2:-2] for array in data] for data in [results, references]]
+        self.checkMaxDiff(sliced[0], sliced[1], places=4, scaled=True)
+
+    def test_KP07_wall_corner(self):
+        results = self.runKP07(1, addCornerBump)
+        self.checkKP07(results, loadResults("KP07", "wallBC", "corner"))
+
+    def test_KP07_periodic_upperCorner(self):
+        results = self.runKP07(2, addUpperCornerBump)
+        self.checkKP07(results, loadResults("KP07", "periodic", "upperCorner"))
+
+    def test_KP07_periodicNS_corner(self):
+        results = self.runKP07(3, addCornerBump)
+        self.checkKP07(results, loadResults("KP07", "periodicNS", "corner"))
+
+    def test_KP07_periodicEW_upperCorner(self):
+        results = self.runKP07(4, addUpperCornerBump)
+        self.checkKP07(results, loadResults("KP07", "periodicEW", "upperCorner"))
+
+    def test_KP07_coriolis_central(self):
+        results = self.runKP07(1, addCentralBump, f=0.01)
+        self.checkKP07(results, loadResults("KP07", "coriolis", "central"))
+
+    def test_KP07_lake_at_rest_crazy_bottom(self):
+        Bi = np.zeros((self.ny+5, self.nx+5), dtype=np.float32)
+        makeBathymetryCrazyness(Bi, self.nx+1, self.ny+1, self.dx, self.dy, [2,2,2,2])
+        eta, hu, hv = self.runKP07(1, Bi=Bi)
+        for name, data in zip(["eta", "hu", "hv"], [eta, hu, hv]):
+            self.assertAlmostEqual(np.max(np.abs(data)), 0.0, places=3,
+                                   msg='Lake at rest not preserved in ' + name)
+
+    ## CDKLM16
+
+    def test_CDKLM16_coriolis_central(self):
+        eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        hu0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        hv0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+        addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, np.array([2,2,2,2]))
+
+        self.sim = CPUSimulators.CPUCDKLM16(None, \
+                                            eta0, hu0, hv0, Hi, \
+                                            self.nx, self.ny, \
+                                            self.dx, self.dy, 0.9, \
+                                            self.g, 0.01, self.r)
+        t = self.sim.step(self.T)
+        self.assertAlmostEqual(t, self.T)
+        # The NumPy version agrees with the GPU results to about 5e-5 (relative)
+        results, references = self.sim.download(), loadResults("CDKLM16", "coriolis", "central")
+        for name, result, reference in zip(["eta", "hu", "hv"], results, references):
+            maxDiff = np.max(np.abs(result[2:-2, 2:-2] - reference[2:-2, 2:-2])) / np.max(np.abs(reference))
+            self.assertLess(maxDiff, 1.0e-4, msg='Unexpected ' + name + ' difference! Max diff: ' + str(maxDiff))
+
+    ## Wind stress
+
+    def test_wind_stress_interpolation(self):
+        # A constant wind stress that is switched on linearly in time
+        X = [np.zeros((2, 2), dtype=np.float32), np.ones((2, 2), dtype=np.float32)*0.5]
+        Y = [np.zeros((2, 2), dtype=np.float32), np.ones((2, 2), dtype=np.float32)*0.25]
+        wind_stress = WindStress.WindStress(t=[0.0, 100.0], X=X, Y=Y)
+
+        h0 = np.ones((self.ny+2, self.nx+2), dtype=np.float32) * 60
+        eta0 = np.zeros((self.ny+2, self.nx+2), dtype=np.float32)
+        u0 = np.zeros((self.ny+2, self.nx+1), dtype=np.float32)
+        v0 = np.zeros((self.ny+3, self.nx+2), dtype=np.float32)
+        self.sim = CPUSimulators.CPUFBL(None, \
+                                        h0, eta0, u0, v0, \
+                                        self.nx, self.ny, \
+                                        self.dx, self.dy, 1.0, \
+                                        self.g, self.f, self.r, \
+                                        wind_stress=wind_stress)
+        self.sim.t = 25.0
+        windX, windY = self.sim.windStress()
+        self.assertEqual(windX.shape, (self.ny+2, self.nx+1))
+        self.assertEqual(windY.shape, (self.ny+1, self.nx))
+        self.assertTrue(np.allclose(windX, 0.125))
+        self.assertTrue(np.allclose(windY, 0.0625))
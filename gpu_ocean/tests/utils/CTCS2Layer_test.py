@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements regression tests running the OpenCL
+CTCS2Layer scheme on a CPU OpenCL device (e.g., POCL).
+These tests do not require a GPU, and are skipped if pyopencl or a
+CPU OpenCL platform is not available.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+try:
+    from SWESimulators import CTCS2Layer, OpenCLContext
+except ImportError:
+    CTCS2Layer = None
+
+
+@unittest.skipIf(CTCS2Layer is None, "pyopencl is not available")
+class CTCS2LayerCPUTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 50
+        self.ny = 40
+        self.dx = 1000.0
+        self.dy = 1000.0
+        self.dt = 5.0
+        self.T = 500.0
+
+        try:
+            self.opencl_ctx = OpenCLContext.OpenCLContext(device_type='cpu')
+        except RuntimeError:
+            self.skipTest("No CPU OpenCL platform available")
+
+    def tearDown(self):
+        self.opencl_ctx = None
+
+    def makeSim(self, eta1_0, block_width=None, block_height=None, wind_type=99):
+        nx, ny = self.nx, self.ny
+        h1_0 = np.ones((ny+2, nx+2), dtype=np.float32)*50.0
+        h2_0 = np.ones((ny+2, nx+2), dtype=np.float32)*150.0
+        eta2_0 = np.zeros((ny+2, nx+2), dtype=np.float32)
+        u_0 = np.zeros((ny+2, nx+1), dtype=np.float32)
+        v_0 = np.zeros((ny+1, nx+2), dtype=np.float32)
+
+        return CTCS2Layer.CTCS2Layer(self.opencl_ctx, \
+                                     h1_0, eta1_0, u_0, v_0, \
+                                     h2_0, eta2_0, u_0.copy(), v_0.copy(), \
+                                     nx, ny, self.dx, self.dy, self.dt, \
+                                     9.81, 1.2e-4, 0.0, 0.0, 1.0, \
+                                     1025.0, 1055.0, \
+                                     wind_type=wind_type, wind_tau0=0.2, wind_alpha=1.0e-5, \
+                                     block_width=block_width, block_height=block_height)
+
+    def makeBump(self):
+        eta1_0 = np.zeros((self.ny+2, self.nx+2), dtype=np.float32)
+        addCentralBump(eta1_0, self.nx, self.ny, self.dx, self.dy, [1, 1, 1, 1])
+        return eta1_0
+
+    def test_device(self):
+        sim = self.makeSim(self.makeBump())
+        self.assertTrue(sim.opencl_ctx.is_cpu)
+        self.assertEqual(sim.local_size, self.opencl_ctx.workGroupSize())
+
+    def test_lake_at_rest(self):
+        sim = self.makeSim(np.zeros((self.ny+2, self.nx+2), dtype=np.float32))
+        sim.step(self.T)
+        for data in sim.download():
+            self.assertEqual(np.max(np.abs(data)), 0.0)
+
+    def test_work_group_sizes(self):
+        # The result must not depend on the work-group size compiled into the kernels
+        results = []
+        for block_width, block_height in [(None, None), (8, 8), (16, 2)]:
+            sim = self.makeSim(self.makeBump(), block_width, block_height)
+            sim.step(self.T)
+            results.append(sim.download())
+
+        eta1 = results[0][0]
+        self.assertTrue(np.all(np.isfinite(eta1)))
+        self.assertGreater(np.max(np.abs(results[0][1])), 0.0)
+        for other in results[1:]:
+            for data, other_data in zip(results[0], other):
+                self.assertLess(np.max(np.abs(data - other_data)), 1.0e-6)
+
+    def test_wind_stress(self):
+        # Uniform along shore wind on a lake at rest drives the upper layer along x
+        sim = self.makeSim(np.zeros((self.ny+2, self.nx+2), dtype=np.float32), wind_type=0)
+        sim.step(self.T)
+        eta1, u1, v1, eta2, u2, v2 = sim.download()
+        self.assertGreater(np.max(u1[1:-1, 1:-1]), 0.0)
+        self.assertTrue(np.all(np.isfinite(u1)))
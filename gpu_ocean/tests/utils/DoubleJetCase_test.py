@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the construction of the
+initial conditions in DoubleJetCase.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import scipy.integrate
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import DoubleJetCase
+
+
+class DoubleJetCaseTest(unittest.TestCase):
+
+    def setUp(self):
+        DoubleJetCase.DoubleJetCase.clear_steady_state_cache()
+        self.case = DoubleJetCase.DoubleJetCase(None, DoubleJetCase.DoubleJetPerturbationType.SteadyState)
+
+    def tearDown(self):
+        self.case = None
+        DoubleJetCase.DoubleJetCase.clear_steady_state_cache()
+
+    def test_steady_state_vs_quad(self):
+        case = self.case
+        dy_phi = (case.phi_1 - case.phi_0)/case.ny
+        sim_phi = np.linspace(case.phi_0 - 2*dy_phi, case.phi_1 + 2*dy_phi, case.ny+4)
+
+        # Reference: adaptive quadrature for each latitude
+        integrand = lambda lat: case._init_h_integrand(np.array([lat]))[0]
+        h_ref = np.zeros_like(sim_phi)
+        for j in range(len(sim_phi)):
+            integral = 0.0
+            if sim_phi[j] > case.phi_0:
+                upper = min(sim_phi[j], case.phi_1)
+                integral += scipy.integrate.quad(integrand, case.phi_0, min(upper, case.phi_05))[0]
+                if upper > case.phi_05:
+                    integral += scipy.integrate.quad(integrand, case.phi_05, upper)[0]
+            h_ref[j] = (case.g*case.h_0 - integral)/case.g
+
+        h_init, hu_init = case._initSteadyState()
+
+        self.assertLess(np.max(np.abs(h_init - h_ref)), 1.0e-9*case.h_0)
+        self.assertEqual(h_init[0], case.h_0)
+
+        hu_ref = np.zeros_like(h_ref)
+        for j in range(1, len(hu_ref)-1):
+            hu_ref[j] = - (case.g*np.mean(h_init)/case.f)*(h_init[j+1]-h_init[j-1])/(2*case.dy)
+        self.assertEqual(np.max(np.abs(hu_init - hu_ref)), 0.0)
+
+    def test_base_state(self):
+        h_init, hu_init = self.case._initSteadyState()
+        base_args, base_init = self.case.getBaseInitConditions()
+
+        self.assertEqual(base_init['eta0'].shape, self.case.dataShape)
+        for i in [0, 1, self.case.nx//2, self.case.dataShape[1]-1]:
+            self.assertEqual(np.max(np.abs(base_init['eta0'][:, i] - (base_init['eta0'][:, 0]))), 0.0)
+            self.assertEqual(np.max(np.abs(base_init['hu0'][:, i] - hu_init.astype(np.float32))), 0.0)
+        self.assertEqual(np.max(np.abs(base_init['hv0'])), 0.0)
+
+    def test_steady_state_cache(self):
+        self.assertEqual(len(DoubleJetCase.DoubleJetCase.steady_states), 1)
+        cached_h, cached_hu = list(DoubleJetCase.DoubleJetCase.steady_states.values())[0]
+
+        other_case = DoubleJetCase.DoubleJetCase(None, DoubleJetCase.DoubleJetPerturbationType.StandardPerturbedState)
+        self.assertEqual(len(DoubleJetCase.DoubleJetCase.steady_states), 1)
+        self.assertIs(list(DoubleJetCase.DoubleJetCase.steady_states.values())[0][0], cached_h)
+
+        self.assertEqual(np.max(np.abs(other_case.base_cpu_eta - self.case.base_cpu_eta)), 0.0)
+        self.assertEqual(np.max(np.abs(other_case.base_cpu_hu - self.case.base_cpu_hu)), 0.0)
+
+        # Modifying the returned arrays should not modify the cache
+        h_init, hu_init = other_case._initSteadyState()
+        h_init[:] = 0.0
+        self.assertGreater(np.min(cached_h), 0.0)
+
+    def _loopPerturbation(self, mid_cell_x_pos, mid_cell_x_neg):
+        """
+        Reference implementation of the eta perturbation, looping over all cells
+        """
+        case = self.case
+        eta_pert = np.zeros(case.dataShape)
+
+        distance_between_longitudes_75 = 28.7e3 # m
+        distance_between_latitudes = 111e3 # m
+        mid_cell_y_pos = int(1*case.ny/4)
+        mid_cell_y_neg = int(3*case.ny/4)
+        pert_alpha = case.phi_delta
+        pert_beta = case.phi_delta/5
+        h_hat = 0.12*case.delta_eta
+        lat = np.cos(75*np.pi/180)
+
+        for j in range(case.dataShape[0]):
+            for i in range(case.dataShape[1]):
+                cell_diff_x_pos = i-mid_cell_x_pos
+                cell_diff_x_pos = min(abs(cell_diff_x_pos), abs(cell_diff_x_pos+case.nx), abs(cell_diff_x_pos-case.nx))
+                cell_diff_x_neg = i-mid_cell_x_neg
+                cell_diff_x_neg = min(abs(cell_diff_x_neg), abs(cell_diff_x_neg+case.nx), abs(cell_diff_x_neg-case.nx))
+
+                squared_dist_y_pos = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_pos)*case.dy/distance_between_latitudes)**2
+                squared_dist_y_neg = ((1/pert_beta)*(np.pi/180)*(j-mid_cell_y_neg)*case.dy/distance_between_latitudes)**2
+                squared_dist_x_pos = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_pos)*case.dx/(distance_between_longitudes_75))**2
+                squared_dist_x_neg = ((1/pert_alpha)*(np.pi/180)*(cell_diff_x_neg)*case.dx/(distance_between_longitudes_75))**2
+
+                eta_pert[j,i] += h_hat*lat*np.exp(-squared_dist_y_pos - squared_dist_x_pos) +\
+                                 h_hat*lat*np.exp(-squared_dist_y_neg - squared_dist_x_neg)
+        return eta_pert
+
+    def test_perturbation_vs_loop(self):
+        for mid_cell_x_pos, mid_cell_x_neg in [(102, 102), (3, 490), (97.3, 120.8)]:
+            sim_args, init = self.case._create_perturbed_init(mid_cell_x_pos, mid_cell_x_neg)
+            eta_pert_ref = self._loopPerturbation(mid_cell_x_pos, mid_cell_x_neg)
+
+            self.assertEqual(init['eta0'].shape, self.case.dataShape)
+            max_diff = np.max(np.abs(init['eta0'] - (self.case.base_cpu_eta + eta_pert_ref)))
+            self.assertAlmostEqual(max_diff, 0.0, places=12,
+                                   msg="perturbed eta " + str((mid_cell_x_pos, mid_cell_x_neg)))
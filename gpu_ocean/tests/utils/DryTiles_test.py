@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the classification of dry tiles,
+and of skipping them in the CDKLM16 step, using the NumPy reference
+version CPUCDKLM16. These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Common, CPUSimulators
+
+
+def tileActivityMapLoop(land_mask, tile_width, tile_height):
+    """
+    The tile activity map found tile by tile
+    """
+    ny, nx = land_mask.shape
+    tiles_y = (ny + tile_height - 1) // tile_height
+    tiles_x = (nx + tile_width - 1) // tile_width
+    activity_map = np.zeros((tiles_y, tiles_x), dtype=bool)
+    for tile_y in range(tiles_y):
+        for tile_x in range(tiles_x):
+            tile = land_mask[tile_y*tile_height:(tile_y+1)*tile_height, tile_x*tile_width:(tile_x+1)*tile_width]
+            activity_map[tile_y, tile_x] = not np.all(tile)
+    return activity_map
+
+
+class DryTilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 50
+        self.ny = 40
+        self.dx = 200.0
+        self.dy = 200.0
+
+        # Land in the east and south, with an island
+        self.H = np.ma.array(np.full((self.ny+5, self.nx+5), 60.0, dtype=np.float32), mask=False)
+        self.H.mask[:, 30:] = True
+        self.H.mask[:12, :] = True
+        self.H.mask[25:29, 5:9] = True
+
+        x, y = np.meshgrid(np.arange(self.nx+4), np.arange(self.ny+4))
+        self.eta0 = (0.5*np.exp(-((x-15)**2 + (y-22)**2)/20.0)).astype(np.float32)
+        self.hu0 = np.zeros_like(self.eta0)
+        self.hv0 = np.zeros_like(self.eta0)
+
+    def test_tile_activity_map(self):
+        rng = np.random.RandomState(1)
+        for ny, nx in [(16, 16), (37, 23), (5, 70)]:
+            land_mask = rng.rand(ny, nx) < 0.97
+            land_mask[:ny//2, :] = True
+            for tile_width, tile_height in [(1, 1), (4, 4), (12, 32), (16, 5)]:
+                activity_map = Common.tileActivityMap(land_mask, tile_width, tile_height)
+                expected = tileActivityMapLoop(land_mask, tile_width, tile_height)
+                self.assertTrue(np.array_equal(activity_map, expected))
+
+                tiles_x = activity_map.shape[1]
+                indices = Common.activeTileIndices(activity_map)
+                self.assertEqual(indices.dtype, np.int32)
+                self.assertTrue(np.array_equal(np.sort(indices), indices))
+                self.assertTrue(np.all(activity_map[indices // tiles_x, indices % tiles_x]))
+                self.assertEqual(len(indices), np.sum(activity_map))
+
+        # Tiles are only inactive when all of their cells are land
+        self.assertTrue(np.all(Common.tileActivityMap(np.zeros((10, 10), dtype=bool), 4, 4)))
+        self.assertFalse(np.any(Common.tileActivityMap(np.ones((10, 10), dtype=bool), 4, 4)))
+
+    def test_bathymetry_tile_activity_map(self):
+        bathymetry = Common.Bathymetry(None, None, self.nx, self.ny, 2, 2, self.H, backend='host')
+        land_mask = bathymetry.download(None)[1].mask[2:-2, 2:-2]
+        activity_map = bathymetry.tileActivityMap(12, 8)
+        self.assertEqual(activity_map.shape, (5, 5))
+        self.assertTrue(np.array_equal(activity_map, tileActivityMapLoop(land_mask, 12, 8)))
+        self.assertTrue(0 < np.sum(activity_map) < activity_map.size)
+
+        # All tiles are launched when all are active, without a tile list
+        active_tiles = Common.ActiveTiles(None, np.ones((3, 4), dtype=bool))
+        self.assertEqual(active_tiles.global_size, (4, 3))
+        self.assertEqual(active_tiles.pointer(), 0)
+
+    def test_wet_cells_bitwise_identical(self):
+        for boundary_conditions in [Common.BoundaryConditions(1, 1, 1, 1), Common.BoundaryConditions(2, 2, 2, 2)]:
+            for rk_order in [1, 2, 3]:
+                r = 0.0 if rk_order == 3 else 3.0e-3
+                sims = [CPUSimulators.CPUCDKLM16(None, self.eta0, self.hu0, self.hv0, self.H, \
+                                                 self.nx, self.ny, self.dx, self.dy, 2.0, \
+                                                 9.81, 1.2e-4, r, rk_order=rk_order, \
+                                                 boundary_conditions=boundary_conditions, \
+                                                 block_width=12, block_height=8, \
+                                                 skip_dry_tiles=skip_dry_tiles) \
+                        for skip_dry_tiles in [False, True]]
+                self.assertLess(len(sims[1]._tiles), sims[1].tile_activity_map.size)
+                for sim in sims:
+                    sim.step(20.0)
+
+                land_mask = sims[0].downloadBathymetry()[1].mask
+                msg = str(boundary_conditions) + ", rk_order " + str(rk_order)
+                for full, tiled in zip(sims[0].download(), sims[1].download()):
+                    self.assertTrue(np.all(np.isfinite(full)), msg=msg)
+                    self.assertTrue(np.array_equal(full[~land_mask], tiled[~land_mask]), msg=msg)
+
+                # The wave has moved, and land cells in skipped tiles are untouched
+                eta, hu, hv = sims[1].download(interior_domain_only=True)
+                self.assertGreater(np.max(np.abs(hu)), 0.1, msg=msg)
+                dry_tiles = np.kron(~sims[1].tile_activity_map, np.ones((8, 12), dtype=bool))[:self.ny, :self.nx]
+                self.assertTrue(np.array_equal(eta[dry_tiles], self.eta0[2:-2, 2:-2][dry_tiles]), msg=msg)
@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the scheduling, checkpointing and
+resuming in ExperimentDriver, using a mock model which needs no GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import ExperimentDriver
+
+
+class MockCrash(Exception):
+    pass
+
+
+class MockModel(ExperimentDriver.ExperimentModel):
+    """
+    Model where the state of each particle is its time plus a counter of the
+    assimilations, and all calls are recorded
+    """
+
+    def __init__(self, num_particles, crash_at=None):
+        self.num_particles = num_particles
+        self.t = 0.0
+        self.state = np.zeros(num_particles)
+        self.active = list(range(num_particles))
+        self.calls = []
+        self.forecasts = {}
+        self.crash_at = crash_at
+
+    def _call(self, *call):
+        if self.crash_at is not None and call == self.crash_at:
+            raise MockCrash()
+        self.calls.append(call)
+
+    def step(self, t, model_error_final_step=True):
+        self._call('step', t, model_error_final_step)
+        assert(t > self.t)
+        self.t = t
+
+    def assimilate(self, t):
+        self._call('assimilate', t)
+        self.state += 1
+
+    def sample(self, t):
+        self._call('sample', t)
+
+    def writeOutput(self, t):
+        self._call('writeOutput', t)
+
+    def saveCheckpoint(self, path):
+        os.makedirs(path)
+        np.savez(os.path.join(path, "state.npz"), t=self.t, state=self.state)
+
+    def loadCheckpoint(self, path):
+        with np.load(os.path.join(path, "state.npz")) as data:
+            self.t = float(data['t'])
+            self.state = data['state']
+
+    def getForecastParticles(self):
+        return self.active
+
+    def startForecast(self, particle_ids, t):
+        self._call('startForecast', tuple(particle_ids), t)
+        self.forecast_t = {p: t for p in particle_ids}
+
+    def stepForecast(self, particle_ids, t):
+        self._call('stepForecast', tuple(particle_ids), t)
+        for p in particle_ids:
+            self.forecast_t[p] = t
+
+    def observeForecast(self, particle_ids, t):
+        self._call('observeForecast', tuple(particle_ids), t)
+
+    def writeForecastOutput(self, particle_ids, t):
+        self._call('writeForecastOutput', tuple(particle_ids), t)
+
+    def finishForecast(self, particle_ids):
+        self._call('finishForecast', tuple(particle_ids))
+        for p in particle_ids:
+            self.forecasts[p] = (self.forecast_t[p], self.state[p])
+
+
+class ExperimentDriverTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.checkpoint_dir = os.path.join(self.tmpdir, "checkpoint")
+
+        # As run_experiment.py: 5 minute cycles sampled every minute, output every hour,
+        # and a forecast observed every 5 minutes and written every 30 minutes
+        self.plan = ExperimentDriver.ExperimentPlan(start_t=3*24*3600, num_cycles=24, cycle_length=300,
+                                                    sample_interval=60, output_interval=3600,
+                                                    forecast_duration=3600, forecast_observation_interval=300,
+                                                    forecast_output_interval=1800)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plan(self):
+        self.assertEqual(len(self.plan.cycles), 24)
+        cycle = self.plan.cycles[3]
+        self.assertEqual(cycle.start_t, 3*24*3600 + 900)
+        self.assertEqual(cycle.end_t, 3*24*3600 + 1200)
+        self.assertTrue(np.array_equal(cycle.sample_times, 3*24*3600 + 900 + 60*np.arange(1, 6)))
+        self.assertEqual([c.index for c in self.plan.cycles if c.write_output], [11, 23])
+
+        self.assertEqual(self.plan.forecast_start_t, 3*24*3600 + 7200)
+        self.assertEqual(self.plan.forecast_end_t, 3*24*3600 + 10800)
+        self.assertEqual(len(self.plan.forecast_observation_times), 12)
+        self.assertEqual(len(self.plan.forecast_output_times), 2)
+
+    def test_schedule(self):
+        model = MockModel(6)
+        model.t = self.plan.start_t
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, forecast_group_size=4)
+        self.assertTrue(driver.run())
+        self.assertTrue(driver.isDone())
+
+        calls = model.calls
+        self.assertEqual(len([c for c in calls if c[0] == 'step']), 24*5)
+        self.assertEqual(len([c for c in calls if c[0] == 'sample']), 24*5)
+        self.assertEqual(len([c for c in calls if c[0] == 'writeOutput']), 2)
+
+        # Within a cycle, only the final step before the assimilation is without model error
+        first_cycle = calls[:calls.index(('assimilate', self.plan.cycles[0].end_t))+2]
+        self.assertEqual([c[0] for c in first_cycle], ['step', 'sample']*4 + ['step', 'assimilate', 'sample'])
+        self.assertEqual([c[2] for c in first_cycle if c[0] == 'step'], [True]*4 + [False])
+
+        # Forecasts are run in groups, each particle stepped in turn to each observation time
+        forecast_calls = [c for c in calls if c[0] == 'stepForecast']
+        self.assertEqual(len(forecast_calls), 2*12)
+        self.assertEqual(forecast_calls[0][1], (0, 1, 2, 3))
+        self.assertEqual(forecast_calls[-1][1], (4, 5))
+        self.assertEqual(len([c for c in calls if c[0] == 'writeForecastOutput']), 2*2)
+        self.assertEqual(sorted(model.forecasts.keys()), list(range(6)))
+        for p in range(6):
+            self.assertEqual(model.forecasts[p], (self.plan.forecast_end_t, 24))
+
+    def test_no_assimilation(self):
+        plan = ExperimentDriver.ExperimentPlan(start_t=0, num_cycles=3, cycle_length=300, sample_interval=60,
+                                               assimilate=False)
+        model = MockModel(2)
+        ExperimentDriver.ExperimentDriver(model, plan).run()
+        self.assertEqual(len([c for c in model.calls if c[0] == 'assimilate']), 0)
+        self.assertTrue(all(c[2] for c in model.calls if c[0] == 'step'))
+        self.assertEqual(len([c for c in model.calls if c[0] == 'startForecast']), 0)
+
+    def test_resume_after_crash(self):
+        reference = MockModel(5)
+        reference.t = self.plan.start_t
+        ExperimentDriver.ExperimentDriver(reference, self.plan, forecast_group_size=2).run()
+
+        # Crash during cycle 14, with checkpoints every 4 cycles
+        crash_t = self.plan.cycles[14].sample_times[2]
+        model = MockModel(5, crash_at=('sample', crash_t))
+        model.t = self.plan.start_t
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir,
+                                                   checkpoint_interval=4, forecast_group_size=2)
+        with self.assertRaises(MockCrash):
+            driver.run()
+        self.assertEqual(driver.completed_cycles, 14)
+        with open(os.path.join(self.checkpoint_dir, "progress.json")) as f:
+            self.assertEqual(json.load(f)['completed_cycles'], 12)
+        # Only the latest model state is kept
+        self.assertEqual(sorted(os.listdir(self.checkpoint_dir)), ["model_state_00012", "progress.json"])
+
+        # Resume in a new model, which continues from the start of cycle 12
+        model = MockModel(5, crash_at=('stepForecast', (2, 3), self.plan.forecast_observation_times[5]))
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir,
+                                                   checkpoint_interval=4, forecast_group_size=2)
+        self.assertEqual(driver.completed_cycles, 12)
+        self.assertEqual(model.t, self.plan.cycles[11].end_t)
+        self.assertEqual(model.state[0], 12)
+
+        # ...and crashes in the second forecast group
+        with self.assertRaises(MockCrash):
+            driver.run()
+        self.assertEqual(model.calls[0], ('step', self.plan.cycles[12].sample_times[0], True))
+        self.assertEqual(driver.completed_forecasts, [0, 1])
+
+        # The final run only forecasts the remaining particles, from the end of the assimilation
+        model = MockModel(5)
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir,
+                                                   checkpoint_interval=4, forecast_group_size=2)
+        self.assertEqual(model.t, self.plan.forecast_start_t)
+        self.assertEqual(driver.getPendingForecasts(), [2, 3, 4])
+        self.assertTrue(driver.run())
+        self.assertEqual(len([c for c in model.calls if c[0] == 'step']), 0)
+        self.assertEqual([c[1] for c in model.calls if c[0] == 'startForecast'], [(2, 3), (4,)])
+        for p in [2, 3, 4]:
+            self.assertEqual(model.forecasts[p], reference.forecasts[p])
+
+        # Nothing is left to do
+        model = MockModel(5)
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir)
+        self.assertTrue(driver.isDone())
+        driver.run()
+        self.assertEqual(model.calls, [])
+
+    def test_partial_run(self):
+        model = MockModel(3)
+        model.t = self.plan.start_t
+        driver = ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir,
+                                                   checkpoint_interval=100)
+        self.assertFalse(driver.run(max_cycles=10))
+        self.assertEqual(driver.completed_cycles, 10)
+
+        # The final cycle is always checkpointed
+        self.assertTrue(driver.run(max_cycles=100))
+        with open(os.path.join(self.checkpoint_dir, "progress.json")) as f:
+            progress = json.load(f)
+        self.assertEqual(progress['completed_cycles'], 24)
+        self.assertEqual(progress['completed_forecasts'], [0, 1, 2])
+
+    def test_different_plan(self):
+        model = MockModel(3)
+        model.t = self.plan.start_t
+        ExperimentDriver.ExperimentDriver(model, self.plan, checkpoint_dir=self.checkpoint_dir,
+                                          checkpoint_interval=4).run(max_cycles=4)
+
+        other_plan = ExperimentDriver.ExperimentPlan(start_t=0, num_cycles=24, cycle_length=300)
+        with self.assertRaises(RuntimeError):
+            ExperimentDriver.ExperimentDriver(MockModel(3), other_plan, checkpoint_dir=self.checkpoint_dir)
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the decimated, streaming and
+headless rendering of frames in FrameRenderer, using synthetic output files.
+These tests do not require a GPU nor a display.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import shutil
+import tempfile
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import CPUSimulators, SimWriter, FrameRenderer
+
+
+class FrameRendererTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 64
+        self.ny = 48
+        self.dx = 200.0
+        self.dy = 200.0
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sims = []
+
+    def tearDown(self):
+        for sim in self.sims:
+            sim.cleanUp()
+        shutil.rmtree(self.tmp_dir)
+
+    def makeKP07(self, scale=1.0):
+        eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        u0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        v0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+        addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, [2,2,2,2])
+        sim = CPUSimulators.CPUKP07(None, scale*eta0, Hi, u0, v0, \
+                                    self.nx, self.ny, self.dx, self.dy, 0.8, \
+                                    9.81, 0.0, 0.0)
+        self.sims.append(sim)
+        return sim
+
+    def writeFile(self, num_steps=3):
+        """
+        Writes a synthetic output file, and returns its name and the states written
+        """
+        sim = self.makeKP07()
+        states = []
+        with SimWriter.SimNetCDFWriter(sim, super_dir_name=self.tmp_dir, filename="frames", diagnostics=[]) as writer:
+            filename = writer.output_file_name
+            states.append(sim.download())
+            for i in range(num_steps):
+                sim.step(20.0*(i+1))
+                writer.writeTimestep(sim)
+                states.append(sim.download())
+        return filename, states
+
+    def test_decimate(self):
+        field = np.arange(7*10, dtype=np.float64).reshape(7, 10)
+        self.assertEqual(FrameRenderer.decimationFactors(field.shape, (3, 5)), (2, 2))
+        self.assertEqual(FrameRenderer.decimationFactors(field.shape, (100, 100)), (1, 1))
+
+        mean = FrameRenderer.decimate(field, (2, 5))
+        self.assertEqual(mean.shape, (3, 2))
+        self.assertEqual(mean[1, 1], np.mean(field[2:4, 5:10]))
+        self.assertTrue(np.array_equal(FrameRenderer.decimate(field, (2, 5), 'stride'), field[::2, ::5]))
+
+        # Masked cells are left out of the averages, and fully masked blocks stay masked
+        masked = np.ma.array(field, mask=False)
+        masked[0:2, 0:5] = np.ma.masked
+        masked[2, 5] = np.ma.masked
+        mean = FrameRenderer.decimate(masked, (2, 5))
+        self.assertTrue(mean.mask[0, 0])
+        self.assertFalse(mean.mask[1, 1])
+        self.assertEqual(mean[1, 1], (np.sum(field[2:4, 5:10]) - field[2, 5])/9)
+
+    def test_streaming_source(self):
+        filename, states = self.writeFile()
+        source = FrameRenderer.FrameSource(filename, resolution=(12, 16))
+        self.assertEqual(source.factors, (4, 4))
+        self.assertEqual(source.shape, (12, 16))
+        self.assertEqual(source.dx, 4*self.dx)
+
+        # Interior cells, averaged over blocks
+        eta, hu, hv = [field[2:-2, 2:-2] for field in states[2]]
+        fields = source.readTimestep(2)
+        self.assertTrue(np.allclose(fields['eta'], FrameRenderer.decimate(eta, (4, 4))))
+        self.assertTrue(np.allclose(fields['hu'], FrameRenderer.decimate(hu, (4, 4))))
+        self.assertTrue(np.allclose(fields['h'], 60.0 + fields['eta']))
+
+        # Frames between timesteps are interpolated
+        t = 0.25*source.times[1] + 0.75*source.times[2]
+        frame = source.getFrame(t, ['eta', 'speed'])
+        ref = 0.25*source.readTimestep(1)['eta'] + 0.75*fields['eta']
+        self.assertTrue(np.allclose(frame['eta'], ref))
+        self.assertEqual(frame['speed'].shape, (12, 16))
+
+        # Strided reads
+        source = FrameRenderer.FrameSource(filename, resolution=(12, 16), decimation='stride')
+        self.assertTrue(np.array_equal(source.readTimestep(2)['eta'], eta[::4, ::4]))
+        source.close()
+
+    def test_vorticity(self):
+        # Solid body rotation u = -omega*y, v = omega*x has vorticity 2*omega
+        omega = 1.0e-4
+        y, x = np.meshgrid(np.arange(20)*100.0, np.arange(30)*100.0, indexing='ij')
+        h = np.full(x.shape, 10.0)
+        fields = {'h': h, 'hu': -omega*y*h, 'hv': omega*x*h, 'eta': np.zeros_like(h)}
+        vorticity = FrameRenderer.FIELDS['vorticity'][0](fields, 100.0, 100.0)
+        self.assertTrue(np.allclose(vorticity, 2*omega))
+
+    def test_ensemble_source(self):
+        sims = [self.makeKP07(scale) for scale in [1.0, 2.0, 3.0]]
+        with SimWriter.SimNetCDFEnsembleWriter(sims, super_dir_name=self.tmp_dir, filename="ensemble", diagnostics=[]) as writer:
+            filename = writer.output_file_name
+        member = FrameRenderer.FrameSource(filename, resolution=(24, 32), member=1)
+        mean = FrameRenderer.FrameSource(filename, resolution=(24, 32), member='mean')
+        self.assertTrue(np.allclose(mean.readTimestep(0)['eta'], member.readTimestep(0)['eta']))
+        with self.assertRaises(AssertionError):
+            FrameRenderer.FrameSource(filename)
+        member.close()
+        mean.close()
+
+    def test_render_frames(self):
+        filename, states = self.writeFile()
+        source = FrameRenderer.FrameSource(filename, resolution=(24, 32))
+        renderer = FrameRenderer.FrameRenderer(source, fields=['eta', 'speed', 'vorticity'], 
+                                               title="Bump", num_processes=2)
+        output_dir = os.path.join(self.tmp_dir, "frames")
+        frames = renderer.renderFrames(output_dir, num_frames=5)
+        self.assertEqual(len(frames), 5)
+        self.assertEqual(sorted(os.listdir(output_dir)), [os.path.basename(f) for f in frames])
+        for frame in frames:
+            with open(frame, 'rb') as f:
+                self.assertEqual(f.read(8), b'\x89PNG\r\n\x1a\n')
+
+        # Color limits are shared by all frames, and symmetric for eta
+        vmin, vmax = renderer.limits['eta']
+        self.assertEqual(vmin, -vmax)
+        self.assertEqual(renderer.limits['speed'][0], float(np.min(source.getFrame(source.times[-1], ['speed'])['speed'])))
+
+        # Existing frames are not rendered again
+        os.remove(frames[3])
+        mtime = os.path.getmtime(frames[0])
+        renderer = FrameRenderer.FrameRenderer(source, fields=['eta'], num_processes=1)
+        renderer.renderFrames(output_dir, num_frames=5)
+        self.assertTrue(os.path.isfile(frames[3]))
+        self.assertEqual(os.path.getmtime(frames[0]), mtime)
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the import cost of the SWESimulators
+modules: The CPU-only modules must import without pycuda, without loading
+any heavy dependencies, and within the import time budget. The modules
+are imported in fresh python processes with pycuda blocked.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import json
+import os
+import subprocess
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import LazyImport
+
+
+# Modules which only need numpy and the standard library at import time
+CPU_MODULES = ['Instrumentation', 'StagingPool', 'TimestepPolicy', 'OceanographicUtilities', 'BathymetryAndICs',
+               'WindStress', 'config', 'Common', 'CPUSimulators', 'DataAssimilationUtils',
+               'BaseDrifterCollection', 'CPUDrifterCollection', 'Observation', 'ParticleInfo',
+               'SimWriter', 'SimReader', 'NetCDFInitialization', 'PostProcessing', 'FrameRenderer']
+
+# Modules using pycuda, which still must import without it
+GPU_MODULES = ['Simulator', 'CDKLM16', 'CTCS', 'FBL', 'KP07', 'GPUDrifterCollection',
+               'OceanStateNoise', 'DoubleJetCase', 'OceanModelEnsemble', 'OceanNoiseEnsemble',
+               'IEWPFOcean', 'ExperimentDriver']
+
+# Dependencies which are only loaded when the feature needing them is used
+HEAVY_MODULES = ['pycuda', 'pyopencl', 'matplotlib', 'pandas', 'netCDF4', 'scipy',
+                 'IPython', 'pyproj', 'mpi4py']
+
+# Budget for importing one SWESimulators module (in addition to numpy), in seconds
+IMPORT_TIME_BUDGET = 0.25
+
+GPU_OCEAN_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+IMPORT_SCRIPT = """
+import importlib, json, sys, time
+sys.modules['pycuda'] = None # Makes 'import pycuda' raise ImportError
+sys.path.insert(0, {path!r})
+
+start = time.perf_counter()
+import numpy
+numpy_time = time.perf_counter() - start
+
+start = time.perf_counter()
+module = importlib.import_module('SWESimulators.' + {module!r})
+import_time = time.perf_counter() - start
+
+extra_result = None
+{extra}
+print(json.dumps({{'numpy_time': numpy_time, 'import_time': import_time, 'extra': extra_result,
+                  'loaded': [m for m in {heavy!r} if sys.modules.get(m, None) is not None]}}))
+"""
+
+
+def measureImport(module, extra=""):
+    """
+    Imports SWESimulators.<module> in a fresh python process with pycuda blocked,
+    runs the python code in extra, and returns the import time and loaded heavy modules
+    """
+    script = IMPORT_SCRIPT.format(path=GPU_OCEAN_PATH, module=module, extra=extra, heavy=HEAVY_MODULES)
+    output = subprocess.run([sys.executable, "-c", script], stdout=subprocess.PIPE, \
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    if output.returncode != 0:
+        raise RuntimeError("Importing " + module + " failed:\n" + output.stderr)
+    return json.loads(output.stdout.strip().split("\n")[-1])
+
+
+class ImportTimeTest(unittest.TestCase):
+
+    def test_cpu_modules(self):
+        for module in CPU_MODULES:
+            result = measureImport(module)
+            self.assertEqual(result['loaded'], [], msg=module)
+            self.assertLess(result['import_time'], IMPORT_TIME_BUDGET, msg=module)
+
+    def test_gpu_modules_without_pycuda(self):
+        for module in GPU_MODULES:
+            result = measureImport(module)
+            self.assertEqual(result['loaded'], [], msg=module)
+
+    def test_gpu_feature_without_pycuda(self):
+        # Using the GPU feature is what fails without pycuda
+        extra = "\n".join(["try:",
+                           "    module.CUDAContext()",
+                           "except ImportError:",
+                           "    extra_result = 'ImportError'"])
+        result = measureImport('Common', extra=extra)
+        self.assertEqual(result['extra'], 'ImportError')
+
+    def test_loading_on_use(self):
+        # netCDF4 is first loaded when a file is opened
+        extra = "\n".join(["extra_result = sys.modules.get('netCDF4', None) is not None",
+                           "try:",
+                           "    module.SimNetCDFReader('/nonexistent.nc')",
+                           "except Exception:",
+                           "    pass"])
+        result = measureImport('SimReader', extra=extra)
+        self.assertFalse(result['extra'])
+        if 'netCDF4' not in result['loaded']:
+            self.skipTest("netCDF4 is not available")
+        self.assertEqual(result['loaded'], ['netCDF4'])
+
+    def test_lazy_module(self):
+        lazy_json = LazyImport.LazyModule('json')
+        self.assertFalse(LazyImport.isLoaded(lazy_json))
+        self.assertEqual(lazy_json.dumps([1]), "[1]")
+        self.assertTrue(LazyImport.isLoaded(lazy_json))
+
+        # Modules which are already imported are returned directly
+        self.assertIs(LazyImport.lazyImport('json'), json)
+
+        # Missing modules only fail when used
+        missing = LazyImport.lazyImport('gpu_ocean_nonexistent_module')
+        with self.assertRaises(ImportError):
+            missing.foo
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the shared loading of initial
+conditions in EnsembleFromFiles, where each initial condition file is
+read only once. These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+import threading
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import EnsembleFromFiles
+
+
+class InitialStateLoadingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.reads = []
+
+        # Ensemble of 10 particles from 4 initial conditions
+        self.init_files = ["init_" + str(i) + ".nc" for i in range(4)]
+        self.filenames = [self.init_files[i % 4] for i in range(10)]
+
+    def tearDown(self):
+        pass
+
+    def readFile(self, filename):
+        with self.lock:
+            self.reads.append(filename)
+        return {'filename': filename, 'eta0': np.full((4, 5), float(filename[5]))}
+
+    def test_each_file_read_once(self):
+        initial_states = EnsembleFromFiles.readInitialStates(self.filenames, read_function=self.readFile)
+        self.assertEqual(sorted(self.reads), self.init_files)
+        self.assertEqual(sorted(initial_states.keys()), self.init_files)
+        for filename in self.filenames:
+            self.assertEqual(initial_states[filename]['filename'], filename)
+
+    def test_threads(self):
+        serial = EnsembleFromFiles.readInitialStates(self.filenames, read_function=self.readFile)
+        self.reads = []
+        threaded = EnsembleFromFiles.readInitialStates(self.filenames, read_function=self.readFile, num_threads=3)
+        self.assertEqual(sorted(self.reads), self.init_files)
+        for filename in self.init_files:
+            self.assertTrue(np.array_equal(serial[filename]['eta0'], threaded[filename]['eta0']))
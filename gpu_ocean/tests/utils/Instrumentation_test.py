@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean. 
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the Instrumentation registry.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Instrumentation
+
+
+class DummySimulator:
+    """
+    Host-only object with instrumented methods, standing in for a simulator
+    """
+    def __init__(self, nx, ny):
+        self.data = np.zeros((ny, nx), dtype=np.float32)
+        self.bc = DummyBoundaryCondition()
+        Instrumentation.attach(self.bc, self)
+    
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def callKernel(self):
+        self.data += 1.0
+        self.bc.boundaryCondition()
+    
+    @Instrumentation.instrument(Instrumentation.TRANSFER, 
+                                nbytes=lambda self, result, *args, **kwargs: Instrumentation.nbytes_of(result))
+    def download(self):
+        return self.data.copy(), self.data.copy()
+    
+class DummyBoundaryCondition:
+    @Instrumentation.instrument(Instrumentation.KERNEL)
+    def boundaryCondition(self):
+        pass
+    
+    
+class FakeComm:
+    """
+    Mimics the gather function of an mpi4py communicator for two ranks
+    """
+    def __init__(self, other_rank_records):
+        self.other_rank_records = other_rank_records
+    def gather(self, data, root=0):
+        return [data, self.other_rank_records]
+    
+
+class InstrumentationTest(unittest.TestCase):
+
+    def setUp(self):
+        Instrumentation.reset()
+        Instrumentation.set_rank(0)
+        self.sims = [DummySimulator(10, 8) for i in range(3)]
+        Instrumentation.assign_ensemble(self.sims[:2], "ensemble_A")
+        
+    def tearDown(self):
+        Instrumentation.disable()
+        Instrumentation.reset()
+        
+    def run_sims(self):
+        for sim in self.sims:
+            sim.callKernel()
+            sim.callKernel()
+            sim.download()
+            
+    def test_disabled(self):
+        Instrumentation.disable()
+        self.run_sims()
+        self.assertEqual(len(Instrumentation.records()), 0)
+        # The instrumented functions should still work
+        self.assertEqual(self.sims[0].data[0,0], 2.0)
+        
+    def test_records(self):
+        Instrumentation.enable()
+        self.run_sims()
+        
+        # callKernel, boundaryCondition and download for each of the three simulators
+        rows = Instrumentation.records()
+        self.assertEqual(len(rows), 9)
+        
+        for row in rows:
+            if row['name'] == 'download':
+                self.assertEqual(row['calls'], 1)
+                self.assertEqual(row['bytes'], 2*10*8*4)
+                self.assertEqual(row['category'], Instrumentation.TRANSFER)
+            else:
+                self.assertEqual(row['calls'], 2)
+                self.assertEqual(row['bytes'], 0)
+                self.assertEqual(row['category'], Instrumentation.KERNEL)
+            self.assertGreaterEqual(row['time'], 0.0)
+            
+        # The boundary conditions should be registered on the simulator
+        bc_owners = set([row['simulator'] for row in rows if row['name'] == 'boundaryCondition'])
+        sim_labels = set([Instrumentation.label(sim) for sim in self.sims])
+        self.assertEqual(bc_owners, sim_labels)
+        
+    def test_report_per_simulator_and_ensemble(self):
+        Instrumentation.enable()
+        self.run_sims()
+        
+        per_sim = Instrumentation.report(group_by=['simulator'])
+        self.assertEqual(len(per_sim), 3)
+        for entry in per_sim:
+            self.assertEqual(entry['calls'], 5)
+            self.assertEqual(entry['bytes'], 2*10*8*4)
+        
+        per_ensemble = Instrumentation.report(group_by=['ensemble', 'category'])
+        totals = dict(((entry['ensemble'], entry['category']), entry['calls']) for entry in per_ensemble)
+        self.assertEqual(totals[("ensemble_A", Instrumentation.KERNEL)], 8)
+        self.assertEqual(totals[("ensemble_A", Instrumentation.TRANSFER)], 2)
+        self.assertEqual(totals[(None, Instrumentation.KERNEL)], 4)
+        self.assertEqual(totals[(None, Instrumentation.TRANSFER)], 1)
+        
+        self.assertTrue("ensemble_A" in Instrumentation.summary(group_by=['ensemble']))
+        
+    def test_report_per_rank(self):
+        Instrumentation.enable()
+        self.run_sims()
+        
+        # Records from another rank with the same structure
+        other_rank_records = Instrumentation.records()
+        for row in other_rank_records:
+            row['rank'] = 1
+        
+        all_rows = Instrumentation.gather(FakeComm(other_rank_records))
+        per_rank = Instrumentation.report(group_by=['rank'], rows=all_rows)
+        self.assertEqual(len(per_rank), 2)
+        for entry in per_rank:
+            self.assertEqual(entry['calls'], 15)
+            self.assertEqual(entry['bytes'], 3*2*10*8*4)
+        
+    def test_record_and_reset(self):
+        Instrumentation.enable()
+        Instrumentation.record(Instrumentation.FILE_IO, "writeTimestep", "writer", 0.5, 1024)
+        Instrumentation.record(Instrumentation.FILE_IO, "writeTimestep", "writer", 0.25, 1024)
+        
+        rows = Instrumentation.records()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(rows[0]['calls'], 2)
+        self.assertAlmostEqual(rows[0]['time'], 0.75)
+        self.assertEqual(rows[0]['bytes'], 2048)
+        
+        Instrumentation.reset()
+        self.assertEqual(len(Instrumentation.records()), 0)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the static buoy configuration and
+extraction in Observation, using a mock simulator which needs no GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Observation
+from SWESimulators import DataAssimilationUtils as dautils
+
+
+class MockDrifters:
+    def __init__(self, positions):
+        self.positions = positions
+
+    def getDrifterPositions(self):
+        return self.positions.copy()
+
+
+class MockSim:
+    """
+    Simulator with random interior eta, hu, hv and cell centered depths
+    """
+    def __init__(self, nx, ny, seed=1):
+        rng = np.random.RandomState(seed)
+        self.t = 0.0
+        self.eta = rng.uniform(-1.0, 1.0, size=(ny, nx)).astype(np.float32)
+        self.hu = rng.normal(size=(ny, nx)).astype(np.float32)
+        self.hv = rng.normal(size=(ny, nx)).astype(np.float32)
+        self.Bm = rng.uniform(50.0, 100.0, size=(ny+4, nx+4)).astype(np.float32)
+        self.drifters = MockDrifters(rng.rand(3, 2))
+
+    def download(self, interior_domain_only=False):
+        return self.eta, self.hu, self.hv
+
+    def downloadBathymetry(self):
+        return None, self.Bm
+
+
+def buoyCellsByFrequencyLoop(nx, ny, frequency_x, frequency_y, avoid_boundary, land_mask):
+    """
+    The buoy layout generated by nested loops
+    """
+    buoy_indices = []
+    y = 0
+    x0 = 0
+    if avoid_boundary:
+        y = int(frequency_y/2)
+        x0 = int(frequency_x/2)
+    while y < ny:
+        x = x0
+        while x < nx:
+            if land_mask is None or not land_mask[y, x]:
+                buoy_indices.append([x, y])
+            x = x + frequency_x
+        y = y + frequency_y
+    return np.array(buoy_indices, dtype=np.int32)
+
+
+def drifterPathLoop(obs, drifter_id, start_t, end_t, in_km=True, keepDomainSize=True, jump_limit=100000):
+    """
+    The drifter path found observation by observation, as get_drifter_path did before
+    """
+    paths = []
+    observation_times = obs.obs_df.time.values[::obs.observationInterval].copy()
+    start_obs_index = np.searchsorted(observation_times, start_t)
+    end_obs_index   = min(np.searchsorted(observation_times, end_t)+1, len(observation_times))
+    all_drifter_positions = np.stack(obs.obs_df[obs.drifter_positions_key].values[::obs.observationInterval], axis=0)[:, drifter_id,:]
+
+    path = np.zeros((end_obs_index - start_obs_index, 2))
+    path_index = 0
+    boundary_correction = np.array([0, 0])
+    for i in range(start_obs_index, end_obs_index):
+        obs_t = observation_times[i]
+        if obs_t < start_t or obs_t > end_t:
+            continue
+        current_pos = all_drifter_positions[i, :]
+        if path_index > 0:
+            if np.sqrt(np.sum((current_pos + boundary_correction - path[path_index-1,:])**2)) > jump_limit:
+                if keepDomainSize:
+                    paths.append(path[:path_index,:])
+                    path_index = 0
+                    path = np.zeros((end_obs_index - start_obs_index, 2))
+                else:
+                    xdiff = current_pos[0] + boundary_correction[0] - path[path_index-1, 0]
+                    ydiff = current_pos[1] + boundary_correction[1] - path[path_index-1, 1]
+                    if min(abs(xdiff - obs.domain_size_x), abs(xdiff + obs.domain_size_x)) < abs(xdiff):
+                        if abs(xdiff - obs.domain_size_x) < abs(xdiff + obs.domain_size_x):
+                            boundary_correction[0] -= obs.domain_size_x
+                        else:
+                            boundary_correction[0] += obs.domain_size_x
+                    if min(abs(ydiff - obs.domain_size_y), abs(ydiff + obs.domain_size_y)) < abs(ydiff):
+                        if abs(ydiff - obs.domain_size_y) < abs(ydiff + obs.domain_size_y):
+                            boundary_correction[1] -= obs.domain_size_y
+                        else:
+                            boundary_correction[1] += obs.domain_size_y
+        path[path_index,:] = current_pos + boundary_correction
+        path_index += 1
+    paths.append(path[:path_index, :])
+    if in_km:
+        for p in range(len(paths)):
+            paths[p] /= 1000
+    return paths
+
+
+class ObservationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 53
+        self.ny = 41
+        self.land_mask = np.zeros((self.ny, self.nx), dtype=bool)
+        self.land_mask[:15, 30:] = True
+
+    def makeObservation(self, land_mask=None):
+        return Observation.Observation(observation_type=dautils.ObservationType.StaticBuoys,
+                                       domain_size_x=self.nx*100.0, domain_size_y=self.ny*100.0,
+                                       nx=self.nx, ny=self.ny, observation_variance=0.01**2,
+                                       land_mask=land_mask)
+
+    def test_buoy_cells_by_frequency(self):
+        for land_mask in [None, self.land_mask]:
+            for avoid_boundary in [False, True]:
+                for frequency in [(1, 1), (5, 3), (25, 25), (60, 7)]:
+                    obs = self.makeObservation(land_mask)
+                    obs.setBuoyCellsByFrequency(frequency[0], frequency[1], avoid_boundary=avoid_boundary)
+                    expected = buoyCellsByFrequencyLoop(self.nx, self.ny, frequency[0], frequency[1],
+                                                        avoid_boundary, land_mask)
+                    self.assertEqual(obs.buoy_indices.dtype, np.int32)
+                    self.assertTrue(np.array_equal(obs.buoy_indices, expected))
+                    self.assertTrue(np.allclose(obs.buoy_positions, (expected + 0.5)*100.0))
+                    self.assertEqual(obs.get_num_drifters(), len(expected))
+
+    def test_reading_area(self):
+        obs = self.makeObservation(self.land_mask)
+        obs.setBuoyCellsByFrequency(4, 4)
+        indices = obs.buoy_indices
+
+        obs.setBuoyReadingArea('south')
+        self.assertTrue(np.array_equal(obs.read_buoy, [y < self.ny/2 for x, y in indices]))
+        obs.setBuoyReadingArea('west')
+        self.assertTrue(np.array_equal(obs.read_buoy, [x < self.nx/2 for x, y in indices]))
+        obs.setBuoyReadingArea('all')
+        self.assertEqual(obs.get_num_drifters(), len(indices))
+        with self.assertRaises(AssertionError):
+            obs.setBuoyReadingArea('north')
+
+        obs.setBuoySet([0, 3, 7])
+        self.assertEqual(obs.get_num_drifters(), 3)
+        self.assertTrue(np.array_equal(np.nonzero(obs.read_buoy)[0], [0, 3, 7]))
+
+    def test_buoy_observations(self):
+        sim = MockSim(self.nx, self.ny)
+        obs = self.makeObservation(self.land_mask)
+        obs.setBuoyCellsByFrequency(3, 2)
+        obs.add_observation_from_sim(sim)
+        sim.t = 60.0
+        obs.add_observation_from_sim(sim)
+
+        # Values as observed buoy by buoy
+        H = sim.Bm[2:-2, 2:-2]
+        expected = np.zeros_like(obs.buoy_positions)
+        for i, (x, y) in enumerate(obs.buoy_indices):
+            factor = H[y, x] / (H[y, x] + sim.eta[y, x])
+            expected[i, 0] = sim.hu[y, x] * factor
+            expected[i, 1] = sim.hv[y, x] * factor
+
+        buoy_observations = obs.obs_df.iloc[1][obs.buoy_observations_key]
+        self.assertEqual(buoy_observations.dtype, expected.dtype)
+        self.assertTrue(np.array_equal(buoy_observations, expected))
+
+        # Only the selected buoys are observed
+        obs.setBuoySet([1, 2, 10])
+        observation = obs.get_observation(60.0, waterDepth=60.0)
+        errors = obs.obs_df.iloc[1][obs.buoy_obs_errors_key]
+        self.assertEqual(observation.shape, (3, 4))
+        self.assertTrue(np.allclose(observation[:, :2], obs.buoy_positions[[1, 2, 10]]))
+        self.assertTrue(np.allclose(observation[:, 2:], expected[[1, 2, 10]] + 0.01*errors[[1, 2, 10]]))
+
+    def test_drifter_paths(self):
+        num_drifters = 7
+        num_times = 120
+        rng = np.random.RandomState(6)
+        t = np.arange(num_times)*600.0
+        for domain_size in [(500000.0, 400000.0), (500000.5, 399999.25)]:
+            # Random walks through the periodic boundaries
+            x = np.mod(1.0e5 + np.cumsum(rng.normal(scale=3.0e4, size=(num_drifters, num_times)), axis=1), domain_size[0])
+            y = np.mod(1.0e5 + np.cumsum(rng.normal(scale=3.0e4, size=(num_drifters, num_times)), axis=1), domain_size[1])
+            for interval in [1, 3]:
+                obs = Observation.Observation(domain_size_x=domain_size[0], domain_size_y=domain_size[1],
+                                              observation_interval=interval)
+                obs.add_observations_from_arrays(t, x, y)
+                for start_t, end_t in [(0.0, t[-1]), (3000.0, 40000.0), (3100.0, 3200.0)]:
+                    for keepDomainSize in [True, False]:
+                        for in_km in [True, False]:
+                            paths = obs.get_drifter_paths(np.arange(num_drifters), start_t, end_t, in_km=in_km,
+                                                          keepDomainSize=keepDomainSize)
+                            self.assertEqual(len(paths), num_drifters)
+                            for drifter_id in range(num_drifters):
+                                expected = drifterPathLoop(obs, drifter_id, start_t, end_t, in_km=in_km,
+                                                           keepDomainSize=keepDomainSize)
+                                single = obs.get_drifter_path(drifter_id, start_t, end_t, in_km=in_km,
+                                                              keepDomainSize=keepDomainSize)
+                                msg = str((domain_size, interval, start_t, end_t, keepDomainSize, drifter_id))
+                                self.assertEqual(len(paths[drifter_id]), len(expected), msg=msg)
+                                self.assertEqual(len(single), len(expected), msg=msg)
+                                for path, single_path, expected_path in zip(paths[drifter_id], single, expected):
+                                    self.assertTrue(np.array_equal(path, expected_path), msg=msg)
+                                    self.assertTrue(np.array_equal(single_path, expected_path), msg=msg)
+
+            # The walks do pass through the boundaries
+            self.assertGreater(len(obs.get_drifter_path(0, 0.0, t[-1])), 1)
+
+        # Without boundary trouble, the path is the positions in the window
+        paths = obs.get_drifter_paths([2, 5], 3000.0, 40000.0, in_km=False, assume_no_boundary_trouble=True)
+        self.assertTrue(np.array_equal(paths[1][0][:, 0], x[5, ::3][2:24]))
@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the host backend of OceanStateNoise,
+of the small scale perturbation in CPUCDKLM16, and of IEWPFOcean with the
+host backend. These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+import tempfile
+import shutil
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import Common, CPUSimulators, OceanStateNoise, IEWPFOcean
+
+
+class HostEnsemble(object):
+    """
+    The parts of an ensemble of CPUCDKLM16 particles that IEWPFOcean reads
+    """
+    def __init__(self, particles, num_drifters, observation_variance):
+        self.gpu_ctx = None
+        self.particles = particles
+        self.num_drifters = num_drifters
+        self.observation_cov = np.eye(2)*observation_variance
+
+    def getNx(self):
+        return self.particles[0].nx
+    def getNy(self):
+        return self.particles[0].ny
+    def getDx(self):
+        return self.particles[0].dx
+    def getDy(self):
+        return self.particles[0].dy
+    def getNumParticles(self):
+        return len(self.particles)
+    def getNumDrifters(self):
+        return self.num_drifters
+    def getObservationCov(self):
+        return self.observation_cov
+
+
+class OceanStateNoiseHostTest(unittest.TestCase):
+
+    def setUp(self):
+        # Same parameters as in the IEWPFOcean GPU tests
+        self.nx = 40
+        self.ny = 40
+        self.dx = 4.0
+        self.dy = 4.0
+        self.dt = 0.05
+        self.g = 9.81
+        self.f = 0.05
+        self.waterDepth = 10.0
+        self.q0 = 0.5*self.dt*self.f/(self.g*self.waterDepth)
+        self.bc = Common.BoundaryConditions(2,2,2,2)
+
+        self.eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        self.hu0 = np.zeros_like(self.eta0)
+        self.hv0 = np.zeros_like(self.eta0)
+        self.Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32)*self.waterDepth
+
+        self.cache_dir = tempfile.mkdtemp(prefix="iewpf_cache_")
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def makeSim(self, **kwargs):
+        return CPUSimulators.CPUCDKLM16(None, self.eta0, self.hu0, self.hv0, self.Hi,
+                                        self.nx, self.ny, self.dx, self.dy, self.dt,
+                                        self.g, self.f, 0.0,
+                                        boundary_conditions=self.bc, **kwargs)
+
+    def test_perturbation_vs_cpu_reference(self):
+        noise = OceanStateNoise.OceanStateNoise(None, None, self.nx, self.ny, self.dx, self.dy,
+                                                self.bc, False, soar_q0=self.q0, backend='host')
+        self.assertEqual(noise.backend, 'host')
+
+        xi = np.random.RandomState(4).standard_normal((noise.rand_ny, noise.rand_nx)).astype(np.float32)
+        noise.random_numbers.upload(None, xi)
+        self.assertTrue(np.array_equal(noise.getRandomNumbers(), xi))
+
+        eta = Common.HostArray2D(None, self.nx, self.ny, 2, 2, self.eta0)
+        hu = Common.HostArray2D(None, self.nx, self.ny, 2, 2, self.hu0)
+        hv = Common.HostArray2D(None, self.nx, self.ny, 2, 2, self.hv0)
+        H = Common.HostArray2D(None, self.nx+1, self.ny+1, 2, 2, self.Hi)
+        noise.perturbOceanState(eta, hu, hv, H, self.f, g=self.g, ghost_cells_x=2, ghost_cells_y=2,
+                                update_random_field=False)
+
+        # The loop based CPU reference
+        noise.random_numbers_host = xi.astype(np.float64)
+        d_eta, d_hu, d_hv = noise._obtainOceanPerturbations_CPU(self.Hi[2:, 2:], self.f, 0.0, self.g)
+
+        for result, reference in zip([eta, hu, hv], [d_eta[2:-2, 2:-2], d_hu, d_hv]):
+            result = result.download(None)[2:-2, 2:-2]
+            self.assertLess(np.max(np.abs(result - reference)), 1.0e-5*np.max(np.abs(reference)))
+
+    def test_stochastic_CPUCDKLM16(self):
+        deterministic = self.makeSim()
+        stochastic = self.makeSim(small_scale_perturbation=True, small_scale_perturbation_amplitude=self.q0)
+        self.assertEqual(stochastic.small_scale_model_error.backend, 'host')
+
+        # Without the stochastic term, the simulators agree
+        deterministic.step(5*self.dt)
+        stochastic.step(5*self.dt, apply_stochastic_term=False)
+        for a, b in zip(deterministic.download(), stochastic.download()):
+            self.assertTrue(np.array_equal(a, b))
+
+        # The perturbation is in geostrophic balance, and keeps the periodic ghost cells
+        stochastic.step(self.dt)
+        deterministic.step(self.dt)
+        eta, hu, hv = stochastic.download()
+        self.assertGreater(np.max(np.abs(eta - deterministic.download()[0])), 0.0)
+        self.assertTrue(np.array_equal(eta[:2, :], eta[self.ny:self.ny+2, :]))
+        self.assertTrue(np.all(np.isfinite(hu)) and np.all(np.isfinite(hv)))
+
+    def test_iewpf_matrices(self):
+        particles = [self.makeSim(small_scale_perturbation=True, small_scale_perturbation_amplitude=self.q0)
+                     for i in range(3)]
+        ensemble = HostEnsemble(particles, 3, 0.01**2)
+        iewpf = IEWPFOcean.IEWPFOcean(ensemble, backend='host', cache_dir=self.cache_dir)
+        self.assertEqual(iewpf.S_device.backend, 'host')
+
+        S_from_file = np.loadtxt("iewpfRefData/S.dat")
+        assert2DListAlmostEqual(self, iewpf.S_host.tolist(), S_from_file.tolist(), 7, "S matrix host vs file")
+
+        localSVD_from_file = np.loadtxt("iewpfRefData/localSVD.dat")
+        full_matrix = np.dot(iewpf.localSVD_host, iewpf.localSVD_host.transpose())
+        full_matrix_reference = np.dot(localSVD_from_file, localSVD_from_file.transpose())
+        assert2DListAlmostEqual(self, full_matrix.tolist(), full_matrix_reference.tolist(), 5, "Full SVD matrix host vs file")
+
+        # A batched update of all particles
+        rng = np.random.RandomState(5)
+        eta = np.zeros((3, self.ny, self.nx))
+        observed_drifter_positions = np.array([[30.0, 40.0], [100.0, 120.0], [150.0, 20.0]])
+        innovations = rng.normal(scale=0.01, size=(3, 3, 2))
+        noise = particles[0].small_scale_model_error
+        random_numbers = rng.standard_normal((3, noise.rand_ny, noise.rand_nx))
+        eta_a, hu_a, hv_a = iewpf.iewpfUpdate_batched_CPU(noise, eta, eta, eta, self.Hi, self.f, 0.0, self.g,
+                                                          observed_drifter_positions, innovations, random_numbers)
+        for field in [eta_a, hu_a, hv_a]:
+            self.assertEqual(field.shape, (3, self.ny, self.nx))
+            self.assertTrue(np.all(np.isfinite(field)))
+            self.assertGreater(np.max(np.abs(field)), 0.0)
+        iewpf.cleanUp()
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+"""
+This software is part of GPU Ocean. 
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module contains the original masked array implementations of
+fillMaskedValues and midpointsToIntersections from
+SWESimulators/OceanographicUtilities.py. It is only used as reference for
+testing the array-based implementations.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+from SWESimulators.OceanographicUtilities import minmodX, minmodY
+
+
+def fillMaskedValues(input, steps=5):
+
+    def fillStep(a):
+        valid = np.zeros(a.shape)
+        valid[~a.mask] = 1
+        valid[1:-1, 1:-1] += valid[:-2, 1:-1] + valid[2:, 1:-1] + valid[1:-1, :-2] + valid[1:-1, 2:]
+        valid[valid == 0] = -1 #avoid divide by zero below
+
+        values = np.copy(a.filled(0))
+        values[1:-1, 1:-1] += values[:-2, 1:-1] + values[2:, 1:-1] + values[1:-1, :-2] + values[1:-1, 2:]
+        values = values / valid
+        values[~a.mask] = 0
+
+        a[values > 0] = values[values > 0]
+    
+    retval = np.ma.copy(input)
+    for i in range(steps):
+        fillStep(retval)
+        
+    return retval
+
+
+
+def intersectionsToMidpoints(a_i):
+    """
+    Converts values at cell intersections to values at midpoints. Use simple averaging
+    Also respects masked values when computing the average
+    """
+    if np.ma.is_masked(a_i):
+        valid = np.zeros(a_i.shape, dtype=np.int32)
+        valid[~a_i.mask] = 1 
+        valid = valid[:-1, :-1] + valid[:-1, 1:] + valid[1:, :-1] + valid[1:, 1:]
+        mask = valid<4
+        
+        #Set values for all elements
+        values = a_i.filled(0)
+        all_values = values[:-1, :-1] + values[:-1, 1:] + values[1:, :-1] + values[1:, 1:]
+        all_values[~mask] = all_values[~mask] / valid[~mask]
+        all_values[mask] = a_i.fill_value
+        
+        return np.ma.array(all_values, mask=mask, fill_value=a_i.fill_value)
+    else:
+        values = 0.25*(a_i[:-1, :-1] + a_i[:-1, 1:] + a_i[1:, :-1] + a_i[1:, 1:])
+   
+    return values
+
+    
+def midpointsToIntersections(a_m, iterations=20, tolerance=5e-3, use_minmod=False, dt=0.125, land_value=0.0, compute_convergence=False):
+    """
+    Converts cell values at midpoints to cell values at midpoints using a cubic
+    interpolating spline to generate first guess, followed by an iterative update. 
+    """
+    def genIntersections(midpoints, use_minmod):
+        if (use_minmod):
+            dx = minmodX(midpoints.data)
+            dy = minmodY(midpoints.data)
+        else:
+            dx, dy = np.gradient(midpoints.data)
+            
+        mask = None
+        if (np.ma.is_masked(midpoints)):
+            mask = midpoints.mask
+        else:
+            mask = np.zeros(midpoints.shape, dtype=bool)
+        
+        #Set slope for masked cells to zero
+        dx[mask] = 0.0
+        dy[mask] = 0.0
+        
+        # d - c
+        # | X |
+        # a - b
+        # Evaluate the piecewise planar surface in the four corners of cell X
+        a_a = midpoints.data - 0.5*dx - 0.5*dy
+        a_b = midpoints.data + 0.5*dx - 0.5*dy
+        a_c = midpoints.data + 0.5*dx + 0.5*dy
+        a_d = midpoints.data - 0.5*dx + 0.5*dy
+        
+        
+        # Now take the average reconstructed value from the four cells which join
+        # in a single cell.
+        # d - c   d - c
+        # | X |   | X |
+        # a - b   a - b
+        #       Y   
+        # d - c   d - c
+        # | X |   | X |
+        # a - b   a - b
+        a_a = a_a[1:, 1:] * (1-mask[1:, 1:])
+        a_b = a_b[:-1, 1:] * (1-mask[:-1, 1:])
+        a_c = a_c[:-1, :-1] * (1-mask[:-1, :-1])
+        a_d = a_d[1:, :-1] * (1-mask[1:, :-1])
+        
+        # First count number of valid cells 
+        # for each intersection
+        count = 4 - (np.int32(mask[1:, 1:]) \
+                + np.int32(mask[:-1, 1:]) \
+                + np.int32(mask[:-1, :-1]) \
+                + np.int32(mask[1:, :-1]))
+
+        # Then set the average
+        values = midpoints.data[1:, 1:] + midpoints.data[:-1, 1:] + midpoints.data[:-1, :-1] + midpoints.data[1:, :-1]
+        values[count>0] = (a_a[count>0] + a_b[count>0] + a_c[count>0] + a_d[count>0]) / count[count>0]
+
+        #Create mask
+        out_mask = (count == 0)
+        
+        return np.ma.array(values, mask=out_mask, fill_value=midpoints.fill_value)
+    
+    vmax = a_m.max()
+    vmin = a_m.min()
+    
+    # Generate initial guess
+    a_i = genIntersections(a_m, use_minmod=use_minmod)
+    a_i = np.clip(a_i, vmin, vmax)
+    
+    a_i_old = None
+    if (compute_convergence):
+        a_i_old = a_i.copy()
+    
+    # Iteratively refine intersections estimate
+    #Use kind of a heat equation explisit solver with a source term from the error
+    gauss_sigma = 1
+    delta = np.zeros_like(a_m)
+    u_mask = a_i.mask.copy() #binary_dilation(a_i.mask)
+    
+    convergence = {'l_1': [], 'l_2': [], 'l_inf': []}
+    for i in range(2*iterations+1):        
+        delta[1:-1,1:-1] = a_m.data[1:-1,1:-1] - intersectionsToMidpoints(a_i.data)
+        
+        if (np.ma.is_masked(a_m)):
+            delta = np.ma.array(delta, mask=a_m.mask.copy())
+        else:
+            delta = np.ma.array(delta, mask=np.zeros(a_m.shape, dtype=bool))
+        
+        if (i%2 == 0):
+            count = 4 - (np.int32(delta.mask[1:, 1:]) \
+                    + np.int32(delta.mask[:-1, 1:]) \
+                    + np.int32(delta.mask[:-1, :-1]) \
+                    + np.int32(delta.mask[1:, :-1]))
+            delta_sum = (delta[:-1, :-1] + delta[:-1, 1:] + delta[1:, 1:] + delta[1:, :-1])
+            delta_i = np.zeros(a_i.shape)
+            delta_i[count>2] = delta_sum[count>2] / count[count>2]
+            a_i[~u_mask] += dt*delta_i[~u_mask]
+            
+            # Heat equation
+            kappa = 1
+            dx = 1
+            dy = 1
+            u = a_i.data.copy()
+            
+            #rand = (np.random.random_sample(a_i.shape) - 0.5)*l_inf*1e-2
+            #u[~a_i.mask] += rand[~a_i.mask]
+            
+            u[1:-1, 1:-1] = u[1:-1, 1:-1] \
+                            + kappa*dt/(dx*dx)*(u[1:-1, :-2] - 2*u[1:-1, 1:-1] + u[1:-1, 2:]) \
+                            + kappa*dt/(dy*dy)*(u[:-2, 1:-1] - 2*u[1:-1, 1:-1] + u[2:, 1:-1])
+            a_i[~u_mask] = u[~u_mask]
+        else:
+            # Intersections fix 
+            a_i[~a_i.mask] = a_i[~a_i.mask] + genIntersections(delta, use_minmod=use_minmod)[~a_i.mask]
+                
+        a_i = np.clip(a_i, vmin, vmax)
+        a_i.mask = u_mask
+        
+        #Stop criteria
+        if (compute_convergence and i % 2 == 1):
+            d = a_i - a_i_old
+            a_i_old = a_i.copy()
+            d[u_mask] = 0.0
+            convergence['l_1'] += [np.sum(np.abs(d))/np.sum(~u_mask)]
+            convergence['l_2'] += [np.sum(np.abs(d**2))**(1/2)/np.sum(~u_mask)]
+            convergence['l_inf'] += [np.max(np.abs(d))]
+            if (convergence['l_1'][0] / convergence['l_1'][0] < tolerance):
+                break
+
+    return a_i, convergence
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements regression tests for the reconstructions
+and rescaling functions in OceanographicUtilities, comparing them to the
+original masked array implementations in OceanographicUtilitiesReference.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from scipy.interpolate import RegularGridInterpolator
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import OceanographicUtilities
+from utils import OceanographicUtilitiesReference
+
+
+class OceanographicUtilitiesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 75
+        self.ny = 60
+
+        # Bathymetry with a curved coastline and an island
+        rng = np.random.RandomState(1)
+        y, x = np.mgrid[0:self.ny, 0:self.nx]
+        H = 50.0 + 200.0*np.exp(-((x - 45)**2 + (y - 30)**2)/400.0) + rng.rand(self.ny, self.nx)
+        land = (x + 0.5*y + 5*np.sin(y/4.0)) < 20
+        land |= ((x - 60)**2 + (y - 15)**2) < 20
+        self.H_m = np.ma.array(H.astype(np.float32), mask=land, fill_value=0.0)
+
+    def tearDown(self):
+        pass
+
+    def checkMaskedEqual(self, a, b):
+        self.assertTrue(np.array_equal(np.ma.getmaskarray(a), np.ma.getmaskarray(b)))
+        self.assertTrue(np.array_equal(np.ma.getdata(a), np.ma.getdata(b)))
+        self.assertEqual(np.ma.getdata(a).dtype, np.ma.getdata(b).dtype)
+
+    def test_fill_masked_values(self):
+        H_m = self.H_m.copy()
+        for steps in [1, 5, 100]:
+            ref = OceanographicUtilitiesReference.fillMaskedValues(self.H_m, steps)
+            out = OceanographicUtilities.fillMaskedValues(self.H_m, steps)
+            self.checkMaskedEqual(out, ref)
+
+        # The input is not modified
+        self.checkMaskedEqual(self.H_m, H_m)
+
+    def test_midpoints_to_intersections(self):
+        # Without early termination the result is identical to the original implementation
+        for use_minmod in [False, True]:
+            ref, ref_convergence = OceanographicUtilitiesReference.midpointsToIntersections(self.H_m, \
+                                        use_minmod=use_minmod, compute_convergence=True)
+            out, convergence = OceanographicUtilities.midpointsToIntersections(self.H_m, \
+                                        use_minmod=use_minmod, tolerance=None, compute_convergence=True)
+            self.checkMaskedEqual(out, ref)
+            self.assertEqual(out.fill_value, ref.fill_value)
+            for norm in ['l_1', 'l_2', 'l_inf']:
+                self.assertEqual(len(convergence[norm]), 20)
+                self.assertTrue(np.allclose(convergence[norm], ref_convergence[norm], rtol=1.0e-5))
+
+    def test_midpoints_to_intersections_unmasked(self):
+        H_m = np.ma.array(self.H_m.data)
+        ref, _ = OceanographicUtilitiesReference.midpointsToIntersections(H_m, iterations=5)
+        out, _ = OceanographicUtilities.midpointsToIntersections(H_m, iterations=5, tolerance=None)
+        self.checkMaskedEqual(out, ref)
+        self.assertFalse(np.any(out.mask))
+
+    def test_midpoints_to_intersections_tolerance(self):
+        ref, _ = OceanographicUtilitiesReference.midpointsToIntersections(self.H_m)
+        out, convergence = OceanographicUtilities.midpointsToIntersections(self.H_m, tolerance=5e-3)
+
+        # Stops early, once the change is below the tolerance
+        l_1 = convergence['l_1']
+        self.assertLess(len(l_1), 20)
+        self.assertLessEqual(l_1[-1], 5e-3*l_1[0])
+        self.assertTrue(np.all(l_1[:-1] > 5e-3*l_1[0]))
+        self.assertEqual(len(convergence['l_2']), 0)
+
+        # The result is close to running all iterations
+        self.assertTrue(np.array_equal(out.mask, ref.mask))
+        diff = np.abs(out - ref)
+        self.assertLess(np.mean(diff), 5e-3*np.mean(np.abs(ref)))
+
+        # and reproduces the midpoint values as well
+        ref_error = np.mean(np.abs(OceanographicUtilities.intersectionsToMidpoints(ref) - self.H_m[1:-1, 1:-1]))
+        error = np.mean(np.abs(OceanographicUtilities.intersectionsToMidpoints(out) - self.H_m[1:-1, 1:-1]))
+        self.assertLess(error, 1.01*ref_error)
+
+    def test_rescale_midpoints(self):
+        nx1, ny1 = 31, 22
+        dx1, dy1, out = OceanographicUtilities.rescaleMidpoints(self.H_m, nx1, ny1)
+        self.assertAlmostEqual(dx1, self.nx/nx1)
+        self.assertAlmostEqual(dy1, self.ny/ny1)
+        self.assertEqual(out.shape, (ny1, nx1))
+
+        # Linear interpolation between the midpoints
+        x0 = np.linspace(0.5, self.nx-0.5, self.nx)
+        y0 = np.linspace(0.5, self.ny-0.5, self.ny)
+        x1 = np.linspace(0.5*dx1, self.nx-0.5*dx1, nx1)
+        y1 = np.linspace(0.5*dy1, self.ny-0.5*dy1, ny1)
+        interp = RegularGridInterpolator((y0, x0), self.H_m.data.astype(np.float64))
+        y1, x1 = np.meshgrid(y1, x1, indexing='ij')
+        ref = interp(np.stack([y1, x1], axis=-1))
+        self.assertLess(np.max(np.abs(out.data - ref)), 1.0e-10)
+
+        ref_mask = self.H_m.mask[y1.round().astype(np.int32), x1.round().astype(np.int32)]
+        self.assertTrue(np.array_equal(out.mask, ref_mask))
+
+    def test_rescale_intersections(self):
+        H_i = np.ma.array(self.H_m[:-1, :-1])
+        nx1, ny1 = 40, 25
+        dx1, dy1, out = OceanographicUtilities.rescaleIntersections(H_i, nx1, ny1)
+        self.assertAlmostEqual(dx1, (self.nx-2)/(nx1-1))
+        self.assertEqual(out.shape, (ny1, nx1))
+
+        x0 = np.arange(self.nx-1)
+        y0 = np.arange(self.ny-1)
+        x1 = np.linspace(0, self.nx-2, nx1)
+        y1 = np.linspace(0, self.ny-2, ny1)
+        interp = RegularGridInterpolator((y0, x0), H_i.data.astype(np.float64))
+        y1, x1 = np.meshgrid(y1, x1, indexing='ij')
+        ref = interp(np.stack([y1, x1], axis=-1))
+        self.assertLess(np.max(np.abs(out.data - ref)), 1.0e-10)
+
+        # The corners are kept exactly
+        for j, i in [(0, 0), (0, -1), (-1, 0), (-1, -1)]:
+            self.assertAlmostEqual(out.data[j, i], H_i.data[j, i], places=10)
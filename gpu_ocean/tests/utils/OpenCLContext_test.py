@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for OpenCLContext, and a
+regression test of the CTCS2Layer eta kernel on a CPU OpenCL device
+(e.g., POCL). These tests do not require a GPU, and are skipped if
+pyopencl or a CPU OpenCL platform is not available.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+try:
+    import pyopencl as cl
+    from SWESimulators import OpenCLContext
+except ImportError:
+    OpenCLContext = None
+
+
+@unittest.skipIf(OpenCLContext is None, "pyopencl is not available")
+class OpenCLContextTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 45
+        self.ny = 30
+        self.dx = 200.0
+        self.dy = 150.0
+        self.dt = 2.0
+
+    def tearDown(self):
+        pass
+
+    def cpuContext(self):
+        try:
+            return OpenCLContext.OpenCLContext(device_type='cpu')
+        except RuntimeError:
+            self.skipTest("No CPU OpenCL platform available")
+
+    def test_work_group_size(self):
+        choose = OpenCLContext.chooseWorkGroupSize
+
+        # Defaults per device type
+        self.assertEqual(choose(False, 1024, [1024, 1024, 64]), OpenCLContext.GPU_WORK_GROUP_SIZE)
+        self.assertEqual(choose(True, 4096, [4096, 4096, 4096]), OpenCLContext.CPU_WORK_GROUP_SIZE)
+
+        # CPU block widths are rounded up to whole float vectors
+        self.assertEqual(choose(True, 4096, [4096, 4096, 4096], preferred_vector_width=16)[0], 32)
+        self.assertEqual(choose(True, 4096, [4096, 4096, 4096], block_height=2, preferred_vector_width=3), (33, 2))
+
+        # Explicit sizes are kept
+        self.assertEqual(choose(True, 4096, [4096, 4096, 4096], 8, 8), (8, 8))
+
+        # Defaults are shrunk to fit the device
+        self.assertEqual(choose(False, 64, [64, 64, 64]), (16, 4))
+        self.assertEqual(choose(True, 16, [16, 16, 16]), (16, 1))
+
+        # Explicit sizes the device cannot run are an error
+        with self.assertRaises(RuntimeError):
+            choose(False, 64, [64, 64, 64], 16, 16)
+
+    def test_compile_options(self):
+        self.assertEqual(OpenCLContext.compileOptions(False), OpenCLContext.GPU_COMPILE_OPTIONS)
+        self.assertIn("-cl-mad-enable", OpenCLContext.compileOptions(True))
+        for is_cpu in [False, True]:
+            self.assertNotIn("-cl-fast-relaxed-math", OpenCLContext.compileOptions(is_cpu))
+
+        # The returned list can be modified without changing the defaults
+        options = OpenCLContext.compileOptions(True)
+        options.append("-DFOO")
+        self.assertNotIn("-DFOO", OpenCLContext.CPU_COMPILE_OPTIONS)
+
+    def runEtaKernel(self, opencl_ctx, local_size, eta1, u1, v1, eta2, u2, v2):
+        """
+        Runs one step of computeEtaKernel from CTCS2Layer with the given work-group size
+        """
+        cl_ctx = opencl_ctx.cl_ctx
+        cl_queue = cl.CommandQueue(cl_ctx)
+        kernel = opencl_ctx.get_kernel("CTCS2Layer_eta_kernel.opencl", \
+                                       {'block_width': local_size[0], 'block_height': local_size[1]})
+        global_size = (int(np.ceil(self.nx / float(local_size[0])) * local_size[0]), \
+                       int(np.ceil(self.ny / float(local_size[1])) * local_size[1]))
+
+        mf = cl.mem_flags
+        buffers = [cl.Buffer(cl_ctx, mf.READ_WRITE | mf.COPY_HOST_PTR, hostbuf=array) \
+                   for array in [eta1, u1, v1, eta2, u2, v2]]
+        pitches = [np.int32(array.shape[1]*4) for array in [eta1, u1, v1, eta2, u2, v2]]
+        args = []
+        for buffer, pitch in zip(buffers, pitches):
+            args += [buffer, pitch]
+
+        kernel.computeEtaKernel(cl_queue, global_size, local_size, \
+                                np.int32(self.nx), np.int32(self.ny), \
+                                np.float32(self.dx), np.float32(self.dy), np.float32(self.dt), \
+                                *args)
+
+        eta1_out = np.empty_like(eta1)
+        eta2_out = np.empty_like(eta2)
+        cl.enqueue_copy(cl_queue, eta1_out, buffers[0])
+        cl.enqueue_copy(cl_queue, eta2_out, buffers[3])
+        cl_queue.finish()
+        return eta1_out, eta2_out
+
+    def test_eta_kernel_cpu(self):
+        opencl_ctx = self.cpuContext()
+        self.assertTrue(opencl_ctx.is_cpu)
+
+        rng = np.random.RandomState(1)
+        nx, ny = self.nx, self.ny
+        eta1 = rng.rand(ny+2, nx+2).astype(np.float32)
+        u1 = rng.rand(ny+2, nx+1).astype(np.float32)
+        v1 = rng.rand(ny+1, nx+2).astype(np.float32)
+        eta2 = rng.rand(ny+2, nx+2).astype(np.float32)
+        u2 = rng.rand(ny+2, nx+1).astype(np.float32)
+        v2 = rng.rand(ny+1, nx+2).astype(np.float32)
+
+        # Reference: leapfrog update of eta in the interior cells
+        cx = 2.0*self.dt/self.dx
+        cy = 2.0*self.dt/self.dy
+        du1 = u1[1:-1, 1:] - u1[1:-1, :-1]
+        du2 = u2[1:-1, 1:] - u2[1:-1, :-1]
+        dv1 = v1[1:, 1:-1] - v1[:-1, 1:-1]
+        dv2 = v2[1:, 1:-1] - v2[:-1, 1:-1]
+        eta1_ref = eta1.copy()
+        eta2_ref = eta2.copy()
+        eta1_ref[1:-1, 1:-1] = eta1[1:-1, 1:-1] - cx*(du1 + du2) - cy*(dv1 + dv2)
+        eta2_ref[1:-1, 1:-1] = eta2[1:-1, 1:-1] - cx*du2 - cy*dv2
+
+        for local_size in [(8, 8), (16, 2), opencl_ctx.workGroupSize()]:
+            eta1_out, eta2_out = self.runEtaKernel(opencl_ctx, local_size, eta1, u1, v1, eta2, u2, v2)
+            msg = "work-group size " + str(local_size)
+            self.assertLess(np.max(np.abs(eta1_out - eta1_ref)), 1.0e-5, msg=msg)
+            self.assertLess(np.max(np.abs(eta2_out - eta2_ref)), 1.0e-5, msg=msg)
+
+            # The ghost cells are not touched
+            self.assertTrue(np.array_equal(eta1_out[0, :], eta1[0, :]), msg=msg)
+            self.assertTrue(np.array_equal(eta1_out[:, -1], eta1[:, -1]), msg=msg)
@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the parallel and restartable
+post-processing in PostProcessing, using small synthetic result files.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import PostProcessing, Observation
+
+
+class PostProcessingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ny = 12
+        self.ensemble_size = 10
+        self.num_files = 13
+
+        # Rank histogram files as written by rank_histogram_experiment.py
+        rng = np.random.RandomState(3)
+        for i in range(self.num_files):
+            data = {'t': 3600.0*(i+1)}
+            for field in ['eta', 'hu', 'hv']:
+                data[field] = rng.normal(size=(self.ny, self.ensemble_size)).astype(np.float32)
+                data['true_' + field] = rng.normal(size=self.ny).astype(np.float32)
+            np.savez(os.path.join(self.tmpdir, "hour_001_rank_hist_experiment_%05d.npz" % i), **data)
+        self.filenames = PostProcessing.fileFilter(self.tmpdir, ext=".npz", prefix="hour_001")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def checkResultsEqual(self, a, b):
+        for field in ['eta', 'hu', 'hv']:
+            for key in ['rank_histogram', 'rmse', 'spread']:
+                self.assertTrue(np.array_equal(a[field][key], b[field][key]), msg=field + " " + key)
+
+    def test_rank_histogram(self):
+        y_indices = [1, 4, 7]
+        reduction = PostProcessing.RankHistogramReduction(self.ensemble_size, y_indices=y_indices)
+        result = PostProcessing.PostProcessor(reduction, self.filenames, num_processes=1).run()
+
+        # As the loop in RankHistogram.ipynb
+        for field in ['eta', 'hu', 'hv']:
+            ref = np.zeros((len(y_indices), self.ensemble_size+1), dtype=np.int64)
+            for filename in self.filenames:
+                with np.load(filename) as data:
+                    for k, y in enumerate(y_indices):
+                        ensemble = np.sort(data[field][y, :].astype(np.float64))
+                        ref[k, np.searchsorted(ensemble, data['true_' + field][y])] += 1
+            self.assertTrue(np.array_equal(result[field]['rank_histogram'], ref))
+            self.assertTrue(np.array_equal(result[field]['total'], np.sum(ref, axis=0)))
+            self.assertEqual(np.sum(result[field]['total']), len(y_indices)*self.num_files)
+        self.assertEqual(result['num_files'], self.num_files)
+
+    def test_spread_skill(self):
+        # Truth and members drawn from the same distribution give a reliable ensemble
+        reduction = PostProcessing.RankHistogramReduction(self.ensemble_size)
+        result = PostProcessing.PostProcessor(reduction, self.filenames, num_processes=1).run()
+        spread_skill = np.mean(result['eta']['spread_skill'])
+        self.assertGreater(spread_skill, 0.7)
+        self.assertLess(spread_skill, 1.3)
+
+    def test_parallel_equals_serial(self):
+        perturbation = {'hu': 1.0, 'hv': 1.0}
+        serial = PostProcessing.PostProcessor(PostProcessing.RankHistogramReduction(self.ensemble_size, perturbation_stddev=perturbation),
+                                              self.filenames, num_processes=1).run()
+        parallel = PostProcessing.PostProcessor(PostProcessing.RankHistogramReduction(self.ensemble_size, perturbation_stddev=perturbation),
+                                                self.filenames, num_processes=2).run()
+        self.checkResultsEqual(serial, parallel)
+
+    def test_restart(self):
+        checkpoint = os.path.join(self.tmpdir, "checkpoint.pickle")
+        perturbation = {'hu': 1.0, 'hv': 1.0}
+
+        processor = PostProcessing.PostProcessor(PostProcessing.RankHistogramReduction(self.ensemble_size, perturbation_stddev=perturbation),
+                                                 self.filenames, checkpoint_file=checkpoint, checkpoint_interval=2, num_processes=2)
+        processor.run(max_files=5)
+        self.assertTrue(os.path.isfile(checkpoint))
+
+        # A new processor continues from the checkpoint
+        processor = PostProcessing.PostProcessor(PostProcessing.RankHistogramReduction(self.ensemble_size, perturbation_stddev=perturbation),
+                                                 self.filenames, checkpoint_file=checkpoint, num_processes=2)
+        self.assertEqual(len(processor.getPendingFiles()), self.num_files-5)
+        restarted = processor.run()
+
+        full = PostProcessing.PostProcessor(PostProcessing.RankHistogramReduction(self.ensemble_size, perturbation_stddev=perturbation),
+                                            self.filenames, num_processes=1).run()
+        self.checkResultsEqual(restarted, full)
+        self.assertEqual(restarted['num_files'], self.num_files)
+
+        # The checkpoint cannot be used for another reduction
+        with self.assertRaises(RuntimeError):
+            PostProcessing.PostProcessor(PostProcessing.ForecastErrorReduction.__new__(PostProcessing.ForecastErrorReduction),
+                                         self.filenames, checkpoint_file=checkpoint)
+
+    def test_forecast_errors(self):
+        nx, ny = 20, 10
+        domain_size_x, domain_size_y = 200000.0, 100000.0
+        times = np.arange(0, 24*3600+1, 900.0)
+        num_drifters = 3
+
+        def writeObservation(filename, x, y):
+            observation = Observation.Observation(domain_size_x=domain_size_x, domain_size_y=domain_size_y, nx=nx, ny=ny)
+            observation.add_observations_from_arrays(times, x, y)
+            observation.to_pickle(filename)
+
+        # True drifters moving east, through the periodic boundary
+        x0 = np.array([150000.0, 100000.0, 20000.0])
+        y0 = np.array([20000.0, 50000.0, 80000.0])
+        true_x = x0[:, np.newaxis] + 2.0*times[np.newaxis, :]
+        true_y = np.repeat(y0[:, np.newaxis], len(times), axis=1)
+        true_file = os.path.join(self.tmpdir, "drifter_observations.pickle")
+        writeObservation(true_file, true_x % domain_size_x, true_y)
+
+        # Forecasts with constant offsets from the truth
+        offsets = [(1000.0, 0.0), (-1000.0, 2000.0), (3000.0, -2000.0), (0.0, 0.0)]
+        forecast_files = []
+        for i, (dx, dy) in enumerate(offsets):
+            filename = os.path.join(self.tmpdir, "forecast_member_%04d.bz2" % i)
+            writeObservation(filename, (true_x + dx) % domain_size_x, (true_y + dy) % domain_size_y)
+            forecast_files.append(filename)
+
+        eval_times = times[4::4]
+        reduction = PostProcessing.ForecastErrorReduction(true_file, eval_times, domain_size_x, domain_size_y, nx, ny)
+        result = PostProcessing.PostProcessor(reduction, forecast_files, num_processes=2).run()
+
+        offsets_km = np.array(offsets)/1000
+        ref_error = np.mean(np.sum(offsets_km**2, axis=1))
+        ref_spread = np.mean(np.sum((offsets_km - np.mean(offsets_km, axis=0))**2, axis=1))
+        self.assertTrue(np.allclose(result['error'], ref_error))
+        self.assertTrue(np.allclose(result['spread'], ref_spread))
+        self.assertEqual(result['error_per_drifter'].shape, (len(eval_times), num_drifters))
+
+        # Drifter sets
+        reduction = PostProcessing.ForecastErrorReduction(true_file, eval_times, domain_size_x, domain_size_y, nx, ny,
+                                                          drifter_set=[0, 2])
+        result = PostProcessing.PostProcessor(reduction, forecast_files, num_processes=1).run()
+        self.assertEqual(result['error_per_drifter'].shape, (len(eval_times), 2))
+        self.assertTrue(np.allclose(result['error'], ref_error))
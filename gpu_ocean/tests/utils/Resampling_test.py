@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements statistical tests of the resampling schemes
+in DataAssimilationUtils. These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import DataAssimilationUtils as dautils
+
+
+def metropolisHastingsLoop(weights, random_state):
+    """
+    The Metropolis-Hastings chain walked in a Python loop, as in van Leeuwen (2009)
+    """
+    newSampleIndices = np.zeros_like(weights, dtype=int)
+    for i in range(1, len(weights)):
+        p = random_state.rand()
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if p < weights[i]/weights[newSampleIndices[i-1]]:
+                newSampleIndices[i] = i
+            else:
+                newSampleIndices[i] = newSampleIndices[i-1]
+    return newSampleIndices
+
+
+class MockEnsemble:
+    def __init__(self, weights):
+        self.weights = weights
+        self.indices = None
+        self.resampled = []
+
+    def getNumParticles(self):
+        return len(self.weights)
+
+    def getGaussianWeight(self):
+        return self.weights
+
+    def resample(self, newSampleIndices, reinitialization_variance):
+        self.indices = newSampleIndices
+        self.resampled.append(newSampleIndices)
+
+
+class ResamplingTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.RandomState(5)
+        weights = np.exp(-0.5*rng.chisquare(4, size=20))
+        self.weights = weights/np.sum(weights)
+
+    def test_valid_indices(self):
+        weights = self.weights.copy()
+        weights[3] = 0.0
+        for method in dautils.RESAMPLERS.keys():
+            indices = dautils.getResamplingIndices(weights, method, np.random.RandomState(1))
+            self.assertEqual(len(indices), len(weights), msg=method)
+            self.assertTrue(np.all((indices >= 0) & (indices < len(weights))), msg=method)
+            self.assertNotIn(3, indices, msg=method)
+
+        with self.assertRaises(AssertionError):
+            dautils.getResamplingIndices(weights, 'unknown')
+        with self.assertRaises(AssertionError):
+            dautils.getResamplingIndices(-weights)
+
+    def test_unbiased(self):
+        # The expected number of copies of each particle is N*w
+        N = len(self.weights)
+        num_trials = 4000
+        rng = np.random.RandomState(2)
+        for method in ['probabilistic', 'residual', 'systematic']:
+            counts = np.zeros(N)
+            for trial in range(num_trials):
+                counts += np.bincount(dautils.getResamplingIndices(self.weights, method, rng), minlength=N)
+            mean_counts = counts/num_trials
+            # Tolerance of five standard deviations of the mean, for probabilistic resampling
+            std = np.sqrt(N*self.weights*(1 - self.weights)/num_trials)
+            self.assertTrue(np.all(np.abs(mean_counts - N*self.weights) < 5*std + 1.0e-10),
+                            msg=method + ": " + str(mean_counts - N*self.weights))
+
+    def test_systematic_counts(self):
+        rng = np.random.RandomState(3)
+        for N in [1, 7, 100, 1000]:
+            weights = rng.rand(N)**4
+            weights = weights/np.sum(weights)
+            for trial in range(10):
+                counts = np.bincount(dautils.systematicResamplingIndices(weights, rng), minlength=N)
+                self.assertEqual(np.sum(counts), N)
+                self.assertTrue(np.all(counts >= np.floor(N*weights - 1.0e-10)))
+                self.assertTrue(np.all(counts <= np.ceil(N*weights + 1.0e-10)))
+
+        # Equal weights give exactly one copy of each particle
+        indices = dautils.systematicResamplingIndices(np.full(50, 1.0/50), rng)
+        self.assertTrue(np.array_equal(indices, np.arange(50)))
+
+    def test_residual_deterministic_part(self):
+        weights = np.array([0.5, 0.25, 0.125, 0.125])
+        indices = dautils.getResamplingIndices(weights, 'residual', np.random.RandomState(1))
+        self.assertTrue(np.array_equal(np.sort(indices), [0, 0, 1, 2]) or \
+                        np.array_equal(np.sort(indices), [0, 0, 1, 3]))
+
+        # No stochastic part when all N*w are integers
+        weights = np.array([0.5, 0.0, 0.25, 0.25])
+        indices = dautils.getResamplingIndices(weights, 'residual', np.random.RandomState(1))
+        self.assertTrue(np.array_equal(indices, [0, 0, 2, 3]))
+
+    def test_residual_sampling_parts(self):
+        # With onlyDeterministic or onlyStochastic, the partial resampling is followed by the full one
+        weights = np.array([0.5, 0.25, 0.125, 0.125])
+        for flags, part in [({'onlyDeterministic': True}, 0), ({'onlyStochastic': True}, 1)]:
+            ensemble = MockEnsemble(weights)
+            np.random.seed(3)
+            dautils.residualSampling(ensemble, **flags)
+            self.assertEqual(len(ensemble.resampled), 2)
+            deterministic, stochastic = ensemble.resampled[1][:3], ensemble.resampled[1][3:]
+            self.assertTrue(np.array_equal(deterministic, [0, 0, 1]))
+            self.assertIn(stochastic[0], [2, 3])
+            self.assertTrue(np.array_equal(ensemble.resampled[0], [deterministic, stochastic][part]))
+
+        ensemble = MockEnsemble(weights)
+        dautils.residualSampling(ensemble)
+        self.assertEqual(len(ensemble.resampled), 1)
+
+    def test_metropolis_hastings_equals_loop(self):
+        rng = np.random.RandomState(4)
+        for seed in range(100):
+            N = rng.randint(1, 300)
+            weights = rng.rand(N)**rng.randint(1, 8)
+            if seed % 3 == 0:
+                weights[rng.rand(N) < 0.3] = 0.0
+                weights[0] = 0.0
+            if np.sum(weights) == 0:
+                weights[-1] = 1.0
+            weights = weights/np.sum(weights)
+
+            expected = metropolisHastingsLoop(weights, np.random.RandomState(seed))
+            indices = dautils.metropolisHastingsResamplingIndices(weights, np.random.RandomState(seed))
+            self.assertTrue(np.array_equal(indices, expected), msg="seed " + str(seed))
+
+    def test_global_random_state(self):
+        # The ensemble wrappers use the global numpy random state as before
+        ensemble = MockEnsemble(self.weights)
+        np.random.seed(7)
+        dautils.metropolisHastingSampling(ensemble)
+        np.random.seed(7)
+        self.assertTrue(np.array_equal(ensemble.indices, metropolisHastingsLoop(self.weights, np.random)))
+
+        for scheme in [dautils.probabilisticResampling, dautils.residualSampling,
+                       dautils.stochasticUniversalSampling, dautils.systematicResampling]:
+            np.random.seed(8)
+            scheme(ensemble)
+            first = ensemble.indices
+            np.random.seed(8)
+            scheme(ensemble)
+            self.assertTrue(np.array_equal(first, ensemble.indices))
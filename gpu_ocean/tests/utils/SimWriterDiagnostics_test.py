@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the scalar diagnostics
+recorded by SimNetCDFWriter, using the CPU simulators.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import CPUSimulators, SimWriter, SimReader
+
+
+class SimWriterDiagnosticsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 30
+        self.ny = 40
+        self.dx = 200.0
+        self.dy = 200.0
+        self.g = 9.81
+
+        self.sim = None
+        self.reader = None
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        if self.sim is not None:
+            self.sim.cleanUp()
+            self.sim = None
+        if self.reader is not None:
+            self.reader.ncfile.close()
+            self.reader = None
+        shutil.rmtree(self.tmp_dir)
+
+    def makeKP07(self):
+        eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        u0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        v0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+        addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, [2,2,2,2])
+        return CPUSimulators.CPUKP07(None, eta0, Hi, u0, v0, \
+                                     self.nx, self.ny, self.dx, self.dy, 0.8, \
+                                     self.g, 0.0, 0.0)
+
+    def makeFBL(self):
+        H = np.ones((self.ny+2, self.nx+2), dtype=np.float32) * 60
+        eta0 = np.zeros((self.ny+2, self.nx+2), dtype=np.float32)
+        u0 = np.zeros((self.ny+2, self.nx+1), dtype=np.float32)
+        v0 = np.zeros((self.ny+3, self.nx+2), dtype=np.float32)
+        addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, [1,1,1,1])
+        return CPUSimulators.CPUFBL(None, H, eta0, u0, v0, \
+                                    self.nx, self.ny, self.dx, self.dy, 1.0, \
+                                    self.g, 0.0, 0.0)
+
+    def writeRun(self, diagnostics=SimWriter.DEFAULT_DIAGNOSTICS, staggered_grid=False):
+        """
+        Writes the initial state and three more timesteps, and returns the states written
+        """
+        states = []
+        with SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, filename="diagnostics", \
+                                       staggered_grid=staggered_grid, diagnostics=diagnostics) as writer:
+            filename = writer.output_file_name
+            states.append(self.sim.download())
+            for i in range(3):
+                self.sim.step(20.0)
+                writer.writeTimestep(self.sim)
+                states.append(self.sim.download())
+        self.reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
+        return states
+
+    def test_cell_centered_diagnostics(self):
+        self.sim = self.makeKP07()
+        states = self.writeRun()
+
+        self.assertEqual(self.reader.getDiagnosticNames(), SimWriter.DEFAULT_DIAGNOSTICS)
+        mass = self.reader.getDiagnostic('mass')
+        max_u = self.reader.getDiagnostic('max_u')
+        max_speed = self.reader.getDiagnostic('max_speed')
+        cfl = self.reader.getDiagnostic('cfl')
+        self.assertEqual(len(mass), len(states))
+
+        Hm = self.sim.downloadBathymetry()[1][2:-2, 2:-2]
+        for i, (eta, hu, hv) in enumerate(states):
+            eta, hu, hv = eta[2:-2, 2:-2], hu[2:-2, 2:-2], hv[2:-2, 2:-2]
+            h = Hm + eta
+            u, v = hu/h, hv/h
+            self.assertAlmostEqual(mass[i]/np.sum(h*self.dx*self.dy), 1.0, places=6)
+            self.assertAlmostEqual(max_u[i], np.max(np.abs(u)), places=6)
+            self.assertAlmostEqual(max_speed[i], np.max(np.sqrt(u*u + v*v)), places=6)
+            cfl_ref = self.sim.dt*np.max(np.maximum((np.abs(u) + np.sqrt(self.g*h))/self.dx,
+                                                     (np.abs(v) + np.sqrt(self.g*h))/self.dy))
+            self.assertAlmostEqual(cfl[i], cfl_ref, places=6)
+
+        # The bump starts at rest, and mass is conserved
+        self.assertEqual(max_u[0], 0.0)
+        self.assertGreater(max_u[-1], 0.0)
+        self.assertAlmostEqual(mass[-1]/mass[0], 1.0, places=6)
+        self.assertEqual(np.max(self.reader.getDiagnostic('nan_count')), 0)
+        num_iterations = self.reader.getDiagnostic('num_iterations')
+        self.assertEqual(num_iterations[0], 0)
+        self.assertTrue(np.all(np.diff(num_iterations) > 0))
+        self.assertEqual(num_iterations[-1], self.sim.num_iterations)
+
+    def test_staggered_diagnostics(self):
+        self.sim = self.makeFBL()
+        states = self.writeRun(diagnostics=['mass', 'energy', 'max_v'], staggered_grid=True)
+
+        self.assertEqual(self.reader.getDiagnosticNames(), ['mass', 'energy', 'max_v'])
+        self.assertFalse(self.reader.has('max_u'))
+        mass = self.reader.getDiagnostic('mass')
+        energy = self.reader.getDiagnostic('energy')
+        max_v = self.reader.getDiagnostic('max_v')
+
+        H = self.sim.H.download(None)[1:-1, 1:-1]
+        for i, (eta, hu, hv) in enumerate(states):
+            h = H + eta[1:-1, 1:-1]
+            # Average the face values to the cell centers
+            hu_c = 0.5*(hu[1:-1, :-1] + hu[1:-1, 1:])
+            hv_c = 0.5*(hv[1:-2, 1:-1] + hv[2:-1, 1:-1])
+            self.assertAlmostEqual(mass[i]/np.sum(h*self.dx*self.dy), 1.0, places=6)
+            self.assertAlmostEqual(max_v[i], np.max(np.abs(hv_c/h)), places=6)
+            energy_ref = 0.5*np.sum((hu_c*hu_c + hv_c*hv_c)/h + self.g*eta[1:-1, 1:-1]**2)*self.dx*self.dy
+            self.assertAlmostEqual(energy[i]/energy_ref, 1.0, places=4)
+
+    def test_no_diagnostics(self):
+        self.sim = self.makeKP07()
+        self.writeRun(diagnostics=[])
+        self.assertEqual(self.reader.getDiagnosticNames(), [])
+        self.assertFalse(self.reader.has('mass'))
+
+    def test_nan_count(self):
+        self.sim = self.makeKP07()
+        eta, hu, hv = self.sim.download()
+        eta[10, 10:13] = np.nan
+        hv[5, 5] = np.nan
+        writer = SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, filename="nan_count", diagnostics=['nan_count'])
+        fields = writer._diagnosticFields(self.sim, eta, hu, hv)
+        writer.ncfile.close()
+        self.assertEqual(fields['nan_count'], 4)
@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for writing several ensemble 
+members to one netCDF file with SimNetCDFEnsembleWriter, using the CPU simulators.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import os
+import shutil
+import subprocess
+import tempfile
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import CPUSimulators, SimWriter, SimReader
+
+GPU_OCEAN_PATH = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+# Run by each process of mpirun -n 2: rank r holds the members [r, 2r], 
+# which are created as in SimWriterEnsembleTest.setUp
+PARALLEL_WRITE_SCRIPT = """
+import sys
+import numpy as np
+sys.path.insert(0, {path!r})
+sys.path.insert(0, {tests_path!r})
+from mpi4py import MPI
+from testUtils import addCentralBump
+from SWESimulators import CPUSimulators, SimWriter
+
+comm = MPI.COMM_WORLD
+nx, ny, dx, dy = {nx}, {ny}, {dx}, {dy}
+sims = []
+for k in range(comm.rank, 2*comm.rank+1):
+    eta0 = np.zeros((ny+4, nx+4), dtype=np.float32)
+    u0 = np.zeros((ny+4, nx+4), dtype=np.float32)
+    v0 = np.zeros((ny+4, nx+4), dtype=np.float32)
+    Hi = np.ones((ny+5, nx+5), dtype=np.float32) * 60
+    addCentralBump(eta0, nx, ny, dx, dy, [2,2,2,2])
+    eta0 *= (k+1)
+    sims.append(CPUSimulators.CPUKP07(None, eta0, Hi, u0, v0, nx, ny, dx, dy, 0.8, 9.81, 0.0, 0.0))
+
+# The file name is given with its directory, so that it is the same on all ranks
+with SimWriter.SimNetCDFEnsembleWriter(sims, filename={filename!r}, diagnostics=['mass', 'max_u'], 
+                                       comm=comm, write_parallel=True) as writer:
+    for i in range(2):
+        for sim in sims:
+            sim.step(20.0)
+        writer.writeTimestep()
+"""
+
+
+class SerialComm:
+    """
+    Stands in for rank 1 of an MPI communicator with two processes, 
+    where rank 0 holds two ensemble members
+    """
+    rank = 1
+    size = 2
+    
+    def allgather(self, value):
+        return [2, value]
+
+
+class SimWriterEnsembleTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 30
+        self.ny = 40
+        self.dx = 200.0
+        self.dy = 200.0
+        self.num_members = 3
+
+        self.sims = []
+        for k in range(self.num_members):
+            eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+            u0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+            v0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+            Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+            addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, [2,2,2,2])
+            eta0 *= (k+1)
+            self.sims.append(CPUSimulators.CPUKP07(None, eta0, Hi, u0, v0, \
+                                                   self.nx, self.ny, self.dx, self.dy, 0.8, \
+                                                   9.81, 0.0, 0.0))
+        self.reader = None
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        for sim in self.sims:
+            sim.cleanUp()
+        if self.reader is not None:
+            self.reader.ncfile.close()
+            self.reader = None
+        shutil.rmtree(self.tmp_dir)
+
+    def stepAll(self, t):
+        for sim in self.sims:
+            sim.step(t)
+
+    def test_shared_file(self):
+        states = []
+        with SimWriter.SimNetCDFEnsembleWriter(self.sims, super_dir_name=self.tmp_dir, filename="ensemble", \
+                                               diagnostics=['mass', 'max_u']) as writer:
+            filename = writer.output_file_name
+            states.append([sim.download() for sim in self.sims])
+            for i in range(2):
+                self.stepAll(20.0)
+                writer.writeTimestep()
+                states.append([sim.download() for sim in self.sims])
+        
+        # One file with all members
+        self.assertEqual(os.listdir(os.path.dirname(filename)), [os.path.basename(filename)])
+        self.reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
+        self.assertEqual(self.reader.getEnsembleMemberIds(), [0, 1, 2])
+        self.assertEqual(self.reader.get('ensemble_size'), self.num_members)
+        self.assertEqual(self.reader.getNumTimeSteps(), 3)
+        self.assertEqual(self.reader.ncfile.variables['Hm'].shape, (self.ny+4, self.nx+4))
+        
+        for i in range(3):
+            for k in range(self.num_members):
+                eta, hu, hv, t = self.reader.getTimeStep(i, member=k)
+                for field, ref in zip([eta, hu, hv], states[i][k]):
+                    self.assertTrue(np.array_equal(field, ref))
+        
+        # Diagnostics for each member, which are identical to those of separate files
+        mass = self.reader.getDiagnostic('mass')
+        self.assertEqual(mass.shape, (3, self.num_members))
+        fields = writer._diagnosticFields(self.sims[1], *states[2][1])
+        self.assertAlmostEqual(mass[2, 1], SimWriter.DIAGNOSTICS['mass'][0](fields, self.sims[1]))
+        self.assertGreater(mass[0, 2], mass[0, 0])
+
+    def test_parallel_shared_file(self):
+        try:
+            import mpi4py
+        except ImportError:
+            self.skipTest("mpi4py is not available")
+        import netCDF4
+        if not netCDF4.__has_parallel4_support__:
+            self.skipTest("netCDF4 is built without parallel support")
+        mpirun = shutil.which('mpirun')
+        if mpirun is None:
+            self.skipTest("mpirun is not available")
+        
+        filename = os.path.join(self.tmp_dir, "parallel")
+        script = PARALLEL_WRITE_SCRIPT.format(path=GPU_OCEAN_PATH, tests_path=os.path.join(GPU_OCEAN_PATH, 'tests'),
+                                              nx=self.nx, ny=self.ny, dx=self.dx, dy=self.dy, filename=filename)
+        output = subprocess.run([mpirun, "-n", "2", sys.executable, "-c", script], stdout=subprocess.PIPE, \
+                                stderr=subprocess.PIPE, universal_newlines=True, timeout=300)
+        self.assertEqual(output.returncode, 0, msg=output.stderr)
+        
+        # Rank 0 holds member 0 and rank 1 holds members 1 and 2, as self.sims
+        states = [[sim.download() for sim in self.sims]]
+        for i in range(2):
+            self.stepAll(20.0)
+            states.append([sim.download() for sim in self.sims])
+        
+        self.reader = SimReader.SimNetCDFReader(filename + ".nc", ignore_ghostcells=False)
+        self.assertEqual(self.reader.getEnsembleMemberIds(), [0, 1, 2])
+        self.assertEqual(self.reader.getNumTimeSteps(), 3)
+        for i in range(3):
+            for k in range(self.num_members):
+                eta, hu, hv, t = self.reader.getTimeStep(i, member=k)
+                for field, ref in zip([eta, hu, hv], states[i][k]):
+                    self.assertTrue(np.array_equal(field, ref))
+        mass = self.reader.getDiagnostic('mass')
+        self.assertEqual(mass.shape, (3, self.num_members))
+        self.assertFalse(np.ma.is_masked(mass))
+        self.assertTrue(np.allclose(self.reader.getTimes(), [0.0, 20.0, 40.0]))
+
+    def test_inactive_members(self):
+        writer = SimWriter.SimNetCDFEnsembleWriter(self.sims, super_dir_name=self.tmp_dir, filename="inactive", \
+                                                   diagnostics=['mass'])
+        self.stepAll(20.0)
+        writer.writeTimestep(active=[True, False, True])
+        with self.assertRaises(AssertionError):
+            writer.writeTimestep(active=[True, False])
+        eta = writer.ncfile.variables['eta'][1]
+        mass = writer.ncfile.variables['mass'][1]
+        writer.ncfile.close()
+        
+        self.assertTrue(np.all(eta.mask[1]))
+        self.assertFalse(np.any(eta.mask[[0, 2]]))
+        self.assertTrue(mass.mask[1])
+        self.assertTrue(np.array_equal(eta[2], self.sims[2].download()[0]))
+
+    def test_packed_ensemble(self):
+        with SimWriter.SimNetCDFEnsembleWriter(self.sims, super_dir_name=self.tmp_dir, filename="packed", \
+                                               diagnostics=[], storage_profile='packed') as writer:
+            filename = writer.output_file_name
+            self.assertEqual(writer.nc_eta.chunking(), [1, 1, self.ny+4, self.nx+4])
+        self.reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
+        eta, hu, hv, t = self.reader.getTimeStep(0, member=2)
+        self.assertLessEqual(np.max(np.abs(eta - self.sims[2].download()[0])), 1.0e-3*(1.0 + 1.0e-4))
+        self.assertEqual(writer.storage_statistics['raw_bytes'], 4*3*self.num_members*(self.nx+4)*(self.ny+4))
+
+    def test_file_per_process(self):
+        # Without parallel netCDF, each process writes its own file with the global member ids
+        with SimWriter.SimNetCDFEnsembleWriter(self.sims, super_dir_name=self.tmp_dir, filename="mpi", \
+                                               comm=SerialComm(), write_parallel=False) as writer:
+            filename = writer.output_file_name
+        self.assertTrue(filename.endswith("_1.nc"))
+        self.reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
+        self.assertEqual(self.reader.getEnsembleMemberIds(), [2, 3, 4])
+        self.assertEqual(self.reader.get('ensemble_size'), 5)
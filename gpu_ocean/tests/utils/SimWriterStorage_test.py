@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the storage profiles
+(compression, chunking and packing) of SimNetCDFWriter, using the CPU simulators.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import shutil
+import tempfile
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import CPUSimulators, SimWriter, SimReader
+
+
+class SimWriterStorageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 30
+        self.ny = 40
+        self.dx = 200.0
+        self.dy = 200.0
+
+        eta0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        u0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        v0 = np.zeros((self.ny+4, self.nx+4), dtype=np.float32)
+        Hi = np.ones((self.ny+5, self.nx+5), dtype=np.float32) * 60
+        addCentralBump(eta0, self.nx, self.ny, self.dx, self.dy, [2,2,2,2])
+        self.sim = CPUSimulators.CPUKP07(None, eta0, Hi, u0, v0, \
+                                         self.nx, self.ny, self.dx, self.dy, 0.8, \
+                                         9.81, 0.0, 0.0)
+        self.reader = None
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.sim.cleanUp()
+        if self.reader is not None:
+            self.reader.ncfile.close()
+            self.reader = None
+        shutil.rmtree(self.tmp_dir)
+
+    def writeRun(self, storage_profile, num_steps=3):
+        """
+        Writes the initial state and num_steps more timesteps, and returns the states 
+        written and the writer
+        """
+        states = []
+        with SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, filename="storage", \
+                                       diagnostics=[], storage_profile=storage_profile) as writer:
+            filename = writer.output_file_name
+            states.append(self.sim.download())
+            for i in range(num_steps):
+                self.sim.step(20.0)
+                writer.writeTimestep(self.sim)
+                states.append(self.sim.download())
+        self.reader = SimReader.SimNetCDFReader(filename, ignore_ghostcells=False)
+        return states, writer
+
+    def test_default_profile(self):
+        states, writer = self.writeRun('default')
+        self.assertEqual(self.reader.get('storage_profile'), 'default')
+        eta = self.reader.ncfile.variables['eta']
+        self.assertEqual(eta.dtype, np.float32)
+        self.assertTrue(eta.filters()['zlib'])
+        self.assertEqual(eta.filters()['complevel'], 4)
+        for i, state in enumerate(states):
+            for name, field in zip(['eta', 'hu', 'hv'], state):
+                self.assertTrue(np.array_equal(self.reader.ncfile.variables[name][i], field))
+
+        stats = writer.storage_statistics
+        self.assertEqual(stats['raw_bytes'], 4*3*4*(self.nx+4)*(self.ny+4))
+        self.assertGreater(stats['throughput'], 0.0)
+        self.assertEqual(stats['clipped_values'], 0)
+
+    def test_fast_profile(self):
+        states, writer = self.writeRun('fast')
+        eta = self.reader.ncfile.variables['eta']
+        self.assertFalse(eta.filters()['zlib'])
+        self.assertEqual(eta.chunking(), [1, self.ny+4, self.nx+4])
+        self.assertTrue(np.array_equal(eta[-1], states[-1][0]))
+
+    def test_timeseries_profile(self):
+        self.writeRun('timeseries')
+        for name in ['eta', 'hu', 'hv']:
+            chunking = self.reader.ncfile.variables[name].chunking()
+            self.assertEqual(chunking, [SimWriter.TIMESERIES_CHUNK_SHAPE[0], 32, 32])
+
+        # Explicit chunk shapes are limited by the domain
+        self.reader.ncfile.close()
+        self.writeRun({'chunking': (8, 100, 16)})
+        self.assertEqual(self.reader.get('storage_profile'), 'custom')
+        self.assertEqual(self.reader.ncfile.variables['hu'].chunking(), [8, self.ny+4, 16])
+
+    def test_packed_profile(self):
+        states, writer = self.writeRun('packed')
+        packing = SimWriter.STORAGE_PROFILES['packed']['packing']
+        for name in ['eta', 'hu', 'hv']:
+            var = self.reader.ncfile.variables[name]
+            self.assertEqual(var.dtype, np.int16)
+            self.assertEqual(var.packing_error_bound, np.float32(packing[name]))
+
+        # Unpacked values are within the stated error bound
+        for i, state in enumerate(states):
+            eta, hu, hv, t = self.reader.getTimeStep(i)
+            for name, field, ref in zip(['eta', 'hu', 'hv'], [eta, hu, hv], state):
+                self.assertEqual(field.dtype, np.float32)
+                self.assertLessEqual(np.max(np.abs(field - ref)), packing[name]*(1.0 + 1.0e-4), msg=name)
+        self.assertEqual(writer.storage_statistics['clipped_values'], 0)
+
+        # Packed files are smaller than the default
+        packed_ratio = writer.storage_statistics['compression_ratio']
+        self.reader.ncfile.close()
+        states, writer = self.writeRun('default')
+        self.assertGreater(packed_ratio, writer.storage_statistics['compression_ratio'])
+
+    def test_packing_out_of_range(self):
+        eta, hu, hv = self.sim.download()
+        eta[10, 10] = 1.0e3
+        eta[11, 11] = -1.0e3
+        eta[12, 12] = np.nan
+        profile = {'packing': {'eta': 1.0e-3}, 'chunking': 'field'}
+        writer = SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, filename="clipped", \
+                                           diagnostics=[], storage_profile=profile)
+        writer.write(self.sim.t, eta, hu, hv)
+        self.assertEqual(writer.getStorageStatistics()['clipped_values'], 2)
+        self.assertEqual(writer.ncfile.variables['hu'].dtype, np.float32)
+
+        written = writer.ncfile.variables['eta'][1]
+        writer.ncfile.close()
+        self.assertAlmostEqual(written[10, 10], 32767*2.0e-3, places=3)
+        self.assertAlmostEqual(written[11, 11], -32767*2.0e-3, places=3)
+        self.assertTrue(written.mask[12, 12])
+
+    def test_unknown_profile(self):
+        with self.assertRaises(AssertionError):
+            SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, storage_profile='tiny')
+        with self.assertRaises(AssertionError):
+            SimWriter.SimNetCDFWriter(self.sim, super_dir_name=self.tmp_dir, storage_profile={'packing': {'h': 0.1}})
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the pooling policy, memory cap and
+statistics of the host staging buffer pool, using its host-only mode.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import StagingPool
+
+
+class StagingPoolTest(unittest.TestCase):
+
+    def tearDown(self):
+        StagingPool.disable()
+
+    def test_reuse(self):
+        pool = StagingPool.StagingPool(host_only=True)
+        a = pool.acquire((10, 12), np.float32)
+        self.assertEqual(a.shape, (10, 12))
+        self.assertEqual(a.dtype, np.float32)
+        self.assertTrue(a.flags['C_CONTIGUOUS'])
+
+        # Buffers in use are not handed out twice
+        b = pool.acquire((10, 12), np.float32)
+        self.assertIsNot(a, b)
+        pool.release(a)
+        self.assertIs(pool.acquire((10, 12), np.float32), a)
+
+        # Buffers are keyed on both shape and dtype
+        c = pool.acquire((12, 10), np.float32)
+        d = pool.acquire((10, 12), np.float64)
+        self.assertIsNot(c, b)
+        self.assertEqual(d.dtype, np.float64)
+
+        stats = pool.statistics()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 4)
+        self.assertEqual(stats['bytes_hit'], 480)
+        self.assertEqual(stats['bytes_allocated'], 3*480 + 960)
+        self.assertEqual(stats['bytes_held'], 3*480 + 960)
+        self.assertEqual(stats['free_buffers'], 0)
+        self.assertTrue(stats['host_only'])
+
+        for buffer in [a, b, c, d]:
+            pool.release(buffer)
+        self.assertEqual(pool.statistics()['free_buffers'], 4)
+        pool.clear()
+        self.assertEqual(pool.statistics()['bytes_held'], 0)
+        self.assertEqual(pool.statistics()['evictions'], 4)
+
+    def test_memory_cap(self):
+        pool = StagingPool.StagingPool(max_bytes=1000, host_only=True)
+        a = pool.acquire(100, np.float32)
+        b = pool.acquire(100, np.int32)
+        self.assertEqual(pool.bytes_held, 800)
+
+        # Does not fit next to the buffers in use, so it is not kept by the pool
+        c = pool.acquire(60, np.float32)
+        self.assertEqual(pool.statistics()['bypasses'], 1)
+        self.assertEqual(pool.bytes_held, 800)
+        pool.release(c)
+        self.assertEqual(pool.statistics()['free_buffers'], 0)
+
+        # Free buffers are evicted, the least recently released first
+        pool.release(a)
+        pool.release(b)
+        c = pool.acquire(60, np.float32)
+        self.assertEqual(pool.statistics()['evictions'], 1)
+        self.assertEqual(pool.bytes_held, 640)
+        self.assertIs(pool.acquire(100, np.int32), b)
+
+        # Larger than the cap
+        pool.release(b)
+        e = pool.acquire(1000, np.float32)
+        self.assertEqual(e.shape, (1000,))
+        self.assertEqual(pool.statistics()['bypasses'], 2)
+        self.assertEqual(pool.statistics()['free_buffers'], 1)
+        self.assertLessEqual(pool.statistics()['peak_bytes_held'], 1000)
+
+    def test_module_pool(self):
+        StagingPool.enable(max_bytes=10000, host_only=True)
+        self.assertTrue(StagingPool.is_enabled())
+        for i in range(5):
+            buffer = StagingPool.acquire((4, 4, 4), np.float32)
+            buffer[:] = i
+            StagingPool.release(buffer)
+        stats = StagingPool.statistics()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 4)
+        self.assertEqual(stats['max_bytes'], 10000)
+
+        # Buffers not from the pool are ignored
+        StagingPool.release(np.zeros((4, 4, 4), dtype=np.float32))
+        self.assertEqual(StagingPool.statistics()['free_buffers'], 1)
+
+        # The free buffers are freed when the pool is disabled
+        pool = StagingPool.pool
+        StagingPool.disable()
+        self.assertEqual(pool.statistics()['bytes_held'], 0)
+        self.assertFalse(StagingPool.is_enabled())
+        self.assertIsNone(StagingPool.statistics())
+        buffer = StagingPool.acquire((3, 2), np.float64)
+        self.assertEqual(buffer.shape, (3, 2))
+        StagingPool.release(buffer)
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements unit tests for the adaptive time step
+policies in TimestepPolicy, using a host model with the CFL reference
+maxTimestepHost (as used by CDKLM16._getMaxTimestepHost).
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import TimestepPolicy
+
+
+class HostCFLModel(object):
+    """
+    Host model implementing the interface used by the time step policies.
+    The velocities are multiplied by growth(step) in each step, and the
+    reductions are computed with maxTimestepHost.
+    """
+    def __init__(self, growth=lambda step: 1.0, ready=True):
+        self.nx, self.ny = 30, 20
+        self.dx, self.dy = 200.0, 100.0
+        self.g = 9.81
+        self.courant_number = 0.8
+        self.dt = 0.0
+        self.growth = growth
+        self.ready = ready
+
+        y, x = np.mgrid[0:self.ny, 0:self.nx]
+        self.Hm = np.ones((self.ny, self.nx), dtype=np.float32)*60.0
+        self.eta = (0.5*np.exp(-((x - 15)**2 + (y - 10)**2)/20.0)).astype(np.float32)
+        self.hu = (10.0*np.sin(2*np.pi*y/self.ny)).astype(np.float32)
+        self.hv = (5.0*np.cos(2*np.pi*x/self.nx)).astype(np.float32)
+
+        self.num_steps = 0
+        self.num_requests = 0
+        self.num_reads = 0
+        self.requested_max_dt = None
+
+    def maxTimestep(self, courant_number=1.0):
+        return TimestepPolicy.maxTimestepHost(self.eta, self.hu, self.hv, self.Hm,
+                                              self.dx, self.dy, self.g, courant_number)
+
+    def requestMaxDt(self):
+        self.requested_max_dt = self.maxTimestep()
+        self.num_requests += 1
+
+    def maxDtReady(self):
+        return self.ready
+
+    def readMaxDt(self):
+        self.num_reads += 1
+        return self.requested_max_dt
+
+    def advance(self):
+        self.num_steps += 1
+        factor = self.growth(self.num_steps)
+        self.hu = self.hu*np.float32(factor)
+        self.hv = self.hv*np.float32(factor)
+
+
+class TimestepPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.num_steps = 25
+
+    def tearDown(self):
+        pass
+
+    def run_policy(self, policy, model):
+        """
+        Updates dt with the policy before each step, and returns the dts used and
+        the CFL time steps (with courant number) of the states they were used for.
+        """
+        dts, cfl_dts = [], []
+        for i in range(self.num_steps):
+            policy.update(model)
+            dts.append(model.dt)
+            cfl_dts.append(model.maxTimestep(model.courant_number))
+            model.advance()
+        return np.array(dts), np.array(cfl_dts)
+
+    def test_max_timestep_host(self):
+        model = HostCFLModel()
+        h = model.eta + model.Hm
+        c = np.sqrt(model.g*h)
+        max_dt_x = np.min(model.dx/(np.abs(model.hu/h) + c))
+        max_dt_y = np.min(model.dy/(np.abs(model.hv/h) + c))
+        self.assertAlmostEqual(model.maxTimestep(0.8), 0.8*0.25*min(max_dt_x, max_dt_y), places=6)
+
+    def test_every_step(self):
+        model = HostCFLModel(growth=lambda step: 1.05)
+        policy = TimestepPolicy.EveryStepTimestep()
+        dts, cfl_dts = self.run_policy(policy, model)
+
+        self.assertTrue(np.allclose(dts, cfl_dts, rtol=1.0e-6))
+        self.assertEqual(model.num_reads, self.num_steps)
+        self.assertEqual(policy.num_recomputes, self.num_steps)
+
+    def test_lagged(self):
+        model = HostCFLModel(growth=lambda step: 1.05)
+        policy = TimestepPolicy.LaggedTimestep(safety_factor=0.9)
+        dts, cfl_dts = self.run_policy(policy, model)
+
+        # First step uses the current state, the rest use the previous state
+        self.assertAlmostEqual(dts[0]/cfl_dts[0], 0.9, places=6)
+        self.assertTrue(np.allclose(dts[1:], 0.9*cfl_dts[:-1], rtol=1.0e-6))
+
+        # The safety factor covers the change in the CFL condition during one step
+        self.assertTrue(np.all(dts <= cfl_dts))
+        self.assertTrue(np.all(dts >= 0.8*cfl_dts))
+
+        # Exactly one request per step, and only the first read waits for the current state
+        self.assertEqual(model.num_requests, self.num_steps + 1)
+        self.assertEqual(model.num_reads, self.num_steps)
+
+    def test_lagged_courant_number(self):
+        model = HostCFLModel()
+        policy = TimestepPolicy.LaggedTimestep(courant_number=0.5, safety_factor=1.0)
+        dts, cfl_dts = self.run_policy(policy, model)
+        self.assertTrue(np.allclose(dts, 0.5/0.8*cfl_dts, rtol=1.0e-6))
+
+    def test_periodic(self):
+        model = HostCFLModel(growth=lambda step: 1.01)
+        policy = TimestepPolicy.PeriodicTimestep(interval=10, guard=False)
+        dts, cfl_dts = self.run_policy(policy, model)
+
+        self.assertEqual(policy.num_recomputes, 3)
+        self.assertEqual(model.num_reads, 3)
+        for start in [0, 10, 20]:
+            self.assertAlmostEqual(dts[start]/cfl_dts[start], 1.0, places=6)
+            self.assertTrue(np.all(dts[start:start+10] == dts[start]))
+
+    def test_periodic_guard(self):
+        # The velocities jump after step 5
+        jump = lambda step: 20.0 if step == 5 else 1.0
+        model = HostCFLModel(growth=jump)
+        policy = TimestepPolicy.PeriodicTimestep(interval=10, guard=True)
+        dts, cfl_dts = self.run_policy(policy, model)
+
+        # The guard sees the jump one step later, and recomputes dt
+        self.assertEqual(policy.num_guard_triggers, 1)
+        self.assertGreater(dts[5], cfl_dts[5])
+        self.assertAlmostEqual(dts[6]/cfl_dts[6], 1.0, places=6)
+        self.assertTrue(np.all(dts[6:] <= cfl_dts[6:]*(1.0 + 1.0e-6)))
+
+        # Periodic recomputes at 0 and 16 (10 steps after the guard), and the guard at 6
+        self.assertEqual(policy.num_recomputes, 3)
+
+    def test_periodic_guard_not_ready(self):
+        # The guard never waits for results that are not ready
+        jump = lambda step: 20.0 if step == 5 else 1.0
+        model = HostCFLModel(growth=jump, ready=False)
+        policy = TimestepPolicy.PeriodicTimestep(interval=10, guard=True)
+        dts, cfl_dts = self.run_policy(policy, model)
+
+        self.assertEqual(policy.num_guard_triggers, 0)
+        self.assertEqual(model.num_reads, 3)
+        self.assertGreater(dts[9], cfl_dts[9])
+        self.assertAlmostEqual(dts[10]/cfl_dts[10], 1.0, places=6)
+
+    def test_reset(self):
+        model = HostCFLModel(growth=lambda step: 1.05)
+        policy = TimestepPolicy.LaggedTimestep()
+        self.run_policy(policy, model)
+        policy.reset()
+        self.assertEqual(policy.num_updates, 0)
+        self.assertFalse(policy.pending)
+
+        # After a reset, the current state is used
+        policy.update(model)
+        self.assertAlmostEqual(model.dt/model.maxTimestep(model.courant_number), policy.safety_factor, places=6)
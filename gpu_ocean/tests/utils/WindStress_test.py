@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean.
+
+Copyright (C) 2019 SINTEF Digital
+
+This python module implements tests of the CPU evaluation of the parametric
+wind stresses, and of the precomputed (and perturbed) wind stress tables.
+These tests do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import numpy as np
+import math
+import sys
+
+from testUtils import *
+
+sys.path.insert(0, '../')
+from SWESimulators import WindStress
+
+
+def windStressPoint(wind, t, x, y):
+    """
+    The wind stress in a single point, as in the original kernels
+    """
+    if isinstance(wind, WindStress.GenericUniformWindStress):
+        speed = float(wind.wind_speed)
+        C_drag = 0.0012 if speed < 11 else 0.00049 + 0.000065*speed
+        stress = wind.rho_air*C_drag*speed*speed/wind.rho
+        direction = math.radians(wind.wind_direction)
+        return -stress*math.sin(direction), -stress*math.cos(direction)
+    elif isinstance(wind, WindStress.UniformAlongShoreWindStress):
+        return wind.tau0/wind.rho * math.exp(-wind.alpha*y), 0.0
+    elif isinstance(wind, WindStress.BellShapedAlongShoreWindStress):
+        if t > 48.0*3600.0:
+            return 0.0, 0.0
+        a = wind.alpha*(x - wind.xm)
+        return wind.tau0/wind.rho * math.exp(-a*a) * math.exp(-wind.alpha*y), 0.0
+    elif isinstance(wind, WindStress.MovingCycloneWindStress):
+        a = x - wind.x0 - wind.u0*t
+        b = y - wind.y0 - wind.v0*t
+        c = 1.0 - math.sqrt(a*a + b*b)/wind.Rc
+        amplitude = wind.tau0/wind.rho * math.exp(-0.5*c*c) / wind.Rc
+        return -amplitude*b, amplitude*a
+
+
+class WindStressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.nx = 12
+        self.ny = 9
+        self.dx = 20000.0
+        self.dy = 25000.0
+        self.t = np.array([0.0, 3600.0, 47*3600.0, 49*3600.0])
+        u0 = 30.0/np.sqrt(5.0)
+        self.winds = [WindStress.GenericUniformWindStress(rho_air=1.3, wind_speed=15.0, wind_direction=30.0),
+                      WindStress.GenericUniformWindStress(rho_air=1.3, wind_speed=5.0, wind_direction=200.0),
+                      WindStress.UniformAlongShoreWindStress(tau0=3.0, rho=1025.0, alpha=5.0e-6),
+                      WindStress.BellShapedAlongShoreWindStress(xm=self.nx*self.dx/3, tau0=3.0, rho=1025.0, alpha=5.0e-6),
+                      WindStress.MovingCycloneWindStress(Rc=10*self.dx, x0=self.dx*self.nx/2 - u0*3600.0*48.0,
+                                                         y0=self.dy*self.ny/2 + 0.5*u0*3600.0*48.0,
+                                                         u0=u0, v0=-0.5*u0, tau0=3.0, rho=1025.0)]
+
+    def test_tables_equal_pointwise(self):
+        for wind in self.winds:
+            tables = WindStress.windStressTables(wind, self.t, self.nx, self.ny, self.dx, self.dy)
+            self.assertEqual(len(tables), 1)
+            table = tables[0]
+            self.assertEqual(list(table.t), list(self.t))
+            self.assertEqual(table.numWindSteps, len(self.t))
+
+            for n, t in enumerate(self.t):
+                self.assertEqual(table.X[n].shape, (self.ny, self.nx))
+                self.assertEqual(table.X[n].dtype, np.float32)
+                self.assertTrue(table.X[n].flags['C_CONTIGUOUS'])
+                expected = np.array([[windStressPoint(wind, t, (i+0.5)*self.dx, (j+0.5)*self.dy)
+                                      for i in range(self.nx)] for j in range(self.ny)])
+                msg = type(wind).__name__ + " at t=" + str(t)
+                self.assertTrue(np.allclose(table.X[n], expected[:, :, 0], rtol=1.0e-5, atol=1.0e-12), msg=msg)
+                self.assertTrue(np.allclose(table.Y[n], expected[:, :, 1], rtol=1.0e-5, atol=1.0e-12), msg=msg)
+
+            # Single table time
+            single = wind.toWindStress(3600.0, self.nx, self.ny, self.dx, self.dy)
+            self.assertEqual(single.numWindSteps, 1)
+            self.assertTrue(np.array_equal(single.X[0], table.X[1]))
+
+        # Bell shaped wind is turned off after 48 hours
+        table = self.winds[3].toWindStress(self.t, self.nx, self.ny, self.dx, self.dy)
+        self.assertGreater(np.max(table.X[2]), 0.0)
+        self.assertFalse(np.any(table.X[3]))
+
+    def test_evaluate_broadcasts(self):
+        x = np.linspace(0, self.nx*self.dx, 7)
+        y = np.linspace(0, self.ny*self.dy, 5)[:, np.newaxis]
+        for wind in self.winds:
+            X, Y = wind.evaluate(3600.0, x, y)
+            self.assertEqual(X.shape, (5, 7))
+            self.assertEqual(Y.shape, (5, 7))
+
+        # No stress without the density of sea water, and from default parameters
+        X, Y = WindStress.MovingCycloneWindStress().evaluate(0.0, x, y)
+        self.assertFalse(np.any(X) or np.any(Y))
+        X, Y = WindStress.UniformAlongShoreWindStress().evaluate(0.0, x, y)
+        self.assertFalse(np.any(X) or np.any(Y))
+
+    def test_perturbed_tables(self):
+        wind = self.winds[0]
+        max_perturbation = 20.0
+        num_members = 6
+        tables = WindStress.windStressTables(wind, self.t, self.nx, self.ny, self.dx, self.dy,
+                                             num_members=num_members,
+                                             max_wind_direction_perturbation=max_perturbation,
+                                             random_state=np.random.RandomState(3))
+        self.assertEqual(len(tables), num_members)
+
+        # Same as evaluating the wind with the perturbed directions, one per member and table time
+        perturbation = 2.0*(np.random.RandomState(3).rand(num_members, len(self.t)) - 0.5) * max_perturbation
+        for m in range(num_members):
+            for n in range(len(self.t)):
+                perturbed = WindStress.GenericUniformWindStress(rho_air=wind.rho_air, wind_speed=wind.wind_speed,
+                                                                wind_direction=wind.wind_direction + perturbation[m, n])
+                X, Y = windStressPoint(perturbed, 0.0, 0.0, 0.0)
+                self.assertTrue(np.allclose(tables[m].X[n], X, rtol=1.0e-5))
+                self.assertTrue(np.allclose(tables[m].Y[n], Y, rtol=1.0e-5))
+
+        # Rotations keep the stress magnitude for all wind types
+        for wind in self.winds[2:]:
+            table = wind.toWindStress(self.t, self.nx, self.ny, self.dx, self.dy)
+            perturbed = WindStress.perturbWindDirection(table, 90.0, num_members=3,
+                                                        random_state=np.random.RandomState(1))
+            for member in perturbed:
+                for n in range(len(self.t)):
+                    self.assertTrue(np.allclose(np.hypot(member.X[n], member.Y[n]),
+                                                np.hypot(table.X[n], table.Y[n]), rtol=1.0e-5, atol=1.0e-12))
+
+        # Without perturbation, all members get the same table
+        tables = WindStress.perturbWindDirection(table, 0.0, num_members=2)
+        self.assertTrue(np.array_equal(tables[0].X, tables[1].X))
+        self.assertTrue(np.array_equal(tables[1].X, table.X))
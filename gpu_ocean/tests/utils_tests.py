@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+This software is part of GPU Ocean. 
+
+Copyright (C) 2019 SINTEF Digital
+
+This python program runs unit tests of utility modules in GPU Ocean
+that do not require a GPU.
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import unittest
+import sys
+import time
+
+import xmlrunner
+# install xmlrunner by
+# $ sudo easy_install unittest-xml-reporting
+
+from utils.Instrumentation_test import InstrumentationTest
+from utils.CPUSimulators_test import CPUSimulatorsTest
+from utils.DoubleJetCase_test import DoubleJetCaseTest
+from utils.BathymetryAndICs_test import BathymetryAndICsTest
+from utils.SimWriterDiagnostics_test import SimWriterDiagnosticsTest
+from utils.TimestepPolicy_test import TimestepPolicyTest
+from utils.OpenCLContext_test import OpenCLContextTest
+from utils.CTCS2Layer_test import CTCS2LayerCPUTest
+from utils.OceanographicUtilities_test import OceanographicUtilitiesTest
+from utils.ImportTime_test import ImportTimeTest
+from utils.PostProcessing_test import PostProcessingTest
+from utils.ExperimentDriver_test import ExperimentDriverTest
+from utils.InitialStateLoading_test import InitialStateLoadingTest
+from utils.ArrayBackend_test import ArrayBackendTest
+from utils.SimWriterStorage_test import SimWriterStorageTest
+from utils.SimWriterEnsemble_test import SimWriterEnsembleTest
+from utils.FrameRenderer_test import FrameRendererTest
+from utils.Resampling_test import ResamplingTest
+from utils.Observation_test import ObservationTest
+from utils.DryTiles_test import DryTilesTest
+from utils.WindStress_test import WindStressTest
+from utils.StagingPool_test import StagingPoolTest
+from utils.OceanStateNoiseHost_test import OceanStateNoiseHostTest
+
+def printSupportedTests():
+    print ("Supported tests:")
+    print ("0: All, 1: Instrumentation, 2: CPUSimulators, 3: DoubleJetCase, 4: BathymetryAndICs, 5: SimWriterDiagnostics, 6: TimestepPolicy, 7: OpenCLContext, 8: CTCS2Layer (CPU OpenCL), 9: OceanographicUtilities, 10: ImportTime, 11: PostProcessing, 12: ExperimentDriver, 13: InitialStateLoading, 14: ArrayBackend, 15: SimWriterStorage, 16: SimWriterEnsemble, 17: FrameRenderer, 18: Resampling, 19: Observation, 20: DryTiles, 21: WindStress, 22: StagingPool, 23: OceanStateNoiseHost")
+
+if (len(sys.argv) < 2):
+    print("Usage:")
+    print("\t %s tests  [jenkins]" % sys.argv[0])
+    printSupportedTests()
+    exit()
+tests = int(sys.argv[1])
+
+# In order to format the test report so that Jenkins can read it:
+jenkins = False
+if (len(sys.argv) > 2):
+    if (sys.argv[1].lower() == "jenkins"):
+        jenkins = True
+
+if (jenkins):
+    unittest.main(testRunner=xmlrunner.XMLTestRunner(output='test-reports'))
+
+
+# Define the tests that will be part of our test suite:
+test_classes_to_run = None
+if tests == 0:
+    test_classes_to_run = [InstrumentationTest, CPUSimulatorsTest, DoubleJetCaseTest, BathymetryAndICsTest, SimWriterDiagnosticsTest, TimestepPolicyTest,
+                           OpenCLContextTest, CTCS2LayerCPUTest, OceanographicUtilitiesTest, ImportTimeTest, PostProcessingTest,
+                           ExperimentDriverTest, InitialStateLoadingTest, ArrayBackendTest, \
+                           SimWriterStorageTest, SimWriterEnsembleTest, FrameRendererTest, ResamplingTest, ObservationTest, DryTilesTest, WindStressTest, StagingPoolTest, OceanStateNoiseHostTest]
+elif tests == 1:
+    test_classes_to_run = [InstrumentationTest]
+elif tests == 2:
+    test_classes_to_run = [CPUSimulatorsTest]
+elif tests == 3:
+    test_classes_to_run = [DoubleJetCaseTest]
+elif tests == 4:
+    test_classes_to_run = [BathymetryAndICsTest]
+elif tests == 5:
+    test_classes_to_run = [SimWriterDiagnosticsTest]
+elif tests == 6:
+    test_classes_to_run = [TimestepPolicyTest]
+elif tests == 7:
+    test_classes_to_run = [OpenCLContextTest]
+elif tests == 8:
+    test_classes_to_run = [CTCS2LayerCPUTest]
+elif tests == 9:
+    test_classes_to_run = [OceanographicUtilitiesTest]
+elif tests == 10:
+    test_classes_to_run = [ImportTimeTest]
+elif tests == 11:
+    test_classes_to_run = [PostProcessingTest]
+elif tests == 12:
+    test_classes_to_run = [ExperimentDriverTest]
+elif tests == 13:
+    test_classes_to_run = [InitialStateLoadingTest]
+elif tests == 14:
+    test_classes_to_run = [ArrayBackendTest]
+elif tests == 15:
+    test_classes_to_run = [SimWriterStorageTest]
+elif tests == 16:
+    test_classes_to_run = [SimWriterEnsembleTest]
+elif tests == 17:
+    test_classes_to_run = [FrameRendererTest]
+elif tests == 18:
+    test_classes_to_run = [ResamplingTest]
+elif tests == 19:
+    test_classes_to_run = [ObservationTest]
+elif tests == 20:
+    test_classes_to_run = [DryTilesTest]
+elif tests == 21:
+    test_classes_to_run = [WindStressTest]
+elif tests == 22:
+    test_classes_to_run = [StagingPoolTest]
+elif tests == 23:
+    test_classes_to_run = [OceanStateNoiseHostTest]
+else:
+    print("Error: " + str(tests) + " is not a supported test number...")
+    printSupportedTests()
+    exit()
+
+    
+loader = unittest.TestLoader()
+suite_list = []
+for test_class in test_classes_to_run:
+    suite = loader.loadTestsFromTestCase(test_class)
+    suite_list.append(suite)
+
+big_suite = unittest.TestSuite(suite_list)
+results = unittest.TextTestRunner(verbosity=2).run(big_suite)
+
+sys.exit(not results.wasSuccessful())